@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# benchmark_markdown_render.py
+"""
+Mide el tiempo de conversión Markdown -> HTML de los mensajes del chat sobre una conversación
+grande con mucho código: sin caché, con la caché de MarkdownRenderer y durante el streaming
+(renderizando el mensaje entero en cada fragmento frente a solo el último bloque).
+
+Uso: python TESTS/benchmark_markdown_render.py [mensajes] [fragmentos]
+"""
+
+import os
+import sys
+import time
+
+# Para poder importar los módulos de la aplicación.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.markdown_renderer import MarkdownRenderer
+
+
+def code_heavy_reply(i: int, sections: int = 6) -> str:
+    """Respuesta de ejemplo con títulos, listas, tablas y bloques de código largos."""
+    parts = [f"## Solución {i}\n", "Pasos a seguir:\n\n1. Leer la entrada\n2. Procesarla\n3. Guardar el resultado\n"]
+    for s in range(sections):
+        code = "\n".join(f"    resultado_{n} = procesar(datos[{n}], modo='{s}')" for n in range(25))
+        parts.append(f"### Parte {s}\n\nExplicación de la parte **{s}** con `código` en línea.\n")
+        parts.append(f"```python\ndef parte_{s}(datos):\n{code}\n\n    return resultado_0\n```\n")
+        parts.append("| Parámetro | Valor |\n|---|---|\n| modo | rápido |\n| hilos | 4 |\n")
+    return "\n".join(parts)
+
+
+def conversation(n_messages: int) -> list[str]:
+    return [code_heavy_reply(i) if i % 2 else f"Pregunta número {i}: ¿cómo lo hago?" for i in range(n_messages)]
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    n_fragments = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    messages = conversation(n_messages)
+    total_kb = sum(len(m) for m in messages) / 1024
+    print(f"Conversación: {n_messages} mensajes, {total_kb:.0f} KB de Markdown.\n")
+
+    renderer = MarkdownRenderer()
+    cold = timed(lambda: [MarkdownRenderer._convert(m) for m in messages])
+    first = timed(lambda: [renderer.render(m) for m in messages])
+    warm = timed(lambda: [renderer.render(m) for m in messages])
+    print(f"Historial sin caché:           {cold * 1000:9.1f} ms")
+    print(f"Historial, primera carga:      {first * 1000:9.1f} ms")
+    print(f"Historial, redibujado (caché): {warm * 1000:9.1f} ms  ({cold / max(warm, 1e-9):.0f}x)")
+
+    reply = code_heavy_reply(0, sections=12)
+    step = max(len(reply) // n_fragments, 1)
+    partials = [reply[:end] for end in range(step, len(reply) + step, step)]
+    streaming_renderer = MarkdownRenderer()
+    full = timed(lambda: [MarkdownRenderer._convert(p) for p in partials])
+    incremental = timed(lambda: [streaming_renderer.render_streaming(p) for p in partials])
+    print(f"\nStreaming de una respuesta de {len(reply) / 1024:.0f} KB en {len(partials)} fragmentos:")
+    print(f"  Mensaje completo cada vez:   {full * 1000:9.1f} ms  ({full / len(partials) * 1000:.2f} ms/fragmento)")
+    print(f"  Solo el último bloque:       {incremental * 1000:9.1f} ms  ({incremental / len(partials) * 1000:.2f} ms/fragmento, {full / max(incremental, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# benchmark_retrieval.py
+"""
+Mide el índice de recuperación (RAG) sobre un historial sintético: velocidad de construcción
+(fragmentos por segundo, incluido el cálculo de embeddings), latencia de búsqueda y coste de
+borrar y volver a añadir conversaciones. Usa el modelo de embeddings por defecto
+(sentence-transformers si está instalado; si no, HashingEmbedder).
+
+Uso: python TESTS/benchmark_retrieval.py [conversaciones] [mensajes por conversación]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import statistics
+
+# Para poder importar los módulos de la aplicación.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.retrieval import RetrievalIndex, chunk_conversation
+
+TOPICS = ["python", "docker", "nginx", "recetas", "viajes", "finanzas", "astronomía", "guitarra", "sql", "redes"]
+WORDS = ("configurar servidor error función clase memoria hilo consulta índice modelo datos archivo "
+         "usuario proceso red puerto caché lista tabla valor prueba resultado versión").split()
+
+
+def conversation(rng: random.Random, n_messages: int) -> list:
+    topic = rng.choice(TOPICS)
+    return [{"role": "user" if i % 2 == 0 else "assistant",
+             "content": f"{topic} " + " ".join(rng.choices(WORDS, k=rng.randint(20, 120)))}
+            for i in range(n_messages)]
+
+
+def main():
+    n_conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = random.Random(0)
+    conversations = [conversation(rng, n_messages) for _ in range(n_conversations)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = RetrievalIndex(directory)
+        print(f"Modelo de embeddings: {index.embedder.name}")
+
+        start = time.perf_counter()
+        chunks = 0
+        for i, messages in enumerate(conversations):
+            items = chunk_conversation(messages)
+            index.add(f"conv:{i}", items, title=f"Conversación {i}", item_count=len(messages))
+            chunks += len(items)
+        build = time.perf_counter() - start
+        print(f"Construcción: {chunks} fragmentos de {n_conversations} conversaciones en {build:.2f} s "
+              f"({chunks / build:.0f} fragmentos/s)")
+
+        latencies = []
+        for _ in range(50):
+            query = f"{rng.choice(TOPICS)} {' '.join(rng.choices(WORDS, k=8))}"
+            start = time.perf_counter()
+            index.build_context(query, max_tokens=512)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"Recuperación (build_context, 512 tokens): mediana {statistics.median(latencies):.2f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms")
+
+        start = time.perf_counter()
+        for i in range(0, n_conversations, 10):
+            index.remove_source(f"conv:{i}")
+            index.add(f"conv:{i}", chunk_conversation(conversations[i]), title=f"Conversación {i}")
+        updates = len(range(0, n_conversations, 10))
+        print(f"Borrar y reindexar {updates} conversaciones: {(time.perf_counter() - start) * 1000 / updates:.1f} ms cada una")
+        print(f"Estado final: {index.stats()}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Martin_LLM'))
 
 from app.agent import Agent
-from app.reasoner import Reasoner
+from app.reasoner import Reasoner, normalize_plan, execute_plan, build_step_task
 from app.llm_providers import BaseLLMProvider
 from app.tools import tool_registry, BaseTool
 
@@ -150,4 +150,111 @@ def test_reasoner_handles_invalid_plan_json(mock_provider):
     plan = reasoner.generate_plan("algún objetivo complejo")
 
     assert plan is None
-    mock_provider.query.assert_called_once()
\ No newline at end of file
+    mock_provider.query.assert_called_once()
+
+def test_reasoner_generates_plan_with_dependencies(mock_provider):
+    """Prueba que el razonador devuelve los pasos con sus dependencias."""
+    plan_response = {
+        "plan": [
+            {"id": 1, "task": "Busca A.", "depends_on": []},
+            {"id": "2", "task": "Busca B.", "depends_on": []},
+            {"id": 3, "task": "Combina A y B.", "depends_on": [1, "2", 7]}
+        ]
+    }
+    mock_provider.query.return_value = json.dumps(plan_response)
+
+    steps = Reasoner(provider=mock_provider).generate_plan_steps("objetivo")
+
+    assert steps == [
+        {"id": 1, "task": "Busca A.", "depends_on": []},
+        {"id": 2, "task": "Busca B.", "depends_on": []},
+        {"id": 3, "task": "Combina A y B.", "depends_on": [1, 2]},
+    ]
+
+def test_normalize_plan_keeps_legacy_plans_sequential_and_breaks_cycles():
+    """Un plan de cadenas se ejecuta en orden; un plan con ciclos, también."""
+    assert [step["depends_on"] for step in normalize_plan(["a", "b", "c"])] == [[], [1], [2]]
+    cyclic = normalize_plan([{"id": 1, "task": "a", "depends_on": [2]}, {"id": 2, "task": "b", "depends_on": [1]}])
+    assert [step["depends_on"] for step in cyclic] == [[], [1]]
+    assert normalize_plan([]) is None
+    assert normalize_plan([{"sin": "tarea"}]) is None
+
+def test_execute_plan_runs_independent_steps_concurrently():
+    """Los pasos independientes se solapan y cada paso recibe solo los resultados de los que depende."""
+    import threading
+    steps = normalize_plan([
+        {"id": 1, "task": "Busca A.", "depends_on": []},
+        {"id": 2, "task": "Busca B.", "depends_on": []},
+        {"id": 3, "task": "Combina.", "depends_on": [1, 2]},
+        {"id": 4, "task": "Resume A.", "depends_on": [1]},
+    ])
+    both_started = threading.Barrier(2, timeout=5)
+    seen = {}
+
+    def run_step(step, upstream):
+        seen[step["id"]] = upstream
+        if step["id"] in (1, 2):
+            both_started.wait() # se bloquearía si los pasos 1 y 2 no corrieran a la vez
+        if step["id"] == 4:
+            raise RuntimeError("sin red")
+        return f"resultado {step['id']}"
+
+    finished = []
+    results = execute_plan(steps, run_step, max_workers=3, on_step_done=lambda step, result: finished.append(step["id"]))
+
+    assert results[3] == "resultado 3"
+    assert results[4] == "Error executing step 4: sin red"
+    assert set(seen[3]) == {1, 2} and set(seen[4]) == {1}
+    assert finished.index(3) > finished.index(1) and finished.index(3) > finished.index(2)
+    task = build_step_task(steps[2], seen[3])
+    assert "Combina." in task and "Step 1 (Busca A.): resultado 1" in task and "Step 2 (Busca B.): resultado 2" in task
+
+class WaitingTool(BaseTool):
+    """Herramienta de prueba que espera en `wait()` (una barrera o un evento) antes de responder."""
+    def __init__(self, name, wait, timeout=10.0):
+        self.name = name
+        self.description = "Espera y devuelve sus argumentos."
+        self.wait = wait
+        self.timeout = timeout
+
+    def run(self, args):
+        self.wait()
+        return f"{self.name} leyó {args}"
+
+def test_agent_runs_several_tools_per_step_concurrently(mock_provider):
+    """Una lista de acciones se ejecuta a la vez y vuelve como una sola observación numerada."""
+    import threading
+    multi_response = {
+        "thought": "Leeré todo a la vez.",
+        "action": [
+            {"tool_name": "slow_a", "args": "uno"},
+            {"tool_name": "slow_b", "args": "dos"},
+            {"tool_name": "stuck", "args": "tres"},
+            {"tool_name": "finish", "args": "demasiado pronto"},
+        ]
+    }
+    finish_response = {"thought": "Listo.", "action": [{"tool_name": "finish", "args": "Hecho."}]}
+    mock_provider.query.side_effect = [json.dumps(multi_response), json.dumps(finish_response)]
+    steps = []
+    # slow_a y slow_b solo terminan si se ejecutan a la vez; stuck no termina hasta el final de la prueba.
+    both_running = threading.Barrier(2, timeout=5)
+    release_stuck = threading.Event()
+
+    agent = Agent(provider=mock_provider)
+    for tool in (WaitingTool("slow_a", both_running.wait), WaitingTool("slow_b", both_running.wait),
+                 WaitingTool("stuck", release_stuck.wait, timeout=0.2)):
+        agent.tool_registry.register(tool)
+    agent.report_step_callback = lambda thought, tool_name, args: steps.append(tool_name)
+    try:
+        final_answer = agent.run("some objective")
+    finally:
+        release_stuck.set()
+
+    assert final_answer == "Hecho."
+    assert steps[:4] == ["slow_a", "slow_b", "stuck", "finish"]
+    observation = agent.history[-2]["content"]
+    assert "Results of your 4 tool calls:" in observation
+    assert "[1] slow_a(uno):\nslow_a leyó uno" in observation
+    assert "[2] slow_b(dos):\nslow_b leyó dos" in observation
+    assert "[3] stuck(tres):\nError: the tool stuck did not answer within 0.2 seconds." in observation
+    assert "[4] finish(demasiado pronto):\nError: 'finish' must be used alone" in observation
@@ -0,0 +1,81 @@
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from PyQt6.QtCore import Qt, QPoint
+from PyQt6.QtWidgets import QApplication, QStyleOptionViewItem
+
+from ui.chat_history_view import ChatHistoryView
+
+
+@pytest.fixture
+def view(qtbot):
+    view = ChatHistoryView()
+    view.resize(800, 600)
+    qtbot.addWidget(view)
+    view.show()
+    qtbot.waitExposed(view)
+    return view
+
+
+def long_history(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"Mensaje **{i}**\n\n- punto a\n- punto b"}
+            for i in range(n)]
+
+
+def test_only_visible_messages_are_rendered(view, qtbot):
+    view.model().set_messages(long_history(1000))
+    view.scrollToBottom()
+    qtbot.wait(50)
+    # Mil mensajes, pero solo se renderizan los que caben en pantalla.
+    assert 0 < view.delegate.rendered_count < 60
+    assert view.verticalScrollBar().value() == view.verticalScrollBar().maximum()
+    assert view.indexAt(QPoint(10, view.viewport().height() - 20)).row() == 999
+
+
+def test_streaming_row_is_updated_and_replaced(view, qtbot):
+    model = view.model()
+    row = model.append_message({"role": "assistant", "content": "Hola"}, show_rating=False)
+    model.set_content(row, "Hola, " + "texto largo " * 200)
+    qtbot.wait(20)
+    final = {"role": "assistant", "content": "Respuesta final"}
+    model.replace_message(row, final)
+    assert model.message(row) is final
+    assert model.index(row).data(model.ShowRatingRole) is True
+
+
+def rating_button_center(view, row, name):
+    index = view.model().index(row)
+    option = QStyleOptionViewItem()
+    view.initViewItemOption(option)
+    option.rect = view.visualRect(index)
+    for x in range(option.rect.left(), option.rect.right()):
+        for y in range(option.rect.top(), option.rect.bottom(), 2):
+            if view.delegate.rating_at(option, index, QPoint(x, y)) == name:
+                return QPoint(x + 8, y + 8)
+    raise AssertionError("No se encontró el botón de valoración")
+
+
+def test_rating_buttons_emit_once(view, qtbot):
+    message = {"role": "assistant", "content": "Respuesta"}
+    view.model().append_message(message)
+    qtbot.wait(20)
+    ratings = []
+    view.rating_requested.connect(lambda row, rating: ratings.append((row, rating)))
+
+    qtbot.mouseClick(view.viewport(), Qt.MouseButton.LeftButton, pos=rating_button_center(view, 0, "up"))
+    assert ratings == [(0, "up")]
+
+    message["rating"] = "up"
+    qtbot.mouseClick(view.viewport(), Qt.MouseButton.LeftButton, pos=rating_button_center(view, 0, "down"))
+    assert ratings == [(0, "up")]
+
+
+def test_selected_messages_can_be_copied(view, qtbot):
+    view.model().set_messages([{"role": "user", "content": "uno"}, {"role": "assistant", "content": "dos"}])
+    view.selectAll()
+    qtbot.keyClick(view, Qt.Key.Key_C, Qt.KeyboardModifier.ControlModifier)
+    assert QApplication.clipboard().text() == "uno\n\ndos"
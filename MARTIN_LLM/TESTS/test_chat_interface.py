@@ -38,11 +38,14 @@ def mock_user_service(monkeypatch):
     return mock
 
 @pytest.fixture
-def chat_interface_widget(qtbot: QtBot, mock_chat_engine, mock_user_service):
+def chat_interface_widget(qtbot: QtBot, mock_chat_engine, mock_user_service, tmp_path, monkeypatch):
     """
     Crea una instancia del widget ChatInterface para ser usada en las pruebas.
     Esta es la fixture principal que prepara el componente a probar.
     """
+    # El índice de recuperación del usuario se crea en un directorio temporal.
+    import app.retrieval
+    monkeypatch.setattr(app.retrieval, "get_app_data_dir", lambda: tmp_path)
     # Datos de usuario falsos para la prueba
     test_user_id = "test_user_id"
     test_username = "test_user"
@@ -127,3 +130,74 @@ def test_send_message_without_model_selected(chat_interface_widget: ChatInterfac
 # 2. Navega al directorio raíz de tu proyecto en la terminal.
 # 3. Ejecuta pytest:
 #    pytest MARTIN_LLM/TESTS/test_chat_interface.py
+
+
+def test_stream_error_replaces_partial_reply(chat_interface_widget: ChatInterface):
+    """Un error a mitad del streaming sustituye la burbuja provisional en lugar de dejarla a medias."""
+    widget = chat_interface_widget
+    model = widget.history_model
+    widget.handle_partial_response("Respuesta a me")
+    row = widget.streaming_row
+    assert model.index(row).data(model.StreamingRole) is True
+
+    widget.handle_error("conexión perdida")
+    assert widget.streaming_row is None
+    assert model.rowCount() == row + 1
+    assert model.message(row)["content"] == "ERROR: conexión perdida"
+    assert not model.index(row).data(model.StreamingRole)
+
+
+def test_retrieval_indexing_does_not_delay_saves(chat_interface_widget: ChatInterface):
+    """La sincronización del índice de recuperación va en su propia cola, no en la de persistencia."""
+    import threading
+    widget = chat_interface_widget
+    assert widget.indexing_worker.flush(timeout=5)
+    release = threading.Event()
+    indexing_started = threading.Event()
+
+    def blocked_sync(*args):
+        indexing_started.set()
+        release.wait(10)
+        return 0
+
+    widget.retrieval_index.sync_conversations = blocked_sync
+    widget.chat_engine.save_key = "k1"
+    widget.user_service.create_conversation.return_value = "conv-1"
+    widget.user_service.get_conversation_details.return_value = None
+    try:
+        widget.sync_retrieval_index()
+        assert indexing_started.wait(5)
+        snapshot = {"conversation_id": None, "saved_count": 0, "fields": {"title": "t"},
+                    "history": [{"role": "user", "content": "hola"}]}
+        widget.persistence_worker.save_conversation(widget.user_id, "k1", snapshot)
+        assert widget.persistence_worker.flush(timeout=5)
+        widget.user_service.create_conversation.assert_called_once()
+    finally:
+        release.set()
+
+
+def test_attached_file_is_sent_without_pasting_into_input(chat_interface_widget: ChatInterface, monkeypatch, tmp_path):
+    """El texto extraído no se pega en el cuadro de entrada: se adjunta al próximo mensaje."""
+    widget = chat_interface_widget
+    document = "página de prueba\n" * 200_000  # unos 3,4 MB de texto
+    worker = object()
+    widget.file_extraction_worker = worker
+    monkeypatch.setattr(widget, "sender", lambda: worker)
+    path = tmp_path / "informe.pdf"
+    path.write_bytes(b"%PDF")
+    widget.on_file_text_ready(str(path), document)
+    assert widget.input_text.toPlainText() == ""
+    assert not widget.attachment_frame.isHidden()
+
+    sent = []
+    widget.chat_engine.provider = MagicMock()
+    monkeypatch.setattr(widget, "run_chat_worker", sent.append)
+    widget.input_text.setPlainText("Resúmelo")
+    widget.send_message()
+
+    assert sent[0].startswith("Basado en el siguiente contenido del archivo 'informe.pdf'")
+    assert document in sent[0] and sent[0].endswith("Resúmelo")
+    assert widget.chat_engine.history[-1]["content"] == sent[0]
+    shown = widget.history_model.message(widget.history_model.rowCount() - 1)["content"]
+    assert shown == "📎 informe.pdf\n\nResúmelo"
+    assert widget.attached_file is None and widget.attachment_frame.isHidden()
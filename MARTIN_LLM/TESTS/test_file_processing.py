@@ -0,0 +1,106 @@
+import threading
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app.services.file_processing_service as fps
+from app.services.file_processing_service import iter_text, iter_pdf, extract_text, ExtractionCancelled
+
+
+def write_pdf(path: Path, pages: int):
+    """Escribe un PDF mínimo con una línea de texto por página."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + 2 * i} 0 R" for i in range(pages)), pages),
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i in range(pages):
+        stream = f"BT /F1 12 Tf 72 712 Td (Pagina {i + 1}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(data)
+
+
+def test_pdf_pages_are_streamed_in_order(tmp_path):
+    path = tmp_path / "largo.pdf"
+    write_pdf(path, 40)
+    progress = []
+    pages = list(iter_pdf(str(path), progress=lambda done, total: progress.append((done, total))))
+    assert [page.strip() for page in pages] == [f"Pagina {i}" for i in range(1, 41)]
+    assert progress[-1] == (40, 40)
+
+
+def test_parallel_extraction_matches_sequential(tmp_path, monkeypatch):
+    path = tmp_path / "largo.pdf"
+    write_pdf(path, 40)
+    sequential = "".join(iter_pdf(str(path), max_workers=1))
+    monkeypatch.setattr(fps, "PDF_PAGES_PER_TASK", 8)
+    progress = []
+    parallel = "".join(iter_pdf(str(path), max_workers=2, progress=lambda done, total: progress.append(done)))
+    assert parallel == sequential
+    assert progress == [8, 16, 24, 32, 40]
+
+
+def test_extracted_text_is_cached_by_content(tmp_path, monkeypatch):
+    path = tmp_path / "notas.txt"
+    path.write_text("línea uno\nlínea dos\n", encoding="utf-8")
+    cache_dir = tmp_path / "cache"
+    assert "".join(iter_text(str(path), cache_dir=cache_dir)) == "línea uno\nlínea dos\n"
+
+    # Una copia con otro nombre tiene el mismo hash: se sirve desde la caché.
+    copy = tmp_path / "copia.txt"
+    copy.write_bytes(path.read_bytes())
+    monkeypatch.setitem(fps._EXTRACTORS, ".txt", lambda *args, **kwargs: pytest.fail("no debería releer el archivo"))
+    assert "".join(iter_text(str(copy), cache_dir=cache_dir)) == "línea uno\nlínea dos\n"
+
+    copy.write_text("otro contenido", encoding="utf-8")
+    with pytest.raises(pytest.fail.Exception):
+        list(iter_text(str(copy), cache_dir=cache_dir))
+
+
+def test_cancellation_and_unsupported_formats(tmp_path):
+    path = tmp_path / "doc.pdf"
+    write_pdf(path, 5)
+    cancel_event = threading.Event()
+    pages = iter_pdf(str(path), cancel_event=cancel_event)
+    next(pages)
+    cancel_event.set()
+    with pytest.raises(ExtractionCancelled):
+        next(pages)
+    with pytest.raises(ValueError):
+        extract_text(str(tmp_path / "imagen.png"))
+
+
+def test_docx_paragraphs(tmp_path):
+    from docx import Document
+    document = Document()
+    for text in ("Uno", "Dos", "Tres"):
+        document.add_paragraph(text)
+    path = tmp_path / "doc.docx"
+    document.save(path)
+    assert extract_text(str(path), use_cache=False) == "Uno\nDos\nTres"
+
+
+def test_worker_reports_progress_and_text(tmp_path, qtbot, monkeypatch):
+    from app.workers import FileExtractionWorker
+    monkeypatch.setattr(fps, "get_app_data_dir", lambda: tmp_path)
+    path = tmp_path / "doc.pdf"
+    write_pdf(path, 3)
+    worker = FileExtractionWorker(str(path))
+    progress = []
+    worker.progress.connect(lambda percent, stage: progress.append(percent))
+    with qtbot.waitSignal(worker.text_ready) as blocker:
+        worker.run()
+    assert blocker.args == [str(path), "Pagina 1\nPagina 2\nPagina 3\n"]
+    assert progress == [0, 33, 66, 100]
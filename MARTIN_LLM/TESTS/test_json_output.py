@@ -0,0 +1,70 @@
+import json
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.json_output import AGENT_ACTION_SCHEMA, PLAN_SCHEMA, JSONObjectDetector, extract_json, matches_schema
+from app.llm_providers import BaseLLMProvider, CtransformersProvider, LlamaCppProvider
+from app.prompt_builder import PromptBuilder
+from test_llm_providers import FakeLLM, ctransformers_provider
+
+ACTION = {"thought": "sumar", "action": {"tool_name": "calculator", "args": "2+2"}}
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(ACTION),
+    "```json\n" + json.dumps(ACTION, indent=2) + "\n```",
+    "Claro, aquí tienes:\n```\n" + json.dumps(ACTION) + "\n```\nEspero que sirva.",
+    '{"thought": "sumar", "action": {"tool_name": "calculator", "args": "2+2",},}',
+    '{"thought": "sumar", "action": {"tool_name": "calculator", "args": "2+2"',  # cortada por el límite de tokens
+])
+def test_extracts_action_from_messy_output(text):
+    assert extract_json(text, AGENT_ACTION_SCHEMA) == ACTION
+
+
+def test_prefers_object_matching_schema():
+    text = 'Ejemplo: {"foo": 1}. Respuesta: ' + json.dumps(ACTION)
+    assert extract_json(text, AGENT_ACTION_SCHEMA) == ACTION
+    # Si ninguno cumple el esquema se devuelve el primero legible.
+    assert extract_json('{"thought": "x", "action": "calculator"}', AGENT_ACTION_SCHEMA) == {"thought": "x", "action": "calculator"}
+    assert extract_json("esto no es json", AGENT_ACTION_SCHEMA) is None
+    assert extract_json('{"texto": "línea 1\nlínea 2"}') == {"texto": "línea 1\nlínea 2"}
+
+
+def test_schema_matching():
+    assert matches_schema({"plan": [{"id": 1, "task": "a", "depends_on": []}]}, PLAN_SCHEMA)
+    assert not matches_schema({"plan": []}, PLAN_SCHEMA)
+    assert not matches_schema({"plan": [{"id": True, "task": "a", "depends_on": []}]}, PLAN_SCHEMA)
+    assert matches_schema({"thought": "", "action": {"tool_name": "x", "args": {"a": 1}}}, AGENT_ACTION_SCHEMA)
+    assert matches_schema({"thought": "", "action": [{"tool_name": "x", "args": "a"}, {"tool_name": "y", "args": "b"}]}, AGENT_ACTION_SCHEMA)
+    assert not matches_schema({"thought": "", "action": []}, AGENT_ACTION_SCHEMA)
+    assert not matches_schema({"thought": "", "action": [{"tool_name": "x"}]}, AGENT_ACTION_SCHEMA)
+
+
+def test_detector_finds_end_across_chunks():
+    detector = JSONObjectDetector()
+    chunks = ['Respuesta: {"a": "}', '{\\"', '", "b": [1, {"c": 2}]', '}\n\nY además', " más texto"]
+    assert [detector.feed(chunk) for chunk in chunks[:3]] == [None, None, None]
+    assert detector.feed(chunks[3]) == 1
+    assert detector.complete and detector.feed(chunks[4]) == 0
+
+
+def test_ctransformers_stops_generation_when_json_is_complete(ctransformers_provider):
+    ctransformers_provider.llm = FakeLLM(['{"thought": "a", ', '"action": {"tool_name": "finish", "args": "b"}}', "\nNota: ", "texto de más"])
+    chunks = list(ctransformers_provider.query_stream([{"role": "user", "content": "hola"}], format=AGENT_ACTION_SCHEMA))
+    assert chunks == ['{"thought": "a", ', '"action": {"tool_name": "finish", "args": "b"}}']
+    # Sin formato se entrega todo.
+    assert ctransformers_provider.query([{"role": "user", "content": "hola"}]).endswith("texto de más")
+
+
+def test_llama_cpp_passes_schema_as_response_format():
+    provider = LlamaCppProvider.__new__(LlamaCppProvider)
+    BaseLLMProvider.__init__(provider, model_identifier="fake.gguf")
+    provider.prompt_builder = PromptBuilder()
+    messages = [{"role": "user", "content": "hola"}]
+    assert provider._completion_params(messages, format=PLAN_SCHEMA)["response_format"] == {"type": "json_object", "schema": PLAN_SCHEMA}
+    assert provider._completion_params(messages, format="json")["response_format"] == {"type": "json_object"}
+    assert "response_format" not in provider._completion_params(messages)
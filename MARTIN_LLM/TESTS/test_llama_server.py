@@ -0,0 +1,195 @@
+import threading
+import time
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from multiprocessing.connection import Client
+
+from app.llama_server import LlamaServer
+
+AUTHKEY = b"test-key"
+
+
+class FakeLlama:
+    """Simula `llama_cpp.Llama.create_chat_completion` con una respuesta troceada."""
+    def __init__(self, words, delay=0.0):
+        self.words = words
+        self.delay = delay
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        if not stream:
+            return {"choices": [{"message": {"role": "assistant", "content": " ".join(self.words)}}]}
+
+        def generator():
+            for word in self.words:
+                time.sleep(self.delay)
+                yield {"choices": [{"delta": {"content": word}}]}
+        return generator()
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+
+    def start(llm, max_queue=8):
+        server = LlamaServer(llm, ("localhost", 0), AUTHKEY, max_queue=max_queue, model_name="fake.gguf")
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while server.listener is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        servers.append((server, thread))
+        return server
+
+    yield start
+    for server, thread in servers:
+        server.shutdown()
+        thread.join(timeout=5)
+
+
+def completion(request_id, stream=True):
+    return {"type": "completion", "id": request_id, "stream": stream,
+            "params": {"messages": [{"role": "user", "content": "hola"}]}}
+
+
+def collect(conn, request_id):
+    chunks = []
+    while True:
+        msg = conn.recv()
+        assert msg["id"] == request_id
+        if msg["type"] == "chunk":
+            chunks.append(msg["data"]["choices"][0]["delta"]["content"])
+        else:
+            return chunks, msg
+
+
+def test_serves_several_clients(server_factory):
+    server = server_factory(FakeLlama(["a", "b", "c"]))
+    results = {}
+
+    def client(name):
+        with Client(server.address, authkey=AUTHKEY) as conn:
+            conn.send(completion(name))
+            results[name] = collect(conn, name)
+
+    threads = [threading.Thread(target=client, args=(f"c{i}",)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    assert len(results) == 3
+    for chunks, final in results.values():
+        assert chunks == ["a", "b", "c"]
+        assert final["type"] == "done" and final["cancelled"] is False
+    # Un cliente que se desconecta no apaga el servidor.
+    with Client(server.address, authkey=AUTHKEY) as conn:
+        conn.send({"type": "stats"})
+        stats = conn.recv()["data"]
+    assert stats["completed"] == 3
+
+
+def test_legacy_plain_dict_request(server_factory):
+    server = server_factory(FakeLlama(["hola", "mundo"]))
+    with Client(server.address, authkey=AUTHKEY) as conn:
+        conn.send({"messages": [{"role": "user", "content": "hola"}]})
+        response = conn.recv()
+    assert response["choices"][0]["message"]["content"] == "hola mundo"
+
+
+def test_cancel_stops_streaming(server_factory):
+    server = server_factory(FakeLlama([str(i) for i in range(200)], delay=0.01))
+    with Client(server.address, authkey=AUTHKEY) as conn:
+        conn.send(completion("r1"))
+        first = conn.recv()
+        assert first["type"] == "chunk"
+        conn.send({"type": "cancel", "id": "r1"})
+        chunks, final = collect(conn, "r1")
+    assert final["type"] == "done" and final["cancelled"] is True
+    assert len(chunks) < 199
+
+
+def test_full_queue_rejects_and_health(server_factory):
+    llm = FakeLlama(["x"])
+    llm.release.clear()
+    server = server_factory(llm, max_queue=1)
+    with Client(server.address, authkey=AUTHKEY) as conn:
+        conn.send(completion("busy", stream=False))
+        deadline = time.monotonic() + 5
+        while not server.get_stats()["busy"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        conn.send(completion("queued", stream=False))
+        conn.send(completion("rejected", stream=False))
+        rejected = conn.recv()
+        assert rejected["type"] == "error" and rejected["id"] == "rejected"
+
+        conn.send({"type": "health"})
+        assert conn.recv() == {"type": "health", "status": "ok", "model": "fake.gguf"}
+
+        llm.release.set()
+        finished = {conn.recv()["id"] for _ in range(2)}
+    assert finished == {"busy", "queued"}
+    assert server.get_stats()["rejected"] == 1
+
+
+FAKE_SERVER_SCRIPT = '''
+import os, sys
+sys.path.insert(0, {root!r})
+from app.llama_server import LlamaServer
+
+class EchoLlama:
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        words = ["eco:", messages[-1]["content"]]
+        if not stream:
+            return {{"choices": [{{"message": {{"content": " ".join(words)}}}}]}}
+        return iter([{{"choices": [{{"delta": {{"content": w}}}}]}} for w in words])
+
+port = int(sys.argv[sys.argv.index("--port") + 1])
+authkey = os.environ["MARTIN_LLM_SERVER_AUTHKEY"].encode()
+LlamaServer(EchoLlama(), ("localhost", port), authkey).serve_forever()
+'''
+
+
+@pytest.fixture
+def llama_cpp_provider(tmp_path, monkeypatch):
+    from app import llm_providers
+    from app.llm_providers import LlamaCppProvider
+
+    script = tmp_path / "fake_server.py"
+    script.write_text(FAKE_SERVER_SCRIPT.format(root=str(Path(__file__).resolve().parents[1])), encoding="utf-8")
+    model = tmp_path / "fake.gguf"
+    model.write_bytes(b"GGUF")
+    monkeypatch.setattr(llm_providers, "get_log_file_path", lambda: tmp_path / "llama_server.log")
+
+    class FakeServerProvider(LlamaCppProvider):
+        def _server_command(self):
+            return [sys.executable, str(script), "--port", str(self.port)]
+
+    provider = FakeServerProvider(str(model), hardware_config={"n_gpu_layers": 0}, startup_timeout=30)
+    yield provider
+    provider.shutdown()
+
+
+def test_llama_cpp_provider_streams_from_child(llama_cpp_provider):
+    messages = [{"role": "user", "content": "hola"}]
+    assert list(llama_cpp_provider.query_stream(messages)) == ["eco:", "hola"]
+    assert llama_cpp_provider.query(messages) == "eco:hola"
+
+
+def test_llama_cpp_provider_restarts_crashed_child(llama_cpp_provider):
+    first_pid = llama_cpp_provider.process.pid
+    llama_cpp_provider.process.kill()
+    llama_cpp_provider.process.wait()
+
+    assert llama_cpp_provider.query([{"role": "user", "content": "otra"}]) == "eco:otra"
+    assert llama_cpp_provider.restarts == 1
+    assert llama_cpp_provider.process.pid != first_pid
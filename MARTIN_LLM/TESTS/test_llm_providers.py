@@ -0,0 +1,180 @@
+import pytest
+import threading
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from types import SimpleNamespace
+
+from app.llm_providers import BaseLLMProvider, CtransformersProvider
+from app.chat_engine import ChatEngine
+from app.prompt_builder import PromptBuilder
+
+
+class FakeLLM:
+    """Simula el objeto LLM de ctransformers devolviendo la respuesta en fragmentos."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = []
+
+    def __call__(self, prompt, **kwargs):
+        self.calls.append((prompt, kwargs))
+        def generator():
+            for chunk in self.chunks:
+                yield chunk
+        return generator() if kwargs.get("stream") else "".join(self.chunks)
+
+
+class FakeTokenLLM:
+    """
+    Simula la API de bajo nivel de ctransformers con un token por carácter.
+    Genera siempre la misma respuesta y registra qué tokens se evalúan.
+    """
+    EOS = -1
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.config = SimpleNamespace(max_new_tokens=256)
+        self.context = []
+        self.evaluated = []
+        self.tokenized = []
+        self._pending_reply = []
+
+    def tokenize(self, text, add_bos_token=None):
+        self.tokenized.append(text)
+        return [ord(c) for c in text]
+
+    def prepare_inputs_for_generation(self, tokens, reset=None):
+        n = min(len(tokens) - 1, len(self.context))
+        l = 0
+        while l < n and tokens[l] == self.context[l]:
+            l += 1
+        self.context = self.context[:l]
+        return tokens[l:]
+
+    def eval(self, tokens):
+        if len(tokens) > 1:  # evaluación de un prompt: prepara una nueva respuesta
+            self._pending_reply = [ord(c) for c in self.reply] + [self.EOS]
+        self.evaluated.append(list(tokens))
+        self.context.extend(tokens)
+
+    def sample(self, **kwargs):
+        return self._pending_reply.pop(0)
+
+    def is_eos_token(self, token):
+        return token == self.EOS
+
+    def detokenize(self, tokens, decode=True):
+        return "".join(chr(t) for t in tokens).encode()
+
+
+class EchoProvider(BaseLLMProvider):
+    def query(self, messages: list, format: str = None) -> str:
+        return "respuesta completa"
+
+
+@pytest.fixture
+def ctransformers_provider():
+    """Crea un CtransformersProvider sin cargar ningún modelo real."""
+    provider = CtransformersProvider.__new__(CtransformersProvider)
+    BaseLLMProvider.__init__(provider, model_identifier="fake.gguf")
+    provider.model_path = "fake.gguf"
+    provider.session_mode = False
+    provider._session_text = ""
+    provider._session_tokens = []
+    provider._generation_lock = threading.RLock()
+    provider.prompt_builder = PromptBuilder()
+    provider.llm = FakeLLM(["Hola", ", ", "mundo"])
+    return provider
+
+
+@pytest.fixture
+def session_provider(ctransformers_provider):
+    ctransformers_provider.session_mode = True
+    ctransformers_provider.llm = FakeTokenLLM("ok")
+    return ctransformers_provider
+
+
+def test_base_provider_query_stream_falls_back_to_query():
+    provider = EchoProvider("echo")
+    assert list(provider.query_stream([{"role": "user", "content": "hola"}])) == ["respuesta completa"]
+
+
+def test_ctransformers_query_stream_yields_chunks(ctransformers_provider):
+    chunks = list(ctransformers_provider.query_stream([{"role": "user", "content": "hola"}]))
+    assert chunks == ["Hola", ", ", "mundo"]
+    _, kwargs = ctransformers_provider.llm.calls[0]
+    assert kwargs["stream"] is True
+
+
+def test_ctransformers_query_joins_stream(ctransformers_provider):
+    assert ctransformers_provider.query([{"role": "user", "content": "hola"}]) == "Hola, mundo"
+
+
+def test_ctransformers_query_stream_stops_when_cancelled(ctransformers_provider):
+    cancel_event = threading.Event()
+    received = []
+    for chunk in ctransformers_provider.query_stream([{"role": "user", "content": "hola"}], cancel_event=cancel_event):
+        received.append(chunk)
+        cancel_event.set()
+    assert received == ["Hola"]
+
+
+def test_ctransformers_builds_prompt_under_generation_lock(ctransformers_provider):
+    """Los pasos paralelos del razonador no construyen su prompt mientras otro genera."""
+    built = []
+    build = ctransformers_provider.prompt_builder.build
+    ctransformers_provider.prompt_builder.build = lambda messages: built.append(messages) or build(messages)
+    with ctransformers_provider._generation_lock:
+        thread = threading.Thread(target=ctransformers_provider.query, args=([{"role": "user", "content": "hola"}],))
+        thread.start()
+        thread.join(0.2)
+        assert built == []
+    thread.join(5)
+    assert len(built) == 1
+
+
+def test_session_mode_only_evaluates_new_turn(session_provider):
+    history = [{"role": "system", "content": "sys"}, {"role": "user", "content": "hola"}]
+    assert session_provider.query(history) == "ok"
+
+    history += [{"role": "assistant", "content": "ok"}, {"role": "user", "content": "otra"}]
+    assert session_provider.query(history) == "ok"
+
+    llm = session_provider.llm
+    # Solo se tokeniza el sufijo nuevo y solo se evalúa lo que no estaba en el contexto.
+    assert llm.tokenized[-1] == "\nassistant: ok\nuser: otra"
+    prompt_eval = llm.evaluated[-3]
+    assert "".join(chr(t) for t in prompt_eval) == "\nassistant: ok\nuser: otra"
+
+
+def test_session_reset_tokenizes_full_prompt(session_provider):
+    history = [{"role": "system", "content": "sys"}, {"role": "user", "content": "hola"}]
+    session_provider.query(history)
+    session_provider.reset_session()
+    session_provider.query(history + [{"role": "user", "content": "mas"}])
+    assert session_provider.llm.tokenized[-1] == "system: sys\nuser: hola\nuser: mas"
+    # También se olvida el recorte de contexto de la conversación anterior.
+    session_provider.prompt_builder._dropped = 5
+    session_provider.reset_session()
+    assert session_provider.prompt_builder._dropped == 0
+
+
+def test_chat_engine_invalidates_session_on_prefix_changes(session_provider):
+    engine = ChatEngine(session_provider)
+    engine.history = [{"role": "user", "content": "hola"}]
+    session_provider.query(engine.get_full_prompt())
+    assert session_provider._session_tokens
+
+    engine.system_prompt = "otro prompt"
+    assert not session_provider._session_tokens
+
+    session_provider.query(engine.get_full_prompt())
+    engine.load_conversation("abc", [{"role": "user", "content": "x"}], "otro prompt")
+    assert not session_provider._session_tokens
+
+    session_provider.query(engine.get_full_prompt())
+    engine.start_new()
+    assert not session_provider._session_tokens
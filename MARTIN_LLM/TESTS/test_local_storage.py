@@ -0,0 +1,106 @@
+import json
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.local_storage_service import LocalStorageService
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorageService(storage_path=str(tmp_path / "local_storage"))
+
+
+def test_list_is_paginated_newest_first(storage):
+    ids = [storage.create_conversation("u1", {"title": f"conv {i}", "messages": []}) for i in range(5)]
+    storage.create_conversation("u2", {"title": "otra", "messages": []})
+    storage.update_conversation("u1", ids[0], {"title": "renombrada"})
+
+    page = storage.get_user_conversations("u1", limit=2)
+    assert [c["_id"] for c in page] == [ids[0], ids[4]]
+    assert page[0]["title"] == "renombrada"
+    assert [c["_id"] for c in storage.get_user_conversations("u1", limit=2, offset=2)] == [ids[3], ids[2]]
+    assert len(storage.get_user_conversations("u1")) == 5
+    assert storage.count_user_conversations("u1") == 5
+
+    assert storage.delete_conversation("u1", ids[1])
+    assert ids[1] not in [c["_id"] for c in storage.get_user_conversations("u1")]
+    assert storage.get_conversation_details("u1", ids[2])["title"] == "conv 2"
+
+
+def test_migrates_existing_json_files_once(tmp_path):
+    root = tmp_path / "local_storage"
+    user_dir = root / "u1"
+    user_dir.mkdir(parents=True)
+    for i in range(3):
+        conv = {"_id": f"c{i}", "title": f"antigua {i}", "timestamp": f"2024-01-0{i + 1}T00:00:00", "messages": [{"role": "user", "content": "hola"}]}
+        (user_dir / f"c{i}.json").write_text(json.dumps(conv), encoding="utf-8")
+    (user_dir / "roto.json").write_text("{no es json", encoding="utf-8")
+
+    storage = LocalStorageService(storage_path=str(root))
+    assert [c["_id"] for c in storage.get_user_conversations("u1")] == ["c2", "c1", "c0"]
+
+    # Un archivo que aparezca después no se vuelve a migrar: el índice manda.
+    (user_dir / "tarde.json").write_text(json.dumps({"_id": "tarde", "title": "x"}), encoding="utf-8")
+    assert len(LocalStorageService(storage_path=str(root)).get_user_conversations("u1")) == 3
+
+
+def test_listing_ten_thousand_conversations_uses_index(storage):
+    with storage._db:
+        storage._db.executemany(
+            "INSERT INTO conversations (_id, user_id, title, timestamp) VALUES (?, ?, ?, ?)",
+            ((f"c{i}", "u1", f"conv {i}", f"2024-01-01T00:00:{i:05d}") for i in range(10_000)),
+        )
+    page = storage.get_user_conversations("u1", limit=50, offset=100)
+    assert len(page) == 50 and page[0]["_id"] == "c9899"
+
+    # La página sale del índice (user_id, timestamp) ya ordenada, sin recorrer ni ordenar la tabla.
+    plan = " ".join(row[-1] for row in storage._db.execute(
+        "EXPLAIN QUERY PLAN SELECT _id, title, timestamp FROM conversations WHERE user_id = ? "
+        "ORDER BY timestamp DESC LIMIT ? OFFSET ?", ("u1", 50, 100)))
+    assert "idx_conversations_user_ts" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_append_messages_uses_journal_and_compacts(storage, monkeypatch):
+    conv_id = storage.create_conversation("u1", {"title": "t", "messages": [{"role": "user", "content": "hola"}]})
+    document = Path(storage._document_path("u1", conv_id))
+    journal = Path(storage._journal_path("u1", conv_id))
+    snapshot_before = document.read_bytes()
+
+    assert storage.append_messages("u1", conv_id, [{"role": "assistant", "content": "buenas"}], {"title": "nuevo"})
+    assert document.read_bytes() == snapshot_before  # el JSON no se reescribe
+    assert journal.exists()
+    assert storage.update_message("u1", conv_id, 1, {"rating": "up"})
+
+    details = storage.get_conversation_details("u1", conv_id)
+    assert [m["content"] for m in details["messages"]] == ["hola", "buenas"]
+    assert details["messages"][1]["rating"] == "up"
+    assert details["title"] == "nuevo" and "_journal_seq" not in details
+    assert storage.get_user_conversations("u1")[0]["title"] == "nuevo"
+
+    # 3 líneas hasta aquí y 2 por cada anexo: la tercera llamada alcanza el umbral.
+    monkeypatch.setattr(LocalStorageService, "COMPACT_THRESHOLD", 9)
+    for i in range(3):
+        storage.append_messages("u1", conv_id, [{"role": "user", "content": f"m{i}"}])
+    assert not journal.exists()
+    compacted = json.loads(document.read_text(encoding="utf-8"))
+    assert [m["content"] for m in compacted["messages"]] == ["hola", "buenas", "m0", "m1", "m2"]
+
+
+def test_journal_survives_torn_line_and_interrupted_compaction(storage):
+    conv_id = storage.create_conversation("u1", {"title": "t", "messages": []})
+    storage.append_messages("u1", conv_id, [{"role": "user", "content": "uno"}])
+    journal = Path(storage._journal_path("u1", conv_id))
+    journal_copy = journal.read_bytes()
+
+    # Compactación interrumpida: el JSON ya se reemplazó pero el diario sigue ahí.
+    storage.compact_conversation("u1", conv_id)
+    journal.write_bytes(journal_copy + b'{"op": "append", "mess')  # y además una línea cortada
+    storage.append_messages("u1", conv_id, [{"role": "assistant", "content": "dos"}])
+
+    messages = storage.get_conversation_details("u1", conv_id)["messages"]
+    assert [m["content"] for m in messages] == ["uno", "dos"]
@@ -0,0 +1,47 @@
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ui.markdown_renderer import MarkdownRenderer, split_blocks
+
+SAMPLE = (
+    "# Título\n\nTexto *uno*.\n\n```python\ndef f():\n\n    return 1\n```\n\n"
+    "1. a\n\n2. b\n\nFin\n\n| a | b |\n|---|---|\n| 1 | 2 |\n\n> cita\n\n> más\n\n"
+    "    sangrado\n\n    sigue\n\nÚltimo párrafo"
+)
+
+
+def test_render_is_cached_by_content():
+    renderer = MarkdownRenderer(max_entries=2)
+    html = renderer.render("**hola**")
+    assert html == "<p><strong>hola</strong></p>"
+    assert renderer.render("**hola**") is html
+    renderer.render("a")
+    renderer.render("b")  # expulsa "**hola**", el menos usado
+    renderer.render("**hola**")
+    assert renderer.stats() == {"hits": 1, "misses": 4, "entries": 2}
+
+
+def test_blocks_do_not_split_code_lists_or_quotes():
+    blocks = split_blocks(SAMPLE)
+    assert any("```python\ndef f():\n\n    return 1\n```\n" in block for block in blocks)
+    assert any("1. a\n\n2. b\n\n" in block for block in blocks)
+    assert any("> cita\n\n> más\n\n" in block for block in blocks)
+    assert "".join(blocks) == SAMPLE
+    assert split_blocks("[x]: http://a\n\nver [x]") == ["[x]: http://a\n\nver [x]"]
+
+
+def test_streaming_matches_full_render_and_reuses_blocks():
+    renderer = MarkdownRenderer()
+    for end in range(1, len(SAMPLE) + 1, 7):
+        partial = SAMPLE[:end]
+        assert renderer.render_streaming(partial) == MarkdownRenderer._convert(partial)
+    assert renderer.render_streaming(SAMPLE) == MarkdownRenderer._convert(SAMPLE)
+
+    # Al añadir texto al final, los bloques anteriores salen de la caché.
+    misses = renderer.misses
+    renderer.render_streaming(SAMPLE + " y más")
+    assert renderer.misses == misses
@@ -0,0 +1,166 @@
+import threading
+import time
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.llm_providers import BaseLLMProvider
+from app.model_cache import ModelCache
+
+HARDWARE = {"n_gpu_layers": 0}
+
+
+class FakeProvider(BaseLLMProvider):
+    loads = 0
+
+    def __init__(self, model_path, hardware_config=None, **kwargs):
+        super().__init__(model_identifier=Path(model_path).name)
+        type(self).loads += 1
+        time.sleep(kwargs.get("load_delay", 0))
+        self.kwargs = kwargs
+        self.closed = False
+
+    def query(self, messages, format=None):
+        return "ok"
+
+    def shutdown(self):
+        self.closed = True
+
+
+@pytest.fixture
+def models(tmp_path):
+    FakeProvider.loads = 0
+    paths = {}
+    for name, size in (("a.gguf", 100), ("b.gguf", 200), ("c.gguf", 300)):
+        paths[name] = tmp_path / name
+        paths[name].write_bytes(b"\0" * size)
+    return paths
+
+
+def test_returns_cached_instance_and_counts_hits(models):
+    cache = ModelCache(max_models=2)
+    first = cache.get(models["a.gguf"], FakeProvider, HARDWARE)
+    second = cache.get(models["a.gguf"], FakeProvider, HARDWARE)
+    assert first is second
+    assert FakeProvider.loads == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_different_hardware_config_is_a_different_entry(models):
+    cache = ModelCache(max_models=2)
+    cpu = cache.get(models["a.gguf"], FakeProvider, HARDWARE)
+    gpu = cache.get(models["a.gguf"], FakeProvider, {"n_gpu_layers": -1})
+    assert cpu is not gpu
+
+
+def test_evicts_least_recently_used(models):
+    cache = ModelCache(max_models=2)
+    a = cache.get(models["a.gguf"], FakeProvider, HARDWARE)
+    b = cache.get(models["b.gguf"], FakeProvider, HARDWARE)
+    cache.get(models["a.gguf"], FakeProvider, HARDWARE)  # a pasa a ser el más reciente
+    cache.get(models["c.gguf"], FakeProvider, HARDWARE)
+    assert b.closed and not a.closed
+    assert cache.contains(models["a.gguf"], FakeProvider, HARDWARE)
+    assert not cache.contains(models["b.gguf"], FakeProvider, HARDWARE)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget(models):
+    cache = ModelCache(max_models=5, max_bytes=550)
+    a = cache.get(models["a.gguf"], FakeProvider, HARDWARE)
+    b = cache.get(models["b.gguf"], FakeProvider, HARDWARE)
+    cache.get(models["c.gguf"], FakeProvider, HARDWARE)
+    assert a.closed and not b.closed
+    assert cache.stats()["bytes"] == 500
+    assert cache.stats()["models"] == 2
+
+
+def test_concurrent_requests_load_once(models):
+    cache = ModelCache()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(models["a.gguf"], FakeProvider, HARDWARE, load_delay=0.2)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert FakeProvider.loads == 1
+    assert len({id(p) for p in results}) == 1
+
+
+def test_clear_shuts_down_everything(models):
+    cache = ModelCache()
+    a = cache.get(models["a.gguf"], FakeProvider, HARDWARE)
+    cache.clear()
+    assert a.closed and cache.stats()["models"] == 0
+
+
+@pytest.fixture
+def load_worker_env(models, monkeypatch):
+    import app.model_cache
+    import app.llm_providers
+    monkeypatch.setattr(app.model_cache, "model_cache", ModelCache())
+    monkeypatch.setattr(app.llm_providers, "CtransformersProvider", FakeProvider)
+    monkeypatch.setattr(app.llm_providers, "load_hardware_config", lambda: dict(HARDWARE))
+    return models
+
+
+def run_load_worker(worker):
+    events = []
+    worker.progress.connect(lambda percent, stage: events.append(("progress", percent)))
+    worker.model_loaded.connect(lambda provider: events.append(("loaded", provider)))
+    worker.cancelled.connect(lambda: events.append(("cancelled", None)))
+    worker.error_occurred.connect(lambda msg: events.append(("error", msg)))
+    worker.run()
+    return events
+
+
+def test_model_load_worker_reports_stages(load_worker_env):
+    from app.workers import ModelLoadWorker
+    events = run_load_worker(ModelLoadWorker(str(load_worker_env["a.gguf"])))
+    percents = [value for kind, value in events if kind == "progress"]
+    assert percents == sorted(percents) and percents[-1] == 100
+    assert events[-1][0] == "loaded" and isinstance(events[-1][1], FakeProvider)
+
+    # La segunda vez el modelo sale de la caché directamente.
+    events = run_load_worker(ModelLoadWorker(str(load_worker_env["a.gguf"])))
+    assert [kind for kind, _ in events] == ["progress", "loaded"]
+    assert FakeProvider.loads == 1
+
+
+def test_model_load_worker_cancel_keeps_model_unloaded(load_worker_env):
+    from app.workers import ModelLoadWorker
+    worker = ModelLoadWorker(str(load_worker_env["b.gguf"]))
+    worker.progress.connect(lambda percent, stage: worker.cancel())
+    events = run_load_worker(worker)
+    assert events[-1][0] == "cancelled"
+    assert FakeProvider.loads == 0
+
+
+def test_model_load_worker_finishes_autotune_cancelled_earlier(load_worker_env):
+    from app.workers import ModelLoadWorker
+    tuned = []
+
+    def autotune(self, cancel_event=None):
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        self.is_tuned = True
+        tuned.append(self)
+
+    FakeProvider.is_tuned = False
+    FakeProvider.autotune = autotune
+    try:
+        worker = ModelLoadWorker(str(load_worker_env["a.gguf"]))
+        worker.progress.connect(lambda percent, stage: percent == 85 and worker.cancel())
+        assert run_load_worker(worker)[-1][0] == "cancelled"
+        assert not tuned
+
+        # El modelo quedó en la caché sin ajustar: la siguiente carga completa el ajuste.
+        events = run_load_worker(ModelLoadWorker(str(load_worker_env["a.gguf"])))
+        assert events[-1][0] == "loaded" and events[-1][1].is_tuned
+        assert len(tuned) == 1 and FakeProvider.loads == 1
+    finally:
+        del FakeProvider.is_tuned, FakeProvider.autotune
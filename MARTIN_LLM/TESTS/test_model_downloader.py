@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.model_downloader import ModelDownloader, ChecksumMismatchError, DownloadCancelled
+
+PAYLOAD = os.urandom(300_000)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Sirve PAYLOAD admitiendo 'Range: bytes=a-b' (salvo que el servidor lo desactive)."""
+    def do_GET(self):
+        server = self.server
+        header = self.headers.get("Range")
+        with server.lock:
+            server.requests.append(header)
+        if header and server.supports_ranges:
+            start, end = header.split("=")[1].split("-")
+            start, end = int(start), min(int(end), len(PAYLOAD) - 1)
+            body = PAYLOAD[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.bytes_sent = 0
+    server.supports_ranges = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/model.gguf"
+
+
+def test_parallel_ranges_and_checksum(http_server, tmp_path):
+    dest = tmp_path / "models" / "model.gguf"
+    progress = []
+    downloader = ModelDownloader(url_of(http_server), dest, sha256=PAYLOAD_SHA256, chunk_size=64_000,
+                                 progress_callback=lambda done, total: progress.append((done, total)))
+    assert downloader.download() == dest
+    assert dest.read_bytes() == PAYLOAD
+    assert not downloader.part_path.exists() and not downloader.journal_path.exists()
+    # Sonda + 5 trozos de 64 KB
+    assert len([r for r in http_server.requests if r != "bytes=0-0"]) == 5
+    assert progress[-1] == (len(PAYLOAD), len(PAYLOAD))
+
+
+def test_resumes_from_journal_after_cancel(http_server, tmp_path):
+    dest = tmp_path / "model.gguf"
+    cancel = threading.Event()
+
+    def cancel_halfway(done, total):
+        if done >= total // 2:
+            cancel.set()
+
+    first = ModelDownloader(url_of(http_server), dest, chunk_size=50_000, max_workers=1,
+                            cancel_event=cancel, progress_callback=cancel_halfway)
+    with pytest.raises(DownloadCancelled):
+        first.download()
+    assert first.part_path.exists() and not dest.exists()
+    sent_before = http_server.bytes_sent
+
+    second = ModelDownloader(url_of(http_server), dest, sha256=PAYLOAD_SHA256, chunk_size=50_000)
+    second.download()
+    assert dest.read_bytes() == PAYLOAD
+    # Solo se vuelven a pedir los trozos que no estaban completos.
+    assert http_server.bytes_sent - sent_before < len(PAYLOAD) * 0.75
+
+
+def test_chunk_is_synced_before_journal_marks_it(http_server, tmp_path, monkeypatch):
+    import app.model_downloader as model_downloader
+    events = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(model_downloader.os, "fsync", lambda fd: (events.append(("fsync", os.fstat(fd).st_size)), real_fsync(fd)))
+    downloader = ModelDownloader(url_of(http_server), tmp_path / "model.gguf", chunk_size=100_000, max_workers=1)
+    real_mark_done = downloader._mark_done
+    monkeypatch.setattr(downloader, "_mark_done", lambda index: (events.append(("done", index)), real_mark_done(index)))
+    downloader.download()
+    # Cada "done" va precedido del fsync del archivo .part (del tamaño completo).
+    for i, event in enumerate(events):
+        if event[0] == "done":
+            assert events[i - 1] == ("fsync", len(PAYLOAD))
+
+
+def test_checksum_mismatch_keeps_destination_clean(http_server, tmp_path):
+    dest = tmp_path / "model.gguf"
+    downloader = ModelDownloader(url_of(http_server), dest, sha256="0" * 64, chunk_size=100_000)
+    with pytest.raises(ChecksumMismatchError):
+        downloader.download()
+    assert not dest.exists()
+    assert not downloader.part_path.exists() and not downloader.journal_path.exists()
+
+
+def test_falls_back_to_single_stream_without_ranges(http_server, tmp_path):
+    http_server.supports_ranges = False
+    dest = tmp_path / "model.gguf"
+    ModelDownloader(url_of(http_server), dest, sha256=PAYLOAD_SHA256, chunk_size=64_000).download()
+    assert dest.read_bytes() == PAYLOAD
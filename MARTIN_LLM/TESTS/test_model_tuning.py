@@ -0,0 +1,137 @@
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from types import SimpleNamespace
+
+import app.model_tuning as model_tuning
+from app.model_tuning import select_model_type, resolve_load_settings, benchmark_llm, TuningStore
+from app.llm_providers import CtransformersProvider
+
+
+@pytest.fixture(autouse=True)
+def isolated_store(tmp_path, monkeypatch):
+    """Los ajustes medidos se guardan en un directorio temporal."""
+    store = TuningStore(tmp_path / "tuning.json")
+    monkeypatch.setattr(model_tuning, "tuning_store", store)
+    import app.llm_providers
+    monkeypatch.setattr(app.llm_providers, "tuning_store", store)
+    return store
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBenchLLM:
+    """
+    Simula el coste de ctransformers: evaluar el prompt es más rápido con lotes de 128 y
+    generar es más rápido con 4 hilos. El tiempo avanza en un reloj falso.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.context = []
+        self.config = SimpleNamespace(threads=-1, batch_size=8)
+
+    def tokenize(self, text, add_bos_token=None):
+        return list(range(len(text.split())))
+
+    def prepare_inputs_for_generation(self, tokens, reset=None):
+        self.context = []
+        return tokens
+
+    def eval(self, tokens, batch_size=None, threads=None):
+        if len(tokens) > 1:
+            self.clock.now += len(tokens) * (0.01 if batch_size == 128 else 0.05)
+        else:
+            self.clock.now += 0.02 if threads == 4 else 0.08
+        self.context.extend(tokens)
+
+    def sample(self, **kwargs):
+        return 7
+
+
+def test_model_type_comes_from_metadata_not_path():
+    # 'yi' aparece en el directorio y 'mistral' en el nombre, pero manda la arquitectura.
+    assert select_model_type("/home/yiannis/mistral-phi3.gguf", {"general.architecture": "phi3"}) == "phi3"
+    assert select_model_type("x.gguf", {"general.architecture": "llama", "general.name": "Mistral 7B"}) == "mistral"
+    assert select_model_type("x.gguf", {"general.architecture": "gptneox"}) == "gpt_neox"
+
+
+def test_filename_fallback_matches_whole_words():
+    assert select_model_type("/home/yiannis/tinyllama.gguf") == "llama"
+    assert select_model_type("/models/Yi-34B.Q4_K_M.gguf") == "yi"
+    assert select_model_type("/models/dolphin-2.gguf") == "llama"
+
+
+def test_resolve_load_settings_uses_metadata_hardware_and_tuning(tmp_path, isolated_store):
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"\0" * 10)
+    metadata = {"general.architecture": "llama", "llama.context_length": 131072}
+    hardware = {"type": "high_cpu", "n_gpu_layers": 0, "n_threads": 6}
+
+    settings = resolve_load_settings(model, hardware, metadata)
+    assert settings == {"model_type": "llama", "gpu_layers": 0, "threads": 6,
+                        "batch_size": model_tuning.DEFAULT_CPU_BATCH_SIZE,
+                        "context_length": model_tuning.MAX_CONTEXT_LENGTH}
+
+    isolated_store.put(model, hardware, {"threads": 3, "batch_size": 128})
+    reloaded = TuningStore(isolated_store.store_path)
+    assert reloaded.get(model, hardware)["threads"] == 3
+    tuned = resolve_load_settings(model, hardware, metadata)
+    assert (tuned["threads"], tuned["batch_size"]) == (3, 128)
+    # Otra configuración de hardware no reutiliza el ajuste.
+    assert isolated_store.get(model, {"type": "gpu", "n_gpu_layers": -1}) is None
+
+
+def test_benchmark_picks_fastest_batch_and_threads(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(model_tuning.time, "perf_counter", clock)
+    result = benchmark_llm(FakeBenchLLM(clock), [2, 4, 8], (8, 128, 512))
+    assert result["batch_size"] == 128
+    assert result["threads"] == 4
+    assert result["generation_tps"] == pytest.approx(50.0)
+
+
+def test_benchmark_prompt_covers_the_largest_batch(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(model_tuning.time, "perf_counter", clock)
+    llm = FakeBenchLLM(clock)
+    evaluated = []
+    original_eval = llm.eval
+    llm.eval = lambda tokens, batch_size=None, threads=None: (evaluated.append((len(tokens), batch_size)), original_eval(tokens, batch_size, threads))
+    benchmark_llm(llm, [4], (8, 128, 512))
+    assert evaluated[:3] == [(512, 8), (512, 128), (512, 512)]
+
+    # Con un contexto corto, los lotes mayores que el prompt no se prueban.
+    evaluated.clear()
+    llm.context_length = 200
+    assert benchmark_llm(llm, [4], (8, 128, 512))["batch_size"] == 128
+    assert [size for _, size in evaluated[:2]] == [8, 128] and evaluated[0][0] == 200 - model_tuning.BENCHMARK_GENERATED_TOKENS - 1
+
+
+def test_autotune_stores_and_applies_result(tmp_path, monkeypatch, isolated_store):
+    clock = FakeClock()
+    monkeypatch.setattr(model_tuning.time, "perf_counter", clock)
+    monkeypatch.setattr("app.llm_providers.thread_candidates", lambda hardware: [2, 4])
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"\0" * 10)
+
+    provider = CtransformersProvider.__new__(CtransformersProvider)
+    provider.model_identifier = "model.gguf"
+    provider.model_path = str(model)
+    provider.hardware_config = {"n_gpu_layers": 0}
+    provider.llm = FakeBenchLLM(clock)
+    provider._session_text, provider._session_tokens = "", []
+    assert not provider.is_tuned
+
+    provider.autotune()
+    assert provider.is_tuned
+    assert (provider.llm.config.threads, provider.llm.config.batch_size) == (4, 128)
@@ -0,0 +1,133 @@
+import threading
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.workers import PersistenceWorker, IndexingWorker, CleanupWorker
+
+
+class RecordingService:
+    """Servicio de persistencia falso que registra cada escritura."""
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+
+    def create_conversation(self, user_id, conv_data):
+        if self.gate:
+            self.gate.wait(5)
+        self.calls.append(("create", [m["content"] for m in conv_data["messages"]]))
+        return "conv-1"
+
+    def append_messages(self, user_id, conversation_id, messages, update_data=None):
+        self.calls.append(("append", [m["content"] for m in messages]))
+        return True
+
+    def update_conversation(self, user_id, conversation_id, update_data):
+        self.calls.append(("update", [m["content"] for m in update_data["messages"]]))
+        return True
+
+    def update_message(self, user_id, conversation_id, index, fields):
+        self.calls.append(("message", index, fields))
+        return True
+
+
+def snapshot(contents, conversation_id=None, saved_count=0):
+    return {
+        "conversation_id": conversation_id,
+        "saved_count": saved_count,
+        "history": [{"role": "user", "content": c} for c in contents],
+        "fields": {"title": "t"},
+    }
+
+
+def run_pending(worker):
+    """Ejecuta en este hilo todo lo encolado (las señales llegan de forma directa)."""
+    worker.stop()
+    worker.run()
+
+
+def test_autosaves_of_one_conversation_coalesce():
+    service = RecordingService()
+    worker = PersistenceWorker(service)
+    results = []
+    worker.task_finished.connect(lambda key, result: results.append((key, result)))
+
+    worker.save_conversation("u1", "k1", snapshot(["a"]))
+    worker.submit(("list",), lambda: ["lista"])
+    worker.save_conversation("u1", "k1", snapshot(["a", "b"]))
+    worker.save_conversation("u1", "k1", snapshot(["a", "b", "c"]))
+    run_pending(worker)
+
+    assert service.calls == [("create", ["a", "b", "c"])]
+    assert worker.coalesced == 2
+    # La clave conserva el turno de su primera aparición.
+    assert [key for key, _ in results] == [("save", "k1"), ("list",)]
+    assert results[0][1] == {"save_key": "k1", "conversation_id": "conv-1", "saved_count": 3, "title": "t", "timestamp": None}
+
+
+def test_worker_tracks_saved_messages_despite_stale_snapshots():
+    service = RecordingService()
+    worker = PersistenceWorker(service)
+    worker.start()
+    worker.save_conversation("u1", "k1", snapshot(["a"]))
+    assert worker.flush(timeout=5)
+
+    # La interfaz aún no recibió el resultado: su snapshot sigue sin id y con 0 guardados.
+    worker.save_conversation("u1", "k1", snapshot(["a", "b"]))
+    worker.update_message("u1", "k1", 0, {"rating": "up"})
+    worker.update_message("u1", "k1", 5, {"rating": "down"})
+    worker.save_conversation("u1", "k2", snapshot(["x"], conversation_id="conv-2", saved_count=3))
+    assert worker.flush(timeout=5)
+    worker.stop()
+
+    assert service.calls == [
+        ("create", ["a"]),
+        ("append", ["b"]),
+        ("message", 0, {"rating": "up"}),
+        ("update", ["x"]),  # el historial se recortó: se reescribe entero
+    ]
+
+
+def test_cleanup_flushes_pending_writes():
+    gate = threading.Event()
+    service = RecordingService(gate)
+    worker = PersistenceWorker(service)
+    worker.start()
+    worker.save_conversation("u1", "k1", snapshot(["a"]))
+    assert not worker.flush(timeout=0.05)
+
+    gate.set()
+    cleanup = CleanupWorker(None, worker)
+    cleanup.run()
+    worker._thread.join(5)
+    assert not worker._thread.is_alive()
+    assert service.calls == [("create", ["a"])]
+    assert not worker.submit(("list",), list)
+
+
+def test_save_completes_while_indexing_is_blocked():
+    """Un embedding largo en la cola de indexación no retrasa los guardados ni el cierre."""
+    service = RecordingService()
+    persistence = PersistenceWorker(service)
+    indexing = IndexingWorker()
+    persistence.start()
+    indexing.start()
+    release = threading.Event()
+    indexing_started = threading.Event()
+    indexing.submit(("document", "grande.pdf"), lambda: (indexing_started.set(), release.wait(10)))
+    assert indexing_started.wait(5)
+
+    persistence.save_conversation("u1", "k1", snapshot(["a"]))
+    assert persistence.flush(timeout=5)
+    assert service.calls == [("create", ["a"])]
+    assert not indexing.flush(timeout=0.05)
+
+    CleanupWorker(None, persistence, indexing).run()
+    persistence._thread.join(5)
+    assert not persistence._thread.is_alive()
+    assert not indexing.submit(("retrieval",), list)
+    release.set()
+    indexing._thread.join(5)
@@ -0,0 +1,176 @@
+import struct
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.gguf_metadata import read_gguf_metadata, get_context_length, GGUFFormatError, GGUFIndex, gguf_index
+from app.prompt_builder import PromptBuilder, detect_template_family
+from app.model_loader import trim_context
+
+
+def _gguf_string(text):
+    raw = text.encode("utf-8")
+    return struct.pack("<Q", len(raw)) + raw
+
+
+def write_gguf(path, metadata, tensors=()):
+    """Escribe un GGUF mínimo con los pares clave/valor y las descripciones de tensores (dims) indicadas."""
+    body = b""
+    for key, value in metadata.items():
+        body += _gguf_string(key)
+        if isinstance(value, str):
+            body += struct.pack("<I", 8) + _gguf_string(value)
+        elif isinstance(value, list):
+            body += struct.pack("<IIQ", 9, 8, len(value)) + b"".join(_gguf_string(v) for v in value)
+        else:
+            body += struct.pack("<I", 4) + struct.pack("<I", value)
+    for i, dims in enumerate(tensors):
+        body += _gguf_string(f"blk.{i}.weight") + struct.pack("<I", len(dims))
+        body += b"".join(struct.pack("<Q", d) for d in dims) + struct.pack("<IQ", 0, 0)
+    path.write_bytes(b"GGUF" + struct.pack("<IQQ", 3, len(tensors), len(metadata)) + body)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def isolated_gguf_index(tmp_path, monkeypatch):
+    """El índice global no debe escribir en el directorio de datos real durante los tests."""
+    monkeypatch.setattr(gguf_index, "index_path", tmp_path / "gguf_index.json")
+    monkeypatch.setattr(gguf_index, "_entries", None)
+
+
+CHATML_TEMPLATE = (
+    "{{ bos_token }}{% for message in messages %}<|im_start|>{{ message['role'] }}\n"
+    "{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+def test_reads_gguf_metadata(tmp_path):
+    model = write_gguf(tmp_path / "tiny.gguf", {
+        "general.architecture": "llama",
+        "general.name": "Tiny Llama-3",
+        "llama.context_length": 8192,
+        "tokenizer.ggml.tokens": ["<unk>", "<s>", "</s>"] + [f"t{i}" for i in range(100)],
+        "tokenizer.ggml.bos_token_id": 1,
+        "tokenizer.ggml.eos_token_id": 2,
+        "tokenizer.chat_template": CHATML_TEMPLATE,
+    })
+    metadata = read_gguf_metadata(model)
+    assert metadata["general.name"] == "Tiny Llama-3"
+    assert get_context_length(metadata) == 8192
+    assert metadata["tokenizer.ggml.tokens"] == {"array_length": 103}
+    assert metadata["tokenizer.ggml.bos_token"] == "<s>"
+    assert metadata["tokenizer.ggml.eos_token"] == "</s>"
+    assert detect_template_family(model, metadata) == "llama3"
+
+
+def test_rejects_non_gguf(tmp_path):
+    bogus = tmp_path / "bogus.gguf"
+    bogus.write_bytes(b"NOPE" + b"\0" * 32)
+    with pytest.raises(GGUFFormatError):
+        read_gguf_metadata(bogus)
+
+
+def test_native_template_is_preferred_and_bos_not_duplicated(tmp_path):
+    model = write_gguf(tmp_path / "tiny.gguf", {
+        "tokenizer.ggml.tokens": ["<unk>", "<s>", "</s>"],
+        "tokenizer.ggml.bos_token_id": 1,
+        "tokenizer.chat_template": CHATML_TEMPLATE,
+    })
+    builder = PromptBuilder.from_model(model)
+    assert builder.has_native_template
+    prompt = builder.build([{"role": "system", "content": "sé breve"}, {"role": "user", "content": "hola"}])
+    assert prompt == "<|im_start|>system\nsé breve<|im_end|>\n<|im_start|>user\nhola<|im_end|>\n<|im_start|>assistant\n"
+
+
+@pytest.mark.parametrize("family, expected", [
+    ("llama3", "<|start_header_id|>user<|end_header_id|>\n\nhola<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"),
+    ("mistral", "[INST] sys\n\nhola [/INST]"),
+    ("phi3", "<|system|>\nsys<|end|>\n<|user|>\nhola<|end|>\n<|assistant|>\n"),
+    ("gemma", "<start_of_turn>user\nsys\n\nhola<end_of_turn>\n<start_of_turn>model\n"),
+])
+def test_family_templates(family, expected):
+    messages = [{"role": "user", "content": "hola"}]
+    if family != "llama3":
+        messages.insert(0, {"role": "system", "content": "sys"})
+    assert PromptBuilder(family=family).render(messages) == expected
+
+
+def test_fit_messages_keeps_system_and_last_turn_with_hysteresis():
+    builder = PromptBuilder(count_tokens=len, budget=1000)
+    system = {"role": "system", "content": "s" * 50}
+    history = []
+    for i in range(8):
+        history += [{"role": "user", "content": f"pregunta {i} " + "u" * 50},
+                    {"role": "assistant", "content": "a" * 100}]
+    history.append({"role": "user", "content": "última"})
+
+    fitted = builder.fit_messages([system] + history)
+    assert fitted[0] == system
+    assert fitted[1]["role"] == "system" and "Se omitieron" in fitted[1]["content"]
+    assert fitted[2]["role"] == "user"
+    assert fitted[-1]["content"] == "última"
+    cost = sum(len(m["content"]) + builder.MESSAGE_OVERHEAD for m in fitted)
+    assert cost <= builder.budget * builder.LOW_WATERMARK
+
+    # Un turno corto más no vuelve a mover el punto de corte.
+    history += [{"role": "assistant", "content": "ok"}, {"role": "user", "content": "y?"}]
+    assert builder.fit_messages([system] + history)[:3] == fitted[:3]
+
+
+def test_fit_messages_does_not_reuse_trim_of_another_conversation():
+    builder = PromptBuilder(count_tokens=len, budget=1000)
+    system = {"role": "system", "content": "s" * 50}
+    long_history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} " + "x" * 100} for i in range(31)]
+    assert len(builder.fit_messages([system] + long_history)) < 32
+
+    # Otra conversación que cabe entera no hereda el recorte anterior.
+    short_history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} corta"} for i in range(31)]
+    assert builder.fit_messages([system] + short_history) == [system] + short_history
+    # Tampoco la misma conversación si, editada, ya cabe completa.
+    builder.fit_messages([system] + long_history)
+    assert builder.fit_messages([system] + long_history[:3]) == [system] + long_history[:3]
+
+
+def test_trim_context_counts_tokens():
+    context = [{"role": "user", "content": "x" * 10}, {"role": "assistant", "content": "y" * 10}, "z" * 5]
+    assert trim_context(context, max_length=15, count_tokens=len) == context[1:]
+    assert trim_context(context, max_length=1, count_tokens=len) == context[2:]
+
+
+def test_index_summarizes_and_caches_by_size_and_mtime(tmp_path, monkeypatch):
+    import app.gguf_metadata
+    models_dir = tmp_path / "models"
+    models_dir.mkdir()
+    model = write_gguf(models_dir / "tiny.gguf", {
+        "general.architecture": "llama",
+        "general.name": "Tiny",
+        "general.file_type": 15,
+        "llama.context_length": 4096,
+    }, tensors=[(4096, 4096), (4096,), (32000, 4096)])
+    (models_dir / "broken.gguf").write_bytes(b"NOPE")
+
+    index = GGUFIndex(tmp_path / "index.json")
+    found = index.scan(models_dir)
+    assert found["tiny.gguf"]["architecture"] == "llama"
+    assert found["tiny.gguf"]["quant_type"] == "Q4_K_M"
+    assert found["tiny.gguf"]["context_length"] == 4096
+    assert found["tiny.gguf"]["parameter_count"] == 4096 * 4096 + 4096 + 32000 * 4096
+    assert found["tiny.gguf"]["parameters"] == "148M"
+    assert found["broken.gguf"] == {"size": 4}
+
+    # Un índice nuevo sobre el mismo archivo no vuelve a leer la cabecera...
+    reads = []
+    original = app.gguf_metadata.read_gguf_metadata
+    monkeypatch.setattr(app.gguf_metadata, "read_gguf_metadata", lambda *a, **k: reads.append(a) or original(*a, **k))
+    reloaded = GGUFIndex(tmp_path / "index.json")
+    assert reloaded.info(model)["quant_type"] == "Q4_K_M"
+    assert reads == []
+
+    # ...hasta que el archivo cambia.
+    write_gguf(model, {"general.architecture": "phi3", "phi3.context_length": 131072})
+    assert reloaded.info(model)["architecture"] == "phi3"
+    assert len(reads) == 1
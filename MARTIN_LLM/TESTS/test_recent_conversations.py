@@ -0,0 +1,118 @@
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from datetime import datetime, timedelta
+
+from PyQt6.QtCore import Qt
+
+from ui.recent_conversations import RecentConversationsModel, RecentConversationsView
+
+NOW = datetime(2026, 5, 10, 12, 0)
+
+
+def backend(n):
+    """Conversaciones del backend, de la más reciente a la más antigua."""
+    return [{"_id": f"c{i}", "title": f"Conversación {i}", "timestamp": (NOW - timedelta(hours=i)).isoformat()}
+            for i in range(n)]
+
+
+class FakeBackend:
+    def __init__(self, model, conversations):
+        self.model = model
+        self.conversations = conversations
+        self.requests = []
+        model.page_requested.connect(lambda *args: self.requests.append(args))
+
+    def answer(self):
+        generation, offset, limit = self.requests.pop(0)
+        return self.model.add_page(generation, self.conversations[offset:offset + limit], limit)
+
+
+def ids(model):
+    return [model.index(row).data(Qt.ItemDataRole.UserRole) for row in range(model.rowCount())]
+
+
+def test_pages_are_loaded_on_demand(qtbot):
+    model = RecentConversationsModel()
+    server = FakeBackend(model, backend(120))
+    model.reset()
+    assert server.requests == [(1, 0, 50)]
+    model.fetchMore()  # ya hay una página en curso
+    assert len(server.requests) == 1
+    server.answer()
+    assert model.rowCount() == 50
+    model.fetchMore()
+    model.fetchMore()
+    assert len(server.requests) == 1
+    server.answer()
+    assert model.rowCount() == 100
+    model.fetchMore()
+    server.answer()
+    assert ids(model) == [f"c{i}" for i in range(120)]
+    assert not model.canFetchMore()
+
+
+def test_view_fetches_next_page_when_scrolled(qtbot):
+    model = RecentConversationsModel()
+    server = FakeBackend(model, backend(120))
+    view = RecentConversationsView()
+    view.setModel(model)
+    view.resize(300, 400)
+    qtbot.addWidget(view)
+    view.show()
+    model.reset()
+    server.answer()
+    assert model.rowCount() == 50
+    view.scrollToBottom()
+    qtbot.waitUntil(lambda: bool(server.requests))
+    assert server.requests[0][1] == 50
+
+
+def test_save_moves_or_inserts_a_single_row(qtbot):
+    model = RecentConversationsModel()
+    server = FakeBackend(model, backend(120))
+    model.reset()
+    server.answer()
+    moved, inserted = [], []
+    model.rowsMoved.connect(lambda *args: moved.append(args))
+    model.rowsInserted.connect(lambda *args: inserted.append(args))
+
+    # Una conversación antigua se guarda de nuevo: sube al principio.
+    model.upsert({"_id": "c7", "title": "Actualizada", "timestamp": NOW + timedelta(minutes=1)})
+    assert ids(model)[:2] == ["c7", "c0"]
+    assert model.index(0).data(RecentConversationsModel.TitleRole) == "Actualizada"
+    assert len(moved) == 1 and not inserted
+
+    # Una conversación nueva se inserta arriba y la siguiente página no la repite.
+    new = {"_id": "nueva", "title": "Nueva", "timestamp": NOW + timedelta(minutes=2)}
+    model.upsert(new)
+    server.conversations.insert(0, new)
+    assert ids(model)[0] == "nueva" and len(inserted) == 1
+    model.fetchMore()
+    assert server.requests[0][1] == 51
+    server.answer()
+    assert len(ids(model)) == len(set(ids(model))) == 101
+
+
+def test_remove_rename_and_stale_pages(qtbot):
+    model = RecentConversationsModel()
+    server = FakeBackend(model, backend(60))
+    model.reset()
+    server.answer()
+    model.rename("c3", "Otro título")
+    assert model.index(3).data(RecentConversationsModel.TitleRole) == "Otro título"
+    model.remove("c0")
+    del server.conversations[0]
+    model.fetchMore()
+    assert server.requests[0][1] == 49
+
+    # Una recarga invalida la página que estaba en camino.
+    model.reset()
+    assert server.answer() == []
+    assert model.rowCount() == 0
+    server.answer()
+    assert model.rowCount() == 50
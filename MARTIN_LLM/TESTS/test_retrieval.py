@@ -0,0 +1,125 @@
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.chat_engine import ChatEngine
+from app.retrieval import RetrievalIndex, HashingEmbedder, chunk_text, chunk_conversation
+from app.services.local_storage_service import LocalStorageService
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = RetrievalIndex(tmp_path / "retrieval", HashingEmbedder())
+    index.INITIAL_CAPACITY = 4
+    yield index
+    index.close()
+
+
+def test_chunking_respects_size_and_overlap():
+    text = "Primer párrafo corto.\n\n" + " ".join(f"palabra{i}" for i in range(300))
+    chunks = chunk_text(text, max_chars=200, overlap=40)
+    assert chunks[0].startswith("Primer párrafo corto.")
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    # La última palabra de un fragmento se repite al principio del siguiente.
+    assert chunks[2].split()[-1] in chunks[3]
+    messages = [{"role": "system", "content": "x"}, {"role": "user", "content": "hola"}, {"role": "assistant", "content": "adiós"}]
+    assert chunk_conversation(messages) == [(1, "Usuario: hola"), (2, "Asistente: adiós")]
+    assert chunk_conversation(messages, start=2) == [(2, "Asistente: adiós")]
+
+
+def test_add_search_and_reuse_deleted_rows(index):
+    index.add("conv:a", [(0, "Usuario: cómo configuro nginx como proxy inverso")], title="Nginx")
+    index.add("conv:b", [(0, "Usuario: receta de tortilla de patatas")], title="Cocina")
+    for i in range(5):  # obliga a ampliar el archivo de vectores
+        index.add(f"conv:{i}", [(0, f"Usuario: relleno sobre astronomía número {i}")])
+    assert index.stats()["capacity"] == 8
+
+    hits = index.search("proxy inverso con nginx", k=3)
+    assert hits[0]["source"] == "conv:a" and hits[0]["title"] == "Nginx"
+    assert index.search("proxy inverso con nginx", exclude_sources=["conv:a"]) == []
+
+    index.remove_source("conv:a")
+    assert index.search("nginx") == []
+    index.add("conv:c", [(0, "Usuario: otra pregunta")])
+    assert index.stats() == {"chunks": 7, "free_rows": 0, "capacity": 8, "embedder": "hashing-512"}
+
+
+def test_index_survives_reopening(tmp_path):
+    index = RetrievalIndex(tmp_path, HashingEmbedder())
+    index.add("conv:b", [(0, "Usuario: borrar")])
+    index.add("conv:a", [(0, "Usuario: cuaterniones y rotaciones")], title="3D")
+    index.remove_source("conv:b")
+    index.close()
+
+    reopened = RetrievalIndex(tmp_path, HashingEmbedder())
+    assert reopened.search("cuaterniones")[0]["source"] == "conv:a"
+    assert reopened.stats()["free_rows"] == 1
+    # Con otro modelo de embeddings los vectores no sirven y se empieza de cero.
+    assert RetrievalIndex(tmp_path, HashingEmbedder(dim=64)).stats()["chunks"] == 0
+
+
+def test_sync_indexes_only_new_messages(tmp_path, index, monkeypatch):
+    storage = LocalStorageService(storage_path=str(tmp_path / "local_storage"))
+    conv_id = storage.create_conversation("u1", {"title": "Viaje", "messages": [{"role": "user", "content": "billetes a Lisboa"}]})
+    assert index.sync_conversations(storage, "u1") == 1
+    assert index.sync_conversations(storage, "u1") == 0
+
+    embedded = []
+    original = index.embedder.embed
+    monkeypatch.setattr(index.embedder, "embed", lambda texts: embedded.extend(texts) or original(texts))
+    storage.append_messages("u1", conv_id, [{"role": "assistant", "content": "El tranvía 28 recorre Alfama"}])
+    assert index.sync_conversations(storage, "u1") == 1
+    assert embedded == ["Asistente: El tranvía 28 recorre Alfama"]
+    assert index.search("tranvía alfama")[0]["source"] == f"conv:{conv_id}"
+
+    storage.delete_conversation("u1", conv_id)
+    index.sync_conversations(storage, "u1")
+    assert index.search("lisboa") == []
+
+
+def test_sync_conversation_indexes_one_conversation_without_listing(tmp_path, index, monkeypatch):
+    storage = LocalStorageService(storage_path=str(tmp_path / "local_storage"))
+    conv_id = storage.create_conversation("u1", {"title": "Viaje", "messages": [{"role": "user", "content": "billetes a Lisboa"}]})
+    monkeypatch.setattr(storage, "get_user_conversations", lambda *args: pytest.fail("no debe recorrer el listado"))
+    assert index.sync_conversation(storage, "u1", conv_id)
+    assert not index.sync_conversation(storage, "u1", conv_id)
+
+    storage.append_messages("u1", conv_id, [{"role": "assistant", "content": "El tranvía 28 recorre Alfama"}])
+    assert index.sync_conversation(storage, "u1", conv_id)
+    assert index.stats()["chunks"] == 2
+    assert index.search("tranvía alfama")[0]["source"] == f"conv:{conv_id}"
+
+
+def test_documents_are_indexed_once(tmp_path, index, monkeypatch):
+    import app.services.file_processing_service as fps
+    # La caché de texto extraído va al directorio temporal, no a los datos del usuario.
+    monkeypatch.setattr(fps, "get_app_data_dir", lambda: tmp_path)
+    path = tmp_path / "notas.txt"
+    path.write_text("El servidor de pruebas escucha en el puerto 8443.", encoding="utf-8")
+    assert index.add_document(str(path))
+    assert not index.add_document(str(path))
+    hit = index.search("puerto del servidor de pruebas")[0]
+    assert hit["kind"] == "document" and hit["title"] == "notas.txt"
+
+
+def test_chat_engine_injects_context_within_budget(index):
+    index.add("conv:old", [(0, f"Usuario: el servidor de pruebas usa el puerto {8000 + i}") for i in range(20)], title="Servidor")
+    index.add("conv:current", [(0, "Usuario: el servidor de pruebas actual")])
+    engine = ChatEngine(None)
+    engine.conversation_id = "current"
+    engine.retriever = index
+    engine.retrieval_budget = 80
+    engine.history = [{"role": "user", "content": "¿Qué puerto usa el servidor de pruebas?"}]
+
+    prompt = engine.get_full_prompt()
+    assert [m["role"] for m in prompt] == ["system", "system", "user"]
+    context = prompt[1]["content"]
+    assert "«Servidor»" in context and "actual" not in context
+    assert len(context) // 3 + 1 <= 80
+    assert engine.history == [{"role": "user", "content": "¿Qué puerto usa el servidor de pruebas?"}]
+
+    engine.history.append({"role": "assistant", "content": "El 8000."})
+    assert len(engine.get_full_prompt()) == 3  # sin consulta nueva del usuario no se recupera nada
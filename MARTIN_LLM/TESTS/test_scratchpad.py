@@ -0,0 +1,80 @@
+import json
+import pytest
+from unittest.mock import MagicMock
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.agent import Agent
+from app.llm_providers import BaseLLMProvider
+from app.prompt_builder import estimate_tokens
+from app.scratchpad import Scratchpad, shorten
+
+
+def page(n: int) -> str:
+    return f"Successfully retrieved content from https://example.com/{n}. " + "texto de la página " * 100
+
+
+def test_recent_steps_are_verbatim_and_older_ones_summarized():
+    pad = Scratchpad(budget=100_000, keep_recent=2)
+    pad.reset("investiga")
+    for n in range(1, 5):
+        pad.add_step(f'{{"action": {n}}}', page(n), "web_search", f"https://example.com/{n}")
+
+    messages = pad.messages()
+    assert messages[0] == {"role": "user", "content": "User objective: investiga"}
+    summary = messages[1]["content"]
+    assert summary.splitlines()[1].startswith("- Step 1: web_search(https://example.com/1) -> Successfully retrieved")
+    assert "- Step 2:" in summary and "Step 3" not in summary
+    assert [m["content"] for m in messages[2:]] == ['{"action": 3}', f"Observation: {page(3)}", '{"action": 4}', f"Observation: {page(4)}"]
+    assert pad.last_stats == {"scratchpad_tokens": pad.last_stats["scratchpad_tokens"], "verbatim_steps": 2, "summarized_steps": 2, "omitted_steps": 0}
+
+
+def test_budget_is_respected_as_steps_accumulate():
+    pad = Scratchpad(budget=1000, keep_recent=2)
+    pad.reset("investiga")
+    sizes = []
+    for n in range(1, 11):
+        pad.add_step(f'{{"action": {n}}}', page(n), "web_search", f"https://example.com/{n}")
+        messages = pad.messages()
+        sizes.append(sum(estimate_tokens(m["content"]) for m in messages))
+        assert pad.last_stats["scratchpad_tokens"] <= 1000
+        # El último paso siempre se envía completo.
+        assert messages[-1]["content"] == f"Observation: {page(n)}"
+    assert max(sizes) <= 1000
+    assert pad.last_stats["omitted_steps"] > 0
+    assert "earlier steps omitted" in pad.messages()[1]["content"]
+
+    pad.reset("otra tarea")
+    assert pad.messages() == [{"role": "user", "content": "User objective: otra tarea"}]
+
+
+def test_shorten():
+    assert shorten("a  b\n c", 10) == "a b c"
+    assert shorten("uno dos tres cuatro", 12) == "uno dos…"
+
+
+def test_agent_prompt_stops_growing_and_resets_per_task(monkeypatch):
+    provider = MagicMock(spec=BaseLLMProvider)
+    search = json.dumps({"thought": "buscar", "action": {"tool_name": "web_search", "args": "https://example.com"}})
+    finish = json.dumps({"thought": "listo", "action": {"tool_name": "finish", "args": "hecho"}})
+    provider.query.side_effect = [search] * 8 + [finish] + [finish]
+
+    agent = Agent(provider=provider, scratchpad_budget=800)
+    monkeypatch.setattr(agent.tool_registry.get_tool("web_search"), "run", lambda url: page(0))
+    assert agent.run("primera tarea") == "hecho"
+
+    metrics = agent.scratchpad.metrics
+    assert len(metrics) == 9
+    assert all(m["scratchpad_tokens"] <= 800 for m in metrics)
+    assert metrics[-1]["prompt_tokens"] - metrics[-1]["scratchpad_tokens"] == estimate_tokens(agent.system_prompt)
+    last_prompt = provider.query.call_args_list[8].args[0]
+    assert last_prompt[1]["content"] == "User objective: primera tarea"
+    assert last_prompt[2]["content"].startswith(Scratchpad.SUMMARY_HEADER)
+
+    # Una nueva tarea con el mismo agente no arrastra los pasos de la anterior.
+    assert agent.execute_task("segunda tarea") == "hecho"
+    assert provider.query.call_args_list[9].args[0][1:] == [{"role": "user", "content": "User objective: segunda tarea"}]
+    assert len(agent.scratchpad.metrics) == 1
@@ -0,0 +1,102 @@
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app.services.login_service as login_service
+from app.services.local_storage_service import LocalStorageService
+from app.services.login_service import UserService
+from app.services.search_index import ConversationSearchIndex, build_match_query
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ConversationSearchIndex(str(tmp_path / "search.sqlite3"))
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """UserService sin MongoDB, con almacenamiento local en un directorio temporal."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(login_service, "LocalStorageService",
+                        lambda: LocalStorageService(storage_path=str(tmp_path / "local_storage")))
+    return UserService()
+
+
+def test_match_query_is_sanitized():
+    assert build_match_query('foo AND "bar" (baz') == '"foo" "AND" "bar" "baz"*'
+    assert build_match_query("  ¿? ") == ""
+
+
+def test_search_ranks_conversations_and_highlights_snippets(index):
+    index.index_conversation("u1", "c1", [
+        {"role": "user", "content": "¿Cómo configuro la caché de Python?"},
+        {"role": "assistant", "content": "Usa functools.lru_cache <b>sin</b> más."},
+    ], title="Caché en Python")
+    index.index_conversation("u1", "c2", [{"role": "user", "content": "Receta de tortilla de patatas"}], title="Cocina")
+    index.index_conversation("u2", "c3", [{"role": "user", "content": "Otra caché de otro usuario"}], title="Ajeno")
+
+    results = index.search("u1", "cache")  # sin tilde también coincide
+    assert [r["_id"] for r in results] == ["c1"]
+    assert results[0]["title"] == "Caché en Python"
+
+    # Prefijo sobre la última palabra, para buscar mientras se escribe.
+    assert [r["_id"] for r in index.search("u1", "tort")] == ["c2"]
+    snippet = index.search("u1", "functools")[0]["snippet"]
+    assert "<b>functools</b>" in snippet and "&lt;b&gt;sin&lt;/b&gt;" in snippet
+
+
+def test_incremental_updates(index):
+    index.index_conversation("u1", "c1", [{"role": "user", "content": "hola"}], title="Primera")
+    index.append_messages("u1", "c1", [{"role": "assistant", "content": "respuesta sobre cuaterniones"}])
+    hit = index.search("u1", "cuaterniones")[0]
+    assert hit["position"] == 1 and hit["role"] == "assistant"
+
+    index.set_title("u1", "c1", "Rotaciones 3D")
+    assert index.search("u1", "rotaciones")[0]["title"] == "Rotaciones 3D"
+    assert index.search("u1", "primera") == []
+
+    index.remove_conversation("c1")
+    assert index.search("u1", "cuaterniones") == []
+
+
+def test_user_service_keeps_index_in_sync(service):
+    user_id = service.register_user("ana", "clave", None, False)
+    conv_id = service.create_conversation(user_id, {"title": "Viaje", "messages": [{"role": "user", "content": "billetes a Lisboa"}]})
+    service.append_messages(user_id, conv_id, [{"role": "assistant", "content": "El tranvía 28 recorre Alfama"}])
+    assert [r["_id"] for r in service.search_conversations(user_id, "alfama")] == [conv_id]
+
+    service.update_conversation_title(user_id, conv_id, "Portugal")
+    assert service.search_conversations(user_id, "portugal")[0]["_id"] == conv_id
+
+    service.delete_or_archive_conversation(user_id, conv_id)
+    assert service.search_conversations(user_id, "lisboa") == []
+
+
+def test_existing_history_is_indexed_once(service):
+    user_id = service.register_user("ana", "clave", None, False)
+    storage = service.local_storage_service
+    conv_id = storage.create_conversation(user_id, {"title": "Antigua", "messages": [{"role": "user", "content": "guardada antes del índice"}]})
+    assert service.search_conversations(user_id, "guardada") == []
+
+    assert service.build_search_index(user_id) == 1
+    assert service.search_conversations(user_id, "guardada")[0]["_id"] == conv_id
+    assert service.build_search_index(user_id) == 0
+
+
+def test_results_view_shows_snippets(index, qtbot):
+    from ui.conversation_search import SearchResultsModel, SearchResultsView
+    index.index_conversation("u1", "c1", [{"role": "user", "content": "hola mundo"}], title="Saludo")
+    model = SearchResultsModel()
+    view = SearchResultsView()
+    view.setModel(model)
+    qtbot.addWidget(view)
+    view.show()
+
+    model.set_results(index.search("u1", "mundo"), "mundo")
+    assert model.index(0).data(SearchResultsModel.SnippetRole) == "hola <b>mundo</b>"
+    assert not view.grab().isNull()
+    model.set_results([], "nada")
+    assert model.status_text == "Sin resultados para «nada»."
@@ -0,0 +1,59 @@
+import json
+import pytest
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app.services.login_service as login_service
+from app.services.local_storage_service import LocalStorageService
+from app.services.login_service import UserService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """UserService sin MongoDB, con users.json y almacenamiento local en un directorio temporal."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(login_service, "LocalStorageService",
+                        lambda: LocalStorageService(storage_path=str(tmp_path / "local_storage")))
+    return UserService()
+
+
+def count_reads(monkeypatch, service):
+    calls = []
+    original = service._lookup_user_consent
+    monkeypatch.setattr(service, "_lookup_user_consent", lambda user_id: calls.append(user_id) or original(user_id))
+    return calls
+
+
+def test_consent_is_resolved_once_per_session(service, monkeypatch):
+    user_id = service.register_user("ana", "clave", None, False)
+    reads = count_reads(monkeypatch, service)
+
+    conv_id = service.create_conversation(user_id, {"title": "t", "messages": []})
+    service.append_messages(user_id, conv_id, [{"role": "user", "content": "hola"}])
+    service.get_user_conversations(user_id)
+    service.get_conversation_details(user_id, conv_id)
+
+    assert reads == [user_id]
+    stats = service.get_consent_cache_stats()
+    assert stats["misses"] == 1 and stats["hits"] == 3
+
+
+def test_cache_is_invalidated_on_consent_change_and_login(service, monkeypatch):
+    user_id = service.register_user("ana", "clave", None, False)
+    assert service.get_user_consent(user_id) is False
+
+    assert service.set_user_consent(user_id, True)
+    assert json.loads(Path("users.json").read_text())["users"][0]["share_data_consent"] is True
+    assert service.get_user_consent(user_id) is True
+
+    # Otro proceso cambia users.json: la caché lo ignora hasta el siguiente inicio de sesión.
+    data = json.loads(Path("users.json").read_text())
+    data["users"][0]["share_data_consent"] = False
+    Path("users.json").write_text(json.dumps(data))
+    assert service.get_user_consent(user_id) is True
+
+    assert service.authenticate_user("ana", "clave") == (user_id, "ana")
+    assert service.get_user_consent(user_id) is False
@@ -0,0 +1,129 @@
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# This is needed to make sure the app modules can be imported
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.web_fetcher import WebFetcher, html_to_text
+from app.tools import WebSearchTool
+
+PAGE = """<html><head><title>Título</title><style>body { color: red }</style></head>
+<body><script>var x = "no";</script><h1>Cabecera</h1><p>Primer   párrafo.</p><!-- comentario --><p>Segundo</p></body></html>"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests_seen = []
+    barrier = None # si se fija, cada petición espera a que lleguen las demás
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get("If-None-Match")))
+        if self.barrier is not None:
+            self.barrier.wait()
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        etag = '"v1"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = PAGE.replace("Segundo", f"Segundo {self.path}").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if self.path == "/private":
+            self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    Handler.requests_seen = []
+    Handler.barrier = None
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    fetcher = WebFetcher(cache_path=tmp_path / "web_cache.sqlite3", ttl=60)
+    yield fetcher
+    fetcher.close()
+
+
+def test_html_to_text_skips_scripts_and_stops_early():
+    assert html_to_text(PAGE) == "Título\nCabecera\nPrimer\npárrafo.\nSegundo"
+    assert html_to_text(PAGE, max_chars=10) == "Título\nCab"
+    assert html_to_text("") == ""
+
+
+def test_cache_hit_then_revalidation(server, fetcher):
+    first = fetcher.fetch(f"{server}/a")
+    assert first["cached"] is False and "Segundo /a" in first["text"]
+    assert fetcher.fetch(f"{server}/a")["cached"] == "hit"
+    assert len(Handler.requests_seen) == 1
+
+    # Caducada: se revalida con el ETag y el servidor responde 304 sin cuerpo.
+    fetcher._db.execute("UPDATE pages SET expires_at = 0")
+    revalidated = fetcher.fetch(f"{server}/a")
+    assert revalidated == {"url": f"{server}/a", "text": first["text"], "cached": "revalidated"}
+    assert Handler.requests_seen[-1] == ("/a", '"v1"')
+    assert fetcher.fetch(f"{server}/a")["cached"] == "hit"
+
+    # La caché persiste entre instancias.
+    other = WebFetcher(cache_path=fetcher.cache_path)
+    assert other.fetch(f"{server}/a")["cached"] == "hit"
+    other.close()
+
+
+def test_no_store_and_eviction(server, tmp_path):
+    fetcher = WebFetcher(cache_path=tmp_path / "cache.sqlite3", max_entries=2)
+    fetcher.fetch(f"{server}/private")
+    assert fetcher.fetch(f"{server}/private")["cached"] is False
+    for path in ("/1", "/2", "/3"):
+        fetcher.fetch(f"{server}{path}")
+    urls = [row[0] for row in fetcher._db.execute("SELECT url FROM pages")]
+    assert sorted(urls) == [f"{server}/2", f"{server}/3"]
+    fetcher.close()
+
+
+def test_fetch_many_is_concurrent_and_ordered(server, fetcher):
+    # Las cuatro peticiones solo se responden si llegan a la vez al servidor.
+    Handler.barrier = threading.Barrier(4, timeout=5)
+    results = fetcher.fetch_many([f"{server}/x", f"{server}/missing", f"{server}/y", f"{server}/z"])
+    assert not Handler.barrier.broken
+    assert [r["url"].rsplit("/", 1)[1] for r in results] == ["x", "missing", "y", "z"]
+    assert "404" in results[1]["error"]
+    assert "Segundo /z" in results[3]["text"]
+
+
+def test_web_search_tool_accepts_several_urls(server, fetcher):
+    tool = WebSearchTool(fetcher)
+    output = tool.run(f"{server}/a {server}/missing")
+    first, second = output.split("\n\n")
+    assert first.startswith(f"Successfully retrieved content from {server}/a. Content (first 2000 chars):\nTítulo")
+    assert second.startswith(f"Error searching web for {server}/missing: 404")
+
+
+def test_web_search_tool_keeps_commas_inside_urls():
+    class StubFetcher:
+        def fetch_many(self, urls):
+            self.urls = urls
+            return [{"url": u, "text": "ok", "cached": False} for u in urls]
+
+    fetcher = StubFetcher()
+    WebSearchTool(fetcher).run("https://en.wikipedia.org/wiki/Washington,_D.C.  https://example.com/a")
+    assert fetcher.urls == ["https://en.wikipedia.org/wiki/Washington,_D.C.", "https://example.com/a"]
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*- 
 # app/agent.py
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from app.llm_providers import BaseLLMProvider
 from app.tools import ToolRegistry
+from app.prompt_builder import estimate_tokens
+from app.scratchpad import Scratchpad
+from app.json_output import AGENT_ACTION_SCHEMA, extract_json
 
 # ANSI escape codes for colors
 class Color:
@@ -16,15 +21,23 @@ class Agent:
     """
     Clase que implementa la lógica de un agente autónomo con un bucle de
     Pensamiento -> Acción -> Observación.
+
+    En un mismo paso el modelo puede pedir varias herramientas independientes (una lista en
+    'action'): se ejecutan a la vez y sus resultados vuelven en una única observación.
     """
-    def __init__(self, provider: BaseLLMProvider, custom_prompt: str = None):
+    # Herramientas ejecutándose a la vez como máximo en un paso.
+    MAX_PARALLEL_TOOLS = 4
+
+    def __init__(self, provider: BaseLLMProvider, custom_prompt: str = None, scratchpad_budget: int = Scratchpad.DEFAULT_BUDGET):
         if not isinstance(provider, BaseLLMProvider):
             raise TypeError("El proveedor debe ser una instancia de BaseLLMProvider.")
         self.provider = provider
         # Crear una instancia del registro de herramientas específica para este agente,
         # pasándole el proveedor para que la ToolGeneratorTool pueda usarlo.
         self.tool_registry = ToolRegistry(provider=self.provider)
+        # Registro completo de la tarea en curso; al modelo solo se le envía el scratchpad.
         self.history = []
+        self.scratchpad = Scratchpad(budget=scratchpad_budget)
         self.report_step_callback = None # Para reportar progreso a la UI
         
         if not custom_prompt:
@@ -58,6 +71,7 @@ Your response MUST be a JSON object with two keys: 'thought' and 'action'.
 The 'action' key must contain a dictionary with 'tool_name' and 'args'.
 The 'tool_name' must be one of the available tools or 'finish' if you have completed the objective.
 The 'args' for the 'finish' tool should be your final answer to the user.
+If you need several tool calls that do not depend on each other (for example, reading several web pages), 'action' can be a list of such dictionaries: they run at the same time and all their results come back in one Observation. 'finish' must always be used alone.
 
 **Example 1 (Using Calculator):**
 {{
@@ -95,6 +109,15 @@ The 'args' for the 'finish' tool should be your final answer to the user.
     }}
 }}
 
+**Example 4 (Several independent tools in one step):**
+{{
+    "thought": "I need two different pages and they do not depend on each other, so I will read both at once.",
+    "action": [
+        {{"tool_name": "web_search", "args": "https://en.wikipedia.org/wiki/Python_(programming_language)"}},
+        {{"tool_name": "web_search", "args": "https://en.wikipedia.org/wiki/Rust_(programming_language)"}}
+    ]
+}}
+
 If you are finished, respond like this:
 {{
     "thought": "I have calculated the result and will now provide it to the user.",
@@ -104,39 +127,88 @@ If you are finished, respond like this:
     }}
 }}
 """
+        self._system_prompt_tokens = estimate_tokens(self.system_prompt)
 
     def _parse_llm_response(self, response_text: str) -> dict | None:
         """Intenta parsear la respuesta del LLM como un objeto JSON.
-        A veces los modelos envuelven el JSON en bloques de código, esto intenta manejarlo.
-        Devuelve el objeto o None si falla el parseo.
+        Tolera texto alrededor, bloques ```json, comas finales y respuestas cortadas
+        (ver `extract_json`). Devuelve el objeto o None si no contiene JSON.
         """
-        try:
-            # Limpiar si está envuelto en ```json ... ```
-            if response_text.strip().startswith("```json"):
-                response_text = response_text.strip()[7:-3].strip()
-            return json.loads(response_text)
-        except json.JSONDecodeError:
+        action_data = extract_json(response_text, AGENT_ACTION_SCHEMA)
+        if action_data is None:
             print(f"[agent.py][_parse_llm_response] Error: No se pudo parsear la respuesta JSON: {response_text}")
-            return None
+        return action_data
+
+    def _execute_tools(self, calls: list) -> list:
+        """
+        Ejecuta las llamadas [(tool_name, args)] a la vez y devuelve una observación por
+        llamada, en el mismo orden. Cada herramienta tiene su propio límite de tiempo
+        (`BaseTool.timeout`); si se agota, su observación es un error y el agente sigue.
+        """
+        observations = [None] * len(calls)
+        pending = []
+        for i, (tool_name, args) in enumerate(calls):
+            tool = self.tool_registry.get_tool(tool_name) if tool_name else None
+            if not tool_name:
+                observations[i] = "Error: El modelo no especificó un 'tool_name' en su acción."
+            elif tool_name == "finish":
+                observations[i] = "Error: 'finish' must be used alone, not together with other tools. Use it in a later step, once you have the results."
+            elif not tool:
+                observations[i] = f"Error: Herramienta desconocida: '{tool_name}'. Las herramientas disponibles son: {self.tool_registry.get_tool_descriptions()}"
+            else:
+                print(f"{Color.GREEN}[Agent]{Color.RESET}    {Color.YELLOW}Action:{Color.RESET} Executing tool '{tool_name}' with args: '{args}'")
+                pending.append((i, tool, args))
+        if not pending:
+            return observations
+
+        executor = ThreadPoolExecutor(max_workers=min(len(pending), self.MAX_PARALLEL_TOOLS), thread_name_prefix="agent-tool")
+        start = time.monotonic()
+        try:
+            futures = [(i, tool, executor.submit(tool.run, args)) for i, tool, args in pending]
+            # 3. OBSERVAR: obtener el resultado de cada herramienta
+            for i, tool, future in futures:
+                try:
+                    observations[i] = future.result(timeout=max(0.0, start + tool.timeout - time.monotonic()))
+                except FutureTimeoutError:
+                    observations[i] = f"Error: the tool {tool.name} did not answer within {tool.timeout:g} seconds."
+                except Exception as e:
+                    observations[i] = f"Error executing tool {tool.name}: {e}"
+        finally:
+            # Una herramienta colgada no bloquea al agente: su hilo termina por su cuenta.
+            executor.shutdown(wait=False, cancel_futures=True)
+        return observations
+
+    def _observe(self, response_text: str, observation: str, tool_name=None, args=None):
+        """Registra el resultado de un paso en el historial y en el scratchpad."""
+        if observation:
+            self.history.append({"role": "system", "content": f"Observation: {observation}"})
+        self.scratchpad.add_step(response_text, observation, tool_name, args)
 
     def run(self, user_message: str) -> str:
         """
         Ejecuta el bucle del agente: Pensar -> Actuar -> Observar.
         Devuelve la respuesta final del agente al usuario.
+
+        Cada llamada es una tarea nueva: el historial y el scratchpad se reinician. En cada
+        paso el modelo recibe el prompt del sistema y el scratchpad (pasos recientes literales
+        y los anteriores resumidos), no el historial completo.
         """
-        # El historial del agente mantiene el estado completo de la conversación.
-        self.history.append({"role": "user", "content": f"User objective: {user_message}"})
+        self.history = [{"role": "user", "content": f"User objective: {user_message}"}]
+        self.scratchpad.reset(user_message)
 
         for i in range(10):  # Límite de seguridad de 10 pasos para evitar bucles infinitos
             print(f"[agent.py][run] --- AGENT STEP {i+1} ---")
             
             # 1. PENSAR: El LLM decide la siguiente acción.
-            messages_for_provider = [{"role": "system", "content": self.system_prompt}] + self.history
+            messages_for_provider = [{"role": "system", "content": self.system_prompt}] + self.scratchpad.messages()
+            metrics = self.scratchpad.record_step(i + 1, fixed_tokens=self._system_prompt_tokens)
+            print(f"{Color.GREEN}[Agent]{Color.RESET}    {Color.BLUE}Prompt:{Color.RESET} ~{metrics['prompt_tokens']} tokens "
+                  f"({metrics['verbatim_steps']} pasos literales, {metrics['summarized_steps']} resumidos, {metrics['omitted_steps']} omitidos)")
             
             try:
                 # Forzar formato JSON para que el modelo se comporte
                 print(f"{Color.GREEN}[Agent]{Color.RESET} -> {Color.YELLOW}run(){Color.RESET}: {Color.BLUE}Querying provider for next action...{Color.RESET}")
-                response_text = self.provider.query(messages_for_provider, format="json")
+                response_text = self.provider.query(messages_for_provider, format=AGENT_ACTION_SCHEMA)
             except Exception as e:
                 return f"Error en el bucle del agente: {e}"
 
@@ -147,15 +219,30 @@ If you are finished, respond like this:
             if not action_data:
                 observation = "Error: Your last response was not a valid JSON object. You MUST respond with a valid JSON object containing 'thought' and 'action' keys. Please try again."
                 print(f"[agent.py][run] Observation: {observation}")
-                self.history.append({"role": "system", "content": f"Observation: {observation}"})
+                self._observe(response_text, observation)
                 continue
 
             thought = action_data.get("thought", "(sin pensamiento)")
             action = action_data.get("action", {})
+            if isinstance(action, list) and len(action) == 1:
+                action = action[0]
+            if isinstance(action, list) and action and all(isinstance(call, dict) for call in action):
+                # Varias herramientas independientes: se ejecutan a la vez.
+                calls = [(call.get("tool_name"), call.get("args", "")) for call in action]
+                if self.report_step_callback:
+                    for tool_name, args in calls:
+                        self.report_step_callback(thought, tool_name, args)
+                print(f"{Color.GREEN}[Agent]{Color.RESET}    {Color.YELLOW}Thought:{Color.RESET} {thought}")
+                results = self._execute_tools(calls)
+                observation = f"Results of your {len(calls)} tool calls:\n\n" + "\n\n".join(
+                    f"[{n}] {tool_name}({args}):\n{result}" for n, ((tool_name, args), result) in enumerate(zip(calls, results), start=1))
+                print(f"{Color.GREEN}[Agent]{Color.RESET}    {Color.YELLOW}Observation:{Color.RESET} {observation[:300]}...")
+                self._observe(response_text, observation, " + ".join(str(name) for name, _ in calls), "; ".join(str(args) for _, args in calls))
+                continue
             if not isinstance(action, dict):
-                observation = f"Error: The 'action' field in your JSON response must be a dictionary, but you provided a {type(action).__name__}. Please correct the format and ensure 'action' contains 'tool_name' and 'args'."
+                observation = f"Error: The 'action' field in your JSON response must be a dictionary (or a list of dictionaries), but you provided a {type(action).__name__}. Please correct the format and ensure 'action' contains 'tool_name' and 'args'."
                 print(f"Observation: {observation}")
-                self.history.append({"role": "system", "content": f"Observation: {observation}"})
+                self._observe(response_text, observation)
                 continue
 
             tool_name = action.get("tool_name")
@@ -183,20 +270,11 @@ If you are finished, respond like this:
                     print(f"Final Answer: {final_answer}")
                     return final_answer
             else: # It's a tool call
-                tool = self.tool_registry.get_tool(tool_name)
-                if not tool:
-                    observation = f"Error: Herramienta desconocida: '{tool_name}'. Las herramientas disponibles son: {self.tool_registry.get_tool_descriptions()}"
-                else:
-                    print(f"{Color.GREEN}[Agent]{Color.RESET}    {Color.YELLOW}Action:{Color.RESET} Executing tool '{tool_name}' with args: '{args}'")
-                    # 3. OBSERVAR: obtener el resultado de la herramienta
-                    try:
-                        observation = tool.run(args)
-                    except Exception as e:
-                        observation = f"Error executing tool {tool_name}: {e}"
+                observation = self._execute_tools([(tool_name, args)])[0]
 
             if observation:
                 print(f"{Color.GREEN}[Agent]{Color.RESET}    {Color.YELLOW}Observation:{Color.RESET} {observation[:300]}...")
-                self.history.append({"role": "system", "content": f"Observation: {observation}"})
+            self._observe(response_text, observation, tool_name, args)
 
         return "El agente no pudo completar la tarea en el número máximo de pasos."
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # app/chat_engine.py
 
+import uuid
 from datetime import datetime
 from app.llm_providers import BaseLLMProvider
 from bson.objectid import ObjectId
@@ -28,25 +29,79 @@ class ChatEngine:
         self.provider = provider
         self.conversation_id = None
         self.history = []
-        self.system_prompt = SYSTEM_PROMPT
+        # Mensajes del historial que ya están guardados; los siguientes se guardan como anexos.
+        self.saved_message_count = 0
+        # Identifica esta sesión de conversación ante el guardado en segundo plano,
+        # incluso antes de que exista un conversation_id.
+        self.save_key = uuid.uuid4().hex
+        self._system_prompt = SYSTEM_PROMPT
         self.title = "Nueva Conversación"
+        # Recuperación (RAG): objeto con `build_context` (p. ej. app.retrieval.RetrievalIndex)
+        # y máximo de tokens que pueden ocupar los fragmentos recuperados en cada consulta.
+        self.retriever = None
+        self.retrieval_budget = 512
+
+    @property
+    def system_prompt(self):
+        return self._system_prompt
+
+    @system_prompt.setter
+    def system_prompt(self, value):
+        # Cambiar el prompt del sistema cambia el prefijo que el proveedor tiene evaluado.
+        if value != getattr(self, "_system_prompt", None):
+            self._system_prompt = value
+            self.invalidate_session()
+
+    def invalidate_session(self):
+        """Pide al proveedor que descarte el prefijo de conversación que tenga en memoria."""
+        if self.provider is not None:
+            self.provider.reset_session()
 
     def start_new(self):
         """Inicia una nueva conversación, reseteando el estado."""
         self.conversation_id = None
         self.history = []
+        self.saved_message_count = 0
+        self.save_key = uuid.uuid4().hex
         self.title = "Nueva Conversación"
         self.system_prompt = SYSTEM_PROMPT # Reset to default
+        self.invalidate_session()
         print("[ChatEngine] Nueva conversación iniciada.")
 
     def load_conversation(self, conversation_id, history, system_prompt):
         """Carga una conversación existente."""
         self.conversation_id = conversation_id
         self.history = history
+        self.saved_message_count = len(history)
+        self.save_key = uuid.uuid4().hex
         self.system_prompt = system_prompt
+        self.invalidate_session()
         print(f"[ChatEngine] Conversación {conversation_id} cargada.")
 
     def get_full_prompt(self):
-        """Construye el prompt completo para enviar al LLM."""
+        """
+        Construye el prompt completo para enviar al LLM. Si hay un `retriever`, los fragmentos
+        recuperados para el último mensaje del usuario van en un mensaje de sistema justo antes
+        de él, para no alterar el prefijo (prompt del sistema e historial) que el proveedor
+        puede tener ya evaluado.
+        """
         full_prompt = [{"role": "system", "content": self.system_prompt}] + self.history
-        return full_prompt
\ No newline at end of file
+        context = self.retrieve_context()
+        if context:
+            full_prompt.insert(len(full_prompt) - 1, {"role": "system", "content": context})
+        return full_prompt
+
+    def retrieve_context(self) -> str:
+        """Fragmentos de conversaciones y documentos anteriores relevantes para el último mensaje del usuario."""
+        if self.retriever is None or self.retrieval_budget <= 0 or not self.history or self.history[-1].get("role") != "user":
+            return ""
+        count_tokens = self.provider.count_tokens if self.provider is not None else None
+        exclude = [f"conv:{self.conversation_id}"] if self.conversation_id else []
+        try:
+            kwargs = {"count_tokens": count_tokens} if count_tokens else {}
+            return self.retriever.build_context(self.history[-1]["content"], self.retrieval_budget,
+                                                exclude_sources=exclude, **kwargs)
+        except Exception as e:
+            # Sin contexto recuperado la consulta sigue funcionando.
+            print(f"[ChatEngine] retrieve_context: ⚠️ No se pudo recuperar contexto: {e}")
+            return ""
\ No newline at end of file
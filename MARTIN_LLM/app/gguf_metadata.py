@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# app/gguf_metadata.py
+
+import os
+import json
+import mmap
+import struct
+import threading
+from pathlib import Path
+
+# Importar la utilidad de rutas desde la raíz del proyecto.
+try:
+    from paths import get_app_data_dir
+except ImportError:
+    def get_app_data_dir():
+        data_dir = Path("data")
+        data_dir.mkdir(exist_ok=True)
+        return data_dir
+
+GGUF_MAGIC = b"GGUF"
+
+# Tipos de valor definidos por la especificación GGUF.
+_SCALAR_FORMATS = {
+    0: "<B",   # uint8
+    1: "<b",   # int8
+    2: "<H",   # uint16
+    3: "<h",   # int16
+    4: "<I",   # uint32
+    5: "<i",   # int32
+    6: "<f",   # float32
+    7: "<?",   # bool
+    10: "<Q",  # uint64
+    11: "<q",  # int64
+    12: "<d",  # float64
+}
+_TYPE_STRING = 8
+_TYPE_ARRAY = 9
+
+# Valores de 'general.file_type' (enum llama_ftype de llama.cpp).
+QUANT_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+# Los arrays más largos (vocabulario, merges...) no se copian: solo se guarda su longitud.
+MAX_ARRAY_ITEMS = 64
+
+
+class GGUFFormatError(ValueError):
+    """El archivo no es un GGUF válido o usa una versión no soportada."""
+
+
+class _Reader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def scalar(self, fmt: str):
+        value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def string(self) -> str:
+        length = self.scalar("<Q")
+        raw = self.buffer[self.offset:self.offset + length]
+        self.offset += length
+        return bytes(raw).decode("utf-8", errors="replace")
+
+    def skip_string(self):
+        length = self.scalar("<Q")
+        self.offset += length
+
+    def value(self, value_type: int):
+        if value_type in _SCALAR_FORMATS:
+            return self.scalar(_SCALAR_FORMATS[value_type])
+        if value_type == _TYPE_STRING:
+            return self.string()
+        if value_type == _TYPE_ARRAY:
+            item_type = self.scalar("<I")
+            count = self.scalar("<Q")
+            if count > MAX_ARRAY_ITEMS:
+                self.skip_array(item_type, count)
+                return {"array_length": count}
+            return [self.value(item_type) for _ in range(count)]
+        raise GGUFFormatError(f"Tipo de valor GGUF desconocido: {value_type}")
+
+    def skip_array(self, item_type: int, count: int):
+        if item_type in _SCALAR_FORMATS:
+            self.offset += struct.calcsize(_SCALAR_FORMATS[item_type]) * count
+        elif item_type == _TYPE_STRING:
+            for _ in range(count):
+                self.skip_string()
+        else:
+            for _ in range(count):
+                self.value(item_type)
+
+    def string_at(self, array_offset: int, index: int) -> str:
+        """Devuelve el elemento `index` de un array de cadenas que empieza en `array_offset`."""
+        self.offset = array_offset
+        for _ in range(index):
+            self.skip_string()
+        return self.string()
+
+
+    def parameter_count(self, tensor_count: int) -> int:
+        """Recorre las descripciones de los tensores (sin sus datos) y suma sus elementos."""
+        total = 0
+        for _ in range(tensor_count):
+            self.skip_string()
+            n_dims = self.scalar("<I")
+            elements = 1
+            for _ in range(n_dims):
+                elements *= self.scalar("<Q")
+            self.offset += 4 + 8  # tipo del tensor y desplazamiento de sus datos
+            total += elements
+        return total
+
+
+def read_gguf_metadata(model_path, count_parameters: bool = False) -> dict:
+    """
+    Lee los pares clave/valor de la cabecera de un archivo GGUF sin cargar los tensores.
+
+    El archivo se recorre con mmap, así que solo se leen de disco las páginas de la cabecera.
+    Además de las claves originales, añade 'tokenizer.ggml.bos_token' y
+    'tokenizer.ggml.eos_token' con el texto de esos tokens cuando el vocabulario está presente.
+    Con `count_parameters` recorre también la tabla de tensores y añade 'gguf.parameter_count'.
+    """
+    path = Path(model_path)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        reader = _Reader(buffer)
+        if bytes(buffer[:4]) != GGUF_MAGIC:
+            raise GGUFFormatError(f"{path.name} no es un archivo GGUF.")
+        reader.offset = 4
+        version = reader.scalar("<I")
+        if version < 2:
+            raise GGUFFormatError(f"Versión GGUF {version} no soportada.")
+        metadata = {"gguf.version": version}
+        metadata["gguf.tensor_count"] = reader.scalar("<Q")
+        kv_count = reader.scalar("<Q")
+
+        tokens_offset = None
+        for _ in range(kv_count):
+            key = reader.string()
+            value_type = reader.scalar("<I")
+            if key == "tokenizer.ggml.tokens" and value_type == _TYPE_ARRAY:
+                # Se recuerda dónde empieza el vocabulario para resolver bos/eos más tarde.
+                tokens_offset = reader.offset + 4 + 8
+            metadata[key] = reader.value(value_type)
+
+        if count_parameters:
+            metadata["gguf.parameter_count"] = reader.parameter_count(metadata["gguf.tensor_count"])
+
+        if tokens_offset is not None:
+            for name in ("bos", "eos"):
+                token_id = metadata.get(f"tokenizer.ggml.{name}_token_id")
+                if token_id is not None:
+                    metadata[f"tokenizer.ggml.{name}_token"] = reader.string_at(tokens_offset, token_id)
+    return metadata
+
+
+def get_context_length(metadata: dict) -> int | None:
+    """Devuelve la longitud de contexto de entrenamiento declarada en los metadatos."""
+    architecture = metadata.get("general.architecture")
+    if architecture:
+        return metadata.get(f"{architecture}.context_length")
+    return None
+
+
+def format_parameter_count(count: int | None) -> str | None:
+    """Convierte un número de parámetros en el formato del catálogo ('8B', '3.8B', '137M')."""
+    if not count:
+        return None
+    for divisor, suffix in ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if count >= divisor:
+            value = count / divisor
+            return f"{value:.0f}{suffix}" if value >= 10 or value.is_integer() else f"{value:.1f}{suffix}"
+    return str(count)
+
+
+def summarize_metadata(metadata: dict) -> dict:
+    """Extrae de los metadatos los datos que muestra el catálogo de modelos."""
+    file_type = metadata.get("general.file_type")
+    parameter_count = metadata.get("gguf.parameter_count")
+    return {
+        "architecture": metadata.get("general.architecture"),
+        "name": metadata.get("general.name"),
+        "parameter_count": parameter_count,
+        "parameters": format_parameter_count(parameter_count),
+        "quant_type": QUANT_TYPES.get(file_type) if file_type is not None else None,
+        "context_length": get_context_length(metadata),
+        "chat_template": metadata.get("tokenizer.chat_template"),
+    }
+
+
+class GGUFIndex:
+    """
+    Índice en disco de los metadatos GGUF, por ruta real del archivo.
+
+    Cada entrada guarda el tamaño y el mtime del archivo: mientras no cambien, los metadatos
+    se sirven del índice sin volver a abrir el modelo. El índice es un JSON en el directorio
+    de datos de la aplicación y se reescribe de forma atómica.
+    """
+    INDEX_FILE = "gguf_index.json"
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _path(self) -> Path:
+        if self.index_path is None:
+            self.index_path = get_app_data_dir() / self.INDEX_FILE
+        return Path(self.index_path)
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self._path(), "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        path = self._path()
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[GGUFIndex] No se pudo guardar el índice de modelos: {e}")
+
+    def _lookup(self, model_path, save: bool) -> dict:
+        key = os.path.realpath(model_path)
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._load().get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry["metadata"]
+
+        metadata = read_gguf_metadata(key, count_parameters=True)
+        with self._lock:
+            self._load()[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "metadata": metadata}
+            if save:
+                self._save()
+        return metadata
+
+    def metadata(self, model_path) -> dict:
+        """Devuelve los metadatos del modelo, leyendo la cabecera solo si el archivo cambió."""
+        return self._lookup(model_path, save=True)
+
+    def info(self, model_path) -> dict:
+        """Resumen del modelo: arquitectura, parámetros, cuantización, contexto y plantilla."""
+        info = summarize_metadata(self.metadata(model_path))
+        info["size"] = os.path.getsize(model_path)
+        return info
+
+    def scan(self, directory) -> dict:
+        """
+        Indexa todos los .gguf de `directory` y devuelve {nombre de archivo: info}.
+        Los archivos ilegibles se omiten; el índice se guarda una sola vez al final.
+        """
+        results = {}
+        directory = Path(directory)
+        if not directory.exists():
+            return results
+        for f in sorted(directory.iterdir()):
+            if not (f.is_file() and f.suffix.lower() == ".gguf"):
+                continue
+            try:
+                info = summarize_metadata(self._lookup(f, save=False))
+            except (OSError, ValueError, struct.error) as e:
+                print(f"[GGUFIndex] No se pudieron leer los metadatos de {f.name}: {e}")
+                info = {}
+            info["size"] = f.stat().st_size
+            results[f.name] = info
+        with self._lock:
+            # Se descartan las entradas de archivos que ya no existen.
+            entries = self._load()
+            for key in [k for k in entries if not os.path.exists(k)]:
+                del entries[key]
+            self._save()
+        return results
+
+
+# Instancia global del índice de metadatos GGUF
+gguf_index = GGUFIndex()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# app/json_output.py
+"""
+Salida JSON estructurada de los modelos: esquemas de las respuestas del agente y del
+razonador, detección incremental del final del objeto durante el streaming y un extractor
+tolerante para las respuestas que no llegan como JSON limpio.
+
+Los proveedores reciben el esquema en `query(..., format=esquema)`: llama.cpp lo convierte
+en una gramática y restringe la generación; ctransformers no admite gramáticas, así que
+allí se detiene la generación en cuanto se cierra el objeto y se extrae con `extract_json`.
+"""
+
+import json
+import re
+
+TOOL_CALL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tool_name": {"type": "string"},
+        "args": {"anyOf": [{"type": "string"}, {"type": "object"}]},
+    },
+    "required": ["tool_name", "args"],
+}
+
+# Una acción, o una lista de llamadas independientes que se ejecutan a la vez.
+AGENT_ACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string"},
+        "action": {"anyOf": [TOOL_CALL_SCHEMA, {"type": "array", "minItems": 1, "items": TOOL_CALL_SCHEMA}]},
+    },
+    "required": ["thought", "action"],
+}
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "plan": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "task": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "integer"}},
+                },
+                "required": ["id", "task", "depends_on"],
+            },
+        },
+    },
+    "required": ["plan"],
+}
+
+# Como mucho se prueban tantos posibles comienzos de objeto en un texto.
+MAX_CANDIDATES = 20
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class JSONObjectDetector:
+    """
+    Sigue un texto que llega por fragmentos y detecta cuándo se cierra el primer objeto
+    JSON de nivel superior (las llaves dentro de cadenas no cuentan). Sirve para cortar la
+    generación en cuanto el modelo ha terminado el objeto, sin esperar al token de fin.
+    """
+    def __init__(self):
+        self.stack = []
+        self.started = False
+        self.complete = False
+        self.in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> int | None:
+        """
+        Procesa un fragmento. Si en él se cierra el objeto, devuelve cuántos caracteres del
+        fragmento le pertenecen (el resto sobra); si no, devuelve None.
+        """
+        if self.complete:
+            return 0
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.stack.append(ch)
+            elif ch == '"':
+                self.in_string = True
+            elif ch in _CLOSERS:
+                self.stack.append(ch)
+            elif ch in "}]" and self.stack:
+                self.stack.pop()
+                if not self.stack:
+                    self.complete = True
+                    return i + 1
+        return None
+
+
+def _candidates(text: str):
+    """Fragmentos que empiezan en una '{' y terminan donde se cierra (o, si se corta, reparados)."""
+    start = text.find("{")
+    tried = 0
+    while start != -1 and tried < MAX_CANDIDATES:
+        tried += 1
+        detector = JSONObjectDetector()
+        end = detector.feed(text[start:])
+        if end is not None:
+            yield text[start:start + end]
+        else:
+            # Respuesta cortada (límite de tokens): se cierran la cadena y los corchetes abiertos.
+            fragment = text[start:].rstrip()
+            if detector.in_string:
+                fragment += '"'
+            fragment = fragment.rstrip().rstrip(",")
+            if fragment.endswith(":"):
+                fragment += " null"
+            yield fragment + "".join(_CLOSERS[ch] for ch in reversed(detector.stack))
+        start = text.find("{", start + 1)
+
+
+def _loads(fragment: str):
+    for attempt in (fragment, _TRAILING_COMMA.sub(r"\1", fragment)):
+        try:
+            return json.loads(attempt, strict=False) # strict=False admite saltos de línea en cadenas
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def matches_schema(value, schema: dict) -> bool:
+    """Comprobación mínima de `value` contra el subconjunto de JSON Schema que usan estos esquemas."""
+    if "anyOf" in schema:
+        return any(matches_schema(value, option) for option in schema["anyOf"])
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(value, dict) or any(key not in value for key in schema.get("required", ())):
+            return False
+        return all(matches_schema(value[key], sub) for key, sub in schema.get("properties", {}).items() if key in value)
+    if expected == "array":
+        return (isinstance(value, list) and len(value) >= schema.get("minItems", 0)
+                and all(matches_schema(item, schema.get("items", {})) for item in value))
+    if expected == "string":
+        return isinstance(value, str)
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if expected == "boolean":
+        return isinstance(value, bool)
+    return True
+
+
+def extract_json(text: str, schema: dict | None = None):
+    """
+    Extrae el objeto JSON de una respuesta del modelo aunque venga rodeado de texto o de
+    bloques ```json, con comas finales o cortado por el límite de tokens.
+
+    Con `schema` devuelve el primer objeto que lo cumple y, si ninguno lo cumple, el primero
+    que se pueda leer (para que el llamador explique al modelo qué falta). None si no hay JSON.
+    """
+    if not isinstance(text, str):
+        return None
+    first = None
+    for fragment in _candidates(text):
+        value = _loads(fragment)
+        if not isinstance(value, dict):
+            continue
+        if schema is None or matches_schema(value, schema):
+            return value
+        if first is None:
+            first = value
+    return first
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 # app/llama_server.py
 
+import os
 import sys
 import argparse
 import logging
 import json
+import queue
+import threading
+import time
 from pathlib import Path
-from multiprocessing.connection import Listener
-from llama_cpp import Llama
+from multiprocessing.connection import Listener, Client
 
 # Añadir explícitamente la raíz del proyecto para que los imports funcionen
 project_root = Path(__file__).parent.parent.resolve()
@@ -40,6 +43,284 @@ def find_project_root():
     # Fallback al directorio actual si no se encuentra
     return Path.cwd()
 
+class _Request:
+    """Petición de inferencia encolada en el planificador del servidor."""
+    def __init__(self, request_id, params, handler, stream=False, legacy=False):
+        self.id = request_id
+        self.params = params
+        self.handler = handler
+        self.stream = stream
+        self.legacy = legacy
+        self.cancel_event = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+
+class _ConnectionHandler(threading.Thread):
+    """
+    Atiende a un cliente conectado: recibe sus mensajes en su propio hilo y envía
+    las respuestas que produce el hilo de inferencia (el envío está protegido por un lock).
+    """
+    def __init__(self, server, conn, address):
+        super().__init__(name=f"llama_server-conn-{address}", daemon=True)
+        self.server = server
+        self.conn = conn
+        self.address = address
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.closed = False
+
+    def send(self, message) -> bool:
+        """Envía un mensaje al cliente. Devuelve False si el cliente ya no está."""
+        if self.closed:
+            return False
+        try:
+            with self.send_lock:
+                self.conn.send(message)
+            return True
+        except (OSError, EOFError, ValueError):
+            self.closed = True
+            return False
+
+    def run(self):
+        try:
+            while not self.server.stopping.is_set():
+                try:
+                    msg = self.conn.recv()
+                except (EOFError, OSError):
+                    print(f"{Color.YELLOW}[llama_server] El cliente {self.address} se ha desconectado.{Color.RESET}")
+                    logging.warning(f"El cliente {self.address} se ha desconectado.")
+                    break
+                if msg == 'shutdown':
+                    print(f"{Color.GREEN}[llama_server]{Color.RESET}    {Color.BLUE}Señal de apagado recibida.{Color.RESET}")
+                    logging.info("Señal de apagado recibida. Terminando...")
+                    self.server.shutdown()
+                    break
+                self.server.dispatch(self, msg)
+        finally:
+            self.closed = True
+            # Las peticiones de un cliente desconectado ya no tienen a quién responder.
+            for request in list(self.pending.values()):
+                request.cancel_event.set()
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+            self.server.connection_closed(self)
+
+
+class LlamaServer:
+    """
+    Servidor de inferencia de larga duración sobre `multiprocessing.connection`.
+
+    Acepta varias conexiones a la vez (un hilo por cliente) y encola las peticiones en una
+    cola acotada que consume un único hilo de inferencia, ya que el modelo no admite
+    llamadas concurrentes. Cuando la cola está llena la petición se rechaza al momento.
+
+    Mensajes admitidos:
+      - 'shutdown': apaga el servidor.
+      - dict sin clave "type": petición heredada; se responde con el resultado de
+        `create_chat_completion` o con {"error": ...}.
+      - {"type": "completion", "id", "params", "stream"}: responde con mensajes
+        {"type": "chunk", "id", "data"} (solo en streaming) y un {"type": "done", "id", "data",
+        "cancelled"} final, o {"type": "error", "id", "error"}.
+      - {"type": "cancel", "id"}: cancela una petición encolada o en curso.
+      - {"type": "health"} y {"type": "stats"}: estado y métricas del servidor.
+    """
+    def __init__(self, llm, address, authkey: bytes, max_queue: int = 8, model_name: str = ""):
+        self.llm = llm
+        self.address = address
+        self.authkey = authkey
+        self.model_name = model_name
+        self.requests = queue.Queue(maxsize=max_queue)
+        self.max_queue = max_queue
+        self.stopping = threading.Event()
+        self.listener = None
+        self.handlers = set()
+        self.handlers_lock = threading.Lock()
+        self.current_request = None
+        self.started_at = time.monotonic()
+        self.stats = {
+            "received": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "rejected": 0,
+            "total_wait_seconds": 0.0,
+            "total_inference_seconds": 0.0,
+        }
+        self.stats_lock = threading.Lock()
+        self._inference_thread = threading.Thread(target=self._inference_loop, name="llama_server-inference", daemon=True)
+
+    def _count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def serve_forever(self):
+        """Acepta conexiones hasta recibir 'shutdown'."""
+        self._inference_thread.start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            self.listener = listener
+            self.address = listener.address
+            print(f"{Color.GREEN}[llama_server]{Color.RESET} -> {Color.YELLOW}serve_forever(){Color.RESET}: Escuchando en {self.address}...")
+            logging.info(f"Servidor escuchando en {self.address}")
+            while not self.stopping.is_set():
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    if self.stopping.is_set():
+                        break
+                    # Un handshake fallido (authkey incorrecta, cliente que cierra) no tumba el servidor.
+                    logging.warning(f"Conexión rechazada: {e}")
+                    continue
+                if self.stopping.is_set():
+                    conn.close()
+                    break
+                print(f"{Color.GREEN}[llama_server]{Color.RESET}    Conexión aceptada desde {listener.last_accepted}")
+                logging.info(f"Conexión aceptada desde {listener.last_accepted}")
+                handler = _ConnectionHandler(self, conn, listener.last_accepted)
+                with self.handlers_lock:
+                    self.handlers.add(handler)
+                handler.start()
+        self._inference_thread.join(timeout=5)
+        print(f"{Color.BLUE}[LLAMA_SERVER] Apagando.{Color.RESET}")
+
+    def shutdown(self):
+        """Detiene el servidor: cancela el trabajo pendiente y desbloquea `accept()`."""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        if self.current_request is not None:
+            self.current_request.cancel_event.set()
+        self.requests.put(None)
+        try:
+            # accept() no se interrumpe al cerrar el socket; una conexión propia lo despierta.
+            Client(self.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+
+    def connection_closed(self, handler):
+        with self.handlers_lock:
+            self.handlers.discard(handler)
+
+    def dispatch(self, handler, msg):
+        """Procesa un mensaje recibido en el hilo del cliente."""
+        if not isinstance(msg, dict):
+            handler.send({"type": "error", "id": None, "error": f"Mensaje no soportado: {msg!r}"})
+            return
+
+        msg_type = msg.get("type")
+        if msg_type is None:
+            self._enqueue(handler, _Request(None, msg, handler, legacy=True))
+        elif msg_type == "completion":
+            request = _Request(msg.get("id"), msg.get("params", {}), handler, stream=bool(msg.get("stream")))
+            self._enqueue(handler, request)
+        elif msg_type == "cancel":
+            request = handler.pending.get(msg.get("id"))
+            if request is not None:
+                request.cancel_event.set()
+        elif msg_type == "health":
+            handler.send({"type": "health", "status": "stopping" if self.stopping.is_set() else "ok", "model": self.model_name})
+        elif msg_type == "stats":
+            handler.send({"type": "stats", "data": self.get_stats()})
+        else:
+            handler.send({"type": "error", "id": msg.get("id"), "error": f"Tipo de mensaje desconocido: {msg_type}"})
+
+    def _enqueue(self, handler, request):
+        self._count("received")
+        if not request.legacy:
+            handler.pending[request.id] = request
+        try:
+            self.requests.put_nowait(request)
+        except queue.Full:
+            self._count("rejected")
+            handler.pending.pop(request.id, None)
+            self._reply_error(request, f"Servidor ocupado: la cola admite {self.max_queue} peticiones.")
+            logging.warning("Petición rechazada: cola llena.")
+
+    def _reply_error(self, request, error):
+        if request.legacy:
+            request.handler.send({"error": error})
+        else:
+            request.handler.send({"type": "error", "id": request.id, "error": error})
+
+    def get_stats(self) -> dict:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        with self.handlers_lock:
+            stats["connections"] = len(self.handlers)
+        stats["queued"] = self.requests.qsize()
+        stats["busy"] = self.current_request is not None
+        stats["uptime_seconds"] = time.monotonic() - self.started_at
+        stats["model"] = self.model_name
+        return stats
+
+    def _inference_loop(self):
+        """Único consumidor de la cola: ejecuta las peticiones de una en una."""
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            self._count("total_wait_seconds", time.monotonic() - request.enqueued_at)
+            if request.cancel_event.is_set() or request.handler.closed or self.stopping.is_set():
+                self._finish_cancelled(request)
+                continue
+            self.current_request = request
+            started = time.monotonic()
+            try:
+                self._run_request(request)
+            except Exception as e:
+                self._count("failed")
+                logging.error(f"Error procesando la petición {request.id}: {e}", exc_info=True)
+                self._reply_error(request, str(e))
+            finally:
+                self.current_request = None
+                request.handler.pending.pop(request.id, None)
+                self._count("total_inference_seconds", time.monotonic() - started)
+
+    def _finish_cancelled(self, request):
+        self._count("cancelled")
+        request.handler.pending.pop(request.id, None)
+        if request.legacy:
+            request.handler.send({"error": "cancelled"})
+        else:
+            request.handler.send({"type": "done", "id": request.id, "data": None, "cancelled": True})
+
+    def _run_request(self, request):
+        print(f"{Color.GREEN}[llama_server]{Color.RESET}    {Color.BLUE}Procesando petición {request.id}...{Color.RESET}")
+        logging.info(f"Petición de inferencia recibida:\n{json.dumps(request.params, indent=2, ensure_ascii=False, default=str)}")
+
+        if request.legacy:
+            response = self.llm.create_chat_completion(**request.params)
+            request.handler.send(response)
+            self._count("completed")
+            return
+
+        if not request.stream:
+            response = self.llm.create_chat_completion(**request.params)
+            request.handler.send({"type": "done", "id": request.id, "data": response, "cancelled": False})
+            self._count("completed")
+            return
+
+        params = dict(request.params, stream=True)
+        chunks = self.llm.create_chat_completion(**params)
+        try:
+            for chunk in chunks:
+                if request.cancel_event.is_set() or self.stopping.is_set():
+                    break
+                if not request.handler.send({"type": "chunk", "id": request.id, "data": chunk}):
+                    request.cancel_event.set()
+                    break
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+        if request.cancel_event.is_set() or self.stopping.is_set():
+            self._finish_cancelled(request)
+        else:
+            request.handler.send({"type": "done", "id": request.id, "data": None, "cancelled": False})
+            self._count("completed")
+
 def main():
     """
     Este script se ejecuta en un proceso separado.
@@ -58,14 +339,23 @@ def main():
         default=0,
         help="Número de capas a descargar en la GPU. -1 para todas las posibles, 0 para solo CPU."
     )
+    parser.add_argument("--n-ctx", type=int, default=4096, help="Longitud de contexto con la que cargar el modelo.")
+    parser.add_argument("--n-threads", type=int, default=None, help="Hilos de CPU. Por defecto, los que elija llama.cpp.")
+    parser.add_argument("--n-batch", type=int, default=512, help="Tamaño de lote para evaluar el prompt.")
     parser.add_argument("--port", required=True, type=int, help="Puerto en el que escuchar.")
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=8,
+        help="Número máximo de peticiones en espera antes de rechazar nuevas."
+    )
     parser.add_argument(
         "--authkey",
         required=False,
         help=(
             "Clave de autenticación para la conexión segura entre procesos "
             "(no relacionada con autenticación de usuarios). "
-            "Por defecto: 'martin_llm'"
+            "Si no se indica se usa la variable MARTIN_LLM_SERVER_AUTHKEY o 'martin_llm'"
         )
     )
     args, _ = parser.parse_known_args()
@@ -96,13 +386,17 @@ def main():
         sys.exit(1)
 
     try:
+        from llama_cpp import Llama
+
         model_params = {
             "model_path": str(model_path),
             "n_gpu_layers": args.n_gpu_layers,
             "verbose": True,
-            "n_batch": 512,
-            "n_ctx": 4096 # Contexto por defecto, puede ser sobreescrito
+            "n_batch": args.n_batch,
+            "n_ctx": args.n_ctx,
         }
+        if args.n_threads:
+            model_params["n_threads"] = args.n_threads
         logging.info(f"Parámetros de carga para Llama.cpp: {model_params}")
         print(f"{Color.GREEN}[llama_server]{Color.RESET} -> {Color.YELLOW}main(){Color.RESET}: Intentando cargar el modelo con los siguientes parámetros:\n{json.dumps(model_params, indent=2)}")
 
@@ -118,50 +412,17 @@ def main():
         sys.exit(1)
 
     # Usar authkey proporcionado o valor por defecto para desarrollo
-    authkey_str = args.authkey or "martin_llm"
+    authkey_str = args.authkey or os.environ.get("MARTIN_LLM_SERVER_AUTHKEY") or "martin_llm"
     authkey = authkey_str.encode('utf-8')
     print(f"{Color.GREEN}[llama_server]{Color.RESET} -> {Color.YELLOW}main(){Color.RESET}: Usando authkey para conexión entre procesos.")
     logging.info("Authkey para conexión IPC establecida.")
 
-    with Listener(address, authkey=authkey) as listener:
-        print(f"{Color.GREEN}[llama_server]{Color.RESET} -> {Color.YELLOW}main(){Color.RESET}: Escuchando en el puerto {args.port}...")
-        logging.info(f"Servidor escuchando en {address}")
-        try:
-            with listener.accept() as conn:
-                print(f"{Color.GREEN}[llama_server]{Color.RESET} -> {Color.YELLOW}main(){Color.RESET}: Conexión aceptada desde {listener.last_accepted}")
-                logging.info(f"Conexión aceptada desde {listener.last_accepted}")
-                while True:
-                    try:
-                        msg = conn.recv()
-                        if msg == 'shutdown':
-                            print(f"{Color.GREEN}[llama_server]{Color.RESET}    {Color.BLUE}Señal de apagado recibida.{Color.RESET}")
-                            logging.info("Señal de apagado recibida. Terminando...")
-                            break
-
-                        print(f"{Color.GREEN}[llama_server]{Color.RESET}    {Color.BLUE}Petición recibida. Procesando...{Color.RESET}")
-                        logging.info(f"Petición de inferencia recibida:\n{json.dumps(msg, indent=2, ensure_ascii=False)}")
-
-                        response = llm.create_chat_completion(**msg)
-
-                        print(f"{Color.GREEN}[llama_server]{Color.RESET}    {Color.BLUE}Respuesta generada. Enviando al cliente...{Color.RESET}")
-                        logging.info(f"Respuesta generada por el modelo:\n{json.dumps(response, indent=2, ensure_ascii=False)}")
-                        conn.send(response)
-                    except EOFError:
-                        print(f"{Color.YELLOW}[llama_server] El cliente se ha desconectado.{Color.RESET}")
-                        logging.warning("El cliente se ha desconectado (EOFError).")
-                        break
-                    except Exception as e:
-                        error_response = {"error": str(e)}
-                        logging.error(f"Error procesando la petición en el bucle de escucha: {e}", exc_info=True)
-                        try:
-                            conn.send(error_response)
-                        except Exception:
-                            # Si no podemos enviar el error, simplemente salimos
-                            break
-        except Exception as e:
-            print(f"{Color.RED}[LLAMA_SERVER] Error en el listener: {e}{Color.RESET}")
-            logging.error(f"Error crítico en el listener principal: {e}", exc_info=True)
-    print(f"{Color.BLUE}[LLAMA_SERVER] Apagando.{Color.RESET}")
+    server = LlamaServer(llm, address, authkey, max_queue=args.max_queue, model_name=model_path.name)
+    try:
+        server.serve_forever()
+    except Exception as e:
+        print(f"{Color.RED}[LLAMA_SERVER] Error en el listener: {e}{Color.RESET}")
+        logging.error(f"Error crítico en el listener principal: {e}", exc_info=True)
 
 if __name__ == "__main__":
     main()
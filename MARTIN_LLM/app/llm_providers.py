@@ -8,11 +8,19 @@ import secrets
 import time
 import os
 import contextlib
+import threading
+from typing import Iterator
 from multiprocessing.connection import Client
 from pathlib import Path
 from abc import ABC, abstractmethod
 import requests
 from ctransformers import AutoModelForCausalLM
+from ctransformers.llm import utf8_split_incomplete
+from app.prompt_builder import PromptBuilder, estimate_tokens
+from app.json_output import JSONObjectDetector
+from app.model_tuning import (
+    resolve_load_settings, benchmark_llm, tuning_store, thread_candidates, BATCH_SIZE_CANDIDATES
+)
 
 # ANSI escape codes for colors
 class Color:
@@ -44,6 +52,26 @@ def chdir_if_packaged(path: Path):
     else:
         yield
 
+def load_hardware_config() -> dict:
+    """Carga la configuración de hardware guardada o usa valores por defecto."""
+    import json
+
+    config_file = 'hardware_config.json'
+    try:
+        if os.path.exists(config_file):
+            with open(config_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get('selected_config', {})
+    except Exception as e:
+        print(f"{Color.YELLOW}[llm_providers] Could not load hardware config: {e}{Color.RESET}")
+
+    return {
+        'type': 'default_cpu',
+        'n_gpu_layers': 0,
+        'n_threads': os.cpu_count(),
+        'requires_cuda_build': False
+    }
+
 class BaseLLMProvider(ABC):
     """Clase base abstracta para todos los proveedores de LLM."""
     def __init__(self, model_identifier: str, **kwargs):
@@ -55,8 +83,37 @@ class BaseLLMProvider(ABC):
         print(f"{Color.BLUE}[BaseLLMProvider] Inicializado para el modelo: {model_identifier}{Color.RESET}")
         print(f"{Color.BLUE}-------------------------------------------------------------------------{Color.RESET}")
     @abstractmethod
-    def query(self, messages: list, format: str = None) -> str:
-        """Envía una lista de mensajes al modelo y devuelve la respuesta."""
+    def query(self, messages: list, format: str | dict = None) -> str:
+        """
+        Envía una lista de mensajes al modelo y devuelve la respuesta.
+
+        `format` puede ser "json" o un JSON Schema (dict, ver app/json_output.py) para pedir
+        una respuesta JSON; cada proveedor la impone en la medida en que su motor lo permita.
+        """
+        pass
+    def query_stream(self, messages: list, format: str | dict = None, cancel_event: threading.Event | None = None) -> Iterator[str]:
+        """
+        Envía una lista de mensajes al modelo y devuelve un generador de fragmentos de texto.
+
+        `cancel_event` actúa como manejador de cancelación: cuando se activa, el generador
+        deja de producir fragmentos en cuanto el proveedor puede detenerse.
+        La implementación por defecto no transmite: produce la respuesta completa de una vez.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        yield self.query(messages, format=format)
+    def count_tokens(self, text: str) -> int:
+        """
+        Cuenta los tokens de un texto. La implementación por defecto es una estimación;
+        los proveedores con acceso al tokenizador del modelo la sustituyen por el valor exacto.
+        """
+        return estimate_tokens(text)
+    def reset_session(self):
+        """
+        Invalida el prefijo de conversación que el proveedor mantenga en memoria (modo sesión).
+        Se llama cuando el historial o el prompt del sistema cambian de forma no incremental.
+        La implementación por defecto no hace nada.
+        """
         pass
     def shutdown(self):
         """
@@ -76,33 +133,70 @@ class BaseLLMProvider(ABC):
             self.repeat_penalty = kwargs["repeat_penalty"]
             print(f"{Color.BLUE}[BaseLLMProvider] Repeat Penalty ajustado a: {self.repeat_penalty}{Color.RESET}")
 
+    def _load_hardware_config(self):
+        """Carga la configuración de hardware guardada o usa valores por defecto."""
+        return load_hardware_config()
+    
+    def _get_gpu_layers(self):
+        """Determina cuántas capas usar en GPU basado en la configuración."""
+        if not self.hardware_config:
+            return 0
+        
+        return self.hardware_config.get('n_gpu_layers', 0)
+
 class CtransformersProvider(BaseLLMProvider):
     """
     Provider for GGUF models using the ctransformers library.
+
+    Con `session_mode=True` el proveedor conserva el prefijo ya evaluado (prompt del
+    sistema y turnos anteriores) entre llamadas: si el nuevo prompt extiende el último,
+    solo se tokeniza y evalúa la parte nueva. `reset_session()` descarta ese prefijo.
+
+    Los mensajes se formatean con la plantilla de chat del modelo (ver `PromptBuilder`) y se
+    recortan para que quepan en `context_budget` tokens (por defecto, el contexto del modelo
+    menos los tokens reservados para la respuesta).
+
+    El modelo tiene un único contexto: las generaciones lanzadas desde varios hilos (p. ej. los
+    pasos paralelos del razonador), incluida la construcción de su prompt, se ejecutan de una en una.
     """
-    def __init__(self, model_path: str, hardware_config=None, **kwargs):
+    def __init__(self, model_path: str, hardware_config=None, session_mode: bool = False, context_budget: int | None = None, **kwargs):
         super().__init__(model_identifier=os.path.basename(model_path))
         self.model_path = model_path
         self.llm = None
         self.hardware_config = hardware_config or self._load_hardware_config()
+        self.session_mode = session_mode
+        # Texto y tokens del último prompt evaluado en modo sesión.
+        self._session_text = ""
+        self._session_tokens = []
+        self._generation_lock = threading.RLock()
 
         if not os.path.exists(self.model_path):
             raise FileNotFoundError(f"Model file not found at: {self.model_path}")
 
         try:
-            n_gpu_layers = self._get_gpu_layers()
-            model_type = self._get_model_type_from_path(self.model_path)
-            
-            print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET} GPU Layers: {n_gpu_layers}, Model Type: {model_type}")
+            settings = resolve_load_settings(self.model_path, self.hardware_config)
+            # Los argumentos explícitos del llamador prevalecen sobre los deducidos.
+            settings.update(kwargs)
+            model_type = settings.pop("model_type")
+
+            print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET} Model Type: {model_type}, GPU Layers: {settings['gpu_layers']}, "
+                  f"Threads: {settings['threads']}, Batch: {settings['batch_size']}, Context: {settings['context_length']}")
 
             self.llm = AutoModelForCausalLM.from_pretrained(
                 self.model_path,
                 model_type=model_type,
-                gpu_layers=n_gpu_layers,
-                **kwargs
+                **settings
             )
             print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET} Model loaded successfully.")
 
+            self.prompt_builder = PromptBuilder.from_model(
+                self.model_path,
+                count_tokens=self.count_tokens,
+                context_length=self.llm.context_length,
+                max_new_tokens=self.llm.config.max_new_tokens,
+                budget=context_budget,
+            )
+
             # Imprimir información detallada del modelo cargado si está disponible
             if hasattr(self.llm, 'metadata') and self.llm.metadata:
                 metadata = self.llm.metadata
@@ -127,42 +221,48 @@ class CtransformersProvider(BaseLLMProvider):
             traceback.print_exc()
             raise RuntimeError(f"Failed to load ctransformers model: {e}")
 
-    def _get_model_type_from_path(self, model_path: str) -> str:
-        """Infers the model type from the model file path."""
-        path_str = str(model_path).lower()
-        if "llama-3" in path_str or "llama3" in path_str:
-            return "llama"
-        if "mistral" in path_str or "mixtral" in path_str:
-            return "mistral"
-        if "phi-3" in path_str or "phi3" in path_str:
-            return "phi3"
-        if "gemma" in path_str:
-            return "gemma"
-        if "command-r" in path_str:
-            return "command-r"
-        if "phi" in path_str: # Must be after phi-3
-            return "phi"
-        if "yi" in path_str or "llava" in path_str:
-             return "yi"
-        # Default fallback for Llama 2 and other llama-like models
-        return "llama"
-
-    def query(self, messages: list, format: str = None) -> str:
+    @property
+    def is_tuned(self) -> bool:
+        """True si ya hay un ajuste medido para este modelo en esta máquina."""
+        return tuning_store.get(self.model_path, self.hardware_config) is not None
+
+    def autotune(self, cancel_event: threading.Event | None = None) -> dict | None:
+        """
+        Mide la velocidad de evaluación y generación con varios hilos y tamaños de lote,
+        guarda el mejor ajuste para esta máquina y lo aplica al modelo cargado.
+        Devuelve el resultado, o None si se cancela.
+        """
+        if not self.llm:
+            raise RuntimeError("Ctransformers model not loaded.")
+        print(f"{Color.BLUE}[CtransformersProvider] Midiendo rendimiento de {self.model_identifier}...{Color.RESET}")
+        result = benchmark_llm(self.llm, thread_candidates(self.hardware_config), BATCH_SIZE_CANDIDATES, cancel_event)
+        # El benchmark vacía el contexto del modelo.
+        self.reset_session()
+        if result is None:
+            return None
+        tuning_store.put(self.model_path, self.hardware_config, result)
+        self.llm.config.threads = result["threads"]
+        self.llm.config.batch_size = result["batch_size"]
+        print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET} Ajuste: {result['threads']} hilos, lote {result['batch_size']} "
+              f"({result['prompt_tps']} tok/s prompt, {result['generation_tps']} tok/s generación).")
+        return result
+
+    def _build_prompt(self, messages: list) -> str:
+        """Convierte la lista de mensajes en el prompt de texto que recibe el modelo."""
+        return self.prompt_builder.build(messages)
+
+    def count_tokens(self, text: str) -> int:
+        if not self.llm:
+            return super().count_tokens(text)
+        return len(self.llm.tokenize(text, add_bos_token=False))
+
+    def query(self, messages: list, format: str | dict = None) -> str:
         if not self.llm:
             return "Error: Ctransformers model not loaded."
 
         print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET} -> {Color.YELLOW}query(){Color.RESET}")
-        prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
-        print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Final prompt being sent to model:{Color.RESET}\n---PROMPT START---\n{prompt}\n---PROMPT END---")
-
         try:
-            print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Generating response...{Color.RESET}")
-            response = self.llm(
-                prompt,
-                temperature=self.temperature,
-                top_p=self.top_p,
-                repetition_penalty=self.repeat_penalty,
-            )
+            response = "".join(self.query_stream(messages, format=format))
             print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Raw response received:{Color.RESET}\n---RESPONSE START---\n{response}\n---RESPONSE END---")
             return response
         except Exception as e:
@@ -171,40 +271,379 @@ class CtransformersProvider(BaseLLMProvider):
             traceback.print_exc()
             return f"Error processing model request: {e}"
 
-    def _load_hardware_config(self):
-        """Carga la configuración de hardware guardada o usa valores por defecto."""
-        import json
-        
-        config_file = 'hardware_config.json'
-        try:
-            if os.path.exists(config_file):
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                return data.get('selected_config', {})
-        except Exception as e:
-            print(f"{Color.YELLOW}[CtransformersProvider] Could not load hardware config: {e}{Color.RESET}")
-        
-        return {
-            'type': 'default_cpu',
-            'n_gpu_layers': 0,
-            'n_threads': os.cpu_count(),
-            'requires_cuda_build': False
-        }
-    
-    def _get_gpu_layers(self):
-        """Determina cuántas capas usar en GPU basado en la configuración."""
-        if not self.hardware_config:
-            return 0
-        
-        return self.hardware_config.get('n_gpu_layers', 0)
+    def query_stream(self, messages: list, format: str | dict = None, cancel_event: threading.Event | None = None) -> Iterator[str]:
+        """
+        Genera la respuesta fragmento a fragmento usando `stream=True` de ctransformers.
+        Comprueba `cancel_event` entre tokens para poder abortar la generación.
+
+        ctransformers no admite gramáticas: si se pide JSON (`format`), la generación se
+        detiene en cuanto se cierra el primer objeto, en lugar de esperar al token de fin.
+        """
+        if not self.llm:
+            raise RuntimeError("Ctransformers model not loaded.")
+
+        print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET} -> {Color.YELLOW}query_stream(){Color.RESET}")
+        with self._generation_lock:
+            # El recorte del contexto guarda estado en el PromptBuilder: también va bajo el cerrojo.
+            prompt = self._build_prompt(messages)
+            print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Final prompt being sent to model:{Color.RESET}\n---PROMPT START---\n{prompt}\n---PROMPT END---")
+            if self.session_mode:
+                chunks = self._session_stream(prompt)
+            else:
+                print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Generating response...{Color.RESET}")
+                chunks = self.llm(
+                    prompt,
+                    temperature=self.temperature,
+                    top_p=self.top_p,
+                    repetition_penalty=self.repeat_penalty,
+                    stream=True,
+                )
+            detector = JSONObjectDetector() if format else None
+            try:
+                for chunk in chunks:
+                    if cancel_event is not None and cancel_event.is_set():
+                        print(f"{Color.YELLOW}[CtransformersProvider] Generación cancelada.{Color.RESET}")
+                        break
+                    end = detector.feed(chunk) if detector else None
+                    if end is not None:
+                        yield chunk[:end]
+                        print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Objeto JSON completo: generación detenida.{Color.RESET}")
+                        break
+                    yield chunk
+            finally:
+                chunks.close()
+
+    def _session_tokens_for(self, prompt: str) -> list:
+        """
+        Devuelve los tokens del prompt reutilizando los del prompt anterior cuando este
+        es un prefijo exacto del nuevo; en ese caso solo se tokeniza el sufijo.
+        """
+        if self._session_tokens and prompt.startswith(self._session_text):
+            suffix = prompt[len(self._session_text):]
+            return self._session_tokens + self.llm.tokenize(suffix, add_bos_token=False)
+        return self.llm.tokenize(prompt)
+
+    def _session_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Bucle de generación del modo sesión. `prepare_inputs_for_generation` descarta del
+        contexto del modelo todo lo que no coincide con los tokens del nuevo prompt, de modo
+        que solo se evalúan los tokens nuevos y el estado nunca queda desalineado.
+        """
+        tokens = self._session_tokens_for(prompt)
+        pending = self.llm.prepare_inputs_for_generation(tokens, reset=True)
+        print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Sesión: {len(tokens) - len(pending)} tokens reutilizados, {len(pending)} por evaluar.{Color.RESET}")
+        # Si la evaluación falla, el prefijo guardado deja de ser fiable.
+        self._session_text, self._session_tokens = "", []
+        print(f"{Color.GREEN}[CtransformersProvider]{Color.RESET}    {Color.BLUE}Generating response...{Color.RESET}")
+        self.llm.eval(pending)
+        self._session_text = prompt
+        self._session_tokens = list(tokens)
+
+        max_new_tokens = self.llm.config.max_new_tokens
+        incomplete = b""
+        for _ in range(max_new_tokens):
+            token = self.llm.sample(
+                temperature=self.temperature,
+                top_p=self.top_p,
+                repetition_penalty=self.repeat_penalty,
+            )
+            # El token de fin no se evalúa: así el contexto sigue siendo un prefijo del próximo prompt.
+            if self.llm.is_eos_token(token):
+                break
+            incomplete += self.llm.detokenize([token], decode=False)
+            complete, incomplete = utf8_split_incomplete(incomplete)
+            if complete:
+                yield complete.decode(errors="ignore")
+            self.llm.eval([token])
+
+    def reset_session(self):
+        """
+        Olvida el prefijo guardado; el siguiente prompt se tokeniza completo. La caché KV
+        del modelo se recorta en esa llamada al primer token que no coincida.
+        """
+        if self._session_tokens:
+            print(f"{Color.BLUE}[CtransformersProvider] Sesión invalidada.{Color.RESET}")
+        self._session_text = ""
+        self._session_tokens = []
+        # El recorte de contexto de la conversación anterior tampoco vale para la siguiente.
+        if getattr(self, "prompt_builder", None) is not None:
+            self.prompt_builder.reset()
 
     def shutdown(self):
         print(f"{Color.BLUE}[CtransformersProvider] Releasing model from memory...{Color.RESET}")
+        self.reset_session()
         self.llm = None
         print(f"{Color.BLUE}[CtransformersProvider] Resources released.{Color.RESET}")
 
 
+class LlamaCppProvider(BaseLLMProvider):
+    """
+    Proveedor que ejecuta llama.cpp fuera del proceso de la interfaz.
 
+    Lanza `run.py --llama-server` (app/llama_server.py) con un puerto libre y una authkey
+    aleatoria, espera a que responda a un mensaje de salud y le envía las peticiones de
+    `create_chat_completion` en streaming. Si el proceso hijo muere, se vuelve a lanzar
+    y la petición se reintenta mientras no se haya entregado ningún fragmento.
 
+    llama.cpp aplica la plantilla de chat del modelo; aquí solo se recortan los mensajes
+    al presupuesto de contexto con `PromptBuilder.fit_messages`.
+    """
+    STARTUP_TIMEOUT = 180 # segundos; cargar un modelo grande puede tardar
+    MAX_RETRIES = 2
+    POLL_INTERVAL = 0.1
+    AUTHKEY_ENV = "MARTIN_LLM_SERVER_AUTHKEY"
 
-    
+    def __init__(self, model_path: str, hardware_config=None, startup_timeout: float | None = None, max_queue: int = 8):
+        super().__init__(model_identifier=os.path.basename(model_path))
+        self.model_path = str(Path(model_path).resolve())
+        self.hardware_config = hardware_config or self._load_hardware_config()
+        self.startup_timeout = startup_timeout or self.STARTUP_TIMEOUT
+        self.max_queue = max_queue
+        self.process = None
+        self.port = None
+        self.authkey = None
+        self.restarts = 0
+        self._log_file = None
+        self._idle_connections = []
+        self._pool_lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Model file not found at: {self.model_path}")
+
+        # n_ctx, hilos y lote con los que llama_server carga el modelo.
+        self.load_settings = resolve_load_settings(self.model_path, self.hardware_config)
+        self.prompt_builder = PromptBuilder.from_model(self.model_path, context_length=self.load_settings["context_length"])
+        self._start_server()
+
+    # --- Ciclo de vida del proceso servidor ---
+
+    @staticmethod
+    def _find_free_port() -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("localhost", 0))
+            return sock.getsockname()[1]
+
+    def _server_command(self) -> list:
+        if getattr(sys, 'frozen', False):
+            command = [sys.executable, "--llama-server"]
+        else:
+            run_script = Path(__file__).resolve().parent.parent / "run.py"
+            command = [sys.executable, str(run_script), "--llama-server"]
+        return command + [
+            "--model-path", self.model_path,
+            "--n-gpu-layers", str(self._get_gpu_layers()),
+            "--n-ctx", str(self.load_settings["context_length"]),
+            "--n-threads", str(self.load_settings["threads"]),
+            "--n-batch", str(self.load_settings["batch_size"]),
+            "--port", str(self.port),
+            "--max-queue", str(self.max_queue),
+        ]
+
+    def _start_server(self):
+        self.port = self._find_free_port()
+        self.authkey = secrets.token_hex(16)
+        command = self._server_command()
+        # La authkey viaja por el entorno para que no aparezca en la lista de procesos.
+        env = dict(os.environ, **{self.AUTHKEY_ENV: self.authkey})
+        creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0) if sys.platform == "win32" else 0
+
+        log_path = get_log_file_path()
+        self._log_file = open(log_path, "a", encoding="utf-8")
+        print(f"{Color.GREEN}[LlamaCppProvider]{Color.RESET} Lanzando llama_server en el puerto {self.port} (log: {log_path})")
+        with chdir_if_packaged(Path(sys.executable).parent):
+            self.process = subprocess.Popen(
+                command,
+                stdout=self._log_file,
+                stderr=subprocess.STDOUT,
+                env=env,
+                creationflags=creationflags,
+            )
+        self._wait_until_ready()
+        print(f"{Color.GREEN}[LlamaCppProvider]{Color.RESET} llama_server listo (pid {self.process.pid}).")
+
+    def _wait_until_ready(self):
+        """Espera a que el servidor acepte conexiones y responda al mensaje de salud."""
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self._stop_process()
+                raise RuntimeError(
+                    f"llama_server terminó durante el arranque (código {self.process.returncode}). "
+                    f"Consulta {get_log_file_path()}"
+                )
+            try:
+                conn = self._connect()
+                conn.send({"type": "health"})
+                if conn.poll(self.startup_timeout) and conn.recv().get("status") == "ok":
+                    self._release_connection(conn)
+                    return
+                conn.close()
+            except (OSError, EOFError):
+                time.sleep(0.25)
+        self._stop_process()
+        raise RuntimeError(f"llama_server no respondió en {self.startup_timeout} segundos.")
+
+    def _stop_process(self, graceful: bool = False):
+        with self._pool_lock:
+            connections, self._idle_connections = self._idle_connections, []
+        for conn in connections:
+            conn.close()
+
+        if self.process is not None and self.process.poll() is None:
+            if graceful:
+                try:
+                    with self._connect() as conn:
+                        conn.send('shutdown')
+                    self.process.wait(timeout=10)
+                except (OSError, EOFError, subprocess.TimeoutExpired):
+                    pass
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def _recover(self):
+        """Reconecta con el servidor o lo relanza si el proceso ha muerto o no responde."""
+        with self._restart_lock:
+            if self.process is not None and self.process.poll() is None:
+                try:
+                    conn = self._connect()
+                    conn.send({"type": "health"})
+                    if conn.poll(5) and conn.recv().get("status") == "ok":
+                        self._release_connection(conn)
+                        return
+                    conn.close()
+                except (OSError, EOFError):
+                    pass
+            print(f"{Color.YELLOW}[LlamaCppProvider] llama_server no disponible. Reiniciando...{Color.RESET}")
+            self._stop_process()
+            self.restarts += 1
+            self._start_server()
+
+    # --- Conexiones ---
+
+    def _connect(self):
+        return Client(("localhost", self.port), authkey=self.authkey.encode("utf-8"))
+
+    def _acquire_connection(self):
+        with self._pool_lock:
+            if self._idle_connections:
+                return self._idle_connections.pop()
+        return self._connect()
+
+    def _release_connection(self, conn):
+        with self._pool_lock:
+            self._idle_connections.append(conn)
+
+    # --- Inferencia ---
+
+    def _completion_params(self, messages: list, format: str | dict = None) -> dict:
+        params = {
+            "messages": [{"role": msg["role"], "content": msg["content"]} for msg in self.prompt_builder.fit_messages(messages)],
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "repeat_penalty": self.repeat_penalty,
+        }
+        # llama.cpp convierte el esquema en una gramática que restringe la generación.
+        if isinstance(format, dict):
+            params["response_format"] = {"type": "json_object", "schema": format}
+        elif format == "json":
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    def _stream_request(self, params: dict, cancel_event: threading.Event | None) -> Iterator[str]:
+        conn = self._acquire_connection()
+        request_id = secrets.token_hex(8)
+        finished = False
+        try:
+            conn.send({"type": "completion", "id": request_id, "params": params, "stream": True})
+            cancel_sent = False
+            while True:
+                if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                    conn.send({"type": "cancel", "id": request_id})
+                    cancel_sent = True
+                if not conn.poll(self.POLL_INTERVAL):
+                    if self.process.poll() is not None:
+                        raise EOFError("El proceso de llama_server ha terminado.")
+                    continue
+                msg = conn.recv()
+                if msg.get("id") != request_id:
+                    continue
+                if msg["type"] == "chunk":
+                    content = msg["data"]["choices"][0].get("delta", {}).get("content")
+                    if content and not cancel_sent:
+                        yield content
+                elif msg["type"] == "done":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise RuntimeError(f"llama_server: {msg.get('error')}")
+        finally:
+            if finished:
+                self._release_connection(conn)
+            else:
+                # Consumidor que abandona el generador o conexión rota: se cancela y se descarta.
+                with contextlib.suppress(OSError, ValueError):
+                    conn.send({"type": "cancel", "id": request_id})
+                conn.close()
+
+    def query_stream(self, messages: list, format: str | dict = None, cancel_event: threading.Event | None = None) -> Iterator[str]:
+        if self.process is None:
+            raise RuntimeError("llama_server no está en ejecución.")
+
+        print(f"{Color.GREEN}[LlamaCppProvider]{Color.RESET} -> {Color.YELLOW}query_stream(){Color.RESET}")
+        params = self._completion_params(messages, format=format)
+        attempts = 0
+        while True:
+            delivered = False
+            try:
+                for chunk in self._stream_request(params, cancel_event):
+                    delivered = True
+                    yield chunk
+                return
+            except (OSError, EOFError) as e:
+                # Sin fragmentos entregados la petición se puede repetir sin duplicar texto.
+                if delivered or attempts >= self.MAX_RETRIES:
+                    raise RuntimeError(f"Se perdió la conexión con llama_server: {e}")
+                attempts += 1
+                print(f"{Color.YELLOW}[LlamaCppProvider] Conexión perdida ({e}). Reintento {attempts}/{self.MAX_RETRIES}.{Color.RESET}")
+                self._recover()
+
+    def query(self, messages: list, format: str | dict = None) -> str:
+        print(f"{Color.GREEN}[LlamaCppProvider]{Color.RESET} -> {Color.YELLOW}query(){Color.RESET}")
+        try:
+            response = "".join(self.query_stream(messages, format=format))
+            print(f"{Color.GREEN}[LlamaCppProvider]{Color.RESET}    {Color.BLUE}Raw response received:{Color.RESET}\n---RESPONSE START---\n{response}\n---RESPONSE END---")
+            return response
+        except Exception as e:
+            print(f"{Color.RED}[LlamaCppProvider] Error during response generation: {e}{Color.RESET}")
+            return f"Error processing model request: {e}"
+
+    def reset_session(self):
+        self.prompt_builder.reset()
+
+    def get_server_stats(self) -> dict:
+        """Devuelve las métricas del servidor (peticiones, cola, conexiones...)."""
+        conn = self._acquire_connection()
+        try:
+            conn.send({"type": "stats"})
+            stats = conn.recv()["data"]
+        except Exception:
+            conn.close()
+            raise
+        self._release_connection(conn)
+        return stats
+
+    def shutdown(self):
+        print(f"{Color.BLUE}[LlamaCppProvider] Deteniendo llama_server...{Color.RESET}")
+        self._stop_process(graceful=True)
+        self.process = None
+        print(f"{Color.BLUE}[LlamaCppProvider] Resources released.{Color.RESET}")
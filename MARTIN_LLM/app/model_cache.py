@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# app/model_cache.py
+
+import os
+import json
+import threading
+from collections import OrderedDict
+
+# ANSI escape codes for colors
+class Color:
+    BLUE = '\033[94m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+
+class _PendingLoad:
+    """Carga en curso: los demás hilos que piden el mismo modelo esperan a su resultado."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.provider = None
+        self.error = None
+
+
+class ModelCache:
+    """
+    Caché LRU de proveedores ya cargados, compartida por todo el proceso.
+
+    La clave es la ruta real del GGUF, la configuración de hardware efectiva, la clase del
+    proveedor y sus argumentos, así que el mismo modelo con otra configuración se carga aparte.
+    Se conservan como máximo `max_models` modelos y, si se indica, no más de `max_bytes`
+    (tamaño de los archivos GGUF como aproximación de la memoria que ocupan). Al expulsar
+    un modelo se llama a su `shutdown()`.
+    """
+    def __init__(self, max_models: int = 2, max_bytes: int | None = None):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # clave -> (proveedor, tamaño en bytes)
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_path, hardware_config, provider_class, kwargs) -> tuple:
+        return (
+            os.path.realpath(model_path),
+            json.dumps(hardware_config or {}, sort_keys=True, default=str),
+            provider_class.__name__,
+            json.dumps(kwargs, sort_keys=True, default=str),
+        )
+
+    @staticmethod
+    def _resolve(provider_class, hardware_config):
+        """Aplica los valores por defecto: CtransformersProvider y la configuración guardada."""
+        from app.llm_providers import CtransformersProvider, load_hardware_config
+        return provider_class or CtransformersProvider, hardware_config or load_hardware_config()
+
+    def get(self, model_path, provider_class=None, hardware_config=None, **kwargs):
+        """
+        Devuelve el proveedor del modelo, cargándolo con `provider_class` si no está en caché.
+        Si otro hilo ya lo está cargando, espera a que termine en lugar de cargarlo dos veces.
+        """
+        provider_class, hardware_config = self._resolve(provider_class, hardware_config)
+        key = self.make_key(model_path, hardware_config, provider_class, kwargs)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                print(f"{Color.GREEN}[ModelCache]{Color.RESET} Modelo en caché: {os.path.basename(model_path)}")
+                return entry[0]
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = _PendingLoad()
+                self.misses += 1
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            with self._lock:
+                self.hits += 1
+            return pending.provider
+
+        try:
+            size = os.path.getsize(model_path)
+            # Se libera memoria antes de cargar, no después.
+            self._evict_for(size)
+            print(f"{Color.BLUE}[ModelCache] Cargando {os.path.basename(model_path)}...{Color.RESET}")
+            provider = provider_class(model_path=model_path, hardware_config=hardware_config, **kwargs)
+            with self._lock:
+                self._entries[key] = (provider, size)
+            pending.provider = provider
+            return provider
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.done.set()
+
+    def _evict_for(self, incoming_bytes: int):
+        """Expulsa los modelos menos usados hasta que quepa uno nuevo de `incoming_bytes`."""
+        evicted = []
+        with self._lock:
+            while self._entries and (
+                len(self._entries) >= self.max_models
+                or (self.max_bytes is not None and self.total_bytes + incoming_bytes > self.max_bytes)
+            ):
+                _, entry = self._entries.popitem(last=False)
+                evicted.append(entry[0])
+                self.evictions += 1
+        for provider in evicted:
+            print(f"{Color.YELLOW}[ModelCache] Expulsando {provider.model_identifier} de la caché.{Color.RESET}")
+            provider.shutdown()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, size in self._entries.values())
+
+    def contains(self, model_path, provider_class=None, hardware_config=None, **kwargs) -> bool:
+        provider_class, hardware_config = self._resolve(provider_class, hardware_config)
+        with self._lock:
+            return self.make_key(model_path, hardware_config, provider_class, kwargs) in self._entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "models": len(self._entries),
+                "bytes": self.total_bytes,
+            }
+
+    def clear(self):
+        """Libera todos los modelos (al cerrar la aplicación)."""
+        with self._lock:
+            providers = [provider for provider, _ in self._entries.values()]
+            self._entries.clear()
+        for provider in providers:
+            provider.shutdown()
+
+
+# Instancia global de la caché de modelos
+model_cache = ModelCache()
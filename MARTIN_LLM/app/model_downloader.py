@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# app/model_downloader.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# ANSI escape codes for colors
+class Color:
+    BLUE = '\033[94m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+
+class DownloadError(RuntimeError):
+    """La descarga no se pudo completar."""
+
+
+class ChecksumMismatchError(DownloadError):
+    """El archivo descargado no coincide con el SHA-256 esperado."""
+
+
+class DownloadCancelled(Exception):
+    """La descarga se canceló; el archivo parcial se conserva para reanudarla."""
+
+
+class ModelDownloader:
+    """
+    Descarga un archivo grande en trozos con peticiones HTTP Range en paralelo.
+
+    Los datos se escriben en `<destino>.part` y un diario `<destino>.part.json` registra los
+    trozos ya completos, así que una descarga interrumpida (o cancelada) se reanuda donde se
+    quedó. Al terminar se comprueba el SHA-256 (si se conoce) y el archivo se mueve a su
+    sitio con `os.replace`, de modo que el destino nunca queda a medio escribir.
+    Si el servidor no admite Range se descarga en un único flujo, sin reanudación.
+    """
+    CHUNK_SIZE = 16 * 1024 * 1024   # tamaño de cada petición Range
+    READ_SIZE = 1024 * 1024         # bloque de lectura de cada respuesta
+    MAX_WORKERS = 4
+    MAX_RETRIES = 5
+    RETRY_DELAY = 1.0
+    TIMEOUT = (10, 60)              # conexión, lectura
+
+    def __init__(self, url: str, dest_path, sha256: str | None = None, max_workers: int | None = None,
+                 chunk_size: int | None = None, cancel_event: threading.Event | None = None, progress_callback=None):
+        self.url = url
+        self.dest_path = Path(dest_path)
+        self.part_path = self.dest_path.with_name(self.dest_path.name + ".part")
+        self.journal_path = self.dest_path.with_name(self.dest_path.name + ".part.json")
+        self.sha256 = sha256.lower() if sha256 else None
+        self.max_workers = max_workers or self.MAX_WORKERS
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.cancel_event = cancel_event or threading.Event()
+        self.progress_callback = progress_callback
+        self.total_size = 0
+        self.downloaded = 0
+        self._journal = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Se activa cuando falla un trozo, para detener al resto sin tocar cancel_event.
+        self._abort = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    # --- Red ---
+
+    def _session(self) -> requests.Session:
+        """Una sesión por hilo: requests.Session no es segura entre hilos."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _probe(self) -> dict:
+        """Pide el primer byte para saber el tamaño total y si el servidor admite Range."""
+        with self._session().get(self.url, headers={"Range": "bytes=0-0"}, stream=True,
+                                 timeout=self.TIMEOUT, allow_redirects=True) as response:
+            response.raise_for_status()
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code == 206 and "/" in content_range and not content_range.endswith("/*"):
+                return {"size": int(content_range.rsplit("/", 1)[1]), "ranges": True, "validator": validator}
+            return {"size": int(response.headers.get("Content-Length", 0)), "ranges": False, "validator": validator}
+
+    # --- Diario de reanudación ---
+
+    def _load_journal(self, probe: dict) -> dict:
+        """Reutiliza el diario si describe la misma descarga; si no, empieza de cero."""
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+            if (journal.get("url") == self.url and journal.get("size") == probe["size"]
+                    and journal.get("validator") == probe["validator"]
+                    and journal.get("chunk_size") == self.chunk_size
+                    and self.part_path.exists() and self.part_path.stat().st_size == probe["size"]):
+                return journal
+        except (OSError, ValueError):
+            pass
+        with open(self.part_path, "wb") as f:
+            f.truncate(probe["size"])
+        journal = {"url": self.url, "size": probe["size"], "validator": probe["validator"],
+                   "chunk_size": self.chunk_size, "done": []}
+        self._write_journal(journal)
+        return journal
+
+    def _write_journal(self, journal: dict):
+        tmp_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(journal, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _mark_done(self, index: int):
+        with self._lock:
+            self._journal["done"].append(index)
+            self._write_journal(self._journal)
+
+    # --- Descarga ---
+
+    def _add_progress(self, n: int):
+        with self._lock:
+            self.downloaded += n
+            downloaded = self.downloaded
+        if self.progress_callback:
+            self.progress_callback(downloaded, self.total_size)
+
+    def _check_cancelled(self):
+        if self.cancel_event.is_set() or self._abort.is_set():
+            raise DownloadCancelled()
+
+    def _download_chunk(self, index: int, start: int, end: int):
+        """Descarga el rango [start, end] reintentando desde el último byte escrito."""
+        position = start
+        for attempt in range(self.MAX_RETRIES + 1):
+            self._check_cancelled()
+            try:
+                headers = {"Range": f"bytes={position}-{end}"}
+                with self._session().get(self.url, headers=headers, stream=True, timeout=self.TIMEOUT) as response:
+                    if response.status_code != 206:
+                        raise DownloadError(f"El servidor respondió {response.status_code} a una petición Range.")
+                    with open(self.part_path, "r+b") as f:
+                        f.seek(position)
+                        for data in response.iter_content(self.READ_SIZE):
+                            self._check_cancelled()
+                            data = data[:end + 1 - position]
+                            f.write(data)
+                            position += len(data)
+                            self._add_progress(len(data))
+                            if position > end:
+                                break
+                        if position > end:
+                            # Los datos deben estar en disco antes de que el diario marque el trozo.
+                            f.flush()
+                            os.fsync(f.fileno())
+                if position > end:
+                    self._mark_done(index)
+                    return
+                raise DownloadError(f"Respuesta incompleta en el trozo {index}.")
+            except (requests.RequestException, DownloadError) as e:
+                if attempt == self.MAX_RETRIES:
+                    raise DownloadError(f"Falló el trozo {index} tras {self.MAX_RETRIES} reintentos: {e}") from e
+                print(f"{Color.YELLOW}[ModelDownloader] Trozo {index}: {e}. Reintentando...{Color.RESET}")
+                time.sleep(self.RETRY_DELAY * (attempt + 1))
+
+    def _download_ranges(self, probe: dict):
+        self._journal = self._load_journal(probe)
+        done = set(self._journal["done"])
+        chunks = []
+        for index, start in enumerate(range(0, probe["size"], self.chunk_size)):
+            end = min(start + self.chunk_size, probe["size"]) - 1
+            if index in done:
+                self.downloaded += end - start + 1
+            else:
+                chunks.append((index, start, end))
+        if done:
+            print(f"{Color.BLUE}[ModelDownloader] Reanudando: {len(done)} trozos ya descargados, {len(chunks)} pendientes.{Color.RESET}")
+        if self.progress_callback:
+            self.progress_callback(self.downloaded, self.total_size)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._download_chunk, *chunk) for chunk in chunks]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Los demás trozos se detienen en su siguiente bloque.
+                self._abort.set()
+                raise
+
+    def _download_stream(self):
+        """Descarga sin Range: un único flujo, sin posibilidad de reanudar."""
+        with self._session().get(self.url, stream=True, timeout=self.TIMEOUT) as response:
+            response.raise_for_status()
+            with open(self.part_path, "wb") as f:
+                for data in response.iter_content(self.READ_SIZE):
+                    self._check_cancelled()
+                    f.write(data)
+                    self._add_progress(len(data))
+
+    def _verify(self):
+        if not self.sha256:
+            print(f"{Color.YELLOW}[ModelDownloader] Sin SHA-256 en el catálogo: no se verifica {self.dest_path.name}.{Color.RESET}")
+            return
+        digest = hashlib.sha256()
+        with open(self.part_path, "rb") as f:
+            for block in iter(lambda: f.read(self.READ_SIZE), b""):
+                self._check_cancelled()
+                digest.update(block)
+        if digest.hexdigest() != self.sha256:
+            self._discard_partial()
+            raise ChecksumMismatchError(
+                f"El SHA-256 de {self.dest_path.name} no coincide (esperado {self.sha256}, obtenido {digest.hexdigest()})."
+            )
+
+    def _discard_partial(self):
+        for path in (self.part_path, self.journal_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def download(self) -> Path:
+        """
+        Ejecuta la descarga completa y devuelve la ruta final. Lanza DownloadCancelled si se
+        cancela (el archivo parcial se conserva), ChecksumMismatchError si la verificación falla
+        y DownloadError ante cualquier otro error.
+        """
+        self.dest_path.parent.mkdir(parents=True, exist_ok=True)
+        probe = self._probe()
+        self.total_size = probe["size"]
+        print(f"{Color.BLUE}[ModelDownloader] Descargando {self.dest_path.name} ({self.total_size / (1024**3):.2f} GB, "
+              f"{'Range en paralelo' if probe['ranges'] else 'flujo único'}).{Color.RESET}")
+
+        if probe["ranges"] and self.total_size > 0:
+            self._download_ranges(probe)
+        else:
+            self._download_stream()
+
+        self._verify()
+        with open(self.part_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(self.part_path, self.dest_path)
+        try:
+            self.journal_path.unlink()
+        except FileNotFoundError:
+            pass
+        print(f"{Color.GREEN}[ModelDownloader]{Color.RESET} {self.dest_path.name} descargado.")
+        return self.dest_path
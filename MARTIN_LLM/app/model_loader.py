@@ -41,11 +41,26 @@ def is_port_in_use(port: int = 11434) -> tuple[bool, str]:
    finally:
        sock.close()
        print("finalizando is_port_in_use...")
-def trim_context(context: list, max_length: int = 1000) -> list:
-    """Limita el tamano del contexto para mejorar el rendimiento"""
-    if context and len(context) > max_length:
-        return context[-max_length:]
-    return context
+def trim_context(context: list, max_length: int = 1000, count_tokens=None) -> list:
+    """
+    Limita el contexto a los elementos más recientes que caben en `max_length` tokens.
+    Los elementos pueden ser cadenas o mensajes con clave 'content'. Sin `count_tokens`
+    se usa una estimación del número de tokens.
+    """
+    if not context:
+        return context
+    from app.prompt_builder import estimate_tokens
+    count_tokens = count_tokens or estimate_tokens
+    total = 0
+    start = len(context)
+    for item in reversed(context):
+        text = item.get("content", "") if isinstance(item, dict) else str(item)
+        total += count_tokens(text)
+        # El elemento más reciente se conserva siempre.
+        if total > max_length and start < len(context):
+            break
+        start -= 1
+    return context[start:]
 def check_system_resources():
     """Verifica recursos del sistema"""
     try:
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# app/model_tuning.py
+
+import os
+import re
+import json
+import time
+import platform
+import threading
+from pathlib import Path
+
+from app.gguf_metadata import gguf_index, get_context_length
+
+# Importar la utilidad de rutas desde la raíz del proyecto.
+try:
+    from paths import get_app_data_dir
+except ImportError:
+    def get_app_data_dir():
+        data_dir = Path("data")
+        data_dir.mkdir(exist_ok=True)
+        return data_dir
+
+# ANSI escape codes for colors
+class Color:
+    BLUE = '\033[94m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+
+# Contexto máximo que se reserva por defecto: la caché KV crece con él aunque no se use.
+MAX_CONTEXT_LENGTH = 4096
+FALLBACK_CONTEXT_LENGTH = 2048
+DEFAULT_CPU_BATCH_SIZE = 32
+DEFAULT_GPU_BATCH_SIZE = 512
+
+# Arquitecturas GGUF cuyo nombre no coincide con el model_type de ctransformers.
+ARCHITECTURE_MODEL_TYPES = {
+    "gptneox": "gpt_neox",
+    "phi2": "phi",
+    "gemma2": "gemma",
+}
+
+# Reglas para archivos sin metadatos legibles, en orden: la primera que coincida gana.
+# Los nombres cortos ('yi', 'phi') solo cuentan como palabra completa del nombre del archivo.
+_FILENAME_MODEL_TYPES = [
+    (r"llama-?3", "llama"),
+    (r"mistral|mixtral", "mistral"),
+    (r"phi-?3", "phi3"),
+    (r"gemma", "gemma"),
+    (r"command-r", "command-r"),
+    (r"(?<![a-z])phi(?![a-z])", "phi"),
+    (r"(?<![a-z])yi(?![a-z])|llava", "yi"),
+]
+
+
+def _model_type_from_filename(model_path) -> str:
+    name = Path(str(model_path)).name.lower()
+    for pattern, model_type in _FILENAME_MODEL_TYPES:
+        if re.search(pattern, name):
+            return model_type
+    # Llama 2 y demás modelos de tipo llama
+    return "llama"
+
+
+def select_model_type(model_path, metadata: dict | None = None) -> str:
+    """
+    Elige el model_type de ctransformers a partir de la arquitectura declarada en el GGUF.
+    El nombre del archivo solo se usa si el modelo no tiene metadatos legibles.
+    """
+    architecture = str((metadata or {}).get("general.architecture", "")).lower()
+    if not architecture:
+        return _model_type_from_filename(model_path)
+    # Los Mistral se publican con arquitectura 'llama'; solo el nombre los distingue.
+    name = str(metadata.get("general.name", "")).lower()
+    if architecture == "llama" and ("mistral" in name or "mixtral" in name):
+        return "mistral"
+    return ARCHITECTURE_MODEL_TYPES.get(architecture, architecture)
+
+
+def default_threads(hardware_config: dict) -> int:
+    """Hilos de la configuración de hardware o, si no hay, los núcleos físicos."""
+    threads = (hardware_config or {}).get("n_threads")
+    if threads:
+        return int(threads)
+    try:
+        import psutil
+        threads = psutil.cpu_count(logical=False)
+    except ImportError:
+        threads = None
+    return threads or os.cpu_count() or 1
+
+
+def machine_key(hardware_config: dict) -> str:
+    """Identifica la máquina y la configuración de hardware para las que vale un ajuste."""
+    hardware_config = hardware_config or {}
+    return "|".join(str(part) for part in (
+        platform.node(),
+        platform.machine(),
+        os.cpu_count(),
+        hardware_config.get("type", "default"),
+        hardware_config.get("n_gpu_layers", 0),
+    ))
+
+
+class TuningStore:
+    """
+    Ajustes medidos (hilos y tamaño de lote) por máquina y por modelo.
+
+    Se guardan en un JSON del directorio de datos de la aplicación. Un modelo se identifica
+    por su ruta real y su tamaño, así que si el archivo se sustituye se vuelve a medir.
+    """
+    STORE_FILE = "model_tuning.json"
+
+    def __init__(self, store_path=None):
+        self.store_path = store_path
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _path(self) -> Path:
+        if self.store_path is None:
+            self.store_path = get_app_data_dir() / self.STORE_FILE
+        return Path(self.store_path)
+
+    def _load(self) -> dict:
+        if self._data is None:
+            try:
+                with open(self._path(), "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    @staticmethod
+    def model_key(model_path) -> str:
+        real_path = os.path.realpath(model_path)
+        return f"{real_path}|{os.path.getsize(real_path)}"
+
+    def get(self, model_path, hardware_config: dict) -> dict | None:
+        with self._lock:
+            return self._load().get(machine_key(hardware_config), {}).get(self.model_key(model_path))
+
+    def put(self, model_path, hardware_config: dict, result: dict):
+        with self._lock:
+            self._load().setdefault(machine_key(hardware_config), {})[self.model_key(model_path)] = result
+            path = self._path()
+            tmp_path = path.with_name(path.name + ".tmp")
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._data, f, indent=2)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"{Color.YELLOW}[TuningStore] No se pudo guardar el ajuste: {e}{Color.RESET}")
+
+
+def resolve_load_settings(model_path, hardware_config: dict, metadata: dict | None = None) -> dict:
+    """
+    Parámetros de carga para ctransformers: model_type, gpu_layers, threads, batch_size y
+    context_length, deducidos de los metadatos GGUF y de hardware_config.json. Si el modelo ya
+    se midió en esta máquina, los hilos y el lote medidos sustituyen a los valores por defecto.
+    """
+    hardware_config = hardware_config or {}
+    if metadata is None:
+        try:
+            metadata = gguf_index.metadata(model_path)
+        except Exception as e:
+            print(f"{Color.YELLOW}[model_tuning] Sin metadatos GGUF ({e}). Se deduce el tipo por el nombre.{Color.RESET}")
+            metadata = {}
+
+    gpu_layers = hardware_config.get("n_gpu_layers", 0)
+    max_context = hardware_config.get("max_context_length", MAX_CONTEXT_LENGTH)
+    settings = {
+        "model_type": select_model_type(model_path, metadata),
+        "gpu_layers": gpu_layers,
+        "threads": default_threads(hardware_config),
+        "batch_size": DEFAULT_GPU_BATCH_SIZE if gpu_layers else DEFAULT_CPU_BATCH_SIZE,
+        "context_length": min(get_context_length(metadata) or FALLBACK_CONTEXT_LENGTH, max_context),
+    }
+    tuned = tuning_store.get(model_path, hardware_config)
+    if tuned:
+        settings["threads"] = tuned["threads"]
+        settings["batch_size"] = tuned["batch_size"]
+    return settings
+
+
+# --- Micro-benchmark ---
+
+BENCHMARK_TEXT = (
+    "El rápido zorro marrón salta sobre el perro perezoso. The quick brown fox jumps over the lazy dog. "
+    "Martin LLM mide aquí la velocidad de evaluación del prompt y de generación de tokens. "
+) * 4
+# Prefijo que se evalúa antes de medir la generación.
+BENCHMARK_PROMPT_TOKENS = 32
+BENCHMARK_GENERATED_TOKENS = 8
+BATCH_SIZE_CANDIDATES = (8, 32, 128, 512)
+
+
+def thread_candidates(hardware_config: dict) -> list:
+    """Hilos a probar: la mitad y el total de los núcleos físicos y los núcleos lógicos."""
+    physical = default_threads({})
+    candidates = {max(1, physical // 2), physical, os.cpu_count() or physical, default_threads(hardware_config)}
+    return sorted(candidates)
+
+
+def _clear_context(llm):
+    # Un token que nunca coincide hace que ctransformers descarte todo el contexto evaluado.
+    llm.prepare_inputs_for_generation([-1], reset=True)
+
+
+def _benchmark_tokens(llm, count: int) -> list:
+    """Tokens de BENCHMARK_TEXT repetidos hasta tener `count`."""
+    base = llm.tokenize(BENCHMARK_TEXT)
+    if not base:
+        return []
+    return (base * (count // len(base) + 1))[:count]
+
+
+def benchmark_llm(llm, threads_options, batch_options, cancel_event: threading.Event | None = None) -> dict | None:
+    """
+    Mide tokens/s de evaluación del prompt (para elegir el lote) y de generación (para elegir
+    los hilos) sobre un modelo ya cargado. Devuelve el mejor ajuste, o None si se cancela.
+
+    El prompt de la medición es tan largo como el lote mayor (o lo que permita el contexto);
+    los lotes que no caben en él se descartan, porque harían exactamente el mismo trabajo.
+    """
+    prompt_length = max(batch_options)
+    context_length = getattr(llm, "context_length", None)
+    if context_length:
+        prompt_length = min(prompt_length, context_length - BENCHMARK_GENERATED_TOKENS - 1)
+    tokens = _benchmark_tokens(llm, max(prompt_length, 1))
+    batch_options = [size for size in batch_options if size <= len(tokens)] or [min(batch_options)]
+    default = max(threads_options)
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    best_batch, prompt_tps = None, 0.0
+    for batch_size in batch_options:
+        if cancelled():
+            return None
+        _clear_context(llm)
+        start = time.perf_counter()
+        llm.eval(tokens, batch_size=batch_size, threads=default)
+        tps = len(tokens) / max(time.perf_counter() - start, 1e-9)
+        if tps > prompt_tps:
+            best_batch, prompt_tps = batch_size, tps
+
+    best_threads, generation_tps = None, 0.0
+    for threads in threads_options:
+        if cancelled():
+            return None
+        _clear_context(llm)
+        llm.eval(tokens[:BENCHMARK_PROMPT_TOKENS], batch_size=best_batch, threads=threads)
+        start = time.perf_counter()
+        for _ in range(BENCHMARK_GENERATED_TOKENS):
+            token = llm.sample()
+            llm.eval([token], threads=threads)
+        tps = BENCHMARK_GENERATED_TOKENS / max(time.perf_counter() - start, 1e-9)
+        if tps > generation_tps:
+            best_threads, generation_tps = threads, tps
+
+    _clear_context(llm)
+    return {
+        "threads": best_threads,
+        "batch_size": best_batch,
+        "prompt_tps": round(prompt_tps, 2),
+        "generation_tps": round(generation_tps, 2),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# Instancia global del almacén de ajustes
+tuning_store = TuningStore()
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# app/prompt_builder.py
+
+from pathlib import Path
+
+from app.gguf_metadata import gguf_index, get_context_length
+
+try:
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+except ImportError:
+    ImmutableSandboxedEnvironment = None
+
+# ANSI escape codes for colors
+class Color:
+    BLUE = '\033[94m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación conservadora del número de tokens cuando no hay tokenizador disponible."""
+    return len(text) // 3 + 1
+
+
+def detect_template_family(model_path="", metadata: dict | None = None) -> str:
+    """
+    Deduce la familia de plantilla de chat a partir de los metadatos GGUF y el nombre del archivo.
+    Devuelve 'plain' (formato "rol: contenido") si no reconoce el modelo.
+    """
+    metadata = metadata or {}
+    name = f"{metadata.get('general.name', '')} {Path(str(model_path)).name}".lower()
+    architecture = str(metadata.get("general.architecture", "")).lower()
+
+    if "llama-3" in name or "llama3" in name:
+        return "llama3"
+    if "mistral" in name or "mixtral" in name:
+        return "mistral"
+    if "phi-3" in name or "phi3" in name or architecture == "phi3":
+        return "phi3"
+    if "gemma" in name or architecture.startswith("gemma"):
+        return "gemma"
+    if any(tag in name for tag in ("qwen", "hermes", "chatml", "yi-")) or architecture.startswith("qwen"):
+        return "chatml"
+    if "llama-2" in name or "llama2" in name:
+        return "llama2"
+    return "plain"
+
+
+def _fold_system_messages(messages: list) -> list:
+    """Para plantillas sin rol de sistema: une cada mensaje de sistema al siguiente mensaje de usuario."""
+    folded = []
+    pending = []
+    for msg in messages:
+        if msg["role"] == "system":
+            pending.append(msg["content"])
+            continue
+        if pending and msg["role"] == "user":
+            msg = {"role": "user", "content": "\n\n".join(pending + [msg["content"]])}
+            pending = []
+        elif pending:
+            folded.append({"role": "user", "content": "\n\n".join(pending)})
+            pending = []
+        folded.append(msg)
+    if pending:
+        folded.append({"role": "user", "content": "\n\n".join(pending)})
+    return folded
+
+
+def _render_plain(messages, add_generation_prompt):
+    return "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+
+
+def _render_llama3(messages, add_generation_prompt):
+    prompt = "".join(
+        f"<|start_header_id|>{msg['role']}<|end_header_id|>\n\n{msg['content']}<|eot_id|>" for msg in messages
+    )
+    if add_generation_prompt:
+        prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
+    return prompt
+
+
+def _render_inst(messages, add_generation_prompt, system_block):
+    """Formato [INST] de Llama 2 / Mistral. El BOS lo añade el tokenizador."""
+    prompt = ""
+    pending_system = None
+    for msg in messages:
+        if msg["role"] == "system":
+            pending_system = msg["content"] if pending_system is None else f"{pending_system}\n\n{msg['content']}"
+        elif msg["role"] == "user":
+            content = msg["content"]
+            if pending_system is not None:
+                content = system_block(pending_system) + content
+                pending_system = None
+            prompt += f"[INST] {content} [/INST]"
+        else:
+            prompt += f" {msg['content']}</s>"
+    if pending_system is not None:
+        prompt += f"[INST] {system_block(pending_system)}[/INST]"
+    return prompt
+
+
+def _render_llama2(messages, add_generation_prompt):
+    return _render_inst(messages, add_generation_prompt, lambda system: f"<<SYS>>\n{system}\n<</SYS>>\n\n")
+
+
+def _render_mistral(messages, add_generation_prompt):
+    return _render_inst(messages, add_generation_prompt, lambda system: f"{system}\n\n")
+
+
+def _render_phi3(messages, add_generation_prompt):
+    prompt = "".join(f"<|{msg['role']}|>\n{msg['content']}<|end|>\n" for msg in messages)
+    if add_generation_prompt:
+        prompt += "<|assistant|>\n"
+    return prompt
+
+
+def _render_gemma(messages, add_generation_prompt):
+    prompt = ""
+    for msg in _fold_system_messages(messages):
+        role = "model" if msg["role"] == "assistant" else "user"
+        prompt += f"<start_of_turn>{role}\n{msg['content']}<end_of_turn>\n"
+    if add_generation_prompt:
+        prompt += "<start_of_turn>model\n"
+    return prompt
+
+
+def _render_chatml(messages, add_generation_prompt):
+    prompt = "".join(f"<|im_start|>{msg['role']}\n{msg['content']}<|im_end|>\n" for msg in messages)
+    if add_generation_prompt:
+        prompt += "<|im_start|>assistant\n"
+    return prompt
+
+
+TEMPLATE_RENDERERS = {
+    "plain": _render_plain,
+    "llama3": _render_llama3,
+    "llama2": _render_llama2,
+    "mistral": _render_mistral,
+    "phi3": _render_phi3,
+    "gemma": _render_gemma,
+    "chatml": _render_chatml,
+}
+
+
+class PromptBuilder:
+    """
+    Convierte una lista de mensajes en el prompt de texto del modelo.
+
+    Usa la plantilla de chat nativa del GGUF ('tokenizer.chat_template') si existe y, si no,
+    la plantilla de la familia del modelo. Antes de renderizar ajusta los mensajes a un
+    presupuesto de tokens: conserva los mensajes de sistema iniciales y el último mensaje,
+    y sustituye los turnos más antiguos por una nota breve.
+
+    El recorte tiene histéresis: cuando hay que recortar se baja hasta `LOW_WATERMARK` del
+    presupuesto y los turnos descartados siguen descartados en las llamadas siguientes, de
+    modo que el prefijo del prompt no cambia en cada turno (lo aprovecha el modo sesión).
+    """
+    MESSAGE_OVERHEAD = 8 # tokens aproximados de las marcas de rol de cada mensaje
+    LOW_WATERMARK = 0.75
+    SUMMARY_ITEMS = 5
+    SUMMARY_ITEM_CHARS = 80
+    SUMMARY_BUDGET_RATIO = 0.15
+    CACHE_SIZE = 4096
+
+    def __init__(self, family: str = "plain", chat_template: str | None = None, bos_token: str = "",
+                 eos_token: str = "", count_tokens=None, context_length: int = 2048,
+                 max_new_tokens: int = 256, budget: int | None = None):
+        if family not in TEMPLATE_RENDERERS:
+            raise ValueError(f"Familia de plantilla desconocida: {family}")
+        self.family = family
+        self.bos_token = bos_token or ""
+        self.eos_token = eos_token or ""
+        self._count_tokens = count_tokens or estimate_tokens
+        self.context_length = context_length
+        self.max_new_tokens = max_new_tokens
+        self.budget = budget or max(context_length - max_new_tokens, 1)
+        self._token_cache = {}
+        self._dropped = 0
+        self._anchor = None # primer mensaje de la conversación a la que se refiere _dropped
+        self._template = None
+        if chat_template and ImmutableSandboxedEnvironment is not None:
+            try:
+                env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+                env.globals["raise_exception"] = self._raise_template_error
+                self._template = env.from_string(chat_template)
+            except Exception as e:
+                print(f"{Color.YELLOW}[PromptBuilder] Plantilla nativa no válida ({e}). Usando '{family}'.{Color.RESET}")
+
+    @classmethod
+    def from_model(cls, model_path, metadata: dict | None = None, **kwargs) -> "PromptBuilder":
+        """Crea el constructor de prompts a partir de los metadatos GGUF del modelo."""
+        if metadata is None:
+            try:
+                metadata = gguf_index.metadata(model_path)
+            except Exception as e:
+                print(f"{Color.YELLOW}[PromptBuilder] No se pudieron leer los metadatos GGUF: {e}{Color.RESET}")
+                metadata = {}
+        kwargs.setdefault("context_length", get_context_length(metadata) or 2048)
+        builder = cls(
+            family=detect_template_family(model_path, metadata),
+            chat_template=metadata.get("tokenizer.chat_template"),
+            bos_token=metadata.get("tokenizer.ggml.bos_token", ""),
+            eos_token=metadata.get("tokenizer.ggml.eos_token", ""),
+            **kwargs,
+        )
+        source = "nativa (GGUF)" if builder.has_native_template else builder.family
+        print(f"{Color.GREEN}[PromptBuilder]{Color.RESET} Plantilla: {source}, presupuesto: {builder.budget} tokens.")
+        return builder
+
+    @property
+    def has_native_template(self) -> bool:
+        return self._template is not None
+
+    @staticmethod
+    def _raise_template_error(message):
+        raise ValueError(message)
+
+    def reset(self):
+        """Olvida el estado del recorte (nueva conversación)."""
+        self._dropped = 0
+        self._anchor = None
+
+    def count_tokens(self, text: str) -> int:
+        count = self._token_cache.get(text)
+        if count is None:
+            if len(self._token_cache) >= self.CACHE_SIZE:
+                self._token_cache.clear()
+            count = self._count_tokens(text)
+            self._token_cache[text] = count
+        return count
+
+    def _message_tokens(self, msg) -> int:
+        return self.count_tokens(msg["content"]) + self.MESSAGE_OVERHEAD
+
+    def render(self, messages: list, add_generation_prompt: bool = True) -> str:
+        """Renderiza los mensajes con la plantilla nativa o con la de la familia."""
+        messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+        if self._template is not None:
+            try:
+                prompt = self._template.render(
+                    messages=messages,
+                    add_generation_prompt=add_generation_prompt,
+                    bos_token=self.bos_token,
+                    eos_token=self.eos_token,
+                )
+                # El tokenizador ya añade el BOS; evitar duplicarlo.
+                if self.bos_token and prompt.startswith(self.bos_token):
+                    prompt = prompt[len(self.bos_token):]
+                return prompt
+            except Exception as e:
+                print(f"{Color.YELLOW}[PromptBuilder] La plantilla nativa falló ({e}). Usando '{self.family}'.{Color.RESET}")
+        return TEMPLATE_RENDERERS[self.family](messages, add_generation_prompt)
+
+    def _summary_note(self, dropped: list) -> dict | None:
+        """
+        Nota que sustituye a los mensajes omitidos. Se acorta (menos temas, o solo el número
+        de mensajes) para no ocupar más de `SUMMARY_BUDGET_RATIO` del presupuesto.
+        """
+        limit = self.budget * self.SUMMARY_BUDGET_RATIO
+        questions = [msg["content"] for msg in dropped if msg["role"] == "user"][-self.SUMMARY_ITEMS:]
+        shortened = [q if len(q) <= self.SUMMARY_ITEM_CHARS else q[:self.SUMMARY_ITEM_CHARS] + "…" for q in questions]
+        header = f"[Se omitieron {len(dropped)} mensajes antiguos para no superar el contexto del modelo."
+        for keep in range(len(shortened), -1, -1):
+            content = header
+            if keep:
+                content += " Temas tratados: " + "; ".join(f"«{q}»" for q in shortened[-keep:])
+            note = {"role": "system", "content": content + "]"}
+            if self._message_tokens(note) <= limit:
+                return note
+        return None
+
+    def fit_messages(self, messages: list) -> list:
+        """Devuelve los mensajes que caben en el presupuesto de tokens."""
+        head = []
+        for msg in messages:
+            if msg["role"] != "system":
+                break
+            head.append(msg)
+        body = messages[len(head):]
+        if not body:
+            return list(messages)
+
+        # El recorte anterior solo vale para la misma conversación y si sigue cabiendo en ella.
+        anchor = (body[0]["role"], body[0]["content"])
+        if anchor != self._anchor or self._dropped >= len(body):
+            self._dropped = 0
+        self._anchor = anchor
+        head_cost = sum(self._message_tokens(msg) for msg in head)
+        costs = [self._message_tokens(msg) for msg in body]
+
+        def total(dropped):
+            cost = head_cost + sum(costs[dropped:])
+            note = self._summary_note(body[:dropped]) if dropped else None
+            if note is not None:
+                cost += self._message_tokens(note)
+            return cost
+
+        # Si la conversación completa cabe, no se omite nada.
+        dropped = self._dropped if self._dropped and total(0) > self.budget else 0
+        if total(dropped) > self.budget:
+            target = self.budget * self.LOW_WATERMARK
+            while dropped < len(body) - 1 and total(dropped) > target:
+                dropped += 1
+            # No empezar el historial con una respuesta huérfana del asistente.
+            while dropped < len(body) - 1 and body[dropped]["role"] == "assistant":
+                dropped += 1
+            print(f"{Color.YELLOW}[PromptBuilder] Contexto recortado: {dropped} mensajes omitidos.{Color.RESET}")
+        self._dropped = dropped
+
+        fitted = list(head)
+        note = self._summary_note(body[:dropped]) if dropped else None
+        if note is not None:
+            fitted.append(note)
+        fitted.extend(body[dropped:])
+
+        overflow = total(dropped) - self.budget
+        if overflow > 0:
+            fitted[-1] = self._truncate(fitted[-1], overflow)
+        return fitted
+
+    def _truncate(self, msg: dict, overflow: int) -> dict:
+        """Recorta el contenido de un mensaje que por sí solo no cabe en el presupuesto."""
+        content = msg["content"]
+        tokens = self.count_tokens(content)
+        keep = max(0, len(content) * (tokens - overflow) // max(tokens, 1))
+        print(f"{Color.YELLOW}[PromptBuilder] El último mensaje supera el presupuesto; se recorta a {keep} caracteres.{Color.RESET}")
+        return {"role": msg["role"], "content": content[:keep] + "…[truncado]"}
+
+    def build(self, messages: list, add_generation_prompt: bool = True) -> str:
+        """Ajusta los mensajes al presupuesto y los renderiza."""
+        return self.render(self.fit_messages(messages), add_generation_prompt=add_generation_prompt)
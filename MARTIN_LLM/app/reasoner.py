@@ -1,32 +1,39 @@
 # -*- coding: utf-8 -*-
 # app/reasoner.py
 
-import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from app.llm_providers import BaseLLMProvider
 from app.tools import tool_registry
+from app.json_output import PLAN_SCHEMA, extract_json
 
 REASONER_SYSTEM_PROMPT_TEMPLATE = """
 # Core Persona
 {custom_prompt}
 
 # Your Mission
-You are a master planner. Your role is to break down a complex user objective into a series of simple, sequential steps.
+You are a master planner. Your role is to break down a complex user objective into a small graph of simple steps.
 Each step must be a clear, self-contained instruction that can be executed by an agent with a specific set of tools.
 
 # Available Tools for the Executor Agent
 {tools}
 
-Your response MUST be a JSON object containing a single key "plan", which is a list of strings.
-Each string in the list is a single step or task for the executor agent.
+Your response MUST be a JSON object containing a single key "plan", which is a list of steps.
+Each step is an object with:
+- "id": a unique integer.
+- "task": a single instruction for the executor agent.
+- "depends_on": the list of ids of the steps whose results this step needs. Use an empty list for steps that can start right away.
+Steps that do not need each other's results MUST NOT depend on each other: independent steps run in parallel.
+Each step only receives the results of the steps listed in its "depends_on".
 
 User Objective: "Investiga en la web qué es la API de Llama.cpp, busca un ejemplo de uso en Python y explícamelo."
 
 Example of your output:
 {{
     "plan": [
-        "Use the web_search tool to find a good explanation of what the Llama.cpp API is. A good starting point could be its official GitHub repository or documentation.",
-        "Use the web_search tool again on a relevant page to find a code example of how to use the Llama.cpp Python bindings to get a chat completion.",
-        "Based on the information gathered from the previous steps, formulate a clear and concise explanation of the API and the code example for the user."
+        {{"id": 1, "task": "Use the web_search tool to find a good explanation of what the Llama.cpp API is. A good starting point could be its official GitHub repository or documentation.", "depends_on": []}},
+        {{"id": 2, "task": "Use the web_search tool to find a code example of how to use the Llama.cpp Python bindings to get a chat completion.", "depends_on": []}},
+        {{"id": 3, "task": "Based on the information gathered in the previous steps, formulate a clear and concise explanation of the API and the code example for the user.", "depends_on": [1, 2]}}
     ]
 }}
 
@@ -50,22 +57,152 @@ class Reasoner:
             tools=tool_registry.get_tool_descriptions()
         )
 
-    def generate_plan(self, user_objective: str) -> list[str] | None:
+    def generate_plan_steps(self, user_objective: str) -> list[dict] | None:
         """
-        Llama al LLM para generar un plan y lo devuelve como una lista de pasos.
+        Llama al LLM para generar un plan y lo devuelve como una lista de pasos
+        {"id", "task", "depends_on"} (ver `normalize_plan`).
         """
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": f"User Objective: \"{user_objective}\""}
         ]
         
-        try:
-            response_text = self.provider.query(messages, format="json")
-            response_data = json.loads(response_text)
-            plan = response_data.get("plan")
-            if isinstance(plan, list):
-                return plan
+        response_text = self.provider.query(messages, format=PLAN_SCHEMA)
+        response_data = extract_json(response_text, PLAN_SCHEMA)
+        if response_data is None:
+            print(f"[Reasoner] Error al generar o parsear el plan: la respuesta no contiene JSON: {response_text}")
             return None
-        except (json.JSONDecodeError, TypeError, AttributeError) as e:
-            print(f"[Reasoner] Error al generar o parsear el plan: {e}")
-            return None
\ No newline at end of file
+        return normalize_plan(response_data.get("plan"))
+
+    def generate_plan(self, user_objective: str) -> list[str] | None:
+        """
+        Llama al LLM para generar un plan y lo devuelve como una lista de pasos.
+        """
+        steps = self.generate_plan_steps(user_objective)
+        return [step["task"] for step in steps] if steps else None
+
+
+def normalize_plan(raw_plan) -> list[dict] | None:
+    """
+    Convierte el plan devuelto por el LLM en una lista de pasos {"id", "task", "depends_on"}.
+
+    Acepta también el formato antiguo (lista de cadenas): cada paso depende del anterior,
+    como cuando se ejecutaban en secuencia. Se descartan las dependencias a pasos que no
+    existen; si quedan ciclos, el plan se ejecuta en secuencia en el orden dado.
+    """
+    if not isinstance(raw_plan, list) or not raw_plan:
+        return None
+    steps = []
+    for position, item in enumerate(raw_plan):
+        if isinstance(item, str):
+            step_id, task = position + 1, item
+            depends_on = [steps[-1]["id"]] if steps else []
+        elif isinstance(item, dict) and isinstance(item.get("task"), str):
+            step_id, task = _as_step_id(item.get("id", position + 1)), item["task"]
+            depends_on = item.get("depends_on") or []
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            depends_on = [_as_step_id(dep) for dep in depends_on]
+        else:
+            return None
+        steps.append({"id": step_id, "task": task, "depends_on": depends_on})
+
+    # Los ids deben ser únicos; si no lo son, se renumeran por posición.
+    if len({step["id"] for step in steps}) != len(steps):
+        print("[Reasoner] Ids de pasos repetidos; se renumeran por posición.")
+        ids = {}
+        for position, step in enumerate(steps):
+            ids.setdefault(step["id"], position + 1)
+            step["id"] = position + 1
+        for step in steps:
+            step["depends_on"] = [ids[dep] for dep in step["depends_on"] if dep in ids]
+
+    known = {step["id"] for step in steps}
+    for step in steps:
+        step["depends_on"] = [dep for dep in dict.fromkeys(step["depends_on"]) if dep in known and dep != step["id"]]
+
+    if _has_cycle(steps):
+        print("[Reasoner] El plan tiene dependencias circulares; se ejecutará en secuencia.")
+        for previous, step in zip([None] + steps, steps):
+            step["depends_on"] = [previous["id"]] if previous else []
+    return steps
+
+
+def _as_step_id(value):
+    """Los modelos mezclan 2 y "2": los ids numéricos se tratan como enteros."""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return value
+    text = str(value).strip()
+    return int(text) if text.isdigit() else text
+
+
+def _has_cycle(steps: list[dict]) -> bool:
+    """Algoritmo de Kahn: hay ciclo si no se pueden ordenar todos los pasos."""
+    pending = {step["id"]: set(step["depends_on"]) for step in steps}
+    ready = [step_id for step_id, deps in pending.items() if not deps]
+    ordered = 0
+    while ready:
+        done = ready.pop()
+        ordered += 1
+        for step_id, deps in pending.items():
+            if done in deps:
+                deps.discard(done)
+                if not deps:
+                    ready.append(step_id)
+    return ordered != len(steps)
+
+
+def build_step_task(step: dict, upstream: dict) -> str:
+    """Instrucción para el agente: la tarea del paso y solo los resultados de los pasos de los que depende."""
+    if not step["depends_on"]:
+        return step["task"]
+    context = "\n".join(f"- Step {dep} ({upstream[dep]['task']}): {upstream[dep]['result']}" for dep in step["depends_on"])
+    return f"{step['task']}\n\nResults of the previous steps this task depends on:\n{context}"
+
+
+def execute_plan(steps: list[dict], run_step, max_workers: int = 3, on_step_done=None,
+                 cancel_event: threading.Event | None = None) -> dict:
+    """
+    Ejecuta los pasos en cuanto sus dependencias han terminado, hasta `max_workers` a la vez.
+
+    `run_step(step, upstream)` recibe el paso y un diccionario {id: {"task", "result"}} con
+    los pasos de los que depende, y devuelve el resultado como texto. Si lanza una excepción,
+    el resultado del paso es el mensaje de error y los pasos dependientes lo reciben así.
+    `on_step_done(step, result)` se llama desde este hilo a medida que terminan los pasos.
+    Devuelve {id: resultado} de los pasos ejecutados (todos, salvo que se cancele).
+    """
+    by_id = {step["id"]: step for step in steps}
+    pending = {step["id"]: set(step["depends_on"]) for step in steps}
+    results = {}
+    running = {}
+
+    def submit_ready(executor):
+        for step_id in [step_id for step_id, deps in pending.items() if not deps]:
+            del pending[step_id]
+            step = by_id[step_id]
+            upstream = {dep: {"task": by_id[dep]["task"], "result": results[dep]} for dep in step["depends_on"]}
+            running[executor.submit(run_step, step, upstream)] = step_id
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan-step") as executor:
+        submit_ready(executor)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step_id = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = f"Error executing step {step_id}: {e}"
+                results[step_id] = str(result)
+                for deps in pending.values():
+                    deps.discard(step_id)
+                if on_step_done:
+                    on_step_done(by_id[step_id], results[step_id])
+            if cancel_event is not None and cancel_event.is_set():
+                print(f"[Reasoner] Plan cancelado; se esperan {len(running)} pasos en curso.")
+                pending.clear()
+                continue
+            submit_ready(executor)
+    return results
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# app/retrieval.py
+
+import os
+import re
+import zlib
+import sqlite3
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from app.prompt_builder import estimate_tokens
+
+# Importar la utilidad de rutas desde la raíz del proyecto.
+try:
+    from paths import get_app_data_dir
+except ImportError:
+    def get_app_data_dir():
+        data_dir = Path("data")
+        data_dir.mkdir(exist_ok=True)
+        return data_dir
+
+# Modelo de embeddings opcional; sin él se usa HashingEmbedder.
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# ANSI escape codes for colors
+class Color:
+    BLUE = '\033[94m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+
+CHUNK_CHARS = 800
+CHUNK_OVERLAP = 120
+ROLE_LABELS = {"user": "Usuario", "assistant": "Asistente"}
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """
+    Divide un texto en fragmentos de hasta `max_chars` caracteres. Se corta por párrafos y,
+    si un párrafo es más largo, en ventanas que se solapan `overlap` caracteres (siempre en
+    un espacio, sin partir palabras).
+    """
+    chunks, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 <= max_chars:
+            current += "\n\n" + paragraph
+            continue
+        if current:
+            chunks.append(current)
+            current = ""
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            chunks.append(paragraph[:cut].strip())
+            restart = paragraph.rfind(" ", 0, max(cut - overlap, 1))
+            paragraph = paragraph[restart + 1 if restart > 0 else cut:].strip()
+        current = paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_conversation(messages: list, start: int = 0) -> list[tuple[int, str]]:
+    """
+    Fragmentos de los mensajes de usuario y asistente a partir de `start`, como
+    (posición del mensaje, texto con el rol delante). Se omiten los mensajes de sistema.
+    """
+    chunks = []
+    for position, message in enumerate(messages[start:], start):
+        label = ROLE_LABELS.get(message.get("role")) if isinstance(message, dict) else None
+        if not label or not message.get("content"):
+            continue
+        for text in chunk_text(message["content"]):
+            chunks.append((position, f"{label}: {text}"))
+    return chunks
+
+
+# --- Modelos de embeddings ---
+
+class HashingEmbedder:
+    """
+    Embeddings sin dependencias para CPU: cada palabra (sin tildes ni mayúsculas) y cada
+    par de palabras consecutivas se proyecta con un hash a una de `dim` dimensiones.
+    Recupera por vocabulario compartido, no por sinónimos; es la alternativa cuando no está
+    instalado sentence-transformers.
+    """
+    min_score = 0.15
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def _tokens(text: str) -> list[str]:
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        return re.findall(r"\w{2,}", text)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = self._tokens(text)
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # Frecuencias sublineales y normalización L2: el producto escalar es el coseno.
+        np.copysign(np.log1p(np.abs(vectors)), vectors, out=vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """Modelo de sentence-transformers ejecutado en CPU (multilingüe por defecto)."""
+    DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    min_score = 0.35
+
+    def __init__(self, model_name: str | None = None):
+        self.name = model_name or self.DEFAULT_MODEL
+        self.model = SentenceTransformer(self.name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=32, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+def default_embedder():
+    """sentence-transformers si está instalado (modelo en MARTIN_EMBEDDING_MODEL); si no, HashingEmbedder."""
+    if SentenceTransformer is not None:
+        try:
+            return SentenceTransformerEmbedder(os.environ.get("MARTIN_EMBEDDING_MODEL"))
+        except Exception as e:
+            print(f"{Color.YELLOW}[RetrievalIndex] No se pudo cargar el modelo de embeddings ({e}); se usa HashingEmbedder.{Color.RESET}")
+    return HashingEmbedder()
+
+
+# --- Índice ---
+
+class RetrievalIndex:
+    """
+    Índice de recuperación (RAG) de las conversaciones y documentos de un usuario.
+
+    Los vectores viven en un archivo float32 mapeado en memoria (np.memmap) que crece al
+    doble cuando se llena; el texto y el origen de cada fragmento, en SQLite. Borrar un
+    origen libera sus filas, que se reutilizan en las siguientes inserciones, así que
+    añadir y borrar no reescribe nunca la matriz. Buscar es un producto matriz-vector sobre
+    las filas ocupadas.
+
+    Se abre en el primer uso (el modelo de embeddings puede tardar en cargar) y es seguro
+    usarlo desde varios hilos.
+    """
+    INITIAL_CAPACITY = 1024
+    VECTORS_FILE = "vectors.f32"
+    DB_FILE = "chunks.sqlite3"
+
+    def __init__(self, directory, embedder=None):
+        self.directory = Path(directory)
+        self._embedder = embedder
+        self._lock = threading.RLock()
+        self._db = None
+        self._vectors = None
+        self._alive = None
+        self._free = []
+        self._size = 0 # filas usadas alguna vez (las libres están en _free)
+
+    @classmethod
+    def for_user(cls, user_id: str, embedder=None) -> "RetrievalIndex":
+        return cls(get_app_data_dir() / "retrieval" / str(user_id), embedder)
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = default_embedder()
+        return self._embedder
+
+    def _open(self):
+        if self._db is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.directory / self.DB_FILE, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        with db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    source TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    title TEXT,
+                    version TEXT,
+                    item_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    row INTEGER PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    text TEXT NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)")
+            stored = dict(db.execute("SELECT key, value FROM meta").fetchall())
+            if stored.get("embedder") != self.embedder.name or stored.get("dim") != str(self.embedder.dim):
+                # Vectores de otro modelo: no son comparables, se empieza de cero.
+                if stored:
+                    print(f"{Color.YELLOW}[RetrievalIndex] Cambió el modelo de embeddings; se reconstruye el índice.{Color.RESET}")
+                db.execute("DELETE FROM chunks")
+                db.execute("DELETE FROM sources")
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedder', ?)", (self.embedder.name,))
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(self.embedder.dim),))
+                vectors_path = self.directory / self.VECTORS_FILE
+                if vectors_path.exists():
+                    vectors_path.unlink()
+        self._db = db
+        rows = [row[0] for row in db.execute("SELECT row FROM chunks")]
+        self._size = max(rows) + 1 if rows else 0
+        self._map(max(self.INITIAL_CAPACITY, self._size))
+        self._alive = np.zeros(len(self._vectors), dtype=bool)
+        self._alive[rows] = True
+        self._free = sorted(set(range(self._size)) - set(rows), reverse=True)
+        print(f"[RetrievalIndex] Índice abierto en '{self.directory}' ({len(rows)} fragmentos, {self.embedder.name}).")
+
+    def _map(self, capacity: int):
+        """(Re)mapea el archivo de vectores con al menos `capacity` filas."""
+        path = self.directory / self.VECTORS_FILE
+        row_bytes = self.embedder.dim * 4
+        current = path.stat().st_size // row_bytes if path.exists() else 0
+        if current < capacity:
+            if self._vectors is not None:
+                # En Windows no se puede cambiar el tamaño de un archivo mapeado: se cierra antes.
+                self._vectors.flush()
+                self._vectors = None
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            current = capacity
+        self._vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(current, self.embedder.dim))
+
+    def _allocate(self, count: int) -> list[int]:
+        rows = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        needed = count - len(rows)
+        if needed:
+            rows.extend(range(self._size, self._size + needed))
+            self._size += needed
+            if self._size > len(self._vectors):
+                self._map(max(self._size, len(self._vectors) * 2))
+                alive = np.zeros(len(self._vectors), dtype=bool)
+                alive[:len(self._alive)] = self._alive
+                self._alive = alive
+        return rows
+
+    # --- Altas y bajas ---
+
+    def add(self, source: str, items: list[tuple[int, str]], kind: str = "conversation",
+            title: str | None = None, version: str | None = None, item_count: int | None = None):
+        """Añade fragmentos (posición, texto) a un origen y actualiza su versión."""
+        with self._lock:
+            self._open()
+            rows = []
+            if items:
+                vectors = self.embedder.embed([text for _, text in items])
+                rows = self._allocate(len(items))
+                self._vectors[rows] = vectors
+                self._vectors.flush()
+            with self._db:
+                self._db.executemany("INSERT INTO chunks (row, source, position, text) VALUES (?, ?, ?, ?)",
+                                     [(row, source, position, text) for row, (position, text) in zip(rows, items)])
+                self._db.execute(
+                    "INSERT INTO sources (source, kind, title, version, item_count) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(source) DO UPDATE SET title = COALESCE(excluded.title, title), "
+                    "version = excluded.version, item_count = excluded.item_count",
+                    (source, kind, title, version, item_count or 0))
+            self._alive[rows] = True
+
+    def remove_source(self, source: str):
+        with self._lock:
+            self._open()
+            rows = [row[0] for row in self._db.execute("SELECT row FROM chunks WHERE source = ?", (source,))]
+            with self._db:
+                self._db.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._db.execute("DELETE FROM sources WHERE source = ?", (source,))
+            self._alive[rows] = False
+            self._free.extend(rows)
+            self._free.sort(reverse=True)
+
+    def sync_conversations(self, storage, user_id: str) -> int:
+        """
+        Pone al día el índice con las conversaciones del usuario en `storage` (LocalStorageService
+        o UserService). Solo se leen las conversaciones cuya fecha cambió; si solo recibieron
+        mensajes nuevos se indexan esos mensajes. Devuelve cuántas conversaciones se actualizaron.
+        """
+        conversations = storage.get_user_conversations(user_id)
+        with self._lock:
+            self._open()
+            known = {row["source"]: row for row in self._db.execute("SELECT * FROM sources WHERE kind = 'conversation'")}
+        current = set()
+        updated = 0
+        for conv in conversations:
+            source = f"conv:{conv['_id']}"
+            current.add(source)
+            stored = known.get(source)
+            if stored and stored["version"] == str(conv.get("timestamp")):
+                continue
+            details = storage.get_conversation_details(user_id, str(conv["_id"]))
+            if details:
+                self._index_conversation(source, details, stored, str(conv.get("timestamp")))
+                updated += 1
+        for source in set(known) - current:
+            self.remove_source(source)
+        if updated:
+            print(f"[RetrievalIndex] sync_conversations: {updated} conversaciones indexadas.")
+        return updated
+
+    def sync_conversation(self, storage, user_id: str, conversation_id: str) -> bool:
+        """
+        Pone al día solo una conversación (p. ej. la que se acaba de guardar), sin recorrer el
+        listado del usuario. Devuelve True si se indexó algo.
+        """
+        source = f"conv:{conversation_id}"
+        with self._lock:
+            self._open()
+            stored = self._db.execute("SELECT * FROM sources WHERE source = ?", (source,)).fetchone()
+        details = storage.get_conversation_details(user_id, str(conversation_id))
+        if not details or (stored and stored["item_count"] == len(details.get("messages") or [])):
+            return False
+        self._index_conversation(source, details, stored, str(details.get("timestamp")))
+        return True
+
+    def _index_conversation(self, source: str, details: dict, stored, version: str):
+        """Indexa los mensajes nuevos de una conversación (o todos, si su historial cambió)."""
+        messages = details.get("messages") or []
+        start = stored["item_count"] if stored and stored["item_count"] <= len(messages) else 0
+        if stored and start == 0:
+            self.remove_source(source)
+        self.add(source, chunk_conversation(messages, start), title=details.get("title"),
+                 version=version, item_count=len(messages))
+
+    def add_document(self, file_path: str, text: str | None = None) -> bool:
+        """Indexa un archivo (txt, pdf, docx). Si no cambió desde la última vez no hace nada."""
+        from app.services.file_processing_service import extract_text
+        path = os.path.realpath(file_path)
+        stat = os.stat(path)
+        source, version = f"file:{path}", f"{stat.st_size}:{stat.st_mtime_ns}"
+        with self._lock:
+            self._open()
+            stored = self._db.execute("SELECT version FROM sources WHERE source = ?", (source,)).fetchone()
+        if stored and stored["version"] == version:
+            return False
+        if text is None:
+            text = extract_text(path)
+        items = list(enumerate(chunk_text(text)))
+        self.remove_source(source)
+        self.add(source, items, kind="document", title=Path(path).name, version=version, item_count=len(items))
+        return True
+
+    # --- Búsqueda ---
+
+    def search(self, query: str, k: int = 5, exclude_sources=(), min_score: float | None = None) -> list:
+        """Los `k` fragmentos más parecidos a `query`, del más al menos parecido."""
+        if not query.strip():
+            return []
+        with self._lock:
+            self._open()
+            if not self._size:
+                return []
+            q = self.embedder.embed([query])[0]
+            scores = self._vectors[:self._size] @ q
+            scores[~self._alive[:self._size]] = -np.inf
+            if exclude_sources:
+                placeholders = ",".join("?" * len(exclude_sources))
+                excluded = [row[0] for row in self._db.execute(
+                    f"SELECT row FROM chunks WHERE source IN ({placeholders})", list(exclude_sources))]
+                scores[excluded] = -np.inf
+            threshold = self.embedder.min_score if min_score is None else min_score
+            k = min(k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = [int(row) for row in top[np.argsort(-scores[top])] if scores[row] >= threshold]
+            if not top:
+                return []
+            placeholders = ",".join("?" * len(top))
+            chunks = {row["row"]: row for row in self._db.execute(
+                f"SELECT chunks.row, chunks.source, chunks.position, chunks.text, sources.kind, sources.title "
+                f"FROM chunks JOIN sources ON sources.source = chunks.source WHERE chunks.row IN ({placeholders})", top)}
+        return [{
+            "source": chunks[row]["source"],
+            "kind": chunks[row]["kind"],
+            "title": chunks[row]["title"],
+            "position": chunks[row]["position"],
+            "text": chunks[row]["text"],
+            "score": float(scores[row]),
+        } for row in top if row in chunks]
+
+    def build_context(self, query: str, max_tokens: int, count_tokens=estimate_tokens,
+                      k: int = 8, exclude_sources=()) -> str:
+        """
+        Texto con los fragmentos recuperados para `query`, por relevancia y sin pasar de
+        `max_tokens`. Devuelve "" si no hay nada relevante.
+        """
+        header = ("Fragmentos de conversaciones y documentos anteriores del usuario que pueden ser "
+                  "relevantes. Úsalos solo si ayudan a responder:")
+        used = count_tokens(header)
+        parts = []
+        for i, passage in enumerate(self.search(query, k, exclude_sources), 1):
+            origin = "Documento" if passage["kind"] == "document" else "Conversación"
+            part = f"[{i}] {origin} «{passage['title'] or 'Sin título'}»:\n{passage['text']}"
+            cost = count_tokens(part)
+            if used + cost > max_tokens:
+                break
+            parts.append(part)
+            used += cost
+        return "\n\n".join([header] + parts) if parts else ""
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._open()
+            return {
+                "chunks": int(self._alive[:self._size].sum()),
+                "free_rows": len(self._free),
+                "capacity": len(self._vectors),
+                "embedder": self.embedder.name,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            if self._db is not None:
+                self._db.close()
+                self._db = None
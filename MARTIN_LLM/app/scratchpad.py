@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# app/scratchpad.py
+
+from app.prompt_builder import estimate_tokens
+
+
+def shorten(text: str, max_chars: int) -> str:
+    """Colapsa los espacios y corta el texto en un límite de palabra, añadiendo '…'."""
+    text = " ".join(str(text).split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0] or text[:max_chars]
+    return cut + "…"
+
+
+class Scratchpad:
+    """
+    Memoria de trabajo del agente durante una tarea: los pasos (respuesta del modelo y
+    observación de la herramienta) que se le reenvían en cada iteración.
+
+    Los últimos `keep_recent` pasos se envían literalmente; los anteriores se sustituyen por
+    un resumen de una línea (acción y comienzo de la observación). Todo ello cabe en `budget`
+    tokens: si no, se resumen también los pasos recientes (salvo el último) y, por último, se
+    omiten los resúmenes más antiguos. Así el prompt deja de crecer con cada paso.
+    """
+    DEFAULT_BUDGET = 1536
+    KEEP_RECENT_STEPS = 2
+    SUMMARY_CHARS = 240
+    ARGS_CHARS = 80
+    SUMMARY_HEADER = "Summary of your earlier steps (observations shortened):"
+    OMITTED_LINE = "- ({} earlier steps omitted)"
+
+    def __init__(self, budget: int = DEFAULT_BUDGET, keep_recent: int = KEEP_RECENT_STEPS, count_tokens=estimate_tokens):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.count_tokens = count_tokens
+        self.reset("")
+
+    def reset(self, objective: str):
+        """Empieza una tarea nueva: descarta los pasos y las métricas de la anterior."""
+        self.objective_message = {"role": "user", "content": f"User objective: {objective}"}
+        self.objective_tokens = self.count_tokens(self.objective_message["content"])
+        self.steps = []
+        self.metrics = []
+        self.last_stats = {}
+
+    def add_step(self, response: str, observation: str = "", tool_name: str | None = None, args=None):
+        """Registra un paso. Los tokens y el resumen se calculan una sola vez, aquí."""
+        messages = [{"role": "assistant", "content": response}]
+        if observation:
+            messages.append({"role": "system", "content": f"Observation: {observation}"})
+        action = f"{tool_name}({shorten(args, self.ARGS_CHARS)})" if tool_name else "invalid response"
+        result = shorten(observation, self.SUMMARY_CHARS) if observation else "(no observation)"
+        summary = f"- Step {len(self.steps) + 1}: {action} -> {result}"
+        self.steps.append({
+            "messages": messages,
+            "tokens": sum(self.count_tokens(m["content"]) for m in messages),
+            "summary": summary,
+            "summary_tokens": self.count_tokens(summary),
+        })
+
+    def messages(self) -> list:
+        """Mensajes que siguen al prompt del sistema: objetivo, resumen de pasos antiguos y pasos recientes."""
+        budget = self.budget - self.objective_tokens
+        split = max(0, len(self.steps) - self.keep_recent)
+        # El último paso siempre va literal, aunque por sí solo supere el presupuesto.
+        while split < len(self.steps) - 1 and sum(step["tokens"] for step in self.steps[split:]) > budget:
+            split += 1
+        recent, older = self.steps[split:], self.steps[:split]
+        used = sum(step["tokens"] for step in recent)
+
+        summaries = []
+        if older:
+            used += self.count_tokens(self.SUMMARY_HEADER)
+            # Si no caben todos los resúmenes, se reserva sitio para la línea de pasos omitidos.
+            if used + sum(step["summary_tokens"] for step in older) > budget:
+                used += self.count_tokens(self.OMITTED_LINE.format(len(older)))
+            for step in reversed(older):
+                if used + step["summary_tokens"] > budget:
+                    break
+                summaries.append(step["summary"])
+                used += step["summary_tokens"]
+            summaries.reverse()
+        omitted = len(older) - len(summaries)
+
+        messages = [self.objective_message]
+        if older:
+            lines = [self.SUMMARY_HEADER]
+            if omitted:
+                lines.append(self.OMITTED_LINE.format(omitted))
+            messages.append({"role": "system", "content": "\n".join(lines + summaries)})
+        for step in recent:
+            messages.extend(step["messages"])
+
+        self.last_stats = {
+            "scratchpad_tokens": self.objective_tokens + used,
+            "verbatim_steps": len(recent),
+            "summarized_steps": len(summaries),
+            "omitted_steps": omitted,
+        }
+        return messages
+
+    def record_step(self, step: int, fixed_tokens: int = 0) -> dict:
+        """Guarda las métricas del prompt construido por la última llamada a `messages()`."""
+        metrics = {"step": step, "prompt_tokens": fixed_tokens + self.last_stats.get("scratchpad_tokens", 0), **self.last_stats}
+        self.metrics.append(metrics)
+        return metrics
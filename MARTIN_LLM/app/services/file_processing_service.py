@@ -1,33 +1,191 @@
+# -*- coding: utf-8 -*-
+# app/services/file_processing_service.py
+
 import os
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from pathlib import Path
 from PyPDF2 import PdfReader
 from docx import Document
 
-def extract_text(file_path):
+# Importar la utilidad de rutas desde la raíz del proyecto.
+try:
+    from paths import get_app_data_dir
+except ImportError:
+    def get_app_data_dir():
+        data_dir = Path("data")
+        data_dir.mkdir(exist_ok=True)
+        return data_dir
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+# Por debajo de estas páginas no compensa arrancar procesos: se extrae en el propio hilo.
+PDF_PARALLEL_MIN_PAGES = 32
+PDF_PAGES_PER_TASK = 16
+TXT_BLOCK_SIZE = 1024 * 1024
+CACHE_DIR_NAME = "extracted_text"
+CACHE_MAX_FILES = 200
+# Subirlo si cambia el texto que producen los extractores, para invalidar la caché.
+EXTRACTOR_VERSION = 1
+
+
+class ExtractionCancelled(Exception):
+    """La extracción se canceló antes de terminar."""
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise ExtractionCancelled()
+
+
+def _extension(file_path) -> str:
     _, ext = os.path.splitext(file_path)
     ext = ext.lower()
-    if ext == '.txt':
-        return extract_text_from_txt(file_path)
-    elif ext == '.pdf':
-        return extract_text_from_pdf(file_path)
-    elif ext == '.docx':
-        return extract_text_from_docx(file_path)
-    else:
+    if ext not in SUPPORTED_EXTENSIONS:
         raise ValueError(f"Formato no soportado: {ext}")
-def extract_text_from_txt(file_path):
+    return ext
+
+
+def file_hash(file_path) -> str:
+    """SHA-256 del contenido del archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(TXT_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Extractores (generadores: entregan el texto por trozos) ---
+
+def iter_txt(file_path, progress=None, cancel_event=None):
+    """Bloques de texto de un .txt. `progress(hecho, total)` se mide en bytes."""
+    total = os.path.getsize(file_path)
     with open(file_path, 'r', encoding='utf-8') as f:
-        return f.read()
-def extract_text_from_pdf(file_path):
-    text = ""
+        for block in iter(lambda: f.read(TXT_BLOCK_SIZE), ""):
+            _check_cancelled(cancel_event)
+            yield block
+            if progress:
+                progress(min(f.buffer.tell(), total), total)
+
+
+def _extract_pdf_pages(file_path, start: int, end: int) -> list:
+    """Texto de las páginas [start, end) de un PDF. Se ejecuta en los procesos del pool."""
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_pdf(file_path, progress=None, cancel_event=None, max_workers=None):
+    """
+    Páginas de un PDF, en orden y terminadas en salto de línea. `progress` se mide en páginas.
+
+    Los PDF grandes se reparten por tramos de páginas entre varios procesos (el análisis
+    de PyPDF2 es Python puro y en hilos no escalaría por el GIL). Se usa "spawn" porque
+    hacer fork de un proceso con Qt e hilos en marcha no es seguro.
+    """
     reader = PdfReader(file_path)
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    total = len(reader.pages)
+    workers = max_workers or max(1, (os.cpu_count() or 1) - 1)
+    if total < PDF_PARALLEL_MIN_PAGES or workers == 1:
+        for i, page in enumerate(reader.pages):
+            _check_cancelled(cancel_event)
+            yield (page.extract_text() or "") + "\n"
+            if progress:
+                progress(i + 1, total)
+        return
+
+    del reader
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, total)) for start in range(0, total, PDF_PAGES_PER_TASK)]
+    executor = ProcessPoolExecutor(min(workers, len(ranges)), mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [executor.submit(_extract_pdf_pages, file_path, start, end) for start, end in ranges]
+        # Los tramos se entregan en orden aunque terminen desordenados.
+        for (start, end), future in zip(ranges, futures):
+            while not future.done():
+                _check_cancelled(cancel_event)
+                wait([future], timeout=0.1)
+            for text in future.result():
+                yield text + "\n"
+            if progress:
+                progress(end, total)
+    finally:
+        # También se llega aquí si se cancela o el consumidor abandona el generador.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_docx(file_path, progress=None, cancel_event=None):
+    """Párrafos de un .docx separados por saltos de línea. `progress` se mide en párrafos."""
+    paragraphs = Document(file_path).paragraphs
+    total = len(paragraphs)
+    for i, para in enumerate(paragraphs):
+        _check_cancelled(cancel_event)
+        yield para.text if i == 0 else "\n" + para.text
+        if progress:
+            progress(i + 1, total)
+
+
+_EXTRACTORS = {".txt": iter_txt, ".pdf": iter_pdf, ".docx": iter_docx}
+
+
+# --- Caché de texto extraído ---
+
+def _cache_path(file_path, ext: str, cache_dir) -> Path:
+    cache_dir = Path(cache_dir) if cache_dir is not None else get_app_data_dir() / CACHE_DIR_NAME
+    return cache_dir / f"{file_hash(file_path)}{ext}.v{EXTRACTOR_VERSION}.txt"
+
+
+def _store_cached(cache_path: Path, text: str):
+    """Guarda el texto de forma atómica y descarta las entradas más antiguas si sobran."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+        entries = sorted(cache_path.parent.glob("*.txt"), key=lambda p: p.stat().st_mtime)
+        for old in entries[:max(0, len(entries) - CACHE_MAX_FILES)]:
+            old.unlink(missing_ok=True)
+    except OSError as e:
+        print(f"[file_processing_service] No se pudo guardar el texto extraído en caché: {e}")
+
+
+def iter_text(file_path, progress=None, cancel_event=None, use_cache=True, cache_dir=None):
+    """
+    Extrae el texto de un archivo (txt, pdf, docx) por trozos, a medida que se lee.
+
+    `progress(hecho, total)` se llama tras cada trozo y `cancel_event` (threading.Event)
+    permite interrumpir la extracción con ExtractionCancelled. El resultado se guarda en
+    caché por el hash del contenido: volver a adjuntar el mismo archivo no lo relee.
+    """
+    ext = _extension(file_path)
+    cache_path = _cache_path(file_path, ext, cache_dir) if use_cache else None
+    if cache_path is not None and cache_path.exists():
+        try:
+            text = cache_path.read_text(encoding="utf-8")
+            os.utime(cache_path) # las entradas usadas son las últimas en descartarse
+            if progress:
+                progress(1, 1)
+            yield text
+            return
+        except OSError as e:
+            print(f"[file_processing_service] Caché ilegible para '{file_path}': {e}")
+
+    parts = []
+    for part in _EXTRACTORS[ext](file_path, progress=progress, cancel_event=cancel_event):
+        parts.append(part)
+        yield part
+    if cache_path is not None:
+        _store_cached(cache_path, "".join(parts))
+
+
+def extract_text(file_path, progress=None, cancel_event=None, use_cache=True):
+    return "".join(iter_text(file_path, progress=progress, cancel_event=cancel_event, use_cache=use_cache))
+def extract_text_from_txt(file_path):
+    return "".join(iter_txt(file_path))
+def extract_text_from_pdf(file_path):
+    return "".join(iter_pdf(file_path))
 def extract_text_from_docx(file_path):
-    doc = Document(file_path)
-    full_text = []
-    for para in doc.paragraphs:
-        full_text.append(para.text)
-    return "\n".join(full_text)
+    return "".join(iter_docx(file_path))
 
 
 def process_file_with_llm(file_path, llm_model):
@@ -4,6 +4,8 @@
 import os
 import json
 import uuid
+import sqlite3
+import threading
 from datetime import datetime
 
 # Obtener la ruta base del proyecto de una manera más robusta
@@ -16,88 +18,306 @@ except ImportError:
 
 LOCAL_STORAGE_PATH = os.path.join(BASE_DIR, "data", "local_storage")
 
+INDEX_FILE_NAME = "index.sqlite3"
+
+
+def _json_default(value):
+    """Serializa las fechas (la interfaz envía datetime) como texto ISO."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
 class LocalStorageService:
     """
     Gestiona el almacenamiento y recuperación de conversaciones en el sistema de archivos local.
+
+    Cada conversación completa (con sus mensajes) vive en su propio archivo JSON, y un índice
+    SQLite guarda solo los metadatos (_id, usuario, título, fecha). Los listados se resuelven
+    con el índice, sin abrir ningún archivo de conversación. La primera vez que se usa el
+    índice se importan los metadatos de los archivos JSON existentes.
+
+    Los mensajes nuevos no reescriben el JSON: se añaden a un diario `<id>.jsonl` (una línea
+    por operación, con fsync), y cada `COMPACT_THRESHOLD` líneas el diario se integra en el
+    JSON con un reemplazo atómico. Cada línea lleva un número de secuencia y el JSON recuerda
+    el último integrado (`_journal_seq`), así que un corte durante la compactación nunca
+    duplica mensajes.
     """
-    def __init__(self):
+    COMPACT_THRESHOLD = 200
+
+    def __init__(self, storage_path: str | None = None):
         print("[LocalStorageService] __init__: Inicializando servicio de almacenamiento local.")
-        os.makedirs(LOCAL_STORAGE_PATH, exist_ok=True)
+        self.storage_path = storage_path or LOCAL_STORAGE_PATH
+        os.makedirs(self.storage_path, exist_ok=True)
+        self._lock = threading.Lock()
+        # Serializa las escrituras de archivos de conversación (diario y compactación).
+        self._file_lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(self.storage_path, INDEX_FILE_NAME), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    _id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    title TEXT,
+                    timestamp TEXT,
+                    journal_seq INTEGER NOT NULL DEFAULT 0,
+                    journal_lines INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(conversations)")}
+            for column in ("journal_seq", "journal_lines"):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE conversations ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_ts ON conversations (user_id, timestamp DESC)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._migrate_json_files()
+
+    def _migrate_json_files(self):
+        """Importa al índice los metadatos de los archivos JSON creados antes de que existiera (una sola vez)."""
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+        rows = []
+        for user_dir in os.scandir(self.storage_path):
+            if not user_dir.is_dir():
+                continue
+            for entry in os.scandir(user_dir.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    conv = self._load_document(user_dir.name, entry.name[:-5])
+                    if os.path.exists(self._journal_path(user_dir.name, entry.name[:-5])):
+                        # Sin fila en el índice no se conoce la secuencia del diario: se integra ya.
+                        self._write_snapshot(user_dir.name, entry.name[:-5], conv)
+                except (IOError, json.JSONDecodeError) as e:
+                    print(f"[LocalStorageService] _migrate_json_files: ⚠️ Se omite '{entry.path}': {e}")
+                    continue
+                timestamp = conv.get("timestamp") or datetime.utcfromtimestamp(entry.stat().st_mtime).isoformat()
+                rows.append((conv.get("_id") or entry.name[:-5], user_dir.name, conv.get("title", "Sin Título"),
+                             timestamp, conv.get("_journal_seq", 0)))
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO conversations (_id, user_id, title, timestamp, journal_seq) VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (datetime.utcnow().isoformat(),))
+        if rows:
+            print(f"[LocalStorageService] _migrate_json_files: {len(rows)} conversaciones importadas al índice.")
+
+    def _index_upsert(self, conv: dict, journal_lines: int | None = None):
+        """Inserta o actualiza los metadatos de la conversación sin perder su secuencia de diario."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO conversations (_id, user_id, title, timestamp, journal_seq) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(_id) DO UPDATE SET title = excluded.title, timestamp = excluded.timestamp",
+                (conv["_id"], str(conv["user_id"]), conv.get("title", "Sin Título"), conv.get("timestamp"),
+                 conv.get("_journal_seq", 0)),
+            )
+            if journal_lines is not None:
+                self._db.execute("UPDATE conversations SET journal_lines = ? WHERE _id = ?", (journal_lines, conv["_id"]))
 
     def _get_user_storage_path(self, user_id: str) -> str:
         """Devuelve la ruta de la carpeta de almacenamiento para un usuario específico."""
-        path = os.path.join(LOCAL_STORAGE_PATH, str(user_id))
+        path = os.path.join(self.storage_path, str(user_id))
         os.makedirs(path, exist_ok=True)
         return path
 
+    def _document_path(self, user_id: str, conversation_id: str) -> str:
+        return os.path.join(self._get_user_storage_path(user_id), f"{conversation_id}.json")
+
+    def _journal_path(self, user_id: str, conversation_id: str) -> str:
+        return os.path.join(self._get_user_storage_path(user_id), f"{conversation_id}.jsonl")
+
+    @staticmethod
+    def _write_json(file_path: str, data: dict):
+        """Escribe el archivo de forma atómica: nunca queda una conversación a medio escribir."""
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False, default=_json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+    # --- Diario de mensajes ---
+
+    @staticmethod
+    def _apply_entry(conv: dict, entry: dict):
+        op = entry.get("op")
+        if op == "append":
+            conv.setdefault("messages", []).append(entry["message"])
+        elif op == "set":
+            conv.update(entry["data"])
+        elif op == "update_message":
+            messages = conv.get("messages", [])
+            if 0 <= entry["index"] < len(messages):
+                messages[entry["index"]].update(entry["data"])
+
+    def _load_document(self, user_id: str, conversation_id: str) -> dict | None:
+        """Lee el JSON de la conversación y le aplica las líneas del diario aún no integradas."""
+        file_path = self._document_path(user_id, conversation_id)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            conv = json.load(f)
+        journal_path = self._journal_path(user_id, conversation_id)
+        if os.path.exists(journal_path):
+            # Solo se descartan las líneas ya integradas en el JSON; se comparan con la secuencia
+            # guardada en él y no con la última aplicada, por si una secuencia se repite.
+            integrated = conv.get("_journal_seq", 0)
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # última línea cortada por un cierre inesperado
+                    if entry.get("seq", 0) <= integrated:
+                        continue
+                    self._apply_entry(conv, entry)
+                    conv["_journal_seq"] = max(conv.get("_journal_seq", 0), entry["seq"])
+        return conv
+
+    def _write_snapshot(self, user_id: str, conversation_id: str, conv: dict):
+        """Integra el diario: reescribe el JSON (atómico) y después borra el diario."""
+        self._write_json(self._document_path(user_id, conversation_id), conv)
+        try:
+            os.remove(self._journal_path(user_id, conversation_id))
+        except FileNotFoundError:
+            pass
+
+    def _append_journal(self, user_id: str, conversation_id: str, entries: list, metadata: dict | None = None) -> bool:
+        """Añade operaciones al diario con fsync; O(1) respecto al tamaño de la conversación."""
+        with self._file_lock:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT journal_seq, journal_lines FROM conversations WHERE _id = ? AND user_id = ?",
+                    (conversation_id, str(user_id)),
+                ).fetchone()
+            if row is None or not os.path.exists(self._document_path(user_id, conversation_id)):
+                return False
+
+            seq = row["journal_seq"]
+            lines = []
+            for entry in entries:
+                seq += 1
+                lines.append(json.dumps(dict(entry, seq=seq), ensure_ascii=False, default=_json_default))
+            with open(self._journal_path(user_id, conversation_id), 'a+b') as f:
+                # Si un cierre inesperado dejó la última línea sin terminar, se cierra antes de seguir.
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(("\n".join(lines) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            journal_lines = row["journal_lines"] + len(lines)
+            with self._lock, self._db:
+                self._db.execute(
+                    "UPDATE conversations SET journal_seq = ?, journal_lines = ?, "
+                    "title = COALESCE(?, title), timestamp = ? WHERE _id = ?",
+                    (seq, journal_lines, (metadata or {}).get("title"), datetime.utcnow().isoformat(), conversation_id),
+                )
+            if journal_lines >= self.COMPACT_THRESHOLD:
+                self.compact_conversation(user_id, conversation_id)
+            return True
+
+    def append_messages(self, user_id: str, conversation_id: str, messages: list, update_data: dict | None = None) -> bool:
+        """
+        Añade mensajes al final de la conversación sin reescribirla. `update_data` (título,
+        modelo, prompt del sistema...) se guarda en la misma escritura del diario.
+        """
+        print(f"[LocalStorageService] append_messages: {len(messages)} mensajes nuevos en '{conversation_id}'.")
+        entries = [{"op": "append", "message": message} for message in messages]
+        update_data = dict(update_data or {}, timestamp=datetime.utcnow().isoformat())
+        entries.append({"op": "set", "data": update_data})
+        try:
+            return self._append_journal(user_id, conversation_id, entries, update_data)
+        except (IOError, sqlite3.Error) as e:
+            print(f"[LocalStorageService] append_messages: ❌ Error al escribir el diario: {e}")
+            return False
+
+    def update_message(self, user_id: str, conversation_id: str, index: int, fields: dict) -> bool:
+        """Modifica campos de un mensaje ya guardado (p. ej. su valoración)."""
+        try:
+            return self._append_journal(user_id, conversation_id, [{"op": "update_message", "index": index, "data": fields}])
+        except (IOError, sqlite3.Error) as e:
+            print(f"[LocalStorageService] update_message: ❌ Error al escribir el diario: {e}")
+            return False
+
+    def compact_conversation(self, user_id: str, conversation_id: str) -> bool:
+        """Integra el diario en el JSON de la conversación."""
+        with self._file_lock:
+            try:
+                conv = self._load_document(user_id, conversation_id)
+                if conv is None:
+                    return False
+                self._write_snapshot(user_id, conversation_id, conv)
+                with self._lock, self._db:
+                    self._db.execute("UPDATE conversations SET journal_lines = 0 WHERE _id = ?", (conversation_id,))
+                print(f"[LocalStorageService] compact_conversation: Diario de '{conversation_id}' compactado.")
+                return True
+            except (IOError, json.JSONDecodeError, sqlite3.Error) as e:
+                print(f"[LocalStorageService] compact_conversation: ❌ Error al compactar: {e}")
+                return False
+
+    # --- Operaciones de conversación ---
+
     def create_conversation(self, user_id: str, conv_data: dict) -> str:
         """
         Crea un nuevo archivo JSON para una conversación y devuelve su ID.
         """
         print(f"[LocalStorageService] create_conversation: Creando nueva conversación local para usuario '{user_id}'.")
-        user_path = self._get_user_storage_path(user_id)
         conversation_id = str(uuid.uuid4())
-        file_path = os.path.join(user_path, f"{conversation_id}.json")
+        file_path = self._document_path(user_id, conversation_id)
 
         # Añadir metadatos importantes a la conversación
         conv_data['_id'] = conversation_id
         conv_data['user_id'] = user_id
         conv_data['timestamp'] = datetime.utcnow().isoformat()
-        
+
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(conv_data, f, indent=4, ensure_ascii=False)
+            self._write_json(file_path, conv_data)
+            self._index_upsert(conv_data)
             print(f"[LocalStorageService] create_conversation: Conversación local creada en: {file_path}")
             return conversation_id
-        except IOError as e:
+        except (IOError, sqlite3.Error) as e:
             print(f"[LocalStorageService] create_conversation: ❌ Error al escribir el archivo de conversación: {e}")
             return None
 
-    def get_user_conversations(self, user_id: str, limit: int = 0) -> list:
+    def get_user_conversations(self, user_id: str, limit: int = 0, offset: int = 0) -> list:
         """
-        Obtiene una lista de todas las conversaciones de un usuario desde el almacenamiento local.
+        Obtiene los metadatos (_id, title, timestamp) de las conversaciones de un usuario,
+        de la más reciente a la más antigua. `limit` y `offset` permiten paginar el listado.
         """
         print(f"[LocalStorageService] get_user_conversations: Obteniendo conversaciones locales para '{user_id}'.")
-        user_path = self._get_user_storage_path(user_id)
-        conversations = []
         try:
-            files = [f for f in os.listdir(user_path) if f.endswith('.json')]
-            
-            # Ordenar archivos por fecha de modificación (más recientes primero)
-            files.sort(key=lambda f: os.path.getmtime(os.path.join(user_path, f)), reverse=True)
-
-            for file_name in files:
-                file_path = os.path.join(user_path, file_name)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    conv = json.load(f)
-                    # Cargar solo metadatos, no los mensajes completos para eficiencia
-                    conversations.append({
-                        "_id": conv.get("_id"),
-                        "title": conv.get("title", "Sin Título"),
-                        "timestamp": conv.get("timestamp")
-                    })
-            
-            if limit > 0:
-                return conversations[:limit]
-            return conversations
-        except (IOError, json.JSONDecodeError) as e:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT _id, title, timestamp FROM conversations WHERE user_id = ? "
+                    "ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+                    (str(user_id), limit if limit > 0 else -1, max(offset, 0)),
+                ).fetchall()
+            return [{"_id": row["_id"], "title": row["title"], "timestamp": row["timestamp"]} for row in rows]
+        except sqlite3.Error as e:
             print(f"[LocalStorageService] get_user_conversations: ❌ Error al leer conversaciones: {e}")
             return []
 
+    def count_user_conversations(self, user_id: str) -> int:
+        """Número total de conversaciones del usuario (para paginar)."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM conversations WHERE user_id = ?", (str(user_id),)).fetchone()[0]
+
     def get_conversation_details(self, user_id: str, conversation_id: str) -> dict | None:
         """
         Obtiene los detalles completos de una conversación específica.
         """
         print(f"[LocalStorageService] get_conversation_details: Obteniendo detalles de '{conversation_id}'.")
-        user_path = self._get_user_storage_path(user_id)
-        file_path = os.path.join(user_path, f"{conversation_id}.json")
-
-        if not os.path.exists(file_path):
-            return None
-            
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with self._file_lock:
+                conv = self._load_document(user_id, conversation_id)
+            if conv is not None:
+                conv.pop("_journal_seq", None)
+            return conv
         except (IOError, json.JSONDecodeError) as e:
             print(f"[LocalStorageService] get_conversation_details: ❌ Error al leer el archivo: {e}")
             return None
@@ -105,41 +325,45 @@ class LocalStorageService:
     def update_conversation(self, user_id: str, conversation_id: str, update_data: dict):
         """
         Actualiza una conversación existente en el almacenamiento local.
+        Reescribe el documento completo (e integra el diario); para añadir mensajes
+        usar `append_messages`.
         """
         print(f"[LocalStorageService] update_conversation: Actualizando '{conversation_id}'.")
-        user_path = self._get_user_storage_path(user_id)
-        file_path = os.path.join(user_path, f"{conversation_id}.json")
-
-        if not os.path.exists(file_path):
-            return False
-
-        try:
-            with open(file_path, 'r+', encoding='utf-8') as f:
-                conv = json.load(f)
+        with self._file_lock:
+            try:
+                conv = self._load_document(user_id, conversation_id)
+                if conv is None:
+                    return False
                 conv.update(update_data)
                 # Actualizar timestamp en cada modificación
                 conv['timestamp'] = datetime.utcnow().isoformat()
-                f.seek(0)
-                json.dump(conv, f, indent=4, ensure_ascii=False)
-                f.truncate()
-            return True
-        except (IOError, json.JSONDecodeError) as e:
-            print(f"[LocalStorageService] update_conversation: ❌ Error al actualizar: {e}")
-            return False
+                conv.setdefault('_id', conversation_id)
+                conv.setdefault('user_id', user_id)
+                self._write_snapshot(user_id, conversation_id, conv)
+                self._index_upsert(conv, journal_lines=0)
+                return True
+            except (IOError, json.JSONDecodeError, sqlite3.Error) as e:
+                print(f"[LocalStorageService] update_conversation: ❌ Error al actualizar: {e}")
+                return False
 
     def delete_conversation(self, user_id: str, conversation_id: str) -> bool:
         """
         Elimina un archivo de conversación.
         """
         print(f"[LocalStorageService] delete_conversation: Eliminando '{conversation_id}'.")
-        user_path = self._get_user_storage_path(user_id)
-        file_path = os.path.join(user_path, f"{conversation_id}.json")
+        file_path = self._document_path(user_id, conversation_id)
+
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM conversations WHERE _id = ?", (conversation_id,))
 
         if not os.path.exists(file_path):
             return False
-            
+
         try:
-            os.remove(file_path)
+            with self._file_lock:
+                os.remove(file_path)
+                if os.path.exists(self._journal_path(user_id, conversation_id)):
+                    os.remove(self._journal_path(user_id, conversation_id))
             print(f"[LocalStorageService] delete_conversation: Conversación '{conversation_id}' eliminada.")
             return True
         except IOError as e:
@@ -11,10 +11,12 @@ from bson import ObjectId
 import secrets
 import json
 import re
+import sqlite3
 
 # Importar la utilidad de rutas desde la raíz del proyecto.
 from paths import get_remember_me_path
 from app.services.local_storage_service import LocalStorageService
+from app.services.search_index import ConversationSearchIndex, SEARCH_INDEX_FILE_NAME
 
 class UserService:
     """
@@ -24,11 +26,19 @@ class UserService:
     def __init__(self):
         print("[UserService] __init__: Inicializando servicio de usuario.")
         self.local_storage_service = LocalStorageService()
+        # Índice local de búsqueda sobre el contenido de las conversaciones (locales y de MongoDB).
+        self.search_index = ConversationSearchIndex(
+            os.path.join(self.local_storage_service.storage_path, SEARCH_INDEX_FILE_NAME))
         self.db = None
         self.users = None
         self.conversations = None
         self.password_resets = None
         self.fernet = None
+        # Consentimiento ya resuelto por usuario: decide el almacenamiento de cada llamada
+        # de persistencia sin volver a consultar MongoDB ni leer users.json.
+        self._consent_cache = {}
+        self.consent_cache_hits = 0
+        self.consent_cache_misses = 0
 
     def _connect_to_db(self):
         """Establece la conexión con MongoDB si aún no está activa."""
@@ -163,6 +173,7 @@ class UserService:
             # pero se informa del error. El ID de la DB (si existe) se devuelve.
             return user_id if 'user_id' in locals() else None
         
+        self.invalidate_consent_cache(user_id)
         return user_id if 'user_id' in locals() else str(uuid.uuid4())
 
     def authenticate_user(self, username, password):
@@ -183,6 +194,8 @@ class UserService:
         # Si el usuario se encuentra en JSON y la contraseña es correcta
         if user_data and self._verify_password(password, user_data['password_hash'].encode('utf-8')):
             user_id = user_data['id']
+            # Cada inicio de sesión parte del consentimiento guardado, no del de una sesión anterior.
+            self.invalidate_consent_cache(user_id)
             print(f"[UserService] authenticate_user: Autenticación exitosa para '{username}' con {user_file_path}.")
             
             # Decidir si conectar a la DB basado en el consentimiento
@@ -201,13 +214,71 @@ class UserService:
             user = self.users.find_one({"username_lower": username.lower()})
             if user and self._verify_password(password, user['password']):
                 print(f"[UserService] authenticate_user: Autenticación exitosa para '{username}' con MongoDB (usuario antiguo).")
+                self.invalidate_consent_cache(str(user['_id']))
                 return str(user['_id']), user['username']
 
         print(f"[UserService] authenticate_user: Autenticación fallida para '{username}'.")
         return None
 
     def get_user_consent(self, user_id: str) -> bool:
-        """Verifica el consentimiento del usuario, usando DB o JSON local."""
+        """
+        Verifica el consentimiento del usuario. El valor se consulta una vez por sesión
+        y se guarda en caché hasta que cambie (registro, inicio de sesión o `set_user_consent`).
+        """
+        if user_id in self._consent_cache:
+            self.consent_cache_hits += 1
+            return self._consent_cache[user_id]
+        self.consent_cache_misses += 1
+        consent = self._lookup_user_consent(user_id)
+        self._consent_cache[user_id] = consent
+        return consent
+
+    def invalidate_consent_cache(self, user_id: str | None = None):
+        """Olvida el consentimiento en caché de un usuario (o de todos)."""
+        if user_id is None:
+            self._consent_cache.clear()
+        else:
+            self._consent_cache.pop(user_id, None)
+
+    def get_consent_cache_stats(self) -> dict:
+        """Consultas de consentimiento evitadas (hits) y realizadas (misses)."""
+        return {
+            "hits": self.consent_cache_hits,
+            "misses": self.consent_cache_misses,
+            "users": len(self._consent_cache),
+        }
+
+    def set_user_consent(self, user_id: str, consent: bool) -> bool:
+        """Cambia el consentimiento del usuario en users.json y en MongoDB, y actualiza la caché."""
+        print(f"[UserService] set_user_consent: Consentimiento de '{user_id}' -> {consent}.")
+        updated = False
+        users_file_path = 'users.json'
+        try:
+            if os.path.exists(users_file_path):
+                with open(users_file_path, 'r') as f:
+                    data = json.load(f)
+                for user_data in data['users']:
+                    if user_data['id'] == user_id:
+                        user_data['share_data_consent'] = consent
+                        updated = True
+                if updated:
+                    with open(users_file_path, 'w') as f:
+                        json.dump(data, f, indent=4)
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"[UserService] set_user_consent: ❌ Error al procesar {users_file_path}: {e}")
+
+        if self.db is not None:
+            try:
+                result = self.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"share_data_consent": consent}})
+                updated = updated or result.matched_count > 0
+            except Exception as e:
+                print(f"Error al actualizar el consentimiento de {user_id}: {e}")
+
+        self.invalidate_consent_cache(user_id)
+        return updated
+
+    def _lookup_user_consent(self, user_id: str) -> bool:
+        """Consulta el consentimiento en la DB o en el JSON local, sin caché."""
         # Si la DB está conectada, es la fuente de verdad
         if self.db is not None:
             try:
@@ -464,88 +535,142 @@ class UserService:
         """Crea una nueva conversación para un usuario con los datos proporcionados."""
         print(f"[UserService] create_conversation: Creando nueva conversación para usuario '{user_id}'.")
         
-        if not self.get_user_consent(user_id):
-            return self.local_storage_service.create_conversation(user_id, conv_data)
+        if not self.get_user_consent(user_id) or self.db is None:
+            conversation_id = self.local_storage_service.create_conversation(user_id, conv_data)
+        else:
+            conv_data['user_id'] = user_id # Asegurarse de que el user_id está en los datos
+            result = self.conversations.insert_one(conv_data)
+            print(f"[UserService] create_conversation: Conversación creada con ID: {result.inserted_id}.")
+            conversation_id = str(result.inserted_id)
 
-        if self.db is None: 
-            return self.local_storage_service.create_conversation(user_id, conv_data)
-            
-        conv_data['user_id'] = user_id # Asegurarse de que el user_id está en los datos
-        result = self.conversations.insert_one(conv_data)
-        print(f"[UserService] create_conversation: Conversación creada con ID: {result.inserted_id}.")
-        return str(result.inserted_id)
+        if conversation_id:
+            self._update_search_index(self.search_index.index_conversation, user_id, conversation_id,
+                                      conv_data.get("messages"), conv_data.get("title"), conv_data.get("timestamp"))
+        return conversation_id
 
     def update_conversation(self, user_id: str, conversation_id: str, update_data: dict):
         """Actualiza una conversación existente."""
         print(f"[UserService] update_conversation: Actualizando conversación '{conversation_id}' para usuario '{user_id}'.")
         
-        if not self.get_user_consent(user_id):
-            return self.local_storage_service.update_conversation(user_id, conversation_id, update_data)
+        if not self.get_user_consent(user_id) or self.db is None:
+            result = self.local_storage_service.update_conversation(user_id, conversation_id, update_data)
+        else:
+            result = None
+            try:
+                self.conversations.update_one(
+                    {"_id": ObjectId(conversation_id), "user_id": user_id},
+                    {"$set": update_data}
+                )
+            except Exception as e:
+                print(f"Error al actualizar la conversación {conversation_id}: {e}")
+                return result
+
+        if result is not False:
+            if "messages" in update_data:
+                self._update_search_index(self.search_index.index_conversation, user_id, conversation_id,
+                                          update_data["messages"], update_data.get("title"), update_data.get("timestamp"))
+            elif update_data.get("title"):
+                self._update_search_index(self.search_index.set_title, user_id, conversation_id, update_data["title"])
+        return result
+
+    def append_messages(self, user_id: str, conversation_id: str, messages: list, update_data: dict | None = None) -> bool:
+        """
+        Añade mensajes al final de una conversación sin reenviar el historial completo
+        (diario local o `$push` en MongoDB). `update_data` actualiza a la vez otros campos.
+        """
+        print(f"[UserService] append_messages: {len(messages)} mensajes nuevos en '{conversation_id}' para usuario '{user_id}'.")
 
-        if self.db is None: 
-            return self.local_storage_service.update_conversation(user_id, conversation_id, update_data)
-            
-        try:
-            self.conversations.update_one(
-                {"_id": ObjectId(conversation_id), "user_id": user_id},
-                {"$set": update_data}
-            )
-        except Exception as e:
-            print(f"Error al actualizar la conversación {conversation_id}: {e}")
+        if not self.get_user_consent(user_id) or self.db is None:
+            appended = self.local_storage_service.append_messages(user_id, conversation_id, messages, update_data)
+        else:
+            update = {"$push": {"messages": {"$each": messages}}}
+            if update_data:
+                update["$set"] = update_data
+            try:
+                result = self.conversations.update_one({"_id": ObjectId(conversation_id), "user_id": user_id}, update)
+                appended = result.matched_count > 0
+            except Exception as e:
+                print(f"Error al añadir mensajes a la conversación {conversation_id}: {e}")
+                return False
 
-    def update_conversation_title(self, user_id: str, conversation_id: str, new_title: str) -> bool:
-        """Actualiza solo el título de una conversación."""
-        print(f"[UserService] update_conversation_title: Renombrando conversación '{conversation_id}' a '{new_title}'.")
-        
+        if appended:
+            update_data = update_data or {}
+            self._update_search_index(self.search_index.append_messages, user_id, conversation_id, messages,
+                                      update_data.get("title"), update_data.get("timestamp"))
+        return appended
+
+    def update_message(self, user_id: str, conversation_id: str, index: int, fields: dict) -> bool:
+        """Actualiza campos de un mensaje concreto (p. ej. su valoración) sin reescribir la conversación."""
         if not self.get_user_consent(user_id):
-            return self.local_storage_service.update_conversation(user_id, conversation_id, {"title": new_title})
+            return self.local_storage_service.update_message(user_id, conversation_id, index, fields)
 
         if self.db is None:
-            return self.local_storage_service.update_conversation(user_id, conversation_id, {"title": new_title})
+            return self.local_storage_service.update_message(user_id, conversation_id, index, fields)
 
         try:
             result = self.conversations.update_one(
                 {"_id": ObjectId(conversation_id), "user_id": user_id},
-                {"$set": {"title": new_title, "timestamp": datetime.now()}}
+                {"$set": {f"messages.{index}.{key}": value for key, value in fields.items()}}
             )
-            return result.modified_count > 0
+            return result.matched_count > 0
         except Exception as e:
-            print(f"Error al actualizar el título de la conversación {conversation_id}: {e}")
+            print(f"Error al actualizar el mensaje {index} de la conversación {conversation_id}: {e}")
             return False
 
+    def update_conversation_title(self, user_id: str, conversation_id: str, new_title: str) -> bool:
+        """Actualiza solo el título de una conversación."""
+        print(f"[UserService] update_conversation_title: Renombrando conversación '{conversation_id}' a '{new_title}'.")
+        
+        if not self.get_user_consent(user_id) or self.db is None:
+            renamed = self.local_storage_service.update_conversation(user_id, conversation_id, {"title": new_title})
+        else:
+            try:
+                result = self.conversations.update_one(
+                    {"_id": ObjectId(conversation_id), "user_id": user_id},
+                    {"$set": {"title": new_title, "timestamp": datetime.now()}}
+                )
+                renamed = result.modified_count > 0
+            except Exception as e:
+                print(f"Error al actualizar el título de la conversación {conversation_id}: {e}")
+                return False
+
+        if renamed:
+            self._update_search_index(self.search_index.set_title, user_id, conversation_id, new_title)
+        return renamed
+
     def delete_or_archive_conversation(self, user_id: str, conversation_id: str) -> bool:
         """Elimina una conversación de la base de datos."""
         print(f"[UserService] delete_or_archive_conversation: Eliminando conversación '{conversation_id}' para usuario '{user_id}'.")
         
-        if not self.get_user_consent(user_id):
-            return self.local_storage_service.delete_conversation(user_id, conversation_id)
+        if not self.get_user_consent(user_id) or self.db is None:
+            deleted = self.local_storage_service.delete_conversation(user_id, conversation_id)
+        else:
+            try:
+                result = self.conversations.delete_one({
+                    "_id": ObjectId(conversation_id),
+                    "user_id": user_id
+                })
+                print("[UserService] conversacion eliminada con éxito")
+                deleted = result.deleted_count > 0
+            except Exception as e:
+                print(f"Error al eliminar la conversación {conversation_id}: {e}")
+                return False
 
-        if self.db is None: 
-            return self.local_storage_service.delete_conversation(user_id, conversation_id)
-            
-        try:
-            result = self.conversations.delete_one({
-                "_id": ObjectId(conversation_id),
-                "user_id": user_id
-            })
-            print("[UserService] conversacion eliminada con éxito")
-            return result.deleted_count > 0
-        except Exception as e:
-            print(f"Error al eliminar la conversación {conversation_id}: {e}")
-            return False
+        self._update_search_index(self.search_index.remove_conversation, conversation_id)
+        return deleted
 
-    def get_user_conversations(self, user_id: str, limit: int = 0):
+    def get_user_conversations(self, user_id: str, limit: int = 0, offset: int = 0):
         """
         Obtiene las conversaciones de un usuario, ordenadas por fecha.
-        Acepta un límite opcional para obtener solo las más recientes.
+        Acepta un límite y un desplazamiento opcionales para paginar desde las más recientes.
         """
-        print(f"[UserService] get_user_conversations: Obteniendo conversaciones para usuario '{user_id}' (límite: {limit}).")
+        print(f"[UserService] get_user_conversations: Obteniendo conversaciones para usuario '{user_id}' (límite: {limit}, desde: {offset}).")
         
         if not self.get_user_consent(user_id):
-            return self.local_storage_service.get_user_conversations(user_id, limit)
+            return self.local_storage_service.get_user_conversations(user_id, limit, offset)
 
         if self.db is None: 
-            return self.local_storage_service.get_user_conversations(user_id, limit)
+            return self.local_storage_service.get_user_conversations(user_id, limit, offset)
             
         # Ordenar por timestamp descendente para obtener las más recientes primero
         query = self.conversations.find(
@@ -553,6 +678,8 @@ class UserService:
             {"messages": 0} # Excluir el campo de mensajes para que la carga sea más rápida
         ).sort("timestamp", DESCENDING)
 
+        if offset > 0:
+            query = query.skip(offset)
         if limit > 0:
             query = query.limit(limit)
             
@@ -571,3 +698,45 @@ class UserService:
         except Exception as e:
             print(f"Error al obtener detalles de la conversación {conversation_id}: {e}")
             return None
+
+    # --- Búsqueda en el historial ---
+
+    def _update_search_index(self, method, *args):
+        """Aplica un cambio al índice de búsqueda; un fallo del índice nunca impide guardar."""
+        try:
+            method(*args)
+        except sqlite3.Error as e:
+            print(f"[UserService] _update_search_index: ⚠️ No se pudo actualizar el índice de búsqueda: {e}")
+
+    def search_conversations(self, user_id: str, query: str, limit: int = 20) -> list:
+        """
+        Busca texto en el historial del usuario con el índice local. Devuelve una entrada por
+        conversación (_id, title, timestamp, snippet HTML...), de la más relevante a la menos.
+        """
+        try:
+            return self.search_index.search(user_id, query, limit)
+        except sqlite3.Error as e:
+            print(f"[UserService] search_conversations: ❌ Error en la búsqueda: {e}")
+            return []
+
+    def build_search_index(self, user_id: str) -> int:
+        """
+        Indexa una sola vez todo el historial que el usuario ya tenía antes de existir el
+        índice (las conversaciones a medio indexar se reindexan desde cero); después el índice
+        se mantiene al guardar. Devuelve cuántas se indexaron.
+        """
+        if self.search_index.is_user_indexed(user_id):
+            return 0
+        print(f"[UserService] build_search_index: Indexando el historial de '{user_id}'.")
+        indexed = 0
+        for conv in self.get_user_conversations(user_id):
+            conversation_id = str(conv.get("_id"))
+            details = self.get_conversation_details(user_id, conversation_id)
+            if not details:
+                continue
+            self._update_search_index(self.search_index.index_conversation, user_id, conversation_id,
+                                      details.get("messages"), details.get("title"), details.get("timestamp"))
+            indexed += 1
+        self.search_index.mark_user_indexed(user_id)
+        print(f"[UserService] build_search_index: {indexed} conversaciones indexadas.")
+        return indexed
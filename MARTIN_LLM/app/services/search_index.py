@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# app/services/search_index.py
+
+import re
+import html
+import sqlite3
+import threading
+from datetime import datetime
+
+SEARCH_INDEX_FILE_NAME = "search_index.sqlite3"
+
+# Marcadores del fragmento devuelto por FTS5: se sustituyen por <b> después de escapar el HTML.
+_MARK_START, _MARK_END = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _to_text(value) -> str | None:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def build_match_query(text: str) -> str:
+    """
+    Convierte lo que escribe el usuario en una consulta FTS5 segura: cada palabra entre
+    comillas (sin operadores ni sintaxis especial) y la última como prefijo, para que
+    los resultados aparezcan mientras se escribe.
+    """
+    tokens = _TOKEN.findall(text)
+    if not tokens:
+        return ""
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class ConversationSearchIndex:
+    """
+    Índice invertido local (SQLite FTS5) sobre el contenido de todas las conversaciones.
+
+    Cada mensaje es una fila del índice y el título de la conversación es una fila más
+    (posición -1). El índice se actualiza al mismo tiempo que se persiste la conversación
+    (`append_messages`, `index_conversation`, `set_title`, `remove_conversation`), así que
+    las búsquedas nunca abren los archivos ni los documentos de las conversaciones.
+    Funciona igual para conversaciones locales y de MongoDB.
+    """
+    TITLE_POSITION = -1
+    SNIPPET_TOKENS = 12
+    # Con palabras muy frecuentes, puntuar cada coincidencia de años de historial tardaría
+    # segundos: solo se ordenan por relevancia las coincidencias más recientes.
+    MAX_CANDIDATES = 500
+
+    def __init__(self, index_path: str):
+        print(f"[ConversationSearchIndex] __init__: Abriendo índice de búsqueda en '{index_path}'.")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self.available = True
+        try:
+            with self._lock, self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+                        content,
+                        conversation_id UNINDEXED,
+                        user_id UNINDEXED,
+                        role UNINDEXED,
+                        position UNINDEXED,
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                """)
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS conversations (
+                        conversation_id TEXT PRIMARY KEY,
+                        user_id TEXT NOT NULL,
+                        title TEXT,
+                        timestamp TEXT,
+                        message_count INTEGER NOT NULL DEFAULT 0,
+                        title_rowid INTEGER
+                    )
+                """)
+                self._db.execute("CREATE TABLE IF NOT EXISTS indexed_users (user_id TEXT PRIMARY KEY, indexed_at TEXT)")
+        except sqlite3.OperationalError as e:
+            # SQLite compilado sin FTS5: la aplicación sigue funcionando, sin búsqueda.
+            print(f"[ConversationSearchIndex] __init__: ⚠️ Búsqueda no disponible: {e}")
+            self.available = False
+
+    # --- Actualización del índice ---
+
+    def _insert_messages(self, user_id: str, conversation_id: str, messages: list, first_position: int):
+        rows = [
+            (message.get("content") or "", conversation_id, user_id, message.get("role", ""), first_position + i)
+            for i, message in enumerate(messages)
+            if isinstance(message, dict) and message.get("content")
+        ]
+        self._db.executemany(
+            "INSERT INTO messages (content, conversation_id, user_id, role, position) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _set_title(self, user_id: str, conversation_id: str, title: str):
+        """Sustituye la fila del título; se localiza por su rowid para no recorrer el índice."""
+        row = self._db.execute("SELECT title_rowid FROM conversations WHERE conversation_id = ?",
+                               (conversation_id,)).fetchone()
+        if row and row["title_rowid"] is not None:
+            self._db.execute("DELETE FROM messages WHERE rowid = ?", (row["title_rowid"],))
+        cursor = self._db.execute(
+            "INSERT INTO messages (content, conversation_id, user_id, role, position) VALUES (?, ?, ?, 'title', ?)",
+            (title, conversation_id, user_id, self.TITLE_POSITION))
+        self._db.execute("UPDATE conversations SET title = ?, title_rowid = ? WHERE conversation_id = ?",
+                         (title, cursor.lastrowid, conversation_id))
+
+    def index_conversation(self, user_id: str, conversation_id: str, messages: list | None,
+                           title: str | None = None, timestamp=None):
+        """Indexa (o reindexa desde cero) una conversación completa."""
+        if not self.available:
+            return
+        user_id, conversation_id = str(user_id), str(conversation_id)
+        messages = messages or []
+        with self._lock, self._db:
+            known = self._db.execute("SELECT 1 FROM conversations WHERE conversation_id = ?", (conversation_id,)).fetchone()
+            if known:
+                self._db.execute("DELETE FROM messages WHERE conversation_id = ? AND position >= 0", (conversation_id,))
+            self._insert_messages(user_id, conversation_id, messages, 0)
+            self._db.execute(
+                "INSERT INTO conversations (conversation_id, user_id, title, timestamp, message_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(conversation_id) DO UPDATE SET title = COALESCE(excluded.title, title), "
+                "timestamp = COALESCE(excluded.timestamp, timestamp), message_count = excluded.message_count",
+                (conversation_id, user_id, title, _to_text(timestamp), len(messages)))
+            if title is not None:
+                self._set_title(user_id, conversation_id, title)
+
+    def append_messages(self, user_id: str, conversation_id: str, messages: list,
+                        title: str | None = None, timestamp=None):
+        """Añade al índice los mensajes nuevos de una conversación ya indexada."""
+        if not self.available:
+            return
+        user_id, conversation_id = str(user_id), str(conversation_id)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT message_count, title FROM conversations WHERE conversation_id = ?",
+                                   (conversation_id,)).fetchone()
+            count = row["message_count"] if row else 0
+            self._insert_messages(user_id, conversation_id, messages, count)
+            self._db.execute(
+                "INSERT INTO conversations (conversation_id, user_id, title, timestamp, message_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(conversation_id) DO UPDATE SET title = COALESCE(excluded.title, title), "
+                "timestamp = COALESCE(excluded.timestamp, timestamp), message_count = excluded.message_count",
+                (conversation_id, user_id, title, _to_text(timestamp or datetime.now()), count + len(messages)))
+            if title is not None and (row is None or row["title"] != title):
+                self._set_title(user_id, conversation_id, title)
+
+    def set_title(self, user_id: str, conversation_id: str, title: str):
+        if not self.available:
+            return
+        user_id, conversation_id = str(user_id), str(conversation_id)
+        with self._lock, self._db:
+            self._set_title(user_id, conversation_id, title)
+
+    def remove_conversation(self, conversation_id: str):
+        if not self.available:
+            return
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM messages WHERE conversation_id = ?", (str(conversation_id),))
+            self._db.execute("DELETE FROM conversations WHERE conversation_id = ?", (str(conversation_id),))
+
+    def is_user_indexed(self, user_id: str) -> bool:
+        """Indica si ya se indexó el historial que el usuario tenía antes de existir el índice."""
+        if not self.available:
+            return True
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM indexed_users WHERE user_id = ?", (str(user_id),)).fetchone() is not None
+
+    def mark_user_indexed(self, user_id: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO indexed_users (user_id, indexed_at) VALUES (?, ?)",
+                             (str(user_id), datetime.now().isoformat()))
+
+    # --- Búsqueda ---
+
+    def search(self, user_id: str, text: str, limit: int = 20) -> list:
+        """
+        Busca `text` en las conversaciones del usuario. Devuelve una entrada por conversación,
+        de la más relevante a la menos (bm25), con un fragmento HTML del mejor mensaje en el
+        que las coincidencias van en <b>. Solo se puntúan las `MAX_CANDIDATES` coincidencias
+        más recientes.
+        """
+        query = build_match_query(text)
+        if not self.available or not query:
+            return []
+        with self._lock:
+            # rowid crece con cada inserción: acotarlo deja fuera las coincidencias más antiguas
+            # y FTS5 aplica el rango antes de calcular bm25.
+            cutoff = self._db.execute(
+                "SELECT rowid FROM messages WHERE messages MATCH ? AND user_id = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (query, str(user_id), self.MAX_CANDIDATES - 1),
+            ).fetchone()
+            # Una sola consulta: cada sentencia MATCH vuelve a leer la lista de coincidencias,
+            # así que pedir los fragmentos aparte costaría una lectura por resultado.
+            hits = self._db.execute(
+                "SELECT conversation_id, role, position, rank, snippet(messages, 0, ?, ?, '…', ?) AS snippet "
+                "FROM messages WHERE messages MATCH ? AND rowid >= ? AND user_id = ? ORDER BY rank",
+                (_MARK_START, _MARK_END, self.SNIPPET_TOKENS, query, cutoff[0] if cutoff else 0, str(user_id)),
+            ).fetchall()
+            best = {}
+            for hit in hits:
+                if hit["conversation_id"] not in best:
+                    best[hit["conversation_id"]] = hit
+                    if len(best) == limit:
+                        break
+            if not best:
+                return []
+            placeholders = ",".join("?" * len(best))
+            metadata = {
+                row["conversation_id"]: row for row in self._db.execute(
+                    f"SELECT conversation_id, title, timestamp FROM conversations WHERE conversation_id IN ({placeholders})",
+                    list(best),
+                )
+            }
+        results = []
+        for conversation_id, hit in best.items():
+            meta = metadata.get(conversation_id)
+            snippet = html.escape(hit["snippet"]).replace(_MARK_START, "<b>").replace(_MARK_END, "</b>")
+            results.append({
+                "_id": conversation_id,
+                "title": meta["title"] if meta else None,
+                "timestamp": meta["timestamp"] if meta else None,
+                "role": hit["role"],
+                "position": hit["position"],
+                "snippet": snippet,
+                "score": -hit["rank"],
+            })
+        return results
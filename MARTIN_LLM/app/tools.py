@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
 # app/tools.py
-import requests
-from bs4 import BeautifulSoup
-
 # Imports para carga dinámica
 import os
 import importlib
@@ -10,34 +7,40 @@ import inspect
 class BaseTool:
     name: str = "base_tool"
     description: str = "This is a base tool."
+    # Segundos que el agente espera el resultado antes de darlo por perdido.
+    timeout: float = 30.0
 
     def run(self, args: str) -> str:
         raise NotImplementedError("The run method must be implemented by a subclass.")
 
 class WebSearchTool(BaseTool):
     name = "web_search"
-    description = "Searches a given URL and returns the clean text content. Use this to get information from a webpage. Argument should be a valid URL."
-
-    def run(self, url: str) -> str:
-        try:
-            headers = {"User-Agent": "Mozilla/5.0"}
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # Remove script and style elements
-            for script_or_style in soup(["script", "style"]):
-                script_or_style.decompose()
-            text = soup.get_text()
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            clean_text = '\n'.join(chunk for chunk in chunks if chunk)
-            return f"Successfully retrieved content from {url}. Content (first 2000 chars):\n{clean_text[:2000]}"
-        except Exception as e:
-            return f"Error searching web for {url}: {e}"
+    description = "Searches a given URL and returns the clean text content. Use this to get information from a webpage. Argument should be a valid URL, or several URLs separated by spaces to fetch them at once."
+    MAX_CHARS = 2000
+    timeout = 45.0
+
+    def __init__(self, fetcher=None):
+        # Sesión y caché compartidas por todos los agentes salvo que se inyecte otra.
+        if fetcher is None:
+            from app.web_fetcher import web_fetcher as fetcher
+        self.fetcher = fetcher
+
+    def run(self, url) -> str:
+        # Solo se separa por espacios: una coma puede formar parte de la URL.
+        urls = url if isinstance(url, list) else str(url).split()
+        urls = [u for u in urls if u]
+        results = self.fetcher.fetch_many(urls)
+        return "\n\n".join(self._format(result) for result in results) if results else "Error: no URL was given."
+
+    def _format(self, result: dict) -> str:
+        if "error" in result:
+            return f"Error searching web for {result['url']}: {result['error']}"
+        return f"Successfully retrieved content from {result['url']}. Content (first {self.MAX_CHARS} chars):\n{result['text'][:self.MAX_CHARS]}"
 
 class CalculatorTool(BaseTool):
     name = "calculator"
     description = "A simple calculator. Use this to perform mathematical calculations. The argument MUST be ONLY the mathematical expression to evaluate (e.g., '2+2', '10 * (4/2)'). Do NOT include the answer or any extra text in the arguments."
+    timeout = 5.0
 
     def run(self, expression: str) -> str:
         try:
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# app/web_fetcher.py
+
+import re
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# lxml es mucho más rápido que html.parser; sin él se usa BeautifulSoup como antes.
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+# Importar la utilidad de rutas desde la raíz del proyecto.
+try:
+    from paths import get_app_data_dir
+except ImportError:
+    def get_app_data_dir():
+        data_dir = Path("data")
+        data_dir.mkdir(exist_ok=True)
+        return data_dir
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+_SKIPPED_TAGS = ("script", "style", "noscript", "template")
+
+
+def html_to_text(html: str, max_chars: int | None = None) -> str:
+    """
+    Texto visible de una página: una línea por bloque de texto, sin scripts ni estilos.
+    Con `max_chars` deja de recorrer el documento en cuanto tiene suficiente texto.
+    """
+    parts, total = [], 0
+    if lxml is not None:
+        try:
+            try:
+                doc = lxml.html.document_fromstring(html)
+            except ValueError: # cadena con declaración de codificación XML
+                doc = lxml.html.document_fromstring(html.encode("utf-8"))
+        except lxml.etree.ParserError: # documento vacío
+            return ""
+        lxml.etree.strip_elements(doc, *_SKIPPED_TAGS, lxml.etree.Comment, with_tail=False)
+        strings = doc.itertext()
+    else:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        for element in soup(list(_SKIPPED_TAGS)):
+            element.decompose()
+        strings = soup.stripped_strings
+    for string in strings:
+        for line in string.splitlines():
+            for phrase in line.split("  "):
+                phrase = phrase.strip()
+                if phrase:
+                    parts.append(phrase)
+                    total += len(phrase) + 1
+        if max_chars is not None and total >= max_chars:
+            break
+    text = "\n".join(parts)
+    return text[:max_chars] if max_chars is not None else text
+
+
+class WebFetcher:
+    """
+    Descarga páginas web y devuelve su texto, con una sesión HTTP compartida (conexiones
+    reutilizadas y reintentos ante errores transitorios) y una caché persistente en SQLite.
+
+    Una entrada de la caché se sirve sin red durante su vida útil (`max-age` de la respuesta
+    o `ttl`). Pasado ese tiempo se revalida con If-None-Match / If-Modified-Since: un 304
+    renueva la entrada sin volver a descargar ni procesar la página. Las entradas sin usar
+    durante `max_age` se eliminan, y nunca se guardan más de `max_entries`.
+    Se guarda el texto extraído, no el HTML, así que la caché ocupa poco.
+    """
+    CACHE_FILE = "web_cache.sqlite3"
+    DEFAULT_TTL = 3600
+    MAX_AGE = 7 * 24 * 3600
+    MAX_ENTRIES = 500
+    TIMEOUT = (5, 15) # conexión, lectura
+    MAX_DOWNLOAD_BYTES = 2 * 1024 * 1024
+    MAX_TEXT_CHARS = 20000
+    POOL_SIZE = 8
+    USER_AGENT = "Mozilla/5.0"
+
+    def __init__(self, cache_path=None, ttl: int = DEFAULT_TTL, max_age: int = MAX_AGE, max_entries: int = MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._db = None
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = self.USER_AGENT
+        retries = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE, max_retries=retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # --- Caché ---
+
+    def _open(self):
+        if self._db is not None:
+            return
+        if self.cache_path is None:
+            self.cache_path = get_app_data_dir() / self.CACHE_FILE
+        db = sqlite3.connect(str(self.cache_path), check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("""CREATE TABLE IF NOT EXISTS pages (
+                          url TEXT PRIMARY KEY, text TEXT, etag TEXT, last_modified TEXT,
+                          fetched_at REAL, expires_at REAL)""")
+        db.commit()
+        self._db = db
+
+    def _cached(self, url: str):
+        with self._lock:
+            self._open()
+            return self._db.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+
+    def _store(self, url: str, text: str, response, now: float):
+        cache_control = response.headers.get("Cache-Control", "")
+        if "no-store" in cache_control:
+            return
+        match = _MAX_AGE.search(cache_control)
+        lifetime = 0 if "no-cache" in cache_control else int(match.group(1)) if match else self.ttl
+        with self._lock:
+            self._open()
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                             (url, text, response.headers.get("ETag"), response.headers.get("Last-Modified"), now, now + lifetime))
+            self._evict(now)
+            self._db.commit()
+
+    def _renew(self, url: str, entry, response, now: float):
+        match = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+        lifetime = int(match.group(1)) if match else self.ttl
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ?, expires_at = ?, etag = COALESCE(?, etag) WHERE url = ?",
+                             (now, now + lifetime, response.headers.get("ETag"), url))
+            self._db.commit()
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM pages WHERE fetched_at < ?", (now - self.max_age,))
+        self._db.execute("""DELETE FROM pages WHERE url NOT IN (
+                                SELECT url FROM pages ORDER BY fetched_at DESC LIMIT ?)""", (self.max_entries,))
+
+    def clear_cache(self):
+        with self._lock:
+            self._open()
+            self._db.execute("DELETE FROM pages")
+            self._db.commit()
+
+    # --- Descarga ---
+
+    def _download(self, response) -> str:
+        """Lee el cuerpo como mucho hasta MAX_DOWNLOAD_BYTES; el texto útil suele estar al principio."""
+        body = bytearray()
+        for block in response.iter_content(64 * 1024):
+            body += block
+            if len(body) >= self.MAX_DOWNLOAD_BYTES:
+                break
+        response.close()
+        encoding = response.encoding or "utf-8"
+        if "charset" not in response.headers.get("Content-Type", "") and response.encoding == "ISO-8859-1":
+            encoding = "utf-8" # requests asume latin-1 en text/* sin charset; casi siempre es UTF-8
+        return bytes(body).decode(encoding, errors="replace")
+
+    def fetch(self, url: str) -> dict:
+        """
+        Devuelve {"url", "text", "cached"} con el texto de la página (como mucho MAX_TEXT_CHARS).
+        `cached` es "hit" (sin red), "revalidated" (304) o False. Lanza requests.RequestException
+        si la descarga falla.
+        """
+        now = time.time()
+        entry = self._cached(url)
+        if entry is not None and entry["expires_at"] > now:
+            return {"url": url, "text": entry["text"], "cached": "hit"}
+
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.session.get(url, headers=headers, timeout=self.TIMEOUT, stream=True)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self._renew(url, entry, response, now)
+            return {"url": url, "text": entry["text"], "cached": "revalidated"}
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        text = html_to_text(self._download(response), self.MAX_TEXT_CHARS)
+        self._store(url, text, response, now)
+        return {"url": url, "text": text, "cached": False}
+
+    def fetch_many(self, urls: list, max_workers: int = 4) -> list:
+        """
+        Descarga varias URL a la vez. Devuelve los resultados en el mismo orden; las que
+        fallan llevan {"url", "error"} en lugar de lanzar.
+        """
+        def fetch_one(url):
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                return {"url": url, "error": str(e)}
+
+        if len(urls) <= 1:
+            return [fetch_one(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(urls)), thread_name_prefix="web-fetch") as executor:
+            return list(executor.map(fetch_one, urls))
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# Instancia global compartida por las herramientas de todos los agentes.
+web_fetcher = WebFetcher()
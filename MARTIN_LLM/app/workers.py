@@ -1,20 +1,28 @@
 # -*- coding: utf-8 -*-
 # app/workers.py
 
+import os
 import time
+import threading
+from collections import OrderedDict
 from PyQt6.QtCore import QObject, pyqtSignal
 
 # --- WORKER PARA CHAT NORMAL ---
 class Worker(QObject):
     """Worker para ejecutar una consulta de chat en un hilo separado."""
+    partial_response = pyqtSignal(str) # texto acumulado hasta el momento
     response_ready = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, chat_engine, user_message, parent=None):
+    # Intervalo mínimo entre actualizaciones parciales para no saturar el hilo de la UI.
+    PARTIAL_UPDATE_INTERVAL = 0.05
+
+    def __init__(self, chat_engine, user_message, cancel_event: threading.Event | None = None, parent=None):
         print(f"[workers.py][Worker][__init__] Inicializando Worker con mensaje del usuario: {user_message}")
         super().__init__(parent)
         self.chat_engine = chat_engine
         self.user_message = user_message
+        self.cancel_event = cancel_event or threading.Event()
         print(f"[workers.py][Worker][__init__] chat_engine.provider: {self.chat_engine.provider}")
         print(f"[workers.py][Worker][__init__] chat_engine.history length: {len(self.chat_engine.history) if self.chat_engine.history else 'N/A'}")
 
@@ -23,12 +31,23 @@ class Worker(QObject):
             print(f"[Worker] Procesando mensaje del usuario: {self.user_message}")
             if not self.chat_engine.provider:
                 raise ValueError("El proveedor del modelo no está configurado en ChatEngine.")
-            response = self.chat_engine.provider.query(self.chat_engine.history)
+            response = ""
+            last_emit = 0.0
+            for chunk in self.chat_engine.provider.query_stream(self.chat_engine.get_full_prompt(), cancel_event=self.cancel_event):
+                response += chunk
+                now = time.monotonic()
+                if now - last_emit >= self.PARTIAL_UPDATE_INTERVAL:
+                    self.partial_response.emit(response)
+                    last_emit = now
             print(f"[Worker] Respuesta recibida: {response}")
             self.response_ready.emit(response)
         except Exception as e:
             self.error_occurred.emit(f"Error en el worker de chat: {e}")
 
+    def cancel(self):
+        """Solicita detener la generación en curso. Es seguro llamarlo desde otro hilo."""
+        self.cancel_event.set()
+
 # --- WORKER PARA MODO AGENTE ---
 class AgentWorker(QObject):
     """Worker para ejecutar el agente en un hilo separado."""
@@ -59,12 +78,19 @@ class AgentWorker(QObject):
 
 # --- WORKER PARA MODO RAZONADOR ---
 class ReasonerWorker(QObject):
-    """Worker para el modo razonador (Plan-and-Execute)."""
-    plan_ready = pyqtSignal(list)
+    """
+    Worker para el modo razonador (Plan-and-Execute). Los pasos del plan forman un grafo de
+    dependencias: los que no dependen entre sí se ejecutan a la vez, cada uno con su propio
+    agente y solo con los resultados de los pasos de los que depende.
+    """
+    plan_ready = pyqtSignal(list) # pasos {"id", "task", "depends_on"}
     step_result = pyqtSignal(int, str, str) # step_index, task, result
     response_ready = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
 
+    # Pasos ejecutándose a la vez como máximo.
+    MAX_PARALLEL_STEPS = 3
+
     def __init__(self, provider, user_objective, custom_prompt, parent=None):
         super().__init__(parent)
         self.provider = provider
@@ -73,29 +99,349 @@ class ReasonerWorker(QObject):
 
     def run(self):
         try:
-            from app.reasoner import Reasoner
+            from app.reasoner import Reasoner, execute_plan, build_step_task
             from app.agent import Agent
 
             planner = Reasoner(self.provider, custom_prompt=self.custom_prompt)
-            plan = planner.generate_plan(self.user_objective)
+            plan = planner.generate_plan_steps(self.user_objective)
 
             if not plan:
                 raise RuntimeError("El razonador no pudo generar un plan.")
             
             self.plan_ready.emit(plan)
 
-            executor_agent = Agent(self.provider, custom_prompt=self.custom_prompt)
-            final_result = ""
-            for i, task in enumerate(plan):
-                result = executor_agent.execute_task(task)
-                self.step_result.emit(i + 1, task, result)
-                final_result += f"Resultado del paso {i+1}: {result}\n\n"
+            # Los agentes se crean aquí, en secuencia: el registro de herramientas recarga módulos.
+            agents = {step["id"]: Agent(self.provider, custom_prompt=self.custom_prompt) for step in plan}
+            positions = {step["id"]: i + 1 for i, step in enumerate(plan)}
+
+            def run_step(step, upstream):
+                return agents[step["id"]].execute_task(build_step_task(step, upstream))
+
+            def on_step_done(step, result):
+                self.step_result.emit(positions[step["id"]], step["task"], result)
+
+            results = execute_plan(plan, run_step, max_workers=self.MAX_PARALLEL_STEPS, on_step_done=on_step_done)
+            final_result = "".join(f"Resultado del paso {positions[step['id']]}: {results[step['id']]}\n\n" for step in plan)
             
             self.response_ready.emit(f"Tarea completada. Resultados combinados:\n{final_result}")
 
         except Exception as e:
             self.error_occurred.emit(f"Error en el worker del razonador: {e}")
 
+# --- WORKER PARA CARGA DE MODELOS ---
+class _LoadCancelled(Exception):
+    pass
+
+class ModelLoadWorker(QObject):
+    """
+    Carga un modelo GGUF en segundo plano informando del progreso por etapas:
+    apertura del archivo, metadatos, precarga del archivo en memoria, carga de capas y,
+    la primera vez que se usa el modelo en esta máquina, un micro-benchmark de ajuste.
+
+    La cancelación se comprueba entre etapas y durante la precarga. La carga de capas la
+    hace la librería del modelo y no se puede interrumpir: si se cancela en esa etapa el
+    modelo queda en la caché de modelos pero no se activa.
+    """
+    progress = pyqtSignal(int, str) # porcentaje, descripción de la etapa
+    model_loaded = pyqtSignal(object)
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+    WARMUP_CHUNK_SIZE = 16 * 1024 * 1024
+    # Solo se precarga el archivo si cabe holgadamente en la memoria libre.
+    WARMUP_MEMORY_FACTOR = 1.5
+
+    def __init__(self, model_path, provider_kwargs=None, cancel_event: threading.Event | None = None, parent=None):
+        super().__init__(parent)
+        self.model_path = model_path
+        self.provider_kwargs = provider_kwargs or {}
+        self.cancel_event = cancel_event or threading.Event()
+
+    def cancel(self):
+        """Solicita cancelar la carga. Es seguro llamarlo desde otro hilo."""
+        self.cancel_event.set()
+
+    def _check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise _LoadCancelled()
+
+    def _warm_up(self, size: int, start: int, end: int):
+        """Lee el archivo de forma secuencial para dejarlo en la caché de páginas del sistema."""
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+        except ImportError:
+            available = 0
+        if size * self.WARMUP_MEMORY_FACTOR > available:
+            self.progress.emit(end, "Archivo mayor que la memoria libre: se omite la precarga.")
+            return
+
+        buffer = bytearray(self.WARMUP_CHUNK_SIZE)
+        read = 0
+        last_percent = -1
+        with open(self.model_path, "rb", buffering=0) as f:
+            while True:
+                self._check_cancelled()
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                read += n
+                percent = start + (end - start) * read // max(size, 1)
+                if percent != last_percent:
+                    self.progress.emit(percent, f"Mapeando archivo en memoria ({read // (1024 * 1024)} / {size // (1024 * 1024)} MB)...")
+                    last_percent = percent
+
+    def _autotune(self, provider, percent: int):
+        """La primera carga de cada modelo en esta máquina mide los hilos y el lote óptimos."""
+        if hasattr(provider, "autotune") and not provider.is_tuned:
+            self.progress.emit(percent, "Midiendo rendimiento (solo la primera vez)...")
+            provider.autotune(self.cancel_event)
+            self._check_cancelled()
+
+    def run(self):
+        from app.model_cache import model_cache
+        from app.gguf_metadata import gguf_index
+        from app.llm_providers import load_hardware_config
+
+        name = os.path.basename(self.model_path)
+        try:
+            hardware_config = load_hardware_config()
+            if model_cache.contains(self.model_path, hardware_config=hardware_config, **self.provider_kwargs):
+                provider = model_cache.get(self.model_path, hardware_config=hardware_config, **self.provider_kwargs)
+                # Si una carga anterior se canceló durante el ajuste, se termina ahora.
+                self._autotune(provider, 50)
+                self.progress.emit(100, f"{name} ya estaba en memoria.")
+                self.model_loaded.emit(provider)
+                return
+
+            self.progress.emit(5, f"Abriendo {name}...")
+            size = os.path.getsize(self.model_path)
+            self._check_cancelled()
+
+            self.progress.emit(10, "Leyendo metadatos GGUF...")
+            try:
+                info = gguf_index.info(self.model_path)
+                self.progress.emit(15, f"Arquitectura: {info['architecture'] or 'desconocida'}, "
+                                       f"{info['parameters'] or '?'} parámetros, {info['quant_type'] or '?'}, "
+                                       f"contexto: {info['context_length'] or '?'} tokens.")
+            except Exception as e:
+                print(f"[ModelLoadWorker] No se pudieron leer los metadatos de {name}: {e}")
+            self._check_cancelled()
+
+            self._warm_up(size, 15, 60)
+            self._check_cancelled()
+
+            gpu_layers = hardware_config.get("n_gpu_layers", 0)
+            if gpu_layers:
+                layers = "todas las capas" if gpu_layers < 0 else f"{gpu_layers} capas"
+                self.progress.emit(65, f"Cargando modelo ({layers} en GPU)...")
+            else:
+                self.progress.emit(65, "Cargando modelo en CPU...")
+            provider = model_cache.get(self.model_path, hardware_config=hardware_config, **self.provider_kwargs)
+            self._check_cancelled()
+
+            self._autotune(provider, 85)
+
+            self.progress.emit(100, "Modelo listo.")
+            self.model_loaded.emit(provider)
+        except _LoadCancelled:
+            print(f"[ModelLoadWorker] Carga de {name} cancelada.")
+            self.cancelled.emit()
+        except Exception as e:
+            self.error_occurred.emit(f"No se pudo cargar el modelo '{name}': {e}")
+        finally:
+            self.finished.emit()
+
+# --- WORKER PARA EXTRAER TEXTO DE ARCHIVOS ---
+class FileExtractionWorker(QObject):
+    """Extrae el texto de un archivo adjunto en segundo plano, informando del progreso."""
+    progress = pyqtSignal(int, str) # porcentaje, descripción
+    text_ready = pyqtSignal(str, str) # ruta del archivo, texto
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+    def __init__(self, file_path, cancel_event: threading.Event | None = None, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.cancel_event = cancel_event or threading.Event()
+        self._last_percent = -1
+
+    def cancel(self):
+        """Solicita cancelar la extracción. Es seguro llamarlo desde otro hilo."""
+        self.cancel_event.set()
+
+    def _report(self, done: int, total: int):
+        percent = done * 100 // max(total, 1)
+        if percent != self._last_percent:
+            self._last_percent = percent
+            self.progress.emit(percent, f"Extrayendo texto ({done} / {total})")
+
+    def run(self):
+        from app.services.file_processing_service import iter_text, ExtractionCancelled
+
+        name = os.path.basename(self.file_path)
+        try:
+            self.progress.emit(0, f"Leyendo {name}...")
+            parts = list(iter_text(self.file_path, progress=self._report, cancel_event=self.cancel_event))
+            self.text_ready.emit(self.file_path, "".join(parts))
+        except ExtractionCancelled:
+            print(f"[FileExtractionWorker] Extracción de {name} cancelada.")
+            self.cancelled.emit()
+        except Exception as e:
+            self.error_occurred.emit(f"No se pudo procesar el archivo: {e}")
+        finally:
+            self.finished.emit()
+
+# --- COLA DE TAREAS EN SEGUNDO PLANO ---
+class TaskQueueWorker(QObject):
+    """
+    Ejecuta en un hilo propio, en orden, las tareas que se le encolan.
+
+    Cada tarea se encola con una clave. Si llega otra tarea con la misma clave mientras la
+    anterior sigue pendiente, la sustituye conservando su turno. Los resultados se notifican
+    con señales.
+    """
+    task_finished = pyqtSignal(object, object) # clave, resultado
+    task_failed = pyqtSignal(object, str) # clave, mensaje de error
+    finished = pyqtSignal()
+    THREAD_NAME = "TaskQueueWorker"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._stopping = False
+        self._thread = None
+        self.coalesced = 0
+
+    def start(self):
+        """
+        Arranca el hilo. Es un hilo daemon para no retener nunca el cierre de la app;
+        el vaciado ordenado de la cola lo hace CleanupWorker con `flush` y `stop`.
+        """
+        self._thread = threading.Thread(target=self.run, name=self.THREAD_NAME, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, fn, *args) -> bool:
+        """Encola `fn(*args)`; sustituye la tarea pendiente con la misma clave. Es seguro desde cualquier hilo."""
+        with self._condition:
+            if self._stopping:
+                print(f"[{self.THREAD_NAME}] Tarea {key} descartada: el worker se está deteniendo.")
+                return False
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (fn, args)
+            self._condition.notify_all()
+        return True
+
+    def run(self):
+        """Ejecuta las tareas en orden hasta que se llame a `stop` y la cola quede vacía."""
+        print(f"[{self.THREAD_NAME}] Iniciado.")
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    break
+                key, (fn, args) = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                result = fn(*args)
+                self.task_finished.emit(key, result)
+            except Exception as e:
+                print(f"[{self.THREAD_NAME}] ❌ Error en la tarea {key}: {e}")
+                self.task_failed.emit(key, str(e))
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+        print(f"[{self.THREAD_NAME}] Detenido ({self.coalesced} tareas agrupadas).")
+        self.finished.emit()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Espera a que la cola se vacíe. Devuelve False si se agota el tiempo."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def stop(self):
+        """Deja de aceptar tareas; el hilo termina cuando ha ejecutado las pendientes."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+# --- WORKER PARA PERSISTENCIA ---
+class PersistenceWorker(TaskQueueWorker):
+    """
+    Escritor único en segundo plano para el servicio de persistencia (MongoDB o disco),
+    para que ninguna escritura ni consulta lenta bloquee el hilo de la interfaz.
+
+    Varios autoguardados de la misma conversación que se acumulan en la cola se reducen a
+    una sola escritura con el estado más reciente.
+    """
+    THREAD_NAME = "PersistenceWorker"
+
+    def __init__(self, persistence_service, parent=None):
+        super().__init__(parent)
+        self.persistence_service = persistence_service
+        # Estado guardado de cada conversación (save_key -> id y mensajes escritos).
+        # Solo lo usa el hilo del worker: al ser el único escritor, es la referencia fiable.
+        self._saved = {}
+
+    def save_conversation(self, user_id: str, save_key: str, snapshot: dict) -> bool:
+        """
+        Encola el guardado de una conversación. `snapshot` es una copia tomada en el hilo de
+        la interfaz: conversation_id, saved_count, history (lista copiada) y fields (título,
+        system_prompt, modelo, timestamp).
+        """
+        return self.submit(("save", save_key), self._write_conversation, user_id, save_key, snapshot)
+
+    def update_message(self, user_id: str, save_key: str, index: int, fields: dict) -> bool:
+        """Encola la actualización de un mensaje ya guardado (p. ej. su calificación)."""
+        return self.submit(("message", save_key, index), self._write_message, user_id, save_key, index, fields)
+
+    def _write_conversation(self, user_id: str, save_key: str, snapshot: dict) -> dict | None:
+        state = self._saved.setdefault(save_key, {
+            "conversation_id": snapshot["conversation_id"],
+            "saved_count": snapshot["saved_count"],
+        })
+        history = snapshot["history"]
+        fields = snapshot["fields"]
+        service = self.persistence_service
+
+        if not state["conversation_id"]:
+            conv_data = {"user_id": user_id, **fields, "messages": history, "metadata": {}}
+            new_id = service.create_conversation(user_id, conv_data)
+            if not new_id:
+                raise RuntimeError("No se pudo crear la conversación.")
+            state["conversation_id"] = new_id
+        elif len(history) < state["saved_count"]:
+            # El historial se reescribió: se guarda completo.
+            service.update_conversation(user_id, state["conversation_id"], {**fields, "messages": history})
+        elif not service.append_messages(user_id, state["conversation_id"], history[state["saved_count"]:], fields):
+            raise RuntimeError("No se pudieron añadir los mensajes; se reintentará en el próximo guardado.")
+        state["saved_count"] = len(history)
+        return {"save_key": save_key, **state, "title": fields.get("title"), "timestamp": fields.get("timestamp")}
+
+    def _write_message(self, user_id: str, save_key: str, index: int, fields: dict) -> bool:
+        state = self._saved.get(save_key)
+        if not state or index >= state["saved_count"]:
+            # El mensaje aún no está guardado: el próximo guardado lo escribirá con estos campos.
+            return False
+        return bool(self.persistence_service.update_message(user_id, state["conversation_id"], index, fields))
+
+# --- WORKER PARA EL ÍNDICE DE RECUPERACIÓN ---
+class IndexingWorker(TaskQueueWorker):
+    """
+    Cola propia para poner al día el índice de recuperación (conversaciones guardadas y
+    documentos adjuntos). Calcular embeddings puede tardar mucho; en su propio hilo nunca
+    retrasa un guardado. Al cerrar no se espera a la cola: lo que quede sin indexar se
+    recupera en la siguiente sincronización.
+    """
+    THREAD_NAME = "IndexingWorker"
+
 # --- WORKER PARA LIMPIEZA ---
 class CleanupWorker(QObject):
     """
@@ -103,16 +449,29 @@ class CleanupWorker(QObject):
     sin bloquear la interfaz de usuario.
     """
     finished = pyqtSignal()
+    PERSISTENCE_FLUSH_TIMEOUT = 15 # segundos
 
-    def __init__(self, ollama_manager=None, parent=None):
+    def __init__(self, ollama_manager=None, persistence_worker=None, indexing_worker=None, parent=None):
         super().__init__(parent)
+        self.persistence_worker = persistence_worker
+        self.indexing_worker = indexing_worker
 
     def run(self):
         """
         El método principal que realiza la limpieza.
         """
         print("[CleanupWorker] Iniciando limpieza...")
-        # No hay tareas de limpieza activas relacionadas con Ollama.
+        if self.indexing_worker is not None:
+            # La indexación pendiente no retiene el cierre.
+            self.indexing_worker.stop()
+        if self.persistence_worker is not None:
+            # Escribir los guardados pendientes antes de cerrar.
+            if not self.persistence_worker.flush(self.PERSISTENCE_FLUSH_TIMEOUT):
+                print("[CleanupWorker] ⚠️ La cola de persistencia no se vació a tiempo.")
+            self.persistence_worker.stop()
+        from app.model_cache import model_cache
+        # Libera los modelos cargados (y detiene los procesos servidor que hubiera).
+        model_cache.clear()
         # Se mantiene para la fluidez del diálogo de cierre.
         time.sleep(1)
         print("[CleanupWorker] Limpieza finalizada.")
@@ -32,12 +32,7 @@ def is_server_process_call():
     """
     # Este print es muy ruidoso, lo dejamos sin color o lo comentamos
     # print(f"[run.py]is_server_process_call() -> sys.argv: {sys.argv}")
-    if __name__ == '__main__':
-    # --- INICIO NORMAL DE LA APLICACIÓN GUI ---
-        from multiprocessing import freeze_support
-        freeze_support() # Necesario para la compatibilidad con multiprocessing en Windows
-        from main_qt import main
-        sys.exit(main())
+    return "--llama-server" in sys.argv[1:]
 
 if __name__ == '__main__':
     # print("[run.py] is_server_process_call():", is_server_process_call())
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+# ui/chat_history_view.py
+
+from collections import OrderedDict
+
+import qtawesome as qta
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QStyleOptionViewItem, QStyle, QTextBrowser, QAbstractItemView, QApplication, QMenu
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QRectF, QSize, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QKeySequence, QPalette, QTextDocument, QAbstractTextDocumentLayout
+
+from ui.markdown_renderer import markdown_renderer
+
+
+class ChatHistoryModel(QAbstractListModel):
+    """
+    Modelo con los mensajes del historial. Cada fila guarda el diccionario del mensaje
+    (el mismo objeto que ChatEngine.history, para que la calificación se vea al instante)
+    y si muestra los botones de valoración.
+    """
+    MessageRole = Qt.ItemDataRole.UserRole + 1
+    ShowRatingRole = Qt.ItemDataRole.UserRole + 2
+    StreamingRole = Qt.ItemDataRole.UserRole + 3
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def flags(self, index):
+        # Editable solo para poder abrir el visor de texto seleccionable con doble clic.
+        return super().flags(index) | Qt.ItemFlag.ItemIsEditable
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row["message"].get("content", "")
+        if role == self.MessageRole:
+            return row["message"]
+        if role == self.ShowRatingRole:
+            return row["show_rating"]
+        if role == self.StreamingRole:
+            return row.get("streaming", False)
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        return False # El visor es de solo lectura.
+
+    def message(self, row: int) -> dict:
+        return self._rows[row]["message"]
+
+    def append_message(self, message_obj: dict, show_rating: bool = True, streaming: bool = False) -> int:
+        """Añade un mensaje. `streaming` marca una respuesta que aún está creciendo."""
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._rows.append({"message": message_obj, "show_rating": show_rating, "streaming": streaming})
+        self.endInsertRows()
+        return row
+
+    def set_messages(self, messages: list, show_rating: bool = True):
+        self.beginResetModel()
+        self._rows = [{"message": message, "show_rating": show_rating} for message in messages]
+        self.endResetModel()
+
+    def replace_message(self, row: int, message_obj: dict, show_rating: bool = True):
+        self._rows[row] = {"message": message_obj, "show_rating": show_rating}
+        self.message_changed(row)
+
+    def set_content(self, row: int, content: str):
+        self._rows[row]["message"]["content"] = content
+        self.message_changed(row)
+
+    def message_changed(self, row: int):
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.beginResetModel()
+        self._rows = []
+        self.endResetModel()
+
+
+class ChatMessageDelegate(QStyledItemDelegate):
+    """
+    Dibuja cada mensaje como una burbuja con Markdown renderizado. Solo se renderizan las filas
+    que se pintan (las visibles); para el resto, la altura se estima a partir del texto y se
+    corrige cuando la fila llega a pintarse.
+    """
+    rating_clicked = pyqtSignal(int, str) # fila, "up" | "down"
+
+    ROLE_STYLES = {
+        "user": ("Tú", "#90cdf4"),
+        "assistant": ("Martin LLM", "#9ae6b4"),
+    }
+    BUBBLE_COLOR = "#2d3748"
+    SELECTED_BORDER_COLOR = "#4a90e2"
+    H_MARGIN = 15
+    SPACING = 15 # separación entre mensajes
+    LABEL_SPACING = 3
+    PADDING = 10 # relleno interior de la burbuja
+    RATING_HEIGHT = 32 # 2px de margen + botones de 30px
+    RATING_BUTTON = 30
+    MAX_DOCUMENTS = 64 # documentos renderizados en memoria (las filas visibles y algo más)
+    MAX_HEIGHTS = 10000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._documents = OrderedDict()
+        self._heights = OrderedDict()
+        self.hover = None # (fila, "up" | "down") bajo el ratón
+        self.rendered_count = 0
+        self._icons = {
+            (name, color): qta.icon(f"fa5s.thumbs-{name}", color=color)
+            for name in ("up", "down") for color in ("white", "#2ecc71", "#e74c3c")
+        }
+
+    # --- Geometría ---
+
+    def _label_font(self, option):
+        font = QFont(option.font)
+        font.setBold(True)
+        return font
+
+    def _column(self, rect: QRect, role: str) -> tuple[int, int]:
+        """Posición x y ancho de la columna del mensaje (a la derecha para el usuario)."""
+        inner = max(rect.width() - 2 * self.H_MARGIN, 1)
+        left_parts = 11 if role == "user" else 4
+        return rect.left() + self.H_MARGIN + inner * left_parts // 24, max(inner * 9 // 24, 2 * self.PADDING + 1)
+
+    def _text_width(self, rect: QRect, role: str) -> int:
+        return self._column(rect, role)[1] - 2 * self.PADDING
+
+    def _layout(self, option, index, content_height: int) -> dict:
+        message = index.data(ChatHistoryModel.MessageRole)
+        role = message.get("role", "unknown")
+        x, width = self._column(option.rect, role)
+        label_height = QFontMetrics(self._label_font(option)).height()
+        top = option.rect.top()
+        bubble = QRect(x, top + label_height + self.LABEL_SPACING, width, content_height + 2 * self.PADDING)
+        layout = {"label": QRect(x, top, width, label_height), "bubble": bubble}
+        if role == "assistant" and index.data(ChatHistoryModel.ShowRatingRole):
+            y = bubble.bottom() + 1 + 2
+            right = x + width - 5
+            layout["down"] = QRect(right - self.RATING_BUTTON, y, self.RATING_BUTTON, self.RATING_BUTTON)
+            layout["up"] = QRect(right - 2 * self.RATING_BUTTON - 5, y, self.RATING_BUTTON, self.RATING_BUTTON)
+        return layout
+
+    def _row_height(self, option, index, content_height: int) -> int:
+        message = index.data(ChatHistoryModel.MessageRole)
+        height = QFontMetrics(self._label_font(option)).height() + self.LABEL_SPACING + content_height + 2 * self.PADDING
+        if message.get("role") == "assistant" and index.data(ChatHistoryModel.ShowRatingRole):
+            height += self.RATING_HEIGHT
+        return height + self.SPACING
+
+    # --- Documentos renderizados ---
+
+    def document(self, content: str, text_width: int, font, streaming: bool = False) -> QTextDocument:
+        """Documento con el Markdown renderizado, reutilizado entre repintados (LRU)."""
+        key = (content, text_width)
+        document = self._documents.get(key)
+        if document is not None:
+            self._documents.move_to_end(key)
+            return document
+        # El HTML sale de la caché compartida; durante el streaming solo se convierte el último bloque.
+        html = markdown_renderer.render_streaming(content) if streaming else markdown_renderer.render(content)
+        document = QTextDocument()
+        document.setDefaultFont(font)
+        document.setDocumentMargin(0)
+        document.setHtml(html)
+        document.setTextWidth(text_width)
+        self.rendered_count += 1
+        self._documents[key] = document
+        if len(self._documents) > self.MAX_DOCUMENTS:
+            self._documents.popitem(last=False)
+        self._remember_height(key, int(document.size().height()))
+        return document
+
+    def _remember_height(self, key, height: int):
+        self._heights[key] = height
+        self._heights.move_to_end(key)
+        if len(self._heights) > self.MAX_HEIGHTS:
+            self._heights.popitem(last=False)
+
+    def _estimate_height(self, content: str, text_width: int, font) -> int:
+        """Altura aproximada del texto sin renderizarlo: líneas envueltas por el ancho medio de carácter."""
+        metrics = QFontMetrics(font)
+        chars_per_line = max(text_width // max(metrics.averageCharWidth(), 1), 1)
+        lines = sum(max(1, -(-len(line) // chars_per_line)) for line in content.split("\n"))
+        return lines * metrics.lineSpacing()
+
+    def content_height(self, content: str, text_width: int, font) -> tuple[int, bool]:
+        """Altura del contenido y si es exacta (ya se renderizó con este ancho) o estimada."""
+        height = self._heights.get((content, text_width))
+        if height is not None:
+            return height, True
+        return self._estimate_height(content, text_width, font), False
+
+    # --- QStyledItemDelegate ---
+
+    def _view_rect(self, option) -> QRect:
+        view = self.parent()
+        if isinstance(view, QAbstractItemView):
+            return QRect(0, 0, view.viewport().width(), 0)
+        return option.rect
+
+    def sizeHint(self, option, index):
+        rect = self._view_rect(option)
+        message = index.data(ChatHistoryModel.MessageRole)
+        text_width = self._text_width(rect, message.get("role", "unknown"))
+        height, _ = self.content_height(message.get("content", ""), text_width, option.font)
+        return QSize(rect.width(), self._row_height(option, index, height))
+
+    def paint(self, painter, option, index):
+        message = index.data(ChatHistoryModel.MessageRole)
+        role = message.get("role", "unknown")
+        content = message.get("content", "")
+        text_width = self._text_width(option.rect, role)
+        _, exact = self.content_height(content, text_width, option.font)
+        document = self.document(content, text_width, option.font, index.data(ChatHistoryModel.StreamingRole))
+        content_height = int(document.size().height())
+        if not exact:
+            # La fila se colocó con una altura estimada: pedir que se recoloque con la real.
+            self.sizeHintChanged.emit(index)
+        layout = self._layout(option, index, content_height)
+
+        painter.save()
+        painter.setRenderHint(painter.RenderHint.Antialiasing)
+
+        display_role, color = self.ROLE_STYLES.get(role, (role.capitalize(), "#e1e5e9"))
+        painter.setFont(self._label_font(option))
+        painter.setPen(QColor(color))
+        alignment = Qt.AlignmentFlag.AlignRight if role == "user" else Qt.AlignmentFlag.AlignLeft
+        painter.drawText(layout["label"], alignment | Qt.AlignmentFlag.AlignVCenter, display_role)
+
+        bubble = layout["bubble"]
+        if option.state & QStyle.StateFlag.State_Selected:
+            painter.setPen(QColor(self.SELECTED_BORDER_COLOR))
+        else:
+            painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(self.BUBBLE_COLOR))
+        painter.drawRoundedRect(QRectF(bubble), 8, 8)
+
+        painter.translate(bubble.left() + self.PADDING, bubble.top() + self.PADDING)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(QPalette.ColorRole.Text, QColor("white"))
+        context.clip = QRectF(0, 0, text_width, content_height)
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+        if "up" in layout:
+            self._paint_rating(painter, index.row(), message.get("rating"), layout)
+
+    def _paint_rating(self, painter, row: int, rating, layout: dict):
+        """Pulgares arriba/abajo: el elegido queda en color fijo; sin elegir, se colorean al pasar el ratón."""
+        colors = {"up": "#2ecc71", "down": "#e74c3c"}
+        for name in ("up", "down"):
+            highlighted = rating == name or (rating is None and self.hover == (row, name))
+            icon = self._icons[(name, colors[name] if highlighted else "white")]
+            icon.paint(painter, layout[name].adjusted(7, 7, -7, -7))
+
+    def rating_at(self, option, index, pos):
+        """Botón de valoración ("up"/"down") bajo `pos`, o None."""
+        message = index.data(ChatHistoryModel.MessageRole)
+        text_width = self._text_width(option.rect, message.get("role", "unknown"))
+        height, _ = self.content_height(message.get("content", ""), text_width, option.font)
+        layout = self._layout(option, index, height)
+        for name in ("up", "down"):
+            if name in layout and layout[name].contains(pos):
+                return name
+        return None
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == event.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            rating = self.rating_at(option, index, event.position().toPoint())
+            if rating:
+                # Una vez calificado, la valoración queda fija.
+                if index.data(ChatHistoryModel.MessageRole).get("rating") is None:
+                    self.rating_clicked.emit(index.row(), rating)
+                return True
+        return super().editorEvent(event, model, option, index)
+
+    def createEditor(self, parent, option, index):
+        """Visor de solo lectura para seleccionar y copiar parte del texto (doble clic)."""
+        editor = QTextBrowser(parent)
+        editor.setOpenExternalLinks(True)
+        editor.setFrameShape(QTextBrowser.Shape.NoFrame)
+        editor.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        editor.setStyleSheet(f"QTextBrowser {{ background-color: {self.BUBBLE_COLOR}; color: white; "
+                             f"border: 1px solid {self.SELECTED_BORDER_COLOR}; border-radius: 8px; }}")
+        editor.document().setDocumentMargin(self.PADDING - 1)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setHtml(markdown_renderer.render(index.data(Qt.ItemDataRole.DisplayRole)))
+
+    def setModelData(self, editor, model, index):
+        pass
+
+    def updateEditorGeometry(self, editor, option, index):
+        message = index.data(ChatHistoryModel.MessageRole)
+        text_width = self._text_width(option.rect, message.get("role", "unknown"))
+        height, _ = self.content_height(message.get("content", ""), text_width, option.font)
+        editor.setGeometry(self._layout(option, index, height)["bubble"])
+
+
+class ChatHistoryView(QListView):
+    """
+    Historial de chat virtualizado: un QListView con ChatHistoryModel y ChatMessageDelegate.
+    Solo se crean y pintan los mensajes visibles, así que abrir conversaciones largas no
+    construye un widget por mensaje.
+    """
+    rating_requested = pyqtSignal(int, str) # fila, "up" | "down"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("chatHistoryView")
+        self.setModel(ChatHistoryModel(self))
+        self.delegate = ChatMessageDelegate(self)
+        self.setItemDelegate(self.delegate)
+        self.delegate.rating_clicked.connect(self.rating_requested)
+
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked)
+        self.setUniformItemSizes(False)
+        self.setMouseTracking(True)
+        self.verticalScrollBar().setSingleStep(20)
+
+        # Mantener la vista pegada al final mientras llegan mensajes o se corrigen alturas.
+        self._stick_to_bottom = True
+        self.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+        self.verticalScrollBar().rangeChanged.connect(self._on_range_changed)
+
+    def _on_scrolled(self, value):
+        self._stick_to_bottom = value >= self.verticalScrollBar().maximum() - 4
+
+    def _on_range_changed(self, minimum, maximum):
+        if self._stick_to_bottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def scrollToBottom(self):
+        self._stick_to_bottom = True
+        super().scrollToBottom()
+
+    def selected_text(self) -> str:
+        rows = sorted(index.row() for index in self.selectionModel().selectedIndexes())
+        return "\n\n".join(self.model().message(row).get("content", "") for row in rows)
+
+    def copy_selection(self):
+        text = self.selected_text()
+        if text:
+            QApplication.clipboard().setText(text)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.StandardKey.Copy):
+            self.copy_selection()
+            return
+        super().keyPressEvent(event)
+
+    def contextMenuEvent(self, event):
+        index = self.indexAt(event.pos())
+        if not index.isValid():
+            return
+        if not self.selectionModel().isSelected(index):
+            self.setCurrentIndex(index)
+        menu = QMenu(self)
+        menu.addAction("Copiar", self.copy_selection)
+        menu.addAction("Seleccionar texto", lambda: self.edit(index))
+        menu.exec(event.globalPos())
+
+    def mouseMoveEvent(self, event):
+        pos = event.position().toPoint()
+        index = self.indexAt(pos)
+        hover = None
+        if index.isValid():
+            option = QStyleOptionViewItem()
+            self.initViewItemOption(option)
+            option.rect = self.visualRect(index)
+            rating = self.delegate.rating_at(option, index, pos)
+            hover = (index.row(), rating) if rating else None
+        if hover != self.delegate.hover:
+            self.delegate.hover = hover
+            self.setCursor(Qt.CursorShape.PointingHandCursor if hover else Qt.CursorShape.ArrowCursor)
+            self.viewport().update()
+        super().mouseMoveEvent(event)
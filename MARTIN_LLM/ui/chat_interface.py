@@ -2,13 +2,14 @@
 # ui/chat_interface.py
 
 import sys
+import threading
 from pathlib import Path
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QRadioButton, QSpacerItem, QComboBox, QInputDialog,
     QButtonGroup, QGraphicsBlurEffect,
     QTextEdit, QLineEdit, QPushButton, QLabel, QCheckBox,
-    QMessageBox, QFrame, QSplitter, QListWidget,
-    QListWidgetItem, QFileDialog, QApplication, QSizePolicy, QToolButton, QProgressBar, QScrollArea,
+    QMessageBox, QFrame, QSplitter,
+    QFileDialog, QApplication, QSizePolicy, QToolButton, QProgressBar,
     QGraphicsOpacityEffect
     
 )
@@ -21,13 +22,18 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QObject
 from PyQt6.QtGui import QFont, QColor, QTextCursor, QTextCharFormat, QIcon, QPixmap
-import markdown
 from app.llm_providers import BaseLLMProvider
 from app.chat_engine import ChatEngine, SYSTEM_PROMPT
 from app.services.login_service import UserService
 from app.llm_providers import CtransformersProvider
+from app.model_cache import model_cache
+from app.gguf_metadata import gguf_index
+from app.retrieval import RetrievalIndex
 from ui.process_log_window import ProcessLogWindow
-from app.workers import Worker, AgentWorker, ReasonerWorker, CleanupWorker
+from ui.chat_history_view import ChatHistoryView
+from ui.recent_conversations import RecentConversationsModel, RecentConversationsView, display_title
+from ui.conversation_search import SearchResultsModel, SearchResultsView
+from app.workers import Worker, AgentWorker, ReasonerWorker, CleanupWorker, ModelLoadWorker, PersistenceWorker, IndexingWorker, FileExtractionWorker
 from ui.model_manager_widget import ModelManagerWidget
 from ui.llm_parameters_widget import LLMParametersWidget
 from ui.closing_dialog import ClosingDialog
@@ -36,7 +42,14 @@ from bson.objectid import ObjectId
 from .custom_widgets import FramelessWindowMixin, CustomTitleBar, FadeInMixin, show_critical_message, show_warning_message, show_information_message, show_question_message, show_detailed_error_message
 import json
 from datetime import datetime, date, timedelta
-from collections import OrderedDict
+
+# Espera tras la última tecla antes de lanzar la búsqueda en el historial.
+SEARCH_DEBOUNCE_MS = 250
+
+# Hilos de limpieza y de extracción de archivos en curso. Se guardan aquí y no en la ventana:
+# si la ventana se destruye antes de que terminen, Qt aborta el proceso al destruir un QThread
+# en ejecución.
+_background_jobs = set()
 
 
 class ModelComboBox(QComboBox):
@@ -239,11 +252,35 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.stats_timer = None
         self.worker_thread = None
         self.running_animations = [] # Lista para mantener las animaciones vivas
+        # Estado de la respuesta que se está transmitiendo token a token
+        self.stream_cancel_event = None
+        self.streaming_row = None # fila provisional del historial durante el streaming
+        # Carga de modelos en segundo plano
+        self.model_load_worker = None
+        self.model_load_callback = None
+        self.model_load_threads = set()
+        # Extracción del texto del archivo adjunto en segundo plano
+        self.file_extraction_worker = None
+        # Texto del último archivo adjunto (nombre, texto); se envía con el próximo mensaje.
+        self.attached_file = None
         
         # Usamos las instancias pasadas por el controlador
         self.chat_engine = chat_engine
         self.user_service = user_service
         self.persistence_service = self.user_service # Persistence is now always through UserService
+        # Las escrituras y consultas de persistencia se hacen en un hilo aparte.
+        self.persistence_worker = PersistenceWorker(self.persistence_service)
+        self.persistence_worker.task_finished.connect(self.on_persistence_task_finished)
+        self.persistence_worker.task_failed.connect(self.on_persistence_task_failed)
+        self.persistence_worker.start()
+        # Índice de recuperación (RAG) de las conversaciones y documentos del usuario. Se pone
+        # al día en su propio hilo para que calcular embeddings nunca retrase un guardado.
+        self.retrieval_index = RetrievalIndex.for_user(self.user_id)
+        self.indexing_worker = IndexingWorker()
+        self.indexing_worker.task_failed.connect(self.on_indexing_task_failed)
+        self.indexing_worker.start()
+        if self.chat_engine:
+            self.chat_engine.retriever = self.retrieval_index
         self.cleanup_in_progress = False
         self.is_ready_to_close = False
         self._init_frameless_mixin()
@@ -298,6 +335,7 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.setup_ui()
         self.populate_installed_models_combo()
         self.populate_recent_conversations()
+        self.sync_retrieval_index()
         # self.setup_stats_timer()
         print("[ChatInterface] __init__: Inicialización síncrona completada.")
 
@@ -438,24 +476,11 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         chat_layout.setContentsMargins(20, 0, 20, 0) # Reducido el padding horizontal para un área de chat más ancha
         chat_layout.setSpacing(10)
 
-        # Create a scroll area for chat history
-        self.history_scroll_area = QScrollArea()
-        self.history_scroll_area.setWidgetResizable(True)
-        self.history_scroll_area.setObjectName("historyScrollArea")
-
-        # Widget que contendrá la lista de mensajes y los stretches para centrar
-        self.history_content_widget = QWidget()
-        self.history_layout = QVBoxLayout(self.history_content_widget)
-        self.history_layout.setContentsMargins(15, 5, 15, 5)
-        self.history_layout.setSpacing(15)
-
-        # Añadir stretches para centrar verticalmente el contenido.
-        # Los mensajes se insertarán entre estos dos stretches.
-        self.history_layout.addStretch(1)
-        self.history_layout.addStretch(1)
-
-        self.history_scroll_area.setWidget(self.history_content_widget)
-        chat_layout.addWidget(self.history_scroll_area, stretch=1)
+        # Historial virtualizado: solo se dibujan los mensajes visibles.
+        self.history_view = ChatHistoryView()
+        self.history_model = self.history_view.model()
+        self.history_view.rating_requested.connect(self.on_message_rated)
+        chat_layout.addWidget(self.history_view, stretch=1)
 
         # Indicador de carga
         self.loading_indicator = QProgressBar()
@@ -471,6 +496,57 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         progress_layout.addStretch()
         chat_layout.addLayout(progress_layout)
 
+        # Progreso de la carga de un modelo (se puede seguir chateando con el anterior)
+        self.model_load_frame = QFrame()
+        model_load_layout = QHBoxLayout(self.model_load_frame)
+        model_load_layout.setContentsMargins(150, 0, 150, 0)
+        self.model_load_label = QLabel()
+        self.model_load_progress = QProgressBar()
+        self.model_load_progress.setRange(0, 100)
+        self.model_load_progress.setFixedHeight(20)
+        self.model_load_cancel_button = QToolButton()
+        self.model_load_cancel_button.setIcon(qta.icon("fa5s.times", color="white"))
+        self.model_load_cancel_button.setToolTip("Cancelar la carga del modelo")
+        self.model_load_cancel_button.clicked.connect(self.cancel_model_load)
+        model_load_layout.addWidget(self.model_load_label)
+        model_load_layout.addWidget(self.model_load_progress, stretch=1)
+        model_load_layout.addWidget(self.model_load_cancel_button)
+        self.model_load_frame.setVisible(False)
+        chat_layout.addWidget(self.model_load_frame)
+
+        # Progreso de la extracción del texto de un archivo adjunto
+        self.file_extraction_frame = QFrame()
+        file_extraction_layout = QHBoxLayout(self.file_extraction_frame)
+        file_extraction_layout.setContentsMargins(150, 0, 150, 0)
+        self.file_extraction_label = QLabel()
+        self.file_extraction_progress = QProgressBar()
+        self.file_extraction_progress.setRange(0, 100)
+        self.file_extraction_progress.setFixedHeight(20)
+        self.file_extraction_cancel_button = QToolButton()
+        self.file_extraction_cancel_button.setIcon(qta.icon("fa5s.times", color="white"))
+        self.file_extraction_cancel_button.setToolTip("Cancelar la lectura del archivo")
+        self.file_extraction_cancel_button.clicked.connect(self.cancel_file_extraction)
+        file_extraction_layout.addWidget(self.file_extraction_label)
+        file_extraction_layout.addWidget(self.file_extraction_progress, stretch=1)
+        file_extraction_layout.addWidget(self.file_extraction_cancel_button)
+        self.file_extraction_frame.setVisible(False)
+        chat_layout.addWidget(self.file_extraction_frame)
+
+        # Archivo adjunto pendiente de enviar. Su texto no se pega en el cuadro de entrada:
+        # un documento de cientos de páginas bloquearía el QTextEdit.
+        self.attachment_frame = QFrame()
+        attachment_layout = QHBoxLayout(self.attachment_frame)
+        attachment_layout.setContentsMargins(150, 0, 150, 0)
+        self.attachment_label = QLabel()
+        self.attachment_remove_button = QToolButton()
+        self.attachment_remove_button.setIcon(qta.icon("fa5s.times", color="white"))
+        self.attachment_remove_button.setToolTip("Quitar el archivo adjunto")
+        self.attachment_remove_button.clicked.connect(self.clear_attachment)
+        attachment_layout.addWidget(self.attachment_label, stretch=1)
+        attachment_layout.addWidget(self.attachment_remove_button)
+        self.attachment_frame.setVisible(False)
+        chat_layout.addWidget(self.attachment_frame)
+
         # Input Frame
         input_frame = QFrame()
         input_layout = QVBoxLayout(input_frame)
@@ -598,10 +674,9 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.conv_title_label = QLabel("Chats")
         self.conv_title_label.setObjectName("panelTitle")
         left_panel_layout.addWidget(self.conv_title_label)
-        self.recent_convs_list = QListWidget()
-        self.recent_convs_list.setObjectName("recentConvsList")
-        self.recent_convs_list.itemDoubleClicked.connect(self.on_recent_conversation_selected)
-        left_panel_layout.addWidget(self.recent_convs_list)
+        left_panel_layout.addWidget(self._create_conversation_search())
+        left_panel_layout.addWidget(self._create_recent_conversations_list())
+        left_panel_layout.addWidget(self.search_results_list)
         return conversations_widget
 
     def toggle_left_panel(self):
@@ -779,174 +854,146 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         title_label.setObjectName("panelTitle")
         left_panel_layout.addWidget(title_label)
         
-        self.recent_convs_list = QListWidget()
-        self.recent_convs_list.setObjectName("recentConvsList")
-        self.recent_convs_list.itemDoubleClicked.connect(self.on_recent_conversation_selected)
-        left_panel_layout.addWidget(self.recent_convs_list)
+        left_panel_layout.addWidget(self._create_recent_conversations_list())
         return left_panel_widget
     
+    def _create_recent_conversations_list(self):
+        """Lista paginada de conversaciones recientes (las páginas se piden en segundo plano)."""
+        self.recent_convs_model = RecentConversationsModel(self)
+        self.recent_convs_model.page_requested.connect(self._request_conversations_page)
+        self.recent_convs_list = RecentConversationsView()
+        self.recent_convs_list.setModel(self.recent_convs_model)
+        self.recent_convs_list.conversation_activated.connect(self.load_selected_conversation)
+        self.recent_convs_list.delegate.rename_clicked.connect(self.rename_recent_conversation)
+        self.recent_convs_list.delegate.delete_clicked.connect(self.delete_recent_conversation)
+        return self.recent_convs_list
+
     def populate_recent_conversations(self):
-        """Carga las conversaciones del usuario en la lista, ordenadas por fecha."""
-        print("[DEBUG] populate_recent_conversations: Iniciando...")
-        try:
-            self.recent_convs_list.clear()
-            print(f"[DEBUG] populate_recent_conversations: Llamando a self.persistence_service.get_user_conversations para user_id: {self.user_id}")
-            conversations = self.persistence_service.get_user_conversations(self.user_id)
-            print(f"[DEBUG] populate_recent_conversations: Datos recibidos de get_user_conversations: {conversations}")
+        """Recarga la lista de conversaciones desde la primera página."""
+        self.recent_convs_model.reset()
+
+    def _create_conversation_search(self):
+        """Caja de búsqueda en el historial; los resultados sustituyen a la lista mientras hay texto."""
+        self.conversation_search_box = QLineEdit()
+        self.conversation_search_box.setObjectName("conversationSearchBox")
+        self.conversation_search_box.setPlaceholderText("Buscar en las conversaciones...")
+        self.conversation_search_box.setClearButtonEnabled(True)
+        self.search_results_model = SearchResultsModel(self)
+        self.search_results_list = SearchResultsView()
+        self.search_results_list.setModel(self.search_results_model)
+        self.search_results_list.conversation_activated.connect(self.load_selected_conversation)
+        self.search_results_list.hide()
+        # Se busca cuando el usuario deja de escribir un momento, no en cada tecla.
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.search_conversations)
+        self.conversation_search_box.textChanged.connect(self.search_timer.start)
+        self.search_index_requested = False
+        return self.conversation_search_box
+
+    def search_conversations(self):
+        """Busca el texto de la caja en el índice local y muestra los resultados."""
+        query = self.conversation_search_box.text()
+        searching = bool(query.strip())
+        if searching and not self.search_index_requested:
+            # La primera búsqueda indexa (una sola vez por usuario y en segundo plano) el
+            # historial anterior al índice; al terminar se repite la búsqueda.
+            self.search_index_requested = True
+            self.persistence_worker.submit(("index",), self.persistence_service.build_search_index, self.user_id)
+        results = self.persistence_service.search_conversations(self.user_id, query) if searching else []
+        self.search_results_model.set_results(results, query)
+        self.search_results_list.setVisible(searching)
+        self.recent_convs_list.setVisible(not searching)
+
+    def _request_conversations_page(self, generation, offset, limit):
+        """Pide al backend (en segundo plano) una página de conversaciones ya ordenada."""
+        self.persistence_worker.submit(("list", generation, offset, limit),
+                                       self.persistence_service.get_user_conversations,
+                                       self.user_id, limit, offset)
+
+    def on_persistence_task_finished(self, key, result):
+        """Recibe en el hilo de la interfaz el resultado de una tarea de persistencia."""
+        kind = key[0]
+        if kind == "list":
+            _, generation, _, limit = key
+            self._update_left_panel_width(self.recent_convs_model.add_page(generation, result or [], limit))
+        elif kind == "save":
+            if self.chat_engine and self.chat_engine.save_key == result["save_key"]:
+                self.chat_engine.conversation_id = result["conversation_id"]
+                self.chat_engine.saved_message_count = result["saved_count"]
+            conv = {"_id": result["conversation_id"], "title": result["title"], "timestamp": result["timestamp"]}
+            self.recent_convs_model.upsert(conv)
+            self._update_left_panel_width([conv])
+            # Solo se indexa la conversación guardada, no todo el listado.
+            self.indexing_worker.submit(("retrieval", result["conversation_id"]), self.retrieval_index.sync_conversation,
+                                        self.persistence_service, self.user_id, result["conversation_id"])
+        elif kind == "rename":
+            _, conversation_id, new_title = key
+            if result:
+                print(f"[DEBUG][chat_interface.py][ChatInterface] rename_recent_conversation: ✅ Conversación ID: {conversation_id} renombrada a '{new_title}'")
+                self.recent_convs_model.rename(conversation_id, new_title)
+                if self.chat_engine and self.chat_engine.conversation_id == conversation_id:
+                    self.chat_engine.title = new_title
+            else:
+                print(f"[DEBUG] rename_recent_conversation: ❌ Error al renombrar conversación ID: {conversation_id}")
+                show_critical_message(self, "Error", "No se pudo renombrar la conversación.")
+        elif kind == "index":
+            if result:
+                print(f"[ChatInterface] build_search_index: {result} conversaciones añadidas al índice de búsqueda.")
+                self.search_conversations()
+        elif kind == "delete":
+            if result:
+                self.recent_convs_model.remove(key[1])
+                self.indexing_worker.submit(("remove", key[1]), self.retrieval_index.remove_source, f"conv:{key[1]}")
+            else:
+                show_critical_message(self, "Error", "No se pudo realizar la operación.")
 
-            print(f"[DEBUG] populate_recent_conversations: Se encontraron {len(conversations) if conversations else 0} conversaciones.")
-            if not conversations:
-                print("[DEBUG] populate_recent_conversations: No hay conversaciones, añadiendo placeholder y saliendo.")
-                placeholder_item = QListWidgetItem("No hay conversaciones recientes.")
-                placeholder_item.setFlags(placeholder_item.flags() & ~Qt.ItemFlag.ItemIsSelectable)
-                self.recent_convs_list.addItem(placeholder_item)
-                return
+    def on_persistence_task_failed(self, key, error_msg):
+        """Informa de una tarea de persistencia que lanzó una excepción."""
+        kind = key[0]
+        if kind == "list":
+            print(f"[ChatInterface] populate_recent_conversations: ❌ Error al cargar conversaciones: {error_msg}")
+            self.recent_convs_model.page_failed(key[1])
+        elif kind in ("save", "message"):
+            print(f"[ChatInterface] save_conversation: ❌ Error al guardar la conversación: {error_msg}")
+        elif kind == "rename":
+            show_critical_message(self, "Error", f"No se pudo renombrar la conversación: {error_msg}")
+        elif kind == "delete":
+            show_critical_message(self, "Error", f"No se pudo realizar la operación: {error_msg}")
+
+    def sync_retrieval_index(self):
+        """Pone al día (en segundo plano) el índice de recuperación con las conversaciones guardadas."""
+        self.indexing_worker.submit(("retrieval",), self.retrieval_index.sync_conversations,
+                                    self.persistence_service, self.user_id)
+
+    def on_indexing_task_failed(self, key, error_msg):
+        """El índice de recuperación es auxiliar: un fallo solo se registra."""
+        print(f"[ChatInterface] sync_retrieval_index: ⚠️ Error al actualizar el índice de recuperación ({key[0]}): {error_msg}")
+
+    def _update_left_panel_width(self, conversations):
+        """Ensancha el panel (entre 350 y 500 px) para que quepan los títulos recibidos."""
+        font_metrics = QFontMetrics(self.recent_convs_list.font())
+        widths = [font_metrics.horizontalAdvance(display_title(conv.get("title") or "")) for conv in conversations]
+        if not widths:
+            return
+        # Título + márgenes + los dos botones de la fila.
+        new_width = max(350, min(max(widths) + 10 + 10 + 40 + 20, 500))
+        if new_width > self.left_panel_width:
+            self.left_panel_width = new_width
+            if self.left_panel.maximumWidth() > 0:
+                self.left_panel.setMaximumWidth(self.left_panel_width)
 
-            print(f"[DEBUG] populate_recent_conversations: Conversaciones recibidas del servicio: {conversations}")
-
-            # Normalizar todos los timestamps a objetos datetime ANTES de ordenar.
-            print("[DEBUG] populate_recent_conversations: Normalizando timestamps...")
-            for conv in conversations:
-                ts = conv.get('timestamp')
-                print(f"[DEBUG] populate_recent_conversations: Procesando conv, timestamp original: {ts} (tipo: {type(ts)})")
-                if isinstance(ts, str):
-                    try:
-                        conv['timestamp'] = datetime.fromisoformat(ts)
-                        print(f"[DEBUG] populate_recent_conversations: Timestamp convertido de string a datetime: {conv['timestamp']}")
-                    except ValueError:
-                        conv['timestamp'] = datetime.min
-                        print(f"[DEBUG] populate_recent_conversations: Timestamp string inválido, asignando datetime.min")
-                elif not isinstance(ts, datetime):
-                    conv['timestamp'] = datetime.min # Asegurar que siempre sea un datetime
-                    print(f"[DEBUG] populate_recent_conversations: Timestamp no es string ni datetime, asignando datetime.min")
-
-            sorted_convs = sorted(conversations, key=lambda x: x.get('timestamp', datetime.min), reverse=True)
-            print("[DEBUG] populate_recent_conversations: Conversaciones ordenadas por fecha.")
-
-            max_calculated_width = 0
-
-            # --- Agrupación de conversaciones ---
-            print("[DEBUG] populate_recent_conversations: Agrupando conversaciones por fecha...")
-            groups = OrderedDict()
-            today = date.today()
-            yesterday = today - timedelta(days=1)
-            meses = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
-
-            for conv in sorted_convs:
-                timestamp = conv.get("timestamp", datetime.now())
-                if not isinstance(timestamp, datetime):
-                    print(f"[DEBUG] populate_recent_conversations: Saltando conversación sin timestamp válido: {conv.get('_id')}")
-                    continue
-
-                conv_date = timestamp.date()
-                
-                if conv_date == today:
-                    group_key = "Hoy"
-                elif conv_date == yesterday:
-                    group_key = "Ayer"
-                else:
-                    group_key = f"{conv_date.day} de {meses[conv_date.month - 1]} de {conv_date.year}"
-
-                if group_key not in groups:
-                    groups[group_key] = []
-                groups[group_key].append(conv)
-
-            print(f"[DEBUG] populate_recent_conversations: Grupos creados: {list(groups.keys())}")
-
-            # --- Poblado del QListWidget ---
-            def add_header_item(text):
-                print(f"[DEBUG] populate_recent_conversations: Añadiendo cabecera de grupo: {text}")
-                header_item = QListWidgetItem(text.upper())
-                header_item.setFlags(header_item.flags() & ~Qt.ItemFlag.ItemIsSelectable & ~Qt.ItemFlag.ItemIsEnabled)
-                font = header_item.font()
-                font.setBold(True)
-                header_item.setFont(font)
-                header_item.setForeground(QColor("#a0aec0"))
-                self.recent_convs_list.addItem(header_item)
-
-            def add_conv_item(conv):
-                nonlocal max_calculated_width
-                conv_id = str(conv.get("_id"))
-                title = conv.get("title", "Sin título")
-                print(f"[DEBUG] populate_recent_conversations: Añadiendo item para conversación ID: {conv_id}, Título: '{title}'")
-
-                words = title.split()
-                if len(words) > 5:
-                    display_title = " ".join(words[:5]) + "..."
-                else:
-                    display_title = title
-
-                row_widget = QWidget()
-                row_widget.setObjectName("recentConvRow")
-                row_layout = QHBoxLayout(row_widget)
-                row_layout.setContentsMargins(5, 2, 5, 2)
-                row_layout.setSpacing(5)
-                title_label = QLabel(display_title)
-                title_label.setToolTip(f"Doble clic para cargar: {title}")
-                title_label.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
-                rename_button = QPushButton(qta.icon('fa5s.edit', color="white"), "")
-                rename_button.setFixedSize(20, 20)
-                rename_button.setToolTip("Renombrar conversación")
-                rename_button.setStyleSheet("QPushButton { border-radius: 10px; background: transparent; padding: 0; } QPushButton:hover { background-color: #4a90e2; }")
-                rename_button.clicked.connect(lambda checked=False, c_id=conv_id, c_title=title: self.rename_recent_conversation(c_id, c_title))
-
-                delete_button = QPushButton(qta.icon('fa5s.trash-alt', color="white"), "")
-                delete_button.setFixedSize(20, 20)
-                delete_button.setToolTip("Eliminar esta conversación")
-                delete_button.setStyleSheet("QPushButton { border-radius: 10px; background: transparent; padding: 0; } QPushButton:hover { background-color: #4a90e2; }")
-                delete_button.clicked.connect(lambda checked=False, c_id=conv_id: self.delete_recent_conversation(c_id))
-
-                row_layout.addWidget(title_label)
-                row_layout.addWidget(rename_button)
-                row_layout.addWidget(delete_button)
-
-                font_metrics = QFontMetrics(title_label.font())
-                title_width = font_metrics.horizontalAdvance(display_title)
-                required_width = 10 + title_width + 10 + 40
-                max_calculated_width = max(max_calculated_width, required_width)
-
-                item = QListWidgetItem()
-                item.setData(Qt.ItemDataRole.UserRole, conv_id)
-                item.setSizeHint(row_widget.sizeHint())
-
-                self.recent_convs_list.addItem(item)
-                self.recent_convs_list.setItemWidget(item, row_widget)
-
-            print("[DEBUG] populate_recent_conversations: Poblando la lista de widgets...")
-            for group_name, convs_in_group in groups.items():
-                add_header_item(group_name)
-                for conv in convs_in_group:
-                    add_conv_item(conv)
-
-            if max_calculated_width > 0:
-                total_panel_width = max_calculated_width + 20
-                new_width = max(350, min(total_panel_width, 500))
-                self.left_panel_width = new_width
-                print(f"[DEBUG] populate_recent_conversations: Ancho del panel calculado: {new_width}px")
-
-                if self.left_panel.maximumWidth() > 0:
-                    self.left_panel.setMaximumWidth(self.left_panel_width)
-            print("[DEBUG] populate_recent_conversations: Finalizado con éxito.")
-        except Exception as e:
-            print(f"[DEBUG] populate_recent_conversations: ❌ Error al poblar conversaciones: {e}")
-            self.recent_convs_list.clear()
-            self.recent_convs_list.addItem("Error al cargar.")
-    
     def rename_recent_conversation(self, conversation_id: str, current_title: str):
         """Permite al usuario renombrar una conversación."""
         new_title, ok = QInputDialog.getText(self, "Renombrar Conversación", 
                                              "Nuevo título:", QLineEdit.EchoMode.Normal, 
                                              current_title)
         if ok and new_title and new_title.strip() != current_title:
-            success = self.persistence_service.update_conversation_title(self.user_id, conversation_id, new_title.strip())
-            if success:
-                print(f"[DEBUG][chat_interface.py][ChatInterface] rename_recent_conversation: ✅ Conversación ID: {conversation_id} renombrada a '{new_title.strip()}'")
-                self.populate_recent_conversations()
-                if self.chat_engine and self.chat_engine.conversation_id == conversation_id:
-                    self.chat_engine.title = new_title.strip()
-            else:
-                print(f"[DEBUG] rename_recent_conversation: ❌ Error al renombrar conversación ID: {conversation_id}")
-                show_critical_message(self, "Error", "No se pudo renombrar la conversación.")
+            new_title = new_title.strip()
+            self.persistence_worker.submit(("rename", conversation_id, new_title),
+                                           self.persistence_service.update_conversation_title,
+                                           self.user_id, conversation_id, new_title)
 
     def delete_recent_conversation(self, conversation_id: str):
         """Maneja la eliminación o archivado de una conversación de la lista."""
@@ -954,11 +1001,9 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
                                      "¿Estás seguro de que quieres quitar esta conversación de la lista?",
                                      buttons=QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)            
         if reply == QMessageBox.StandardButton.Yes:
-            success = self.persistence_service.delete_or_archive_conversation(self.user_id, conversation_id)
-            if success:
-                self.populate_recent_conversations()
-            else:
-                show_critical_message(self, "Error", "No se pudo realizar la operación.")
+            self.persistence_worker.submit(("delete", conversation_id),
+                                           self.persistence_service.delete_or_archive_conversation,
+                                           self.user_id, conversation_id)
     
     def update_system_prompt(self):
         """Actualiza el System Prompt en el chat engine."""
@@ -1017,154 +1062,135 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
    
     def on_model_selected(self, model_identifier):
         """Maneja la selección de un modelo para iniciar una nueva conversación."""
-        print(f"[DEBUG] ChatInterface.on_model_selected llamado con modelo: {model_identifier}")
-        
-        self.add_system_message(f"CARGANDO MODELO: {Path(model_identifier).name}...")
-        QApplication.processEvents()
         print(f"[ChatInterface] on_model_selected: Modelo seleccionado: {model_identifier}")
+        if not model_identifier.lower().endswith('.gguf'):
+            # This case should no longer happen as we only load GGUF files
+            show_critical_message(self, "Error de Modelo", f"El archivo seleccionado no es un modelo GGUF válido: {model_identifier}")
+            return
+        self.add_system_message(f"CARGANDO MODELO: {Path(model_identifier).name}...")
+        self.start_model_load(model_identifier, lambda provider: self._activate_selected_model(model_identifier, provider))
 
-        try:
-            if model_identifier.lower().endswith('.gguf'):
-                provider = CtransformersProvider(model_path=model_identifier)
-                display_name = Path(model_identifier).name
-            else:
-                # This case should no longer happen as we only load GGUF files
-                show_critical_message(self, "Error de Modelo", f"El archivo seleccionado no es un modelo GGUF válido: {model_identifier}")
-                return
-            print(f"[ChatInterface] on_model_selected: Proveedor '{type(provider).__name__}' creado para el modelo.")
-
-            if hasattr(self, 'parameters_panel'):
-                current_params = self.parameters_panel.content.get_current_parameters()
-                print(f"[DEBUG] Aplicando parámetros al nuevo modelo: {current_params}")
-                provider.set_generation_parameters(**current_params)
+    def _activate_selected_model(self, model_identifier, provider):
+        """Activa un modelo ya cargado e inicia una nueva conversación con él."""
+        print(f"[ChatInterface] Proveedor '{type(provider).__name__}' listo para el modelo.")
+        self._apply_model(model_identifier, provider)
 
-            self.chat_engine.provider = provider
-            
-            self.selected_model_name = model_identifier
-            self.update_installed_models_combo_selection()
-
-            self.chat_engine.start_new()
-            print("[ChatInterface] on_model_selected: Nueva conversación iniciada en chat_engine.")
-            self.system_prompt_edit.setPlainText(SYSTEM_PROMPT)
-            
-            def on_history_cleared():
-                self.add_system_message(f"MODELO {display_name} CARGADO EXITOSAMENTE, Sistema listo para recibir comandos.")
-            self.clear_history(on_finished_callback=on_history_cleared)
-
-        except Exception as e:
-            error_msg = f"No se pudo cargar el modelo '{Path(model_identifier).name}':\n{e}"
-            print(f"[ERROR] {error_msg}")
-            show_critical_message(self, "Error al Cargar Modelo", error_msg)
-            self.chat_engine.provider = None
-    
-    def _create_message_widget(self, role, content, message_obj=None, show_rating_buttons=True):
-        """Crea un widget para un mensaje individual, devolviendo el contenedor y el editor de contenido."""
-        
-        message_widget = QWidget()
-        message_layout = QVBoxLayout(message_widget)
-        message_layout.setContentsMargins(0, 0, 0, 0)
-        message_layout.setSpacing(3)
-
-        if role == "user":
-            display_role = "Tú"
-            style = "font-weight: bold; color: #90cdf4;"
-            alignment = Qt.AlignmentFlag.AlignRight
-        elif role == "assistant":
-            display_role = "Martin LLM"
-            style = "font-weight: bold; color: #9ae6b4;"
-            alignment = Qt.AlignmentFlag.AlignLeft
-        else:
-            display_role = role.capitalize()
-            style = "font-weight: bold; color: #e1e5e9;"
-            alignment = Qt.AlignmentFlag.AlignLeft
-
-        role_label = QLabel(display_role)
-        role_label.setStyleSheet(style)
-        role_label.setAlignment(alignment)
-        message_layout.addWidget(role_label)
-
-        content_edit = QTextEdit()
-        content_edit.setReadOnly(True)
-        html_content = markdown.markdown(content, extensions=['fenced_code', 'tables', 'sane_lists'])
-        content_edit.setHtml(html_content)
-        content_edit.setStyleSheet("""
-            QTextEdit {
-                background-color: #2d3748;
-                padding: 10px;
-                border-radius: 8px;
-                border: none;
-                color: white;
-            }
-        """)
-        content_edit.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        content_edit.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-
-        message_layout.addWidget(content_edit)
-
-        if role == "assistant" and show_rating_buttons:
-            rating_layout = QHBoxLayout()
-            rating_layout.setContentsMargins(0, 2, 5, 0)
-            rating_layout.setSpacing(5)
-            rating_layout.addStretch()
-            self.create_rating_buttons(rating_layout, role, content, message_obj)
-            message_layout.addLayout(rating_layout)
-
-        outer_layout = QHBoxLayout()
-        outer_layout.setContentsMargins(0, 0, 0, 0)
-        outer_layout.setSpacing(0)
-        if alignment == Qt.AlignmentFlag.AlignRight:
-            outer_layout.addStretch(11)
-            outer_layout.addWidget(message_widget, 9)
-            outer_layout.addStretch(4)
-        else:
-            outer_layout.addStretch(4)
-            outer_layout.addWidget(message_widget, 9)
-            outer_layout.addStretch(11)
+        self.chat_engine.start_new()
+        print("[ChatInterface] on_model_selected: Nueva conversación iniciada en chat_engine.")
+        self.system_prompt_edit.setPlainText(SYSTEM_PROMPT)
 
-        container_widget = QWidget()
-        container_widget.setLayout(outer_layout)
-        
-        return container_widget, content_edit
+        display_name = Path(model_identifier).name
+        def on_history_cleared():
+            self.add_system_message(f"MODELO {display_name} CARGADO EXITOSAMENTE, Sistema listo para recibir comandos.")
+        self.clear_history(on_finished_callback=on_history_cleared)
 
-    def add_to_history(self, message_obj, show_rating_buttons=True, scroll_to_bottom=True):
-        """Añade un mensaje al historial de la UI con una animación de fade-in."""
-        role = message_obj.get("role", "unknown")
-        content = message_obj.get("content", "")
+    def _apply_model(self, model_identifier, provider):
+        """Aplica los parámetros actuales al proveedor y lo convierte en el modelo activo."""
+        if hasattr(self, 'parameters_panel'):
+            current_params = self.parameters_panel.content.get_current_parameters()
+            print(f"[DEBUG] Aplicando parámetros al nuevo modelo: {current_params}")
+            provider.set_generation_parameters(**current_params)
 
-        message_widget, content_edit = self._create_message_widget(role, content, message_obj, show_rating_buttons)
+        self.chat_engine.provider = provider
+        self.selected_model_name = model_identifier
+        self.installed_models_combo.blockSignals(True)
+        self.update_installed_models_combo_selection()
+        self.installed_models_combo.blockSignals(False)
 
-        # --- Animación de Fade-In ---
-        opacity_effect = QGraphicsOpacityEffect(message_widget)
-        message_widget.setGraphicsEffect(opacity_effect)
-        
-        animation = QPropertyAnimation(opacity_effect, b"opacity")
-        animation.setDuration(450)
-        animation.setStartValue(0.0)
-        animation.setEndValue(1.0)
-        animation.setEasingCurve(QEasingCurve.Type.InOutQuad)
-        
-        animation.finished.connect(lambda: self.running_animations.remove(animation))
-        self.running_animations.append(animation)
-        
-        animation.start()
+    def start_model_load(self, model_identifier, on_loaded):
+        """
+        Carga el modelo en un hilo aparte y llama a `on_loaded(provider)` al terminar.
+        Mientras tanto el modelo anterior sigue activo. Una nueva carga sustituye a la anterior.
+        """
+        if self.model_load_worker is not None:
+            self.model_load_worker.cancel()
+        self._prune_model_load_threads()
+
+        thread = QThread()
+        worker = ModelLoadWorker(model_identifier, provider_kwargs={"session_mode": True})
+        worker.moveToThread(thread)
+        self.model_load_worker = worker
+        self.model_load_callback = on_loaded
+        # Se mantienen referencias hasta que el hilo termine, aunque la carga se sustituya.
+        self.model_load_threads.add((thread, worker))
+
+        thread.started.connect(worker.run)
+        worker.progress.connect(self.on_model_load_progress)
+        worker.model_loaded.connect(self.on_model_loaded)
+        worker.error_occurred.connect(self.on_model_load_failed)
+        worker.cancelled.connect(self.on_model_load_cancelled)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(thread.deleteLater)
+
+        self.model_load_label.setText(f"Cargando {Path(model_identifier).name}")
+        self.model_load_progress.setValue(0)
+        self.model_load_progress.setFormat("%p%")
+        self.model_load_frame.setVisible(True)
+        thread.start()
+
+    def _prune_model_load_threads(self):
+        """Olvida los hilos de carga que ya han terminado."""
+        for entry in list(self.model_load_threads):
+            try:
+                finished = entry[0].isFinished()
+            except RuntimeError: # el objeto de Qt ya se ha eliminado con deleteLater
+                finished = True
+            if finished:
+                self.model_load_threads.discard(entry)
+
+    def cancel_model_load(self):
+        """Cancela la carga en curso; el modelo anterior sigue activo."""
+        if self.model_load_worker is not None:
+            self.model_load_worker.cancel()
+            self.model_load_label.setText("Cancelando...")
+
+    def _finish_model_load(self):
+        self.model_load_worker = None
+        self.model_load_callback = None
+        self.model_load_frame.setVisible(False)
+
+    def on_model_load_progress(self, percent, stage):
+        if self.sender() is not self.model_load_worker:
+            return
+        self.model_load_progress.setValue(percent)
+        self.model_load_progress.setFormat(f"{stage}  %p%")
+
+    def on_model_loaded(self, provider):
+        if self.sender() is not self.model_load_worker:
+            return # carga sustituida por otra más reciente
+        callback = self.model_load_callback
+        self._finish_model_load()
+        try:
+            callback(provider)
+        except Exception as e:
+            show_critical_message(self, "Error al Cargar Modelo", str(e))
 
-        # Insertar el nuevo mensaje
-        self.history_layout.insertWidget(self.history_layout.count() - 1, message_widget)
-        
-        def adjust_and_scroll():
-            self._adjust_message_height(content_edit)
-            if scroll_to_bottom:
-                # Damos un pequeño respiro extra para que el scroll máximo se actualice
-                QTimer.singleShot(10, self.scroll_to_bottom_animated)
+    def on_model_load_failed(self, error_msg):
+        if self.sender() is not self.model_load_worker:
+            return
+        self._finish_model_load()
+        print(f"[ERROR] {error_msg}")
+        show_critical_message(self, "Error al Cargar Modelo", error_msg)
+        self.installed_models_combo.blockSignals(True)
+        self.update_installed_models_combo_selection()
+        self.installed_models_combo.blockSignals(False)
 
-        # Ajustar la altura y hacer scroll después de un breve retraso
-        QTimer.singleShot(50, adjust_and_scroll)
+    def on_model_load_cancelled(self):
+        if self.sender() is not self.model_load_worker:
+            return
+        self._finish_model_load()
+        self.add_system_message("CARGA DEL MODELO CANCELADA. Se mantiene el modelo anterior.")
+        self.installed_models_combo.blockSignals(True)
+        self.update_installed_models_combo_selection()
+        self.installed_models_combo.blockSignals(False)
 
-    def _adjust_message_height(self, content_edit):
-        """Ajusta la altura de un QTextEdit de mensaje para que encaje con su contenido."""
-        doc_height = content_edit.document().size().height()
-        stylesheet_padding = 20 # 10px top + 10px bottom
-        content_edit.setFixedHeight(int(doc_height + stylesheet_padding))
+    def add_to_history(self, message_obj, show_rating_buttons=True, scroll_to_bottom=True):
+        """Añade un mensaje al historial de la UI."""
+        self.history_model.append_message(message_obj, show_rating_buttons)
+        if scroll_to_bottom:
+            # Damos un pequeño respiro para que el scroll máximo se actualice
+            QTimer.singleShot(10, self.scroll_to_bottom_animated)
 
     def add_system_message(self, message: str, show_rating_buttons: bool = False):
         """Muestra un mensaje del sistema en la barra de estado."""
@@ -1173,48 +1199,24 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
 
     def clear_history(self, on_finished_callback=None):
         """Limpia el historial de chat de la UI, ejecutando un callback al finalizar."""
-        
-        widgets_to_remove = []
-        for i in range(self.history_layout.count()):
-            item = self.history_layout.itemAt(i)
-            if item and item.widget():
-                widgets_to_remove.append(item.widget())
-
-        if not widgets_to_remove:
-            while self.history_layout.count() > 0:
-                item = self.history_layout.takeAt(0)
-                if item.widget():
-                    item.widget().deleteLater()
-            self.history_layout.addStretch(1)
-            self.history_layout.addStretch(1)
+        if self.history_model.rowCount() == 0:
             if on_finished_callback:
                 on_finished_callback()
             return
 
+        opacity_effect = QGraphicsOpacityEffect(self.history_view)
+        self.history_view.setGraphicsEffect(opacity_effect)
         self.animation_group = QParallelAnimationGroup(self)
-        for widget in widgets_to_remove:
-            opacity_effect = QGraphicsOpacityEffect(widget)
-            widget.setGraphicsEffect(opacity_effect)
-            animation = QPropertyAnimation(opacity_effect, b"opacity")
-            animation.setDuration(200)
-            animation.setStartValue(1.0)
-            animation.setEndValue(0.0)
-            animation.setEasingCurve(QEasingCurve.Type.InOutQuad)
-            self.animation_group.addAnimation(animation)
+        animation = QPropertyAnimation(opacity_effect, b"opacity")
+        animation.setDuration(200)
+        animation.setStartValue(1.0)
+        animation.setEndValue(0.0)
+        animation.setEasingCurve(QEasingCurve.Type.InOutQuad)
+        self.animation_group.addAnimation(animation)
 
         def on_animations_finished():
-            for widget in widgets_to_remove:
-                self.history_layout.removeWidget(widget)
-                widget.deleteLater()
-            
-            while self.history_layout.count() > 0:
-                item = self.history_layout.takeAt(0)
-                if item.widget():
-                    item.widget().deleteLater()
-
-            self.history_layout.addStretch(1)
-            self.history_layout.addStretch(1)
-            
+            self.history_model.clear()
+            self.history_view.setGraphicsEffect(None)
             self.animation_group = None
             if on_finished_callback:
                 on_finished_callback()
@@ -1227,7 +1229,7 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         print("[ChatInterface] send_message: Intento de enviar mensaje.")
         
         user_message = self.input_text.toPlainText().strip()
-        if not user_message:
+        if not user_message and self.attached_file is None:
             return
 
         if not self.chat_engine.provider:
@@ -1235,8 +1237,17 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             return
 
         user_message_obj = {"role": "user", "content": user_message}
+        if self.attached_file is not None:
+            # El modelo recibe el documento completo; en el historial solo se muestra su nombre.
+            name, text = self.attached_file
+            user_message = f"Basado en el siguiente contenido del archivo '{name}' :\n\n---\n{text}\n---\n\n{user_message}"
+            display_obj = {"role": "user", "content": f"📎 {name}\n\n{user_message_obj['content']}".rstrip()}
+            user_message_obj = {"role": "user", "content": user_message}
+            self.clear_attachment()
+        else:
+            display_obj = user_message_obj
         self.chat_engine.history.append(user_message_obj)
-        self.add_to_history(user_message_obj, show_rating_buttons=False)
+        self.add_to_history(display_obj, show_rating_buttons=False)
         self.input_text.clear()
         self.send_button.setEnabled(False)
         self.loading_indicator.setVisible(True)
@@ -1250,11 +1261,13 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
 
     def run_chat_worker(self, user_message: str):
         """Inicia el worker para el modo de chat normal."""
+        self.stream_cancel_event = threading.Event()
         self.worker_thread = QThread()
-        self.worker = Worker(self.chat_engine, user_message)
+        self.worker = Worker(self.chat_engine, user_message, cancel_event=self.stream_cancel_event)
         self.worker.moveToThread(self.worker_thread)
 
         self.worker_thread.started.connect(self.worker.run)
+        self.worker.partial_response.connect(self.handle_partial_response)
         self.worker.response_ready.connect(self.handle_response)
         self.worker.error_occurred.connect(self.handle_error)
         
@@ -1328,7 +1341,11 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.worker_thread.start()
     
     def display_reasoner_plan(self, plan: list):
-        plan_text = "\n".join([f"  - Paso {i+1}: {step}" for i, step in enumerate(plan)])
+        positions = {step["id"]: i + 1 for i, step in enumerate(plan)}
+        plan_text = "\n".join(
+            f"  - Paso {i+1}: {step['task']}" + (f" (tras {', '.join(str(positions[dep]) for dep in step['depends_on'])})" if step["depends_on"] else "")
+            for i, step in enumerate(plan)
+        )
         self.add_system_message(f"📝 PLAN GENERADO:\n{plan_text}", show_rating_buttons=False)
         self.process_log_window.append_log(f"📝 PLAN GENERADO:\n{plan_text}")
     
@@ -1351,13 +1368,35 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.process_log_window.append_log("AGENTE HA FINALIZADO LA TAREA.")
         self.handle_response(response)
     
+    def handle_partial_response(self, partial_content):
+        """Muestra el texto parcial de la respuesta mientras el modelo sigue generando."""
+        if self.stream_cancel_event is not None and self.stream_cancel_event.is_set():
+            return
+        if self.streaming_row is None:
+            self.streaming_row = self.history_model.append_message(
+                {"role": "assistant", "content": partial_content}, show_rating=False, streaming=True)
+        else:
+            self.history_model.set_content(self.streaming_row, partial_content)
+
     def handle_response(self, response_content):
         """Maneja la respuesta exitosa del worker."""
         self.loading_indicator.setVisible(False)
+        if self.stream_cancel_event is not None and self.stream_cancel_event.is_set():
+            # La respuesta pertenecía a una generación cancelada (p. ej. nueva conversación): se descarta.
+            self.stream_cancel_event = None
+            self.send_button.setEnabled(True)
+            return
+        self.stream_cancel_event = None
         response_obj = {"role": "assistant", "content": response_content}
         if self.chat_engine:
             self.chat_engine.history.append(response_obj)
-        self.add_to_history(response_obj)
+
+        if self.streaming_row is not None:
+            # Sustituir la burbuja provisional por el mensaje definitivo (con botones de valoración).
+            self.history_model.replace_message(self.streaming_row, response_obj)
+            self.streaming_row = None
+        else:
+            self.add_to_history(response_obj)
         self.save_conversation(is_autosave=True)
         self.send_button.setEnabled(True)
         self.input_text.setFocus()
@@ -1365,7 +1404,14 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
     def handle_error(self, error_msg):
         """Maneja un error del worker."""
         self.loading_indicator.setVisible(False)
-        self.add_to_history({"role": "assistant", "content": f"ERROR: {error_msg}"})
+        self.stream_cancel_event = None
+        error_obj = {"role": "assistant", "content": f"ERROR: {error_msg}"}
+        if self.streaming_row is not None:
+            # La respuesta a medias se sustituye por el error en lugar de quedar como provisional.
+            self.history_model.replace_message(self.streaming_row, error_obj)
+            self.streaming_row = None
+        else:
+            self.add_to_history(error_obj)
         self.send_button.setEnabled(True)
         self.input_text.setFocus()
         self.process_log_window.append_log(f"ERROR: {error_msg}")
@@ -1377,7 +1423,12 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             show_warning_message(self, "Advertencia", 
                                "Debes seleccionar un modelo primero.")
             return
-        
+
+        # Detener cualquier respuesta que se siga transmitiendo para la conversación anterior.
+        if self.stream_cancel_event is not None:
+            self.stream_cancel_event.set()
+        self.streaming_row = None
+
         def on_history_cleared():
             self.chat_engine.start_new()
             self.add_system_message("NUEVA CONVERSACIÓN INICIADA.")
@@ -1394,150 +1445,27 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         if not self.user_id:
             return
         
-        try:
-            if not self.chat_engine.conversation_id:
-                conv_data = {
-                    "user_id": self.user_id,
-                    "model": self.chat_engine.provider.model_identifier,
-                    "title": self.generate_conversation_title(),
-                    "timestamp": datetime.now(),
-                    "messages": self.chat_engine.history,
-                    "system_prompt": self.chat_engine.system_prompt,
-                    "metadata": {}
-                }
-                new_id = self.persistence_service.create_conversation(self.user_id, conv_data)
-                if new_id:
-                    self.chat_engine.conversation_id = new_id
-                    self.populate_recent_conversations()
-            else:
-                conv_data_to_update = {
-                    "messages": self.chat_engine.history,
-                    "system_prompt": self.chat_engine.system_prompt,
-                    "metadata": {},
-                    "timestamp": datetime.now(),
-                    "title": self.generate_conversation_title(),
-                    "model": self.chat_engine.provider.model_identifier
-                }
-                self.persistence_service.update_conversation(
-                    self.user_id, self.chat_engine.conversation_id, conv_data_to_update)
-                self.populate_recent_conversations()
-        except Exception as e:
-            print(f"[ChatInterface] save_conversation: ❌ Error al guardar la conversación: {e}")
-
-    def create_rating_buttons(self, layout, role, message, message_obj=None):
-        """Crea y configura los botones de calificación con estado visual."""
-        
-        rating = message_obj.get("rating") if message_obj else None
-
-        # --- Colores ---
-        color_default = "white"
-        color_up = "#2ecc71"  # Verde
-        color_down = "#e74c3c" # Rojo
-
-        # --- Iconos ---
-        icon_up_normal = qta.icon("fa5s.thumbs-up", color=color_default)
-        icon_up_hover = qta.icon("fa5s.thumbs-up", color=color_up)
-        icon_down_normal = qta.icon("fa5s.thumbs-down", color=color_default)
-        icon_down_hover = qta.icon("fa5s.thumbs-down", color=color_down)
-
-        # --- Botones ---
-        thumbs_up_button = QPushButton(icon_up_normal, "")
-        thumbs_down_button = QPushButton(icon_down_normal, "")
-
-        for btn in [thumbs_up_button, thumbs_down_button]:
-            btn.setToolTip("Respuesta útil" if btn is thumbs_up_button else "Respuesta no útil")
-            btn.setFixedSize(30, 30)
-            btn.setStyleSheet("background: transparent; border: none;")
-            btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        
-        def set_button_state():
-            if rating == "up":
-                thumbs_up_button.setIcon(icon_up_hover)  # Verde fijo
-                thumbs_up_button.setEnabled(False)
-                thumbs_down_button.setEnabled(True)  # Permitir recambiar
-            elif rating == "down":
-                thumbs_down_button.setIcon(icon_down_hover)  # Rojo fijo
-                thumbs_up_button.setEnabled(True)  # Permitir recambiar
-                thumbs_down_button.setEnabled(False)
-
-        def hover_in_up(e):
-            if thumbs_up_button.isEnabled():
-                thumbs_up_button.setIcon(icon_up_hover)
-        def hover_out_up(e):
-            if thumbs_up_button.isEnabled():
-                thumbs_up_button.setIcon(icon_up_normal)
-
-        def hover_in_down(e):
-            if thumbs_down_button.isEnabled() or rating == "down":
-                thumbs_down_button.setIcon(icon_down_hover)
-        def hover_out_down(e):
-            if thumbs_down_button.isEnabled():
-                thumbs_down_button.setIcon(icon_down_normal)
-
-        thumbs_up_button.enterEvent = hover_in_up
-        thumbs_up_button.leaveEvent = hover_out_up
-        thumbs_down_button.enterEvent = hover_in_down
-        thumbs_down_button.leaveEvent = hover_out_down
-
-        print(f"[DEBUG] Estado inicial de calificación: {rating}")
-
-        print("[DEBUG] Botón de valoración clickeado.")
-        def on_rate(new_rating):
-            nonlocal rating
-            rating = new_rating
-            print(f"[DEBUG] Usuario ha calificado con: {new_rating}")
-            self.rate_message(role, message, new_rating)
-            set_button_state()
-
-        # --- Lógica de estado y eventos ---
-        
-        def set_button_state():
-            # Desactivar botones y fijar color si ya hay una calificación
-            if rating == "up":
-                thumbs_up_button.setIcon(icon_up_hover) # Color verde fijo
-                thumbs_up_button.setEnabled(False)
-                thumbs_down_button.setEnabled(False)
-            elif rating == "down":
-                thumbs_down_button.setIcon(icon_down_hover) # Color rojo fijo
-                thumbs_up_button.setEnabled(False)
-                thumbs_down_button.setEnabled(False)
-
-        # --- Eventos de Hover ---
-        def hover_in_up(e):
-            if thumbs_up_button.isEnabled():
-                thumbs_up_button.setIcon(icon_up_hover)
-        def hover_out_up(e):
-            if thumbs_up_button.isEnabled():
-                thumbs_up_button.setIcon(icon_up_normal)
-
-        def hover_in_down(e):
-            if thumbs_down_button.isEnabled():
-                thumbs_down_button.setIcon(icon_down_hover)
-        def hover_out_down(e):
-            if thumbs_down_button.isEnabled():
-                thumbs_down_button.setIcon(icon_down_normal)
-
-        thumbs_up_button.enterEvent = hover_in_up
-        thumbs_up_button.leaveEvent = hover_out_up
-        thumbs_down_button.enterEvent = hover_in_down
-        thumbs_down_button.leaveEvent = hover_out_down
-
-        # --- Eventos de Click ---
-        def on_rate(new_rating):
-            nonlocal rating
-            rating = new_rating
-            self.rate_message(role, message, new_rating)
-            set_button_state() # Actualizar estado visual permanentemente
-
-        thumbs_up_button.clicked.connect(lambda: print("[DEBUG] Thumbs up clickeado.") or on_rate("up"))
-        thumbs_down_button.clicked.connect(lambda: print("[DEBUG] Thumbs down clickeado.") or on_rate("down"))
-
-        # --- Estado Inicial ---
-        set_button_state()
-
-        layout.addWidget(thumbs_up_button)
-        layout.addWidget(thumbs_down_button)
-        set_button_state()
+        # Se toma una copia del estado y se escribe en segundo plano. El worker decide si crear
+        # la conversación, anexar solo los mensajes nuevos o reescribirla entera.
+        snapshot = {
+            "conversation_id": self.chat_engine.conversation_id,
+            "saved_count": self.chat_engine.saved_message_count,
+            "history": [dict(message) for message in self.chat_engine.history],
+            "fields": {
+                "model": self.chat_engine.provider.model_identifier,
+                "title": self.generate_conversation_title(),
+                "timestamp": datetime.now(),
+                "system_prompt": self.chat_engine.system_prompt,
+            },
+        }
+        self.persistence_worker.save_conversation(self.user_id, self.chat_engine.save_key, snapshot)
+
+    def on_message_rated(self, row, rating):
+        """Recibe la calificación hecha con los botones de un mensaje del historial."""
+        message = self.history_model.message(row)
+        print(f"[DEBUG] Usuario ha calificado con: {rating}")
+        self.rate_message(message.get("role"), message.get("content"), rating)
+        self.history_model.message_changed(row)
 
     def rate_message(self, role, content, rating):
         """Maneja la calificación de un mensaje."""
@@ -1545,15 +1473,19 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             show_warning_message(self, "Advertencia", "No hay conversación activa.")
             return
 
-        for msg in self.chat_engine.history:
+        rated_index = None
+        for index, msg in enumerate(self.chat_engine.history):
             if msg["role"] == role and msg["content"] == content:
                 msg["rating"] = rating
+                rated_index = index
                 break
 
-        try:
+        if rated_index is not None:
+            # El worker solo la aplica si el mensaje ya está guardado; si no, la escribe el próximo guardado.
+            self.persistence_worker.update_message(
+                self.user_id, self.chat_engine.save_key, rated_index, {"rating": rating})
+        if rated_index is None or rated_index >= self.chat_engine.saved_message_count:
             self.save_conversation(is_autosave=True)
-        except Exception as e:
-            show_critical_message(self, "Error", f"No se pudo guardar la calificación: {e}")
     
     def export_conversation(self):
         """Exporta la conversación actual a un archivo .txt o .json."""
@@ -1631,22 +1563,16 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             return
 
         model_identifier = conv_data.get("model", "default_model")
-        
-        try:
-            if model_identifier.lower().endswith(".gguf"):
-                provider = CtransformersProvider(model_path=model_identifier)
-            else:
-                # This case should no longer happen as we only load GGUF files
-                show_critical_message(self, "Error de Modelo", f"El modelo guardado en esta conversación no es un archivo GGUF: {model_identifier}")
-                return
-
-            if hasattr(self, "parameters_panel"):
-                current_params = self.parameters_panel.content.get_current_parameters()
-                provider.set_generation_parameters(**current_params)
+        if not model_identifier.lower().endswith(".gguf"):
+            # This case should no longer happen as we only load GGUF files
+            show_critical_message(self, "Error de Modelo", f"El modelo guardado en esta conversación no es un archivo GGUF: {model_identifier}")
+            return
+        self.start_model_load(model_identifier, lambda provider: self._activate_conversation(conv_id, conv_data, model_identifier, provider))
 
-            self.chat_engine.provider = provider
-            self.selected_model_name = model_identifier
-            self.update_installed_models_combo_selection()
+    def _activate_conversation(self, conv_id, conv_data, model_identifier, provider):
+        """Activa el modelo de una conversación guardada y la muestra en la UI."""
+        try:
+            self._apply_model(model_identifier, provider)
             history = conv_data.get("messages", [])
             system_prompt = conv_data.get("system_prompt", SYSTEM_PROMPT)
             self.chat_engine.load_conversation(
@@ -1659,17 +1585,10 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             def on_history_cleared():
                 self.add_system_message(f"Conversación cargada: {conv_data.get('title', 'Sin título')}")
                 self.repopulate_history_ui()
-                self.populate_recent_conversations()
             self.clear_history(on_finished_callback=on_history_cleared)           
         except Exception as e:
             show_critical_message(self, "Error al Cargar Modelo", f"No se pudo cargar el modelo '{model_identifier}' asociado a esta conversación:\n{e}")
     
-    def on_recent_conversation_selected(self, item):
-        """Maneja la selección de una conversación reciente de la lista."""
-        conv_id = item.data(Qt.ItemDataRole.UserRole)
-        if conv_id:
-            self.load_selected_conversation(conv_id)
-    
     def attach_file(self):
         """Adjunta un archivo"""
         file_path, _ = QFileDialog.getOpenFileName(
@@ -1677,44 +1596,88 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             "Todos los archivos (*);;Archivos de texto (*.txt);;Documentos (*.pdf *.doc *.docx)"
         )        
         if file_path:
-            try:
-                text = extract_text(file_path)
-                self.add_system_message(f"ARCHIVO CARGADO: {file_path}")
-                current_prompt = self.input_text.toPlainText()
-                new_prompt = f"Basado en el siguiente contenido del archivo '{Path(file_path).name}' :\n\n---\n{text}\n---\n\n{current_prompt}"
-                self.input_text.setPlainText(new_prompt)
-            except Exception as e:
-                show_critical_message(self, "Error", 
-                                    f"No se pudo procesar el archivo: {e}")
+            self.start_file_extraction(file_path)
+
+    def start_file_extraction(self, file_path):
+        """Extrae el texto del archivo en un hilo aparte; un nuevo adjunto sustituye al anterior."""
+        if self.file_extraction_worker is not None:
+            self.file_extraction_worker.cancel()
+
+        thread = QThread()
+        worker = FileExtractionWorker(file_path)
+        worker.moveToThread(thread)
+        self.file_extraction_worker = worker
+        job = (thread, worker)
+        _background_jobs.add(job)
+
+        thread.started.connect(worker.run)
+        worker.progress.connect(self.on_file_extraction_progress)
+        worker.text_ready.connect(self.on_file_text_ready)
+        worker.error_occurred.connect(self.on_file_extraction_failed)
+        worker.cancelled.connect(self.on_file_extraction_cancelled)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(worker.deleteLater)
+        thread.finished.connect(thread.deleteLater)
+        thread.finished.connect(lambda: _background_jobs.discard(job))
+
+        self.file_extraction_label.setText(Path(file_path).name)
+        self.file_extraction_progress.setValue(0)
+        self.file_extraction_progress.setFormat("%p%")
+        self.file_extraction_frame.setVisible(True)
+        thread.start()
+
+    def cancel_file_extraction(self):
+        if self.file_extraction_worker is not None:
+            self.file_extraction_worker.cancel()
+            self.file_extraction_label.setText("Cancelando...")
+
+    def _finish_file_extraction(self):
+        self.file_extraction_worker = None
+        self.file_extraction_frame.setVisible(False)
+
+    def on_file_extraction_progress(self, percent, stage):
+        if self.sender() is not self.file_extraction_worker:
+            return
+        self.file_extraction_progress.setValue(percent)
+        self.file_extraction_progress.setFormat(f"{stage}  %p%")
+
+    def on_file_text_ready(self, file_path, text):
+        if self.sender() is not self.file_extraction_worker:
+            return # extracción sustituida por otra más reciente
+        self._finish_file_extraction()
+        self.add_system_message(f"ARCHIVO CARGADO: {file_path}")
+        # El documento queda disponible para la recuperación en próximas consultas.
+        self.indexing_worker.submit(("document", file_path), self.retrieval_index.add_document, file_path, text)
+        self.attached_file = (Path(file_path).name, text)
+        self.attachment_label.setText(f"📎 {Path(file_path).name} ({len(text):,} caracteres): se enviará con tu próximo mensaje.")
+        self.attachment_frame.setVisible(True)
+        self.input_text.setFocus()
+
+    def clear_attachment(self):
+        self.attached_file = None
+        self.attachment_frame.setVisible(False)
+
+    def on_file_extraction_failed(self, error_msg):
+        if self.sender() is not self.file_extraction_worker:
+            return
+        self._finish_file_extraction()
+        show_critical_message(self, "Error", error_msg)
+
+    def on_file_extraction_cancelled(self):
+        if self.sender() is not self.file_extraction_worker:
+            return
+        self._finish_file_extraction()
+        self.add_system_message("LECTURA DEL ARCHIVO CANCELADA.")
     
     def repopulate_history_ui(self):
         """Vuelve a dibujar el historial en la UI a partir de self.chat_engine.history."""
-        content_edits = []
-        for msg in self.chat_engine.history:
-            role = msg.get("role", "unknown")
-            content = msg.get("content", "")
-            
-            # Creamos el widget sin animaciones ni scroll individual
-            message_widget, content_edit = self._create_message_widget(role, content, msg, show_rating_buttons=True)
-            
-            # Lo añadimos directamente al layout
-            self.history_layout.insertWidget(self.history_layout.count() - 1, message_widget)
-            content_edits.append(content_edit)
-
-        # Después de añadir todos los widgets, ajustamos sus alturas.
-        # Usamos un timer para asegurar que todos los widgets se hayan añadido al layout
-        # antes de intentar medir su contenido.
-        def adjust_all_heights():
-            for editor in content_edits:
-                self._adjust_message_height(editor)
-            # Finalmente, hacemos scroll al fondo.
-            self.scroll_to_bottom_animated()
-
-        QTimer.singleShot(100, adjust_all_heights)
+        # El modelo referencia los mensajes del historial; la vista solo pinta los visibles.
+        self.history_model.set_messages(self.chat_engine.history)
+        QTimer.singleShot(0, self.history_view.scrollToBottom)
 
     def scroll_to_bottom_animated(self):
         """Anima el scroll vertical hasta su valor máximo."""
-        scrollbar = self.history_scroll_area.verticalScrollBar()
+        scrollbar = self.history_view.verticalScrollBar()
         # Usamos una animación para el scroll, para que sea suave
         self.scroll_animation = QPropertyAnimation(scrollbar, b"value")
         self.scroll_animation.setDuration(400) # Duración en milisegundos
@@ -1732,9 +1695,11 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.overlay.show()
         self.overlay.raise_()
 
+        if self.file_extraction_worker is not None:
+            self.file_extraction_worker.cancel()
         self.cleanup_in_progress = True
         self.closing_dialog = ClosingDialog()
-        self.cleanup_worker = CleanupWorker(None)
+        self.cleanup_worker = CleanupWorker(None, self.persistence_worker, self.indexing_worker)
         self.cleanup_thread = QThread()
         self.cleanup_worker.moveToThread(self.cleanup_thread)
 
@@ -1743,6 +1708,9 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.cleanup_thread.finished.connect(self.cleanup_worker.deleteLater)
         self.cleanup_thread.finished.connect(self.cleanup_thread.deleteLater)
         self.cleanup_thread.finished.connect(on_finish_callback)
+        job = (self.cleanup_thread, self.cleanup_worker)
+        _background_jobs.add(job)
+        self.cleanup_thread.finished.connect(lambda: _background_jobs.discard(job))
 
         self.cleanup_thread.started.connect(self.cleanup_worker.run)
 
@@ -1755,6 +1723,8 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         self.overlay.hide()
         self.cleanup_in_progress = False
         self.closing_dialog.close()
+        # El siguiente usuario debe resolver su consentimiento desde cero.
+        self.persistence_service.invalidate_consent_cache(self.user_id)
         self.logout_requested.emit()
         self.is_ready_to_close = True
         self.close()
@@ -1957,10 +1927,12 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
         all_local_models = []
         try:
             models_dir = Path("models")
-            if models_dir.exists():
-                for f in models_dir.iterdir():
-                    if f.is_file() and f.suffix.lower() == ".gguf":
-                        all_local_models.append({'identifier': str(f.resolve()), 'display': f.name})
+            for name, info in gguf_index.scan(models_dir).items():
+                details = [info.get('architecture'), info.get('parameters'), info.get('quant_type')]
+                tooltip = " · ".join(str(d) for d in details if d)
+                if info.get('context_length'):
+                    tooltip += f" · contexto {info['context_length']}"
+                all_local_models.append({'identifier': str((models_dir / name).resolve()), 'display': name, 'tooltip': tooltip})
         except Exception as e:
             print(f"Error al leer modelos GGUF locales: {e}")
 
@@ -1976,6 +1948,9 @@ class ChatInterface(FadeInMixin, QMainWindow, FramelessWindowMixin):
             sorted_models = sorted(all_local_models, key=lambda x: x['display'])
             for model in sorted_models:
                 self.installed_models_combo.addItem(model['display'], userData=model['identifier'])
+                if model['tooltip']:
+                    self.installed_models_combo.setItemData(self.installed_models_combo.count() - 1,
+                                                            model['tooltip'], Qt.ItemDataRole.ToolTipRole)
         
         self.update_installed_models_combo_selection()
         self.installed_models_combo.blockSignals(False)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# ui/conversation_search.py
+
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QStyle, QAbstractItemView
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, QRectF, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QPainter, QTextDocument
+
+from ui.recent_conversations import RecentConversationDelegate, normalize_timestamp, group_label
+
+
+class SearchResultsModel(QAbstractListModel):
+    """Resultados de una búsqueda en el historial: una fila por conversación, por relevancia."""
+    SnippetRole = Qt.ItemDataRole.UserRole + 1
+    DateRole = Qt.ItemDataRole.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._results = []
+        self.status_text = ""
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._results)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        result = self._results[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return result.get("title") or "Sin título"
+        if role == Qt.ItemDataRole.UserRole:
+            return result["_id"]
+        if role == self.SnippetRole:
+            return result.get("snippet", "")
+        if role == self.DateRole:
+            return group_label(normalize_timestamp(result.get("timestamp")))
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return f"Doble clic para cargar: {result.get('title') or 'Sin título'}"
+        return None
+
+    def set_results(self, results: list, query: str):
+        self.beginResetModel()
+        self._results = list(results)
+        self.status_text = "" if self._results or not query.strip() else f"Sin resultados para «{query.strip()}»."
+        self.endResetModel()
+
+
+class SearchResultDelegate(QStyledItemDelegate):
+    """Dibuja el título y la fecha de la conversación y, debajo, el fragmento con las coincidencias resaltadas."""
+    ROW_HEIGHT = 58
+    TITLE_HEIGHT = 22
+    SNIPPET_COLOR = "#cbd5e0"
+    HIGHLIGHT_COLOR = "#90cdf4"
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        rect = option.rect
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        if option.state & (QStyle.StateFlag.State_Selected | QStyle.StateFlag.State_MouseOver):
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(RecentConversationDelegate.HOVER_COLOR))
+            painter.drawRoundedRect(rect.adjusted(2, 1, -2, -1), 6, 6)
+
+        metrics = QFontMetrics(option.font)
+        date = index.data(SearchResultsModel.DateRole)
+        date_width = metrics.horizontalAdvance(date) + 10
+        title_rect = QRect(rect.left() + 10, rect.top() + 4, rect.width() - 20 - date_width, self.TITLE_HEIGHT)
+        date_rect = QRect(title_rect.right() + 5, title_rect.top(), date_width, self.TITLE_HEIGHT)
+
+        font = QFont(option.font)
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        title = QFontMetrics(font).elidedText(index.data(Qt.ItemDataRole.DisplayRole), Qt.TextElideMode.ElideRight, title_rect.width())
+        painter.drawText(title_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, title)
+        painter.setFont(option.font)
+        painter.setPen(QColor(RecentConversationDelegate.HEADER_COLOR))
+        painter.drawText(date_rect, Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter, date)
+
+        # El fragmento ya viene escapado, con las coincidencias en <b>.
+        snippet_rect = QRectF(rect.left() + 10, title_rect.bottom() + 1, rect.width() - 20, rect.bottom() - title_rect.bottom() - 3)
+        document = QTextDocument()
+        document.setDefaultFont(option.font)
+        document.setDocumentMargin(0)
+        document.setDefaultStyleSheet(f"body {{ color: {self.SNIPPET_COLOR}; }} b {{ color: {self.HIGHLIGHT_COLOR}; }}")
+        document.setHtml(f"<body>{index.data(SearchResultsModel.SnippetRole)}</body>")
+        document.setTextWidth(snippet_rect.width())
+        painter.translate(snippet_rect.topLeft())
+        painter.setClipRect(QRectF(0, 0, snippet_rect.width(), snippet_rect.height()))
+        document.drawContents(painter)
+        painter.restore()
+
+
+class SearchResultsView(QListView):
+    """Lista de resultados de búsqueda; doble clic para cargar la conversación."""
+    conversation_activated = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("searchResultsList")
+        self.setItemDelegate(SearchResultDelegate(self))
+        self.setUniformItemSizes(True)
+        self.setMouseTracking(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.doubleClicked.connect(lambda index: self.conversation_activated.emit(index.data(Qt.ItemDataRole.UserRole)))
+
+    def setModel(self, model):
+        super().setModel(model)
+        model.modelReset.connect(self.viewport().update)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        model = self.model()
+        if model is not None and model.rowCount() == 0 and model.status_text:
+            painter = QPainter(self.viewport())
+            painter.setPen(QColor(RecentConversationDelegate.HEADER_COLOR))
+            painter.drawText(self.viewport().rect().adjusted(10, 10, -10, -10),
+                             Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft | Qt.TextFlag.TextWordWrap, model.status_text)
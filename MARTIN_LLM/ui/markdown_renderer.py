@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# ui/markdown_renderer.py
+
+import re
+import hashlib
+from collections import OrderedDict
+
+import markdown
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists']
+
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# Líneas que, tras una línea en blanco, continúan el bloque anterior (lista, cita o sangría).
+_CONTINUATION = re.compile(r"^(\s|[*+-]\s|\d+[.)]\s|>)")
+# Las definiciones de enlaces por referencia afectan a todo el documento.
+_REFERENCE = re.compile(r"^ {0,3}\[[^\]]+\]:", re.MULTILINE)
+
+
+def split_blocks(text: str) -> list[str]:
+    """
+    Divide el Markdown en bloques de nivel superior que se renderizan igual por separado que
+    juntos: se corta en líneas en blanco fuera de bloques de código y solo si la línea siguiente
+    no continúa una lista, una cita o un bloque sangrado. Si el texto usa enlaces por
+    referencia no se divide.
+    """
+    if _REFERENCE.search(text):
+        return [text]
+    lines = text.splitlines(keepends=True)
+    blocks, current, fence = [], [], None
+    for i, line in enumerate(lines):
+        current.append(line)
+        match = _FENCE.match(line)
+        if fence:
+            stripped = line.strip()
+            if match and stripped.startswith(fence) and set(stripped) == {fence[0]}:
+                fence = None
+            continue
+        if match:
+            fence = match.group(1)
+            continue
+        if not line.strip() and i + 1 < len(lines):
+            following = lines[i + 1]
+            if following.strip() and not _CONTINUATION.match(following):
+                blocks.append("".join(current))
+                current = []
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+
+class MarkdownRenderer:
+    """
+    Caché LRU del HTML generado a partir de Markdown, indexada por el hash del contenido.
+
+    `render` convierte un mensaje completo. `render_streaming` es para una respuesta que
+    sigue creciendo: la divide en bloques y cada bloque pasa por la caché, así que en cada
+    actualización solo se vuelve a convertir el último bloque (el que cambió).
+    Se usa desde el hilo de la interfaz.
+    """
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # hash del contenido -> HTML
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(content: str) -> bytes:
+        return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+    @staticmethod
+    def _convert(content: str) -> str:
+        return markdown.markdown(content, extensions=MARKDOWN_EXTENSIONS)
+
+    def render(self, content: str) -> str:
+        key = self.make_key(content)
+        html = self._entries.get(key)
+        if html is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+        self.misses += 1
+        html = self._convert(content)
+        self._entries[key] = html
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return html
+
+    def render_streaming(self, content: str) -> str:
+        """
+        Renderiza bloque a bloque: los bloques completos salen de la caché y solo se convierte
+        el último, que no se guarda porque cambiará con el siguiente fragmento.
+        """
+        blocks = split_blocks(content)
+        if not blocks:
+            return ""
+        parts = [self.render(block) for block in blocks[:-1]]
+        parts.append(self._convert(blocks[-1]))
+        return "\n".join(part for part in parts if part)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def clear(self):
+        self._entries.clear()
+
+
+markdown_renderer = MarkdownRenderer()
@@ -2,7 +2,8 @@
 # ui/model_manager_widget.py
 import json
 import os
-import requests
+import time
+import threading
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QProgressBar,
     QPushButton, QMessageBox, QFrame, QWidget, QScrollArea, QApplication
@@ -10,17 +11,19 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt, pyqtSignal, QObject, QThread
 from PyQt6.QtGui import QFont
 from ui.custom_widgets import FramelessWindowMixin, CustomTitleBar
+from app.gguf_metadata import gguf_index
+from app.model_downloader import ModelDownloader, DownloadCancelled
 from pathlib import Path
 
 class ModelLoaderWorker(QObject):
     """Worker to load model lists in a separate thread."""
-    finished = pyqtSignal(list, list, str)  # catalog_models, installed_models, error_string
+    finished = pyqtSignal(list, dict, str)  # catalog_models, installed_models ({filename: info}), error_string
     
 
     def run(self):
         """Executes model loading and emits the result."""
         catalog_models = []
-        installed_models = []
+        installed_models = {}
         error_messages = []
 
         # 1. Load models from models.json
@@ -35,11 +38,9 @@ class ModelLoaderWorker(QObject):
         except Exception as e:
             error_messages.append(f"Error al leer 'models.json': {e}")
 
-        # 2. Load installed models by checking for GGUF files in ./models
+        # 2. Load installed models (GGUF files in ./models) with their header metadata
         try:
-            models_dir = Path("models")
-            if models_dir.exists():
-                installed_models = [f.name for f in models_dir.iterdir() if f.is_file() and f.suffix.lower() == ".gguf"]
+            installed_models = gguf_index.scan(Path("models"))
         except Exception as e:
             error_messages.append(f"Error al leer la carpeta de modelos: {e}")
 
@@ -47,52 +48,67 @@ class ModelLoaderWorker(QObject):
 
 
 class DownloadWorker(QObject):
-    """Worker to download models from a URL."""
+    """Worker to download models from a URL (resumable, parallel ranges, SHA-256 check)."""
     progress_updated = pyqtSignal(int, str)
     finished = pyqtSignal(str)
     error = pyqtSignal(str, str)
+    cancelled = pyqtSignal(str)
 
-    def __init__(self, model_name, download_url, download_path):
+    def __init__(self, model_name, download_url, download_path, sha256=None):
         super().__init__()
         self.model_name = model_name
         self.download_url = download_url
         self.download_path = download_path
+        self.sha256 = sha256
+        self.cancel_event = threading.Event()
+        self._last_report = (None, 0.0)
+
+    def cancel(self):
+        """Detiene la descarga; el archivo parcial se conserva para reanudarla."""
+        self.cancel_event.set()
+
+    def _report_progress(self, downloaded_size, total_size):
+        # Los trozos avisan desde varios hilos: se emite como mucho una vez por porcentaje y cada 0.2 s.
+        percentage = int(downloaded_size / total_size * 100) if total_size > 0 else -1
+        last_percentage, last_time = self._last_report
+        now = time.monotonic()
+        if percentage == last_percentage or now - last_time < 0.2 and percentage < 100:
+            return
+        self._last_report = (percentage, now)
+        if total_size > 0:
+            completed_gb = downloaded_size / (1024**3)
+            total_gb = total_size / (1024**3)
+            self.progress_updated.emit(percentage, f"{completed_gb:.2f} GB / {total_gb:.2f} GB")
+        else:
+            # indeterminate progress
+            self.progress_updated.emit(-1, f"{downloaded_size / (1024**2):.2f} MB")
 
     def run(self):
         try:
-            response = requests.get(self.download_url, stream=True)
-            response.raise_for_status()
-
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 1024
-            downloaded_size = 0
-
-            with open(self.download_path, 'wb') as f:
-                for data in response.iter_content(block_size):
-                    downloaded_size += len(data)
-                    f.write(data)
-                    if total_size > 0:
-                        percentage = int(downloaded_size / total_size * 100)
-                        completed_gb = downloaded_size / (1024**3)
-                        total_gb = total_size / (1024**3)
-                        status_text = f"{completed_gb:.2f} GB / {total_gb:.2f} GB"
-                        self.progress_updated.emit(percentage, status_text)
-                    else:
-                        # indeterminate progress
-                        self.progress_updated.emit(-1, f"{downloaded_size / (1024**2):.2f} MB")
-            
+            downloader = ModelDownloader(
+                self.download_url,
+                self.download_path,
+                sha256=self.sha256,
+                cancel_event=self.cancel_event,
+                progress_callback=self._report_progress,
+            )
+            downloader.download()
+            self.progress_updated.emit(100, "Completado")
             self.finished.emit(self.model_name)
-
+        except DownloadCancelled:
+            self.cancelled.emit(self.model_name)
         except Exception as e:
             self.error.emit(str(e), self.model_name)
 
 
 class ModelCard(QFrame):
     """A card widget to display model information."""
-    def __init__(self, model_data, is_installed, manager, parent=None):
+    def __init__(self, model_data, is_installed, manager, parent=None, local_info=None):
         super().__init__(parent)
         self.model_data = model_data
         self.is_installed = is_installed
+        # Metadatos leídos del GGUF instalado; prevalecen sobre los del catálogo.
+        self.local_info = local_info or {}
         self.manager = manager
         self.setObjectName("modelCard")
         self.setup_ui()
@@ -157,10 +173,17 @@ class ModelCard(QFrame):
             v_layout.addWidget(val)
             details_layout.addLayout(v_layout)
 
-        add_detail("Parámetros", self.model_data.get('parameters', 'N/A'))
-        add_detail("Tamaño", self.model_data.get('size', 'N/A'))
-        add_detail("Cuantización", self.model_data.get('quantization', 'N/A'))
-        add_detail("Contexto", self.model_data.get('context_length', 'N/A'))
+        def local_or_catalog(info_key, catalog_key):
+            value = self.local_info.get(info_key)
+            return str(value) if value else self.model_data.get(catalog_key, 'N/A')
+
+        size_bytes = self.local_info.get('size')
+        add_detail("Parámetros", local_or_catalog('parameters', 'parameters'))
+        add_detail("Tamaño", f"{size_bytes / (1024**3):.1f} GB" if size_bytes else self.model_data.get('size', 'N/A'))
+        add_detail("Cuantización", local_or_catalog('quant_type', 'quantization'))
+        add_detail("Contexto", local_or_catalog('context_length', 'context_length'))
+        if self.local_info.get('architecture'):
+            add_detail("Arquitectura", self.local_info['architecture'])
         
         main_layout.addWidget(details_frame)
         
@@ -315,7 +338,7 @@ class ModelManagerWidget(QDialog, FramelessWindowMixin):
             filename = download_url.split('/')[-1]
             is_installed = filename in installed_models
             
-            card = ModelCard(model_data, is_installed, self)
+            card = ModelCard(model_data, is_installed, self, local_info=installed_models.get(filename))
             self.models_layout.addWidget(card)
             self.model_cards[model_data['name']] = card
 
@@ -341,17 +364,19 @@ class ModelManagerWidget(QDialog, FramelessWindowMixin):
         download_path.parent.mkdir(parents=True, exist_ok=True)
 
         thread = QThread()
-        worker = DownloadWorker(model_name, download_url, str(download_path))
+        worker = DownloadWorker(model_name, download_url, str(download_path), sha256=model_data.get('sha256'))
         worker.moveToThread(thread)
 
         worker.progress_updated.connect(card.update_progress)
         worker.finished.connect(lambda model_name: self.on_install_finished(model_name, card))
         worker.error.connect(lambda error_msg, model_name: self.on_install_error(error_msg, model_name, card))
+        worker.cancelled.connect(lambda model_name: self.on_install_cancelled(model_name, card))
         
         thread.started.connect(worker.run)
         
         worker.finished.connect(thread.quit)
         worker.error.connect(thread.quit)
+        worker.cancelled.connect(thread.quit)
         worker.finished.connect(worker.deleteLater)
         thread.finished.connect(thread.deleteLater)
         
@@ -371,6 +396,11 @@ class ModelManagerWidget(QDialog, FramelessWindowMixin):
         self.cleanup_install_thread(model_name)
         self.set_all_buttons_enabled(True)
 
+    def on_install_cancelled(self, model_name, card):
+        card.update_button_state() # Revert to install button; the .part file allows resuming
+        self.cleanup_install_thread(model_name)
+        self.set_all_buttons_enabled(True)
+
     def cleanup_install_thread(self, model_name):
         if model_name in self.install_threads:
             del self.install_threads[model_name]
@@ -420,6 +450,9 @@ class ModelManagerWidget(QDialog, FramelessWindowMixin):
                 QMessageBox.StandardButton.No
             )
             if reply == QMessageBox.StandardButton.Yes:
+                # Lo descargado se conserva en el archivo .part y se reanuda en la próxima instalación.
+                for worker in self.install_workers.values():
+                    worker.cancel()
                 event.accept()
             else:
                 event.ignore()
@@ -53,15 +53,17 @@ def get_futuristic_stylesheet():
         border: none; /* Sin bordes */
     }
 
-    /* Área de scroll del historial de chat */
-    QScrollArea#historyScrollArea {
+    /* Historial de chat (los mensajes los dibuja ChatMessageDelegate) */
+    QListView#chatHistoryView {
         background-color: #1a1d23; /* Fondo oscuro para el área de chat */
         border: none;
+        outline: none;
     }
-
-    /* Contenido dentro del área de scroll */
-    QWidget#history_content_widget {
-        background-color: #1a1d23;
+    QListView#chatHistoryView::item,
+    QListView#chatHistoryView::item:selected,
+    QListView#chatHistoryView::item:hover {
+        background: transparent;
+        border: none;
     }
 
     /* Estilo para el encabezado de los paneles plegables */
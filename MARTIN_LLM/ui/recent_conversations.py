@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# ui/recent_conversations.py
+
+from datetime import datetime, date, timedelta
+
+import qtawesome as qta
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QStyleOptionViewItem, QStyle, QAbstractItemView
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QPainter
+
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+
+
+def normalize_timestamp(ts) -> datetime:
+    """Convierte el timestamp guardado (datetime o cadena ISO) en datetime; datetime.min si no es válido."""
+    if isinstance(ts, datetime):
+        return ts
+    if isinstance(ts, str):
+        try:
+            return datetime.fromisoformat(ts)
+        except ValueError:
+            pass
+    return datetime.min
+
+
+def group_label(timestamp: datetime, today: date | None = None) -> str:
+    """Cabecera del grupo de fecha: Hoy, Ayer o «d de Mes de aaaa»."""
+    if timestamp == datetime.min:
+        return "Sin fecha"
+    today = today or date.today()
+    conv_date = timestamp.date()
+    if conv_date == today:
+        return "Hoy"
+    if conv_date == today - timedelta(days=1):
+        return "Ayer"
+    return f"{conv_date.day} de {MESES[conv_date.month - 1]} de {conv_date.year}"
+
+
+def display_title(title: str) -> str:
+    """Título abreviado a cinco palabras para la lista."""
+    words = title.split()
+    return " ".join(words[:5]) + "..." if len(words) > 5 else title
+
+
+class RecentConversationsModel(QAbstractListModel):
+    """
+    Conversaciones recientes, de la más nueva a la más antigua, cargadas por páginas.
+
+    El backend devuelve cada página ya ordenada; cuando la vista llega al final pide la
+    siguiente con `fetchMore`, que emite `page_requested` para que la carga se
+    haga en segundo plano y llegue con `add_page`. Los guardados, renombrados y borrados se
+    aplican fila a fila (`upsert`, `rename`, `remove`) sin recargar la lista.
+    """
+    PAGE_SIZE = 50
+    GroupRole = Qt.ItemDataRole.UserRole + 1
+    TitleRole = Qt.ItemDataRole.UserRole + 2
+
+    page_requested = pyqtSignal(int, int, int) # generación, offset, límite
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        self._ids = set()
+        self._has_more = True
+        self._loading = False
+        self._offset = 0 # filas del backend ya recorridas
+        # Cambia en cada `reset` para descartar páginas pedidas antes de recargar.
+        self.generation = 0
+        self.status_text = ""
+
+    # --- QAbstractListModel ---
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        conv = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return display_title(conv["title"])
+        if role == Qt.ItemDataRole.UserRole:
+            return conv["_id"]
+        if role == self.TitleRole:
+            return conv["title"]
+        if role == self.GroupRole:
+            return group_label(conv["timestamp"])
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return f"Doble clic para cargar: {conv['title']}"
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._has_more and not self._loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._loading = True
+        self.page_requested.emit(self.generation, self._offset, self.PAGE_SIZE)
+
+    # --- Carga por páginas ---
+
+    def reset(self):
+        """Vacía la lista y vuelve a empezar por la primera página."""
+        self.beginResetModel()
+        self._rows = []
+        self._ids = set()
+        self._has_more = True
+        self._loading = False
+        self._offset = 0
+        self.generation += 1
+        self.status_text = ""
+        self.endResetModel()
+        self.fetchMore()
+
+    @staticmethod
+    def _normalize(conv: dict) -> dict:
+        return {
+            "_id": str(conv.get("_id")),
+            "title": conv.get("title") or "Sin título",
+            "timestamp": normalize_timestamp(conv.get("timestamp")),
+        }
+
+    def add_page(self, generation: int, conversations: list, limit: int) -> list:
+        """Añade una página recibida del backend. Devuelve las filas nuevas."""
+        if generation != self.generation:
+            return []
+        self._loading = False
+        self._has_more = len(conversations) >= limit
+        self._offset += len(conversations)
+        # Un guardado puede haber insertado ya alguna (y desplazado el offset): se omiten repetidas.
+        new_rows = [self._normalize(conv) for conv in conversations]
+        new_rows = [conv for conv in new_rows if conv["_id"] not in self._ids]
+        if new_rows:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(new_rows) - 1)
+            self._rows.extend(new_rows)
+            self._ids.update(conv["_id"] for conv in new_rows)
+            self.endInsertRows()
+        self.status_text = "" if self._rows else "No hay conversaciones recientes."
+        return new_rows
+
+    def page_failed(self, generation: int):
+        if generation != self.generation:
+            return
+        self._loading = False
+        self._has_more = False
+        if not self._rows:
+            self.status_text = "Error al cargar."
+            self.layoutChanged.emit()
+
+    # --- Cambios fila a fila ---
+
+    def row_of(self, conversation_id: str) -> int:
+        for row, conv in enumerate(self._rows):
+            if conv["_id"] == conversation_id:
+                return row
+        return -1
+
+    def _sorted_position(self, timestamp: datetime, exclude: int = -1) -> int:
+        """Fila que le corresponde a `timestamp` (orden descendente), sin contar la fila `exclude`."""
+        position = 0
+        for row, conv in enumerate(self._rows):
+            if row == exclude:
+                continue
+            if conv["timestamp"] < timestamp:
+                break
+            position += 1
+        return position
+
+    def upsert(self, conv: dict):
+        """Inserta o actualiza una conversación y la coloca en su sitio según la fecha."""
+        conv = self._normalize(conv)
+        row = self.row_of(conv["_id"])
+        if row >= 0:
+            self._rows[row] = conv
+            target = self._sorted_position(conv["timestamp"], exclude=row)
+            if target != row:
+                # beginMoveRows indica el destino contando aún con la fila en su sitio.
+                self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), target if target < row else target + 1)
+                self._rows.insert(target, self._rows.pop(row))
+                self.endMoveRows()
+            index = self.index(target)
+            self.dataChanged.emit(index, index)
+            return
+        target = self._sorted_position(conv["timestamp"])
+        if target == len(self._rows) and self._has_more:
+            return # Aún no cargada: llegará con su página.
+        self.beginInsertRows(QModelIndex(), target, target)
+        self._rows.insert(target, conv)
+        self._ids.add(conv["_id"])
+        self.endInsertRows()
+        self._offset += 1 # también es una fila más en el backend, antes de la siguiente página
+        self.status_text = ""
+
+    def rename(self, conversation_id: str, title: str):
+        row = self.row_of(conversation_id)
+        if row >= 0:
+            self._rows[row]["title"] = title
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def remove(self, conversation_id: str):
+        row = self.row_of(conversation_id)
+        if row < 0:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self._rows.pop(row)
+        self._ids.discard(conversation_id)
+        self.endRemoveRows()
+        self._offset = max(self._offset - 1, 0)
+        if not self._rows and not self._has_more:
+            self.status_text = "No hay conversaciones recientes."
+
+
+class RecentConversationDelegate(QStyledItemDelegate):
+    """
+    Dibuja cada conversación con su título y los botones de renombrar y eliminar. Encima de la
+    primera conversación de cada fecha dibuja la cabecera del grupo (HOY, AYER...).
+    """
+    rename_clicked = pyqtSignal(str, str) # id, título
+    delete_clicked = pyqtSignal(str)
+
+    ROW_HEIGHT = 30
+    HEADER_HEIGHT = 26
+    BUTTON = 20
+    HEADER_COLOR = "#a0aec0"
+    HOVER_COLOR = "#2d3748"
+    BUTTON_HOVER_COLOR = "#4a90e2"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.hover = None # (fila, "rename" | "delete") bajo el ratón
+        self._icons = {"rename": qta.icon('fa5s.edit', color="white"), "delete": qta.icon('fa5s.trash-alt', color="white")}
+
+    @staticmethod
+    def has_header(index) -> bool:
+        if index.row() == 0:
+            return True
+        previous = index.model().index(index.row() - 1)
+        return previous.data(RecentConversationsModel.GroupRole) != index.data(RecentConversationsModel.GroupRole)
+
+    def _layout(self, option, index) -> dict:
+        rect = option.rect
+        top = rect.top() + (self.HEADER_HEIGHT if self.has_header(index) else 0)
+        row_rect = QRect(rect.left(), top, rect.width(), self.ROW_HEIGHT)
+        y = top + (self.ROW_HEIGHT - self.BUTTON) // 2
+        delete = QRect(row_rect.right() - 5 - self.BUTTON, y, self.BUTTON, self.BUTTON)
+        rename = QRect(delete.left() - 5 - self.BUTTON, y, self.BUTTON, self.BUTTON)
+        return {
+            "header": QRect(rect.left() + 5, rect.top(), rect.width() - 10, self.HEADER_HEIGHT),
+            "row": row_rect,
+            "title": QRect(rect.left() + 10, top, rename.left() - rect.left() - 20, self.ROW_HEIGHT),
+            "rename": rename,
+            "delete": delete,
+        }
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.ROW_HEIGHT + (self.HEADER_HEIGHT if self.has_header(index) else 0))
+
+    def paint(self, painter, option, index):
+        layout = self._layout(option, index)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        if self.has_header(index):
+            font = QFont(option.font)
+            font.setBold(True)
+            painter.setFont(font)
+            painter.setPen(QColor(self.HEADER_COLOR))
+            painter.drawText(layout["header"], Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                             index.data(RecentConversationsModel.GroupRole).upper())
+
+        if option.state & (QStyle.StateFlag.State_Selected | QStyle.StateFlag.State_MouseOver):
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(self.HOVER_COLOR))
+            painter.drawRoundedRect(layout["row"].adjusted(2, 1, -2, -1), 6, 6)
+
+        painter.setFont(option.font)
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        title = QFontMetrics(option.font).elidedText(index.data(Qt.ItemDataRole.DisplayRole), Qt.TextElideMode.ElideRight, layout["title"].width())
+        painter.drawText(layout["title"], Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, title)
+
+        for name in ("rename", "delete"):
+            if self.hover == (index.row(), name):
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(QColor(self.BUTTON_HOVER_COLOR))
+                painter.drawEllipse(layout[name])
+            self._icons[name].paint(painter, layout[name].adjusted(3, 3, -3, -3))
+        painter.restore()
+
+    def button_at(self, option, index, pos):
+        """Botón ("rename"/"delete") bajo `pos`, o None."""
+        layout = self._layout(option, index)
+        for name in ("rename", "delete"):
+            if layout[name].contains(pos):
+                return name
+        return None
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == event.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            button = self.button_at(option, index, event.position().toPoint())
+            if button == "rename":
+                self.rename_clicked.emit(index.data(Qt.ItemDataRole.UserRole), index.data(RecentConversationsModel.TitleRole))
+                return True
+            if button == "delete":
+                self.delete_clicked.emit(index.data(Qt.ItemDataRole.UserRole))
+                return True
+        return super().editorEvent(event, model, option, index)
+
+
+class RecentConversationsView(QListView):
+    """Lista de conversaciones recientes; pide más páginas al acercarse al final."""
+    conversation_activated = pyqtSignal(str) # doble clic en una conversación
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("recentConvsList")
+        self.delegate = RecentConversationDelegate(self)
+        self.setItemDelegate(self.delegate)
+        self.setUniformItemSizes(False)
+        self.setMouseTracking(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.doubleClicked.connect(lambda index: self.conversation_activated.emit(index.data(Qt.ItemDataRole.UserRole)))
+
+    def setModel(self, model):
+        super().setModel(model)
+        model.modelReset.connect(self.viewport().update)
+        model.layoutChanged.connect(self.viewport().update)
+
+    def mouseMoveEvent(self, event):
+        pos = event.position().toPoint()
+        index = self.indexAt(pos)
+        hover = None
+        if index.isValid():
+            option = QStyleOptionViewItem()
+            self.initViewItemOption(option)
+            option.rect = self.visualRect(index)
+            button = self.delegate.button_at(option, index, pos)
+            hover = (index.row(), button) if button else None
+        if hover != self.delegate.hover:
+            self.delegate.hover = hover
+            self.viewport().update()
+        super().mouseMoveEvent(event)
+
+    def leaveEvent(self, event):
+        self.delegate.hover = None
+        self.viewport().update()
+        super().leaveEvent(event)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        model = self.model()
+        if model is not None and model.rowCount() == 0 and model.status_text:
+            painter = QPainter(self.viewport())
+            painter.setPen(QColor(RecentConversationDelegate.HEADER_COLOR))
+            painter.drawText(self.viewport().rect().adjusted(10, 10, -10, -10),
+                             Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft, model.status_text)